@@ -0,0 +1,273 @@
+"""
+# Description:
+Generator of realistic synthetic fixtures for the benchmarks.
+
+Builds the two kinds of inputs the refresh pipeline sees:
+    - a year / quarter directory tree ("2021/2021 Q2/...") with thousands of
+      CIG-style file names, in both the '2021Q2' and the '3Q2023' form, mixed
+      with files of other extensions that the scan has to skip
+    - workbooks with an "output_tbl" sheet of configurable size, plus heavy
+      decoy sheets that a reader must not pay for
+
+Everything is generated from a seeded random generator, so the same
+arguments always produce the same fixtures.
+
+Only ".xlsx" workbooks can be generated: no python library writes ".xlsb".
+To benchmark ".xlsb" reads, save a generated workbook as ".xlsb" from Excel
+and pass the folder to `run_benchmarks.py --xlsb-dir`.
+"""
+
+import os
+import random
+
+# CIG file stems and their file types, as in the `cig_filetypes` frame
+CIG_FILETYPES = {
+    'filename': [
+        'CA Link Ratios', 'GL Link Ratios', 'WC Link Ratios', 'CPP Link Ratios',
+        'BOP Link Ratios', 'Umbrella Link Ratios', 'CA IBNR Allocation',
+        'GL IBNR Allocation', 'WC IBNR Allocation', 'CA Tail Factors',
+    ],
+    'type': [
+        'link ratio', 'link ratio', 'link ratio', 'link ratio',
+        'link ratio', 'link ratio', 'ibnr allocation',
+        'ibnr allocation', 'ibnr allocation', 'tail factor',
+    ],
+}
+
+# LOB codes and states used in the output_tbl rows
+LOBS = ['CA', 'GL', 'WC', 'CPP', 'BOP', 'UMB', 'PR', 'IM']
+STATES = ['OH', 'IN', 'KY', 'MI', 'IL', 'PA', 'GA', 'TN', 'WI', 'NC']
+
+# extensions of the files that are not workbooks the scan is looking for
+DECOY_EXTENSIONS = ['.pdf', '.docx', '.msg', '.txt', '.xlsx.bak']
+
+
+def get_cig_file_name(
+    stem: str,
+    year: int,
+    quarter: int,
+    extension: str = '.xlsb',
+    year_first: bool = True
+) -> str:
+    """
+    # Description:
+    This function builds a CIG-style file name, with the analysis in the
+    '2021Q2' form (`year_first`) or in the '3Q2023' form.
+
+    # Parameters:
+        stem: str
+            this is the CIG file stem
+        year: int
+            this is the analysis year
+        quarter: int
+            this is the analysis quarter
+        extension: str
+            this is the file extension
+            defaults to '.xlsb'
+        year_first: bool
+            if True, '2021Q2', otherwise '2Q2021'
+            defaults to True
+
+    # Returns:
+        str
+            this is the file name
+    """
+    analysis = f'{year}Q{quarter}' if year_first else f'{quarter}Q{year}'
+    return f'{stem} {analysis}{extension}'
+
+
+def build_directory_tree(
+    root: str,
+    first_year: int = 2015,
+    last_year: int = 2023,
+    files_per_quarter: int = 100,
+    decoys_per_quarter: int = 20,
+    extension: str = '.xlsb',
+    seed: int = 0
+) -> list:
+    """
+    # Description:
+    This function builds a year / quarter directory tree of empty files with
+    CIG-style names, plus decoy files of other extensions, for the scan
+    benchmarks (walk, metadata parse, stem match).
+
+    # Parameters:
+        root: str
+            this is the root folder of the tree
+        first_year: int
+            this is the first analysis year
+            defaults to 2015
+        last_year: int
+            this is the last analysis year
+            defaults to 2023
+        files_per_quarter: int
+            this is the number of CIG files per quarter folder
+            defaults to 100
+        decoys_per_quarter: int
+            this is the number of decoy files per quarter folder
+            defaults to 20
+        extension: str
+            this is the extension of the CIG files
+            defaults to '.xlsb'
+        seed: int
+            this is the seed of the random generator
+            defaults to 0
+
+    # Returns:
+        list
+            this is the list of the paths of the CIG files
+    """
+    generator = random.Random(seed)
+    stems = CIG_FILETYPES['filename']
+    paths = []
+
+    for year in range(first_year, last_year + 1):
+        for quarter in range(1, 5):
+            folder = os.path.join(root, str(year), f'{year} Q{quarter}')
+            os.makedirs(folder, exist_ok=True)
+
+            # the CIG files, with a numbered suffix to get many per stem
+            for i in range(files_per_quarter):
+                stem = f'{stems[i % len(stems)]} {i // len(stems):03d}'
+                file_name = get_cig_file_name(
+                    stem, year, quarter, extension,
+                    year_first=generator.random() < 0.5)
+                path = os.path.join(folder, file_name)
+                open(path, 'wb').close()
+                paths.append(path)
+
+            # the decoys
+            for i in range(decoys_per_quarter):
+                decoy_extension = generator.choice(DECOY_EXTENSIONS)
+                path = os.path.join(folder, f'notes {i:03d}{decoy_extension}')
+                open(path, 'wb').close()
+
+    return paths
+
+
+def build_workbook(
+    path: str,
+    rows: int = 5_000,
+    helper_columns: int = 5,
+    decoy_sheets: int = 3,
+    decoy_rows: int = 20_000,
+    trailing_blank_rows: int = 200,
+    seed: int = 0
+) -> str:
+    """
+    # Description:
+    This function writes a workbook with an "output_tbl" sheet and heavy decoy
+    sheets. The output_tbl has the link ratio columns, `helper_columns`
+    helper columns to the right of them, and `trailing_blank_rows`
+    formula-junk rows below the table (empty strings in the helper columns),
+    like the real workbooks.
+
+    # Parameters:
+        path: str
+            this is the path of the ".xlsx" workbook
+        rows: int
+            this is the number of rows of the output_tbl table
+            defaults to 5,000
+        helper_columns: int
+            this is the number of helper columns
+            defaults to 5
+        decoy_sheets: int
+            this is the number of decoy sheets
+            defaults to 3
+        decoy_rows: int
+            this is the number of rows per decoy sheet
+            defaults to 20,000
+        trailing_blank_rows: int
+            this is the number of junk rows below the table
+            defaults to 200
+        seed: int
+            this is the seed of the random generator
+            defaults to 0
+
+    # Returns:
+        str
+            this is the path of the workbook
+    """
+    import openpyxl
+
+    generator = random.Random(seed)
+
+    # write-only mode streams the rows to disk, so large fixtures fit in memory
+    workbook = openpyxl.Workbook(write_only=True)
+
+    # the decoy sheets come first, like the calculation sheets of the real workbooks
+    for sheet_index in range(decoy_sheets):
+        sheet = workbook.create_sheet(f'calc_{sheet_index}')
+        for _ in range(decoy_rows):
+            sheet.append([generator.random() for _ in range(20)])
+
+    # the output_tbl sheet
+    sheet = workbook.create_sheet('output_tbl')
+    sheet.append(
+        ['LOB', 'State', 'Accident Year', 'Development Period',
+         'Link Ratio', 'Selected Link Ratio', 'Paid Loss', 'Reported Loss']
+        + [f'helper {i}' for i in range(helper_columns)]
+    )
+    for _ in range(rows):
+        sheet.append(
+            [generator.choice(LOBS), generator.choice(STATES),
+             generator.randint(2000, 2023), generator.randint(1, 40) * 3,
+             round(1 + generator.random() / 2, 4), round(1 + generator.random() / 2, 4),
+             round(generator.random() * 1e6, 2), round(generator.random() * 1e6, 2)]
+            + [generator.random() for _ in range(helper_columns)]
+        )
+
+    # the formula-junk rows below the table
+    for _ in range(trailing_blank_rows):
+        sheet.append([None] * 8 + [''] * helper_columns)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    workbook.save(path)
+    return path
+
+
+def build_workbooks(
+    folder: str,
+    count: int = 8,
+    rows: int = 5_000,
+    decoy_sheets: int = 3,
+    decoy_rows: int = 20_000,
+    seed: int = 0
+) -> list:
+    """
+    # Description:
+    This function writes `count` workbooks with CIG-style names to a folder.
+
+    # Parameters:
+        folder: str
+            this is the folder of the workbooks
+        count: int
+            this is the number of workbooks
+            defaults to 8
+        rows: int
+            this is the number of output_tbl rows per workbook
+            defaults to 5,000
+        decoy_sheets: int
+            this is the number of decoy sheets per workbook
+            defaults to 3
+        decoy_rows: int
+            this is the number of rows per decoy sheet
+            defaults to 20,000
+        seed: int
+            this is the seed of the random generator
+            defaults to 0
+
+    # Returns:
+        list
+            this is the list of the paths of the workbooks
+    """
+    stems = CIG_FILETYPES['filename']
+    paths = []
+    for i in range(count):
+        year, quarter = 2021 + i // 4, i % 4 + 1
+        file_name = get_cig_file_name(
+            stems[i % len(stems)], year, quarter, '.xlsx', year_first=i % 2 == 0)
+        paths.append(build_workbook(
+            os.path.join(folder, file_name), rows=rows, decoy_sheets=decoy_sheets,
+            decoy_rows=decoy_rows, seed=seed + i))
+    return paths
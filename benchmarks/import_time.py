@@ -0,0 +1,191 @@
+"""
+# Description:
+Cold-start check of the modules the dashboard host imports.
+
+Each check runs in a fresh interpreter, so nothing is cached from a previous
+import, and measures the median wall time over `--repeats` runs:
+    import_dashboard: `import src.python_inside_dashboard`
+    import_folder_to_parquet: `import src.folder_to_parquet`
+    fresh_snapshot_refresh: `python_inside_dashboard.get_dashboard_data` on a
+        fresh snapshot, which must not touch sharepoint or the workbooks
+
+A check fails when it takes longer than its budget, or when it loads a module
+it must not load: the imports must not load pandas, pyarrow, office365 or the
+Excel engines, and the fresh-snapshot refresh must not load office365 or the
+Excel engines. The command exits with status 1 if any check fails.
+
+# Usage (from the repository root):
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --import-budget-ms 150 --refresh-budget-ms 1500
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# the checks run from a checkout, not from an installed package
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the modules a dashboard refresh from a fresh snapshot must never load
+EXCEL_ENGINE_MODULES = ['openpyxl', 'pyxlsb', 'python_calamine']
+SHAREPOINT_MODULES = ['office365']
+
+# the modules importing the entry points must not load
+HEAVY_MODULES = ['pandas', 'pyarrow'] + SHAREPOINT_MODULES + EXCEL_ENGINE_MODULES
+
+# the budgets, in milliseconds, of a module import and of a fresh-snapshot refresh
+IMPORT_BUDGET_MS = 250
+REFRESH_BUDGET_MS = 2500
+
+# runs in the fresh interpreter: times the code, and reports the loaded modules
+_CHILD_TEMPLATE = """
+import json, sys, time
+start = time.perf_counter()
+{code}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds,
+                   'loaded': [name for name in {modules!r} if name in sys.modules]}}))
+"""
+
+
+def run_cold(
+    code: str,
+    modules: list
+) -> dict:
+    """
+    # Description:
+    This function runs `code` in a fresh interpreter from the repository root.
+
+    # Parameters:
+        code: str
+            this is the code to time
+        modules: list
+            this is the list of modules to look for after the code ran
+
+    # Returns:
+        dict
+            this is the wall time of the code (`seconds`) and the modules of
+            `modules` it loaded (`loaded`)
+    """
+    completed = subprocess.run(
+        [sys.executable, '-c', _CHILD_TEMPLATE.format(code=code, modules=modules)],
+        cwd=REPOSITORY_ROOT, capture_output=True, text=True, check=False)
+    if completed.returncode != 0:
+        raise RuntimeError(f'the check failed to run:\n{completed.stderr}')
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def run_check(
+    name: str,
+    code: str,
+    forbidden: list,
+    budget_ms: float,
+    repeats: int = 5
+) -> dict:
+    """
+    # Description:
+    This function runs a check `repeats` times in fresh interpreters.
+
+    # Parameters:
+        name: str
+            this is the name of the check
+        code: str
+            this is the code to time
+        forbidden: list
+            this is the list of modules the code must not load
+        budget_ms: float
+            this is the allowed median wall time, in milliseconds
+        repeats: int
+            this is the number of cold runs
+            defaults to 5
+
+    # Returns:
+        dict
+            this is the result of the check, with its failures
+    """
+    runs = [run_cold(code, forbidden) for _ in range(repeats)]
+    median_ms = statistics.median(run['seconds'] for run in runs) * 1000
+    loaded = sorted({name for run in runs for name in run['loaded']})
+
+    failures = []
+    if median_ms > budget_ms:
+        failures.append(f'{median_ms:.0f} ms is over the budget of {budget_ms:.0f} ms')
+    if len(loaded) > 0:
+        failures.append('loaded ' + ', '.join(loaded))
+
+    return {'check': name, 'median_ms': median_ms, 'budget_ms': budget_ms,
+            'loaded': loaded, 'failures': failures}
+
+
+def write_snapshot(
+    path: str
+) -> None:
+    """
+    # Description:
+    This function writes a small parquet snapshot for the refresh check.
+    """
+    import pandas as pd
+    pd.DataFrame({
+        'lob': pd.Categorical(['CA', 'GL'] * 50),
+        'analysis_idx': [8093] * 100,
+        'link_ratio': [1.0] * 100,
+    }).to_parquet(path)
+
+
+def main(
+    args: list = None
+) -> int:
+    """
+    # Description:
+    Command line entry point of the cold-start check.
+
+    # Returns:
+        int
+            this is the exit status, 1 if a check failed
+    """
+    parser = argparse.ArgumentParser(
+        description='check the cold-start import time of the dashboard modules')
+    parser.add_argument('--import-budget-ms', type=float, default=IMPORT_BUDGET_MS,
+                        help='budget of each module import')
+    parser.add_argument('--refresh-budget-ms', type=float, default=REFRESH_BUDGET_MS,
+                        help='budget of a dashboard refresh from a fresh snapshot')
+    parser.add_argument('--repeats', type=int, default=5)
+    arguments = parser.parse_args(args)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        snapshot_path = os.path.join(work_dir, 'data.parquet')
+        write_snapshot(snapshot_path)
+
+        results = [
+            run_check('import_dashboard',
+                      'import src.python_inside_dashboard',
+                      HEAVY_MODULES, arguments.import_budget_ms, arguments.repeats),
+            run_check('import_folder_to_parquet',
+                      'import src.folder_to_parquet',
+                      HEAVY_MODULES, arguments.import_budget_ms, arguments.repeats),
+            run_check('fresh_snapshot_refresh',
+                      'from src.python_inside_dashboard import get_dashboard_data\n'
+                      f'get_dashboard_data({snapshot_path!r})',
+                      SHAREPOINT_MODULES + EXCEL_ENGINE_MODULES,
+                      arguments.refresh_budget_ms, arguments.repeats),
+        ]
+
+    # report
+    failed = False
+    for result in results:
+        status = 'FAIL' if result['failures'] else 'ok'
+        print(f"{result['check']:<26} {result['median_ms']:8.1f} ms "
+              f"(budget {result['budget_ms']:.0f} ms)  {status}")
+        for failure in result['failures']:
+            print('    ' + failure)
+        failed = failed or len(result['failures']) > 0
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
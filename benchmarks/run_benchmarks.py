@@ -0,0 +1,349 @@
+"""
+# Description:
+Benchmarks for the scan -> parse -> write stages of the refresh pipeline,
+run on the synthetic fixtures of `fixtures.py`.
+
+Stages:
+    walk: `find_cig_files.find_files_with_extension` over the directory tree
+    metadata_parse: `get_year_quarter` + `filter_year_quarter` on the file paths
+    stem_match: `get_cig_link_ratio_filenames` on the parsed file names
+    stem_match_indexed: the same, with the stem index of a CIG reference
+        file (see `searching_inputs`) instead of the `cig_filetypes` frame
+    sheet_read: `folder_to_parquet.get_dataframe_from_file` on each workbook
+    sheet_read_xlsb: the same on the ".xlsb" workbooks of `--xlsb-dir`, if given
+    concat_write: `concat_output_tbls` + sorted parquet write of the frames
+
+For every stage the median wall time over `--repeats` runs is reported with
+the throughput (items and MB per second) and the peak traced memory
+(measured in a separate run, because tracemalloc slows the code down).
+
+Results can be saved as a named baseline, and later runs compared against
+it; a stage that got slower or bigger than the tolerance is a regression,
+and the command exits with status 1.
+
+# Usage (from the repository root):
+    python benchmarks/run_benchmarks.py --save-baseline main
+    python benchmarks/run_benchmarks.py --compare main
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+# the benchmarks run from a checkout, not from an installed package
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd  # noqa: E402
+
+import fixtures  # noqa: E402
+from src import find_cig_files, searching_inputs  # noqa: E402
+from src.dataset_query import ROW_GROUP_SIZE, sort_for_pushdown  # noqa: E402
+from src.folder_to_parquet import get_dataframe_from_file  # noqa: E402
+from src.output_tbl_schema import UnknownColumnsWarning, concat_output_tbls  # noqa: E402
+
+# where the baselines are saved
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+
+def measure(
+    stage: str,
+    function,
+    items: int,
+    size: int = None,
+    repeats: int = 3
+) -> dict:
+    """
+    # Description:
+    This function times a stage and measures its peak memory.
+
+    # Parameters:
+        stage: str
+            this is the name of the stage
+        function: callable
+            this runs the stage once, and returns its result
+        items: int
+            this is the number of items (files, rows) the stage processes
+        size: int
+            this is the number of bytes the stage processes
+            defaults to None when it does not apply
+        repeats: int
+            this is the number of timed runs
+            defaults to 3
+
+    # Returns:
+        dict
+            this is the measurement of the stage
+    """
+    # the timed runs
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    median_seconds = statistics.median(seconds)
+
+    # the traced run
+    tracemalloc.start()
+    function()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'stage': stage,
+        'seconds': median_seconds,
+        'items': items,
+        'items_per_second': items / median_seconds if median_seconds > 0 else None,
+        'mb_per_second': (size / 1e6 / median_seconds
+                          if size is not None and median_seconds > 0 else None),
+        'peak_memory_mb': peak_memory / 1e6,
+    }
+
+
+def get_fixtures(
+    work_dir: str,
+    arguments: argparse.Namespace
+) -> tuple:
+    """
+    # Description:
+    This function builds the fixtures in `work_dir`, or reuses them if the
+    same arguments built them before.
+
+    # Returns:
+        tuple
+            this is (tree root, list of workbook paths)
+    """
+    # the fixtures are keyed by the arguments that shape them
+    key = (f'{arguments.first_year}-{arguments.last_year}-{arguments.files_per_quarter}'
+           f'-{arguments.workbooks}-{arguments.rows}-{arguments.decoy_sheets}'
+           f'-{arguments.decoy_rows}')
+    root = os.path.join(work_dir, key)
+    tree_root = os.path.join(root, 'tree')
+    workbook_dir = os.path.join(root, 'workbooks')
+
+    # build what is missing
+    if not os.path.exists(tree_root):
+        print('building the directory tree fixture ...')
+        fixtures.build_directory_tree(
+            tree_root, arguments.first_year, arguments.last_year,
+            arguments.files_per_quarter)
+    if not os.path.exists(workbook_dir):
+        print('building the workbook fixtures ...')
+        fixtures.build_workbooks(
+            workbook_dir, arguments.workbooks, arguments.rows,
+            arguments.decoy_sheets, arguments.decoy_rows)
+
+    workbooks = sorted(os.path.join(workbook_dir, name)
+                       for name in os.listdir(workbook_dir))
+    return tree_root, workbooks
+
+
+def run_benchmarks(
+    arguments: argparse.Namespace
+) -> list:
+    """
+    # Description:
+    This function runs every stage on the fixtures.
+
+    # Returns:
+        list
+            this is the list of stage measurements
+    """
+    work_dir = arguments.work_dir or os.path.join(
+        tempfile.gettempdir(), 'reserving_dashboard_benchmarks')
+    tree_root, workbooks = get_fixtures(work_dir, arguments)
+    repeats = arguments.repeats
+    results = []
+
+    # walk
+    paths = find_cig_files.find_files_with_extension(tree_root, '.xlsb')
+    results.append(measure(
+        'walk',
+        lambda: find_cig_files.find_files_with_extension(tree_root, '.xlsb'),
+        len(paths), repeats=repeats))
+
+    # metadata parse
+    results.append(measure(
+        'metadata_parse',
+        lambda: find_cig_files.filter_year_quarter(
+            find_cig_files.get_year_quarter(paths), 0),
+        len(paths), repeats=repeats))
+
+    # stem match
+    metadata = find_cig_files.filter_year_quarter(
+        find_cig_files.get_year_quarter(paths), 0)
+    cig_filetypes = pd.DataFrame(fixtures.CIG_FILETYPES)
+    results.append(measure(
+        'stem_match',
+        lambda: find_cig_files.get_cig_link_ratio_filenames(
+            metadata.copy(), cig_filetypes),
+        len(paths), repeats=repeats))
+
+    # stem match with the reference file indexes
+    reference_path = os.path.join(work_dir, 'cig_reference.json')
+    with open(reference_path, 'w', encoding='utf-8') as file:
+        json.dump({'version': 'benchmark', 'file_types': cig_filetypes.to_dict('records'),
+                   'lobs': [{'code': code} for code in fixtures.LOBS]}, file)
+    # only for this stage, so the sheet reads stay comparable with the baselines
+    previous_reference_path = os.environ.get(searching_inputs.REFERENCE_PATH_VARIABLE)
+    os.environ[searching_inputs.REFERENCE_PATH_VARIABLE] = reference_path
+    try:
+        results.append(measure(
+            'stem_match_indexed',
+            lambda: find_cig_files.get_cig_link_ratio_filenames(metadata.copy()),
+            len(paths), repeats=repeats))
+    finally:
+        if previous_reference_path is None:
+            del os.environ[searching_inputs.REFERENCE_PATH_VARIABLE]
+        else:
+            os.environ[searching_inputs.REFERENCE_PATH_VARIABLE] = previous_reference_path
+
+    # sheet read
+    def read_all(files):
+        return [get_dataframe_from_file(file) for file in files]
+
+    results.append(measure(
+        'sheet_read', lambda: read_all(workbooks), len(workbooks),
+        sum(os.path.getsize(file) for file in workbooks), repeats=repeats))
+
+    # sheet read of the ".xlsb" samples
+    if arguments.xlsb_dir is not None:
+        xlsb_files = sorted(
+            os.path.join(arguments.xlsb_dir, name)
+            for name in os.listdir(arguments.xlsb_dir) if name.endswith('.xlsb'))
+        results.append(measure(
+            'sheet_read_xlsb', lambda: read_all(xlsb_files), len(xlsb_files),
+            sum(os.path.getsize(file) for file in xlsb_files), repeats=repeats))
+
+    # concat and write
+    frames = read_all(workbooks)
+    output_path = os.path.join(work_dir, 'data.parquet')
+
+    def concat_write():
+        df = sort_for_pushdown(concat_output_tbls(frames))
+        df.to_parquet(output_path, row_group_size=ROW_GROUP_SIZE)
+
+    results.append(measure(
+        'concat_write', concat_write, sum(len(frame) for frame in frames),
+        repeats=repeats))
+
+    return results
+
+
+def compare_to_baseline(
+    results: list,
+    baseline: list,
+    tolerance: float = 0.2
+) -> list:
+    """
+    # Description:
+    This function compares the results to a baseline.
+
+    # Parameters:
+        results: list
+            this is the list of stage measurements
+        baseline: list
+            this is the list of stage measurements of the baseline
+        tolerance: float
+            this is the relative slowdown / growth allowed
+            defaults to 0.2 for 20%
+
+    # Returns:
+        list
+            this is the list of regression messages, empty if none
+    """
+    baseline_by_stage = {result['stage']: result for result in baseline}
+    regressions = []
+    for result in results:
+        before = baseline_by_stage.get(result['stage'])
+        if before is None:
+            continue
+        for metric in ('seconds', 'peak_memory_mb'):
+            if result[metric] > before[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{result['stage']}: {metric} {before[metric]:.4g} -> "
+                    f"{result[metric]:.4g} ({result[metric] / before[metric] - 1:+.0%})")
+    return regressions
+
+
+def print_results(
+    results: list
+) -> None:
+    """
+    # Description:
+    This function prints the stage measurements as a table.
+    """
+    table = pd.DataFrame(results).set_index('stage')
+    with pd.option_context('display.float_format', '{:,.3f}'.format,
+                           'display.width', 120):
+        print(table)
+
+
+def main(
+    args: list = None
+) -> int:
+    """
+    # Description:
+    Command line entry point of the benchmarks.
+
+    # Returns:
+        int
+            this is the exit status, 1 if a regression was found
+    """
+    parser = argparse.ArgumentParser(
+        description='benchmark the scan -> parse -> write pipeline on synthetic fixtures')
+    parser.add_argument('--work-dir', default=None,
+                        help='folder of the generated fixtures (default: temp folder)')
+    parser.add_argument('--first-year', type=int, default=2015)
+    parser.add_argument('--last-year', type=int, default=2023)
+    parser.add_argument('--files-per-quarter', type=int, default=100)
+    parser.add_argument('--workbooks', type=int, default=8)
+    parser.add_argument('--rows', type=int, default=5_000)
+    parser.add_argument('--decoy-sheets', type=int, default=3)
+    parser.add_argument('--decoy-rows', type=int, default=20_000)
+    parser.add_argument('--xlsb-dir', default=None,
+                        help='folder of ".xlsb" workbooks with an output_tbl sheet')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--save-baseline', default=None, metavar='NAME')
+    parser.add_argument('--compare', default=None, metavar='NAME')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    arguments = parser.parse_args(args)
+
+    # the fixtures have columns the benchmark does not declare
+    warnings.simplefilter('ignore', UnknownColumnsWarning)
+
+    results = run_benchmarks(arguments)
+    print_results(results)
+
+    # save the baseline
+    if arguments.save_baseline is not None:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, arguments.save_baseline + '.json')
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+        print('saved baseline', path)
+
+    # compare to a baseline
+    if arguments.compare is not None:
+        path = os.path.join(BASELINE_DIR, arguments.compare + '.json')
+        with open(path, 'r', encoding='utf-8') as file:
+            regressions = compare_to_baseline(
+                results, json.load(file), arguments.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if len(regressions) > 0:
+            return 1
+        print('no regressions against', arguments.compare)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
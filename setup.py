@@ -30,7 +30,11 @@ long_description_content_type = "python"
 url = " "
 
 # packages of the package
-packages = setuptools.find_packages()
+# the code lives in the `src` folder, installed as `reserving_dashboard_update`
+packages = [name]
+
+# folders of the packages
+package_dir = {name: "src"}
 
 # classifiers of the package
 classifiers = [
@@ -48,6 +52,7 @@ install_requires = [
     "numpy",
     "openpyxl",
     "pyxlsb",
+    "pyarrow",
     "office365"
 ]
 
@@ -69,6 +74,7 @@ setuptools.setup(
     long_description_content_type=long_description_content_type,
     url=url,
     packages=packages,
+    package_dir=package_dir,
     classifiers=classifiers,
     python_requires=python_requires,
     install_requires=install_requires,
@@ -0,0 +1,600 @@
+"""
+# Description:
+Command line interface of the reserving dashboard update.
+
+# Commands:
+    refresh: combine the output_tbl sheets of the sharepoint folder into
+        parquet and upload it (see `folder_to_parquet`)
+    scan: list the workbooks of the sharepoint folder
+    plan: show what a refresh would do, the bytes it would download and the
+        time it would take, without doing it (see `refresh_plan`)
+    watch: poll the sharepoint change log (or the modification times of a
+        local share) and refresh only what changed (see `watch`)
+    jobs: refresh the many sites / folders / outputs of a job spec under
+        global limits, with one consolidated report (see `jobs`)
+    worker: parse the files queued by `refresh --work-queue` in a shared
+        work folder (see `work_queue`)
+    serve: serve a local folder over HTTP, as a stand-in for sharepoint to
+        run `refresh --http-url` against (see `storage`)
+    compact: merge the small fragments of the versioned dataset written by
+        `refresh --versioned`, and expire its old versions (see `versioned_dataset`)
+    pin / unpin: keep versions of the versioned dataset whatever their age,
+        for example the versions of the quarter-end reports; the pins are
+        stored in the dataset, and every compaction keeps them
+    quarantine list / release: show the files the refreshes skip because
+        they kept failing, and let them be read again (see `run_journal`)
+
+`refresh`, `scan` and `plan` read the sharepoint folder by default, a local
+or mounted folder with `--local-root`, or a served folder with `--http-url`;
+`--mirror-dir` keeps a synced local copy of the files.
+
+The sharepoint credentials are read from the environment variables
+RESERVING_DASHBOARD_SHAREPOINT_USERNAME and RESERVING_DASHBOARD_SHAREPOINT_PASSWORD;
+without them the Windows credentials are used.
+
+# Usage:
+    reserving_dashboard_update plan --incremental --max-workers 4
+    reserving_dashboard_update plan --versioned --mirror-dir refresh_mirror
+    reserving_dashboard_update refresh --incremental --max-workers 4
+    reserving_dashboard_update watch --local-root O:/ --publish-dir published
+    reserving_dashboard_update jobs jobs.json --report-path job_report.json
+    reserving_dashboard_update refresh --work-dir //server/refresh_work --work-queue
+    reserving_dashboard_update worker --work-dir //server/refresh_work
+    reserving_dashboard_update refresh --incremental --mirror-dir refresh_mirror
+    reserving_dashboard_update serve test_workbooks --port 8765
+    reserving_dashboard_update refresh --versioned --mirror-dir refresh_mirror
+    reserving_dashboard_update pin 42 --note "2Q2024 reserve review"
+    reserving_dashboard_update compact --keep-versions 8
+    reserving_dashboard_update unpin 42
+    reserving_dashboard_update quarantine list
+    reserving_dashboard_update quarantine release "CA Link Ratios 2Q2024.xlsx"
+    reserving_dashboard_update refresh --http-url http://127.0.0.1:8765 --sharepoint-folder ''
+    python -m src scan
+"""
+
+import argparse
+import json
+import sys
+
+from .folder_to_parquet import (EXCEL_EXTENSIONS, add_refresh_arguments,
+                                add_sharepoint_arguments, add_storage_arguments,
+                                get_client_context_and_sharepoint_folder,
+                                get_sharepoint_credentials, get_storage_from_arguments,
+                                refresh_from_arguments)
+from .run_journal import DEFAULT_JOURNAL_PATH, DEFAULT_MAX_FAILURES, DEFAULT_WORK_DIR
+from .versioned_dataset import (DEFAULT_DATASET_NAME, DEFAULT_KEEP_VERSIONS,
+                                DEFAULT_SMALL_FRAGMENT_BYTES)
+from .watch import DEFAULT_MAX_WAIT_SECONDS, DEFAULT_POLL_INTERVAL, DEFAULT_QUIET_SECONDS
+from .work_queue import DEFAULT_LEASE_SECONDS, DEFAULT_MAX_ATTEMPTS
+from .work_queue import DEFAULT_POLL_INTERVAL as WORK_QUEUE_POLL_INTERVAL
+
+
+def get_storage_file_infos(
+    parsed: argparse.Namespace
+) -> list:
+    """
+    # Description:
+    This function connects to the storage backend of the command line
+    options, and lists the files of its folder.
+    """
+    from .refresh_plan import get_file_infos
+
+    storage = get_storage_from_arguments(parsed)
+    try:
+        return get_file_infos(storage.list(parsed.sharepoint_folder))
+    finally:
+        storage.close()
+
+
+def scan(
+    parsed: argparse.Namespace
+) -> int:
+    """
+    # Description:
+    Runs the `scan` command: lists the workbooks of the folder.
+    """
+    file_infos = get_storage_file_infos(parsed)
+
+    if parsed.json:
+        print(json.dumps(file_infos, indent=2, default=str))
+        return 0
+
+    for info in sorted(file_infos, key=lambda info: info['name']):
+        print(f"{info['size'] / 1e6:10,.2f} MB  {info['modified'] or '':<20}  {info['name']}")
+    print(f"{len(file_infos):,} files, "
+          f"{sum(info['size'] for info in file_infos) / 1e6:,.1f} MB")
+    return 0
+
+
+def plan(
+    parsed: argparse.Namespace
+) -> int:
+    """
+    # Description:
+    Runs the `plan` command: shows what a refresh with the same options
+    would do, from the run journal and the traces of the earlier runs.
+    """
+    from .instrumentation import read_trace
+    from .refresh_plan import (find_trace_paths, format_plan, get_file_infos, get_rates,
+                               plan_refresh, summarize_plan)
+    from .run_journal import open_journal
+    from .storage import join_path
+    from .versioned_dataset import read_manifest
+
+    # the files, and the latest version of the versioned dataset
+    storage = get_storage_from_arguments(parsed)
+    try:
+        file_infos = get_file_infos(storage.list(parsed.sharepoint_folder))
+        manifest = (read_manifest(storage, join_path(parsed.sharepoint_folder,
+                                                     parsed.dataset_name))
+                    if parsed.versioned else None)
+    finally:
+        storage.close()
+
+    # the metrics of the earlier runs
+    trace_paths = parsed.trace_path or find_trace_paths(parsed.work_dir, parsed.history)
+    rates = get_rates(read_trace(trace_paths))
+
+    journal = open_journal(parsed.journal_path)
+    try:
+        refresh_plan = plan_refresh(file_infos, journal, parsed.incremental,
+                                    parsed.resume, rates, manifest, parsed.versioned)
+    finally:
+        journal.close()
+    summary = summarize_plan(refresh_plan, parsed.max_workers)
+
+    if parsed.json:
+        print(json.dumps({'files': refresh_plan, 'summary': summary},
+                         indent=2, default=str))
+    else:
+        print(format_plan(refresh_plan, summary, show_files=not parsed.summary_only))
+    return 0
+
+
+def refresh(
+    parsed: argparse.Namespace
+) -> int:
+    """
+    # Description:
+    Runs the `refresh` command.
+    """
+    refresh_from_arguments(parsed)
+    return 0
+
+
+def watch(
+    parsed: argparse.Namespace
+) -> int:
+    """
+    # Description:
+    Runs the `watch` command, until interrupted.
+    """
+    from . import watch as watch_mode
+    from .run_journal import open_journal
+
+    journal = open_journal(parsed.journal_path)
+    try:
+        # the local share: re-publish the partitions of the changed workbooks
+        if parsed.local_root is not None:
+            source = watch_mode.LocalChangeSource(
+                parsed.local_root, journal,
+                tuple(parsed.extension) if parsed.extension else EXCEL_EXTENSIONS)
+            handle_changes = watch_mode.LocalPartitionPublisher(
+                parsed.publish_dir, journal, source, parsed.work_dir, parsed.max_failures)
+
+        # sharepoint: incremental refreshes
+        else:
+            sharepoint_username, sharepoint_password = get_sharepoint_credentials()
+            client_context, _ = get_client_context_and_sharepoint_folder(
+                parsed.sharepoint_url, sharepoint_username, sharepoint_password,
+                parsed.sharepoint_folder)
+            source = watch_mode.SharePointChangeSource(
+                client_context, parsed.sharepoint_folder, journal)
+            handle_changes = watch_mode.SharePointRefresher(
+                sharepoint_folder=parsed.sharepoint_folder,
+                sharepoint_url=parsed.sharepoint_url,
+                sharepoint_username=sharepoint_username,
+                sharepoint_password=sharepoint_password,
+                journal_path=parsed.journal_path,
+                work_dir=parsed.work_dir,
+                max_failures=parsed.max_failures,
+                max_workers=parsed.max_workers)
+
+        watch_mode.watch(source, handle_changes, parsed.poll_interval,
+                         parsed.quiet_seconds, parsed.max_wait_seconds)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        journal.close()
+    return 0
+
+
+def jobs(
+    parsed: argparse.Namespace
+) -> int:
+    """
+    # Description:
+    Runs the `jobs` command. The exit status is 1 when a target failed.
+    """
+    from .jobs import format_job_report, load_job_spec, run_jobs
+
+    spec = load_job_spec(parsed.spec_path)
+    for option in ('max_targets', 'max_connections', 'max_workers', 'memory_budget_mb'):
+        if getattr(parsed, option) is not None:
+            spec['limits'][option] = getattr(parsed, option)
+
+    report = run_jobs(spec, parsed.work_dir, parsed.resume, parsed.trace_path,
+                      parsed.report_path)
+    print(format_job_report(report))
+    return 0 if report['totals']['failed'] == 0 else 1
+
+
+def worker(
+    parsed: argparse.Namespace
+) -> int:
+    """
+    # Description:
+    Runs the `worker` command, until interrupted or idle for `--idle-timeout`.
+    """
+    from .work_queue import run_worker
+
+    try:
+        processed = run_worker(parsed.work_dir, parsed.lease_seconds, parsed.max_attempts,
+                               parsed.poll_interval, parsed.idle_timeout)
+    except KeyboardInterrupt:
+        return 0
+    print(f'{processed:,} task(s) processed')
+    return 0
+
+
+def serve(
+    parsed: argparse.Namespace
+) -> int:
+    """
+    # Description:
+    Runs the `serve` command, until interrupted.
+    """
+    from .storage import serve_folder
+
+    server = serve_folder(parsed.root, parsed.host, parsed.port)
+    print(f'Serving {parsed.root} at {server.url}')
+    try:
+        # join with a timeout, so that Ctrl+C is not held up
+        while server.thread.is_alive():
+            server.thread.join(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+    return 0
+
+
+def compact(
+    parsed: argparse.Namespace
+) -> int:
+    """
+    # Description:
+    Runs the `compact` command.
+    """
+    from .storage import join_path
+    from .versioned_dataset import compact_dataset, pin_version
+
+    storage = get_storage_from_arguments(parsed)
+    try:
+        # the pins are kept in the dataset, for the next compactions too
+        dataset_folder = join_path(parsed.sharepoint_folder, parsed.dataset_name)
+        for version in parsed.pin or []:
+            if pin_version(storage, dataset_folder, version):
+                print("Pinned version", version)
+
+        summary = compact_dataset(
+            storage, dataset_folder, parsed.keep_versions, None,
+            parsed.small_fragment_mb * 1_000_000, parsed.work_dir)
+    finally:
+        storage.close()
+
+    print(f"version {summary['version']}: {summary['merged_fragments']} fragment(s) merged, "
+          f"{len(summary['expired_versions'])} version(s) expired, "
+          f"{summary['removed_fragments']} fragment(s) removed "
+          f"({summary['removed_bytes'] / 1e6:,.1f} MB)")
+    print('kept versions:', ', '.join(str(version) for version in summary['kept_versions']))
+    return 0
+
+
+def pin(
+    parsed: argparse.Namespace
+) -> int:
+    """
+    # Description:
+    Runs the `pin` command: pins versions of the versioned dataset, or
+    lists the pinned versions when none is given. The exit status is 1 when
+    a version does not exist.
+    """
+    from .storage import join_path
+    from .versioned_dataset import pin_version, read_pins
+
+    storage = get_storage_from_arguments(parsed)
+    try:
+        dataset_folder = join_path(parsed.sharepoint_folder, parsed.dataset_name)
+        status = 0
+        for version in parsed.versions:
+            try:
+                if pin_version(storage, dataset_folder, version, parsed.note):
+                    print("Pinned version", version)
+                else:
+                    print("Already pinned:", version)
+            except FileNotFoundError as error:
+                print("Not pinned:", error)
+                status = 1
+
+        if len(parsed.versions) == 0:
+            pins = read_pins(storage, dataset_folder)
+            for version, pinned in sorted(pins.items()):
+                print(f"{version:>6}  {pinned['pinned']}  {pinned['note'] or ''}")
+            print(f"{len(pins):,} pinned version(s)")
+    finally:
+        storage.close()
+    return status
+
+
+def unpin(
+    parsed: argparse.Namespace
+) -> int:
+    """
+    # Description:
+    Runs the `unpin` command. The exit status is 1 when a version was not pinned.
+    """
+    from .storage import join_path
+    from .versioned_dataset import unpin_version
+
+    storage = get_storage_from_arguments(parsed)
+    try:
+        dataset_folder = join_path(parsed.sharepoint_folder, parsed.dataset_name)
+        status = 0
+        for version in parsed.versions:
+            if unpin_version(storage, dataset_folder, version):
+                print("Unpinned version", version)
+            else:
+                print("Not pinned:", version)
+                status = 1
+    finally:
+        storage.close()
+    return status
+
+
+def quarantine(
+    parsed: argparse.Namespace
+) -> int:
+    """
+    # Description:
+    Runs the `quarantine list` and `quarantine release` commands.
+    The exit status of `release` is 1 when a named file was not quarantined.
+    """
+    import time
+
+    from .run_journal import get_quarantine, open_journal, release_from_quarantine
+
+    journal = open_journal(parsed.journal_path)
+    try:
+        quarantined = get_quarantine(journal)
+
+        # list the quarantined files
+        if parsed.action == 'list':
+            if parsed.json:
+                print(json.dumps(quarantined, indent=2, default=str))
+                return 0
+            for row in quarantined:
+                quarantined_at = time.strftime(
+                    '%Y-%m-%d %H:%M', time.localtime(row['quarantined_at']))
+                print(f"{quarantined_at}  {row['failures']:>3} failures  {row['file_key']}")
+                print(f"    {row['last_error']}")
+            print(f"{len(quarantined):,} quarantined file(s)")
+            return 0
+
+        # release the named files, or every file
+        file_keys = ([row['file_key'] for row in quarantined] if parsed.all
+                     else parsed.file_names)
+        status = 0
+        for file_key in file_keys:
+            if release_from_quarantine(journal, file_key):
+                print("Released:", file_key)
+            else:
+                print("Not quarantined:", file_key)
+                status = 1
+        return status
+    finally:
+        journal.close()
+
+
+def main(
+    args: list = None
+) -> int:
+    """
+    # Description:
+    Command line entry point.
+
+    # Returns:
+        int
+            this is the exit status
+    """
+    parser = argparse.ArgumentParser(
+        prog='reserving_dashboard_update',
+        description='refresh the combined output_tbl data of the reserving dashboard')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    # refresh
+    refresh_parser = commands.add_parser(
+        'refresh', help='combine the output_tbl sheets into parquet and upload it')
+    add_refresh_arguments(refresh_parser)
+    refresh_parser.set_defaults(function=refresh)
+
+    # scan
+    scan_parser = commands.add_parser(
+        'scan', help='list the workbooks of the folder')
+    add_sharepoint_arguments(scan_parser)
+    add_storage_arguments(scan_parser)
+    scan_parser.add_argument('--json', action='store_true')
+    scan_parser.set_defaults(function=scan)
+
+    # plan
+    plan_parser = commands.add_parser(
+        'plan', help='show what a refresh would do, without doing it')
+    add_sharepoint_arguments(plan_parser)
+    add_storage_arguments(plan_parser)
+    plan_parser.add_argument('--resume', action='store_true',
+                             help='plan the continuation of the latest run that did not complete')
+    plan_parser.add_argument('--incremental', action='store_true',
+                             help='plan an incremental refresh')
+    plan_parser.add_argument('--versioned', action='store_true',
+                             help='plan a refresh of the versioned dataset (refresh --versioned)')
+    plan_parser.add_argument('--dataset-name', default=DEFAULT_DATASET_NAME,
+                             help='folder of the versioned dataset, in the sharepoint folder')
+    plan_parser.add_argument('--max-workers', type=int, default=1,
+                             help='number of files the refresh would read at a time')
+    plan_parser.add_argument('--journal-path', default=DEFAULT_JOURNAL_PATH)
+    plan_parser.add_argument('--work-dir', default=DEFAULT_WORK_DIR)
+    plan_parser.add_argument('--trace-path', action='append', default=None,
+                             help='trace of an earlier run to estimate from (repeatable; '
+                                  'default: the latest traces in WORK_DIR/traces)')
+    plan_parser.add_argument('--history', type=int, default=5,
+                             help='number of latest traces to estimate from')
+    plan_parser.add_argument('--summary-only', action='store_true',
+                             help='print the totals only')
+    plan_parser.add_argument('--json', action='store_true')
+    plan_parser.set_defaults(function=plan)
+
+    # watch
+    watch_parser = commands.add_parser(
+        'watch', help='refresh only what changed, as it changes')
+    add_sharepoint_arguments(watch_parser)
+    watch_parser.add_argument('--local-root', default=None,
+                              help='watch this local folder tree instead of sharepoint')
+    watch_parser.add_argument('--extension', action='append', default=None,
+                              help='extension of the workbooks of the local folder tree '
+                                   '(repeatable), defaults to every excel extension')
+    watch_parser.add_argument('--publish-dir', default='published',
+                              help='partitioned parquet folder published from the local tree')
+    watch_parser.add_argument('--poll-interval', type=float,
+                              default=DEFAULT_POLL_INTERVAL,
+                              help='seconds between two polls')
+    watch_parser.add_argument('--quiet-seconds', type=float,
+                              default=DEFAULT_QUIET_SECONDS,
+                              help='seconds without a change before refreshing')
+    watch_parser.add_argument('--max-wait-seconds', type=float,
+                              default=DEFAULT_MAX_WAIT_SECONDS,
+                              help='longest a change waits during a burst of changes')
+    watch_parser.add_argument('--max-workers', type=int, default=1,
+                              help='number of files a sharepoint refresh reads at a time')
+    watch_parser.add_argument('--max-failures', type=int, default=DEFAULT_MAX_FAILURES)
+    watch_parser.add_argument('--journal-path', default=DEFAULT_JOURNAL_PATH)
+    watch_parser.add_argument('--work-dir', default=DEFAULT_WORK_DIR)
+    watch_parser.set_defaults(function=watch)
+
+    # jobs
+    jobs_parser = commands.add_parser(
+        'jobs', help='refresh every target of a job spec under global limits')
+    jobs_parser.add_argument('spec_path', help='JSON job spec (see the `jobs` module)')
+    jobs_parser.add_argument('--resume', action='store_true',
+                             help='continue the runs of the targets that did not complete')
+    jobs_parser.add_argument('--work-dir', default=DEFAULT_WORK_DIR)
+    jobs_parser.add_argument('--report-path', default=None,
+                             help='consolidated JSON report (default: WORK_DIR/job_report.json)')
+    jobs_parser.add_argument('--trace-path', default=None,
+                             help='JSON-lines trace of the job')
+    jobs_parser.add_argument('--max-targets', type=int, default=None,
+                             help='override the number of targets refreshed at a time')
+    jobs_parser.add_argument('--max-connections', type=int, default=None,
+                             help='override the number of sharepoint transfers at a time')
+    jobs_parser.add_argument('--max-workers', type=int, default=None,
+                             help='override the number of parses at a time, over every target')
+    jobs_parser.add_argument('--memory-budget-mb', type=int, default=None,
+                             help='override the memory of the parses, over every target')
+    jobs_parser.set_defaults(function=jobs)
+
+    # worker
+    worker_parser = commands.add_parser(
+        'worker', help='parse the files queued by a work-queue refresh')
+    worker_parser.add_argument('--work-dir', default=DEFAULT_WORK_DIR,
+                               help='work folder shared with the refresh')
+    worker_parser.add_argument('--lease-seconds', type=float, default=DEFAULT_LEASE_SECONDS,
+                               help='seconds a task belongs to a worker without a renewal')
+    worker_parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS,
+                               help='claims of a task before its file is given up')
+    worker_parser.add_argument('--poll-interval', type=float,
+                               default=WORK_QUEUE_POLL_INTERVAL,
+                               help='seconds between two looks at an empty queue')
+    worker_parser.add_argument('--idle-timeout', type=float, default=None,
+                               help='stop after this many seconds without a task')
+    worker_parser.set_defaults(function=worker)
+
+    # serve
+    serve_parser = commands.add_parser(
+        'serve', help='serve a local folder over HTTP as a stand-in for sharepoint')
+    serve_parser.add_argument('root', help='folder to serve')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8765)
+    serve_parser.set_defaults(function=serve)
+
+    # compact
+    compact_parser = commands.add_parser(
+        'compact', help='merge the small fragments of the versioned dataset '
+                        'and expire its old versions')
+    add_sharepoint_arguments(compact_parser)
+    add_storage_arguments(compact_parser)
+    compact_parser.add_argument('--dataset-name', default=DEFAULT_DATASET_NAME,
+                                help='folder of the versioned dataset, in the sharepoint folder')
+    compact_parser.add_argument('--keep-versions', type=int, default=DEFAULT_KEEP_VERSIONS,
+                                help='number of latest versions to keep')
+    compact_parser.add_argument('--pin', type=int, action='append', default=None,
+                                help='pin this version first, like the pin command (repeatable)')
+    compact_parser.add_argument('--small-fragment-mb', type=float,
+                                default=DEFAULT_SMALL_FRAGMENT_BYTES / 1_000_000,
+                                help='size under which a fragment is merged')
+    compact_parser.add_argument('--work-dir', default=DEFAULT_WORK_DIR,
+                                help='folder of the temporary merged fragment')
+    compact_parser.set_defaults(function=compact)
+
+    # pin / unpin
+    pin_parser = commands.add_parser(
+        'pin', help='keep versions of the versioned dataset whatever their age, '
+                    'or list the pinned versions')
+    unpin_parser = commands.add_parser(
+        'unpin', help='let compact expire pinned versions of the versioned dataset again')
+    for pins_parser in (pin_parser, unpin_parser):
+        add_sharepoint_arguments(pins_parser)
+        add_storage_arguments(pins_parser)
+        pins_parser.add_argument('--dataset-name', default=DEFAULT_DATASET_NAME,
+                                 help='folder of the versioned dataset, in the sharepoint folder')
+    pin_parser.add_argument('versions', type=int, nargs='*',
+                            help='versions to pin, for example the version of a quarter-end '
+                                 'report; none to list the pinned versions')
+    pin_parser.add_argument('--note', default=None,
+                            help='why the versions are pinned')
+    pin_parser.set_defaults(function=pin)
+    unpin_parser.add_argument('versions', type=int, nargs='+', help='versions to unpin')
+    unpin_parser.set_defaults(function=unpin)
+
+    # quarantine
+    quarantine_parser = commands.add_parser(
+        'quarantine', help='list the quarantined files, or release them')
+    quarantine_actions = quarantine_parser.add_subparsers(dest='action', required=True)
+    quarantine_list_parser = quarantine_actions.add_parser(
+        'list', help='list the files the refreshes skip because they kept failing')
+    quarantine_list_parser.add_argument('--json', action='store_true')
+    quarantine_release_parser = quarantine_actions.add_parser(
+        'release', help='let quarantined files be read again by the next refresh')
+    release_files = quarantine_release_parser.add_mutually_exclusive_group(required=True)
+    release_files.add_argument('file_names', nargs='*', default=[],
+                               help='names of the files to release')
+    release_files.add_argument('--all', action='store_true',
+                               help='release every quarantined file')
+    for action_parser in (quarantine_list_parser, quarantine_release_parser):
+        action_parser.add_argument('--journal-path', default=DEFAULT_JOURNAL_PATH)
+        action_parser.set_defaults(function=quarantine)
+
+    parsed = parser.parse_args(args)
+    return parsed.function(parsed)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
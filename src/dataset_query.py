@@ -0,0 +1,313 @@
+"""
+# Description:
+Lazy query API over the parquet dataset written by `folder_to_parquet`.
+
+Instead of loading the whole uploaded `data.parquet` into pandas, callers
+describe the rows (analysis_idx range, LOB, CIG type) and the columns they
+need. The filters are handed to `pyarrow.dataset`, which pushes them down to
+the hive partitions (when the dataset is a partitioned directory) and to the
+parquet row-group statistics (min/max per column), so only the row groups
+that can contain matching rows are ever read from disk.
+
+`folder_to_parquet` writes the combined table sorted by analysis_idx and LOB
+in small row groups (see `sort_for_pushdown` and `ROW_GROUP_SIZE`), which is
+what makes the row-group statistics selective.
+
+The source can also be the local folder of a versioned dataset (see the
+`versioned_dataset` module); `version` pins the query to one version of it,
+so a report reads the same rows however many refreshes ran since.
+
+# Example:
+    df = query_dataset(
+        'data.parquet',
+        analysis_idx_range=(2023 * 4 + 3, 2023 * 4 + 3),
+        lobs=['CA'],
+        columns=['lob', 'analysis_idx', 'paid_loss']
+    )
+    df = query_dataset('dataset_copy', version=42, lobs=['CA'])
+"""
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+# names of the columns the query filters are applied to
+# analysis_idx is added to every output_tbl frame by `folder_to_parquet`
+# and is year * 4 + quarter (see `find_cig_files.filter_year_quarter`)
+ANALYSIS_IDX_COLUMN = 'analysis_idx'
+LOB_COLUMN = 'lob'
+CIG_TYPE_COLUMN = 'cig_type'
+
+# the columns the written table is sorted by, in order
+# sorting clusters each quarter / LOB into a few row groups
+# so the min/max statistics of the other row groups exclude them
+SORT_COLUMNS = [ANALYSIS_IDX_COLUMN, LOB_COLUMN, CIG_TYPE_COLUMN]
+
+# number of rows per parquet row group when writing the combined table
+# small enough that one quarter for one LOB spans few row groups,
+# large enough that the per-row-group overhead stays negligible
+ROW_GROUP_SIZE = 50_000
+
+
+def sort_for_pushdown(
+    df: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    # Description:
+    This function sorts a dataframe by the `SORT_COLUMNS` that it contains,
+    so that the parquet row-group statistics written for it are selective.
+    Columns in `SORT_COLUMNS` that are not in the dataframe are ignored.
+
+    # Parameters:
+        df: pd.DataFrame
+            this is the combined output_tbl dataframe
+
+    # Returns:
+        pd.DataFrame
+            this is the sorted dataframe, with a fresh index
+    """
+    # only sort by the columns that are actually present
+    sort_columns = [column for column in SORT_COLUMNS if column in df.columns]
+
+    # nothing to sort by, return the dataframe unchanged
+    if len(sort_columns) == 0:
+        return df
+
+    # a stable sort keeps the original file order within each key
+    return df.sort_values(sort_columns, kind='stable').reset_index(drop=True)
+
+
+def get_dataset(
+    source: str,
+    partitioning: str = 'hive',
+    version: int = None
+) -> ds.Dataset:
+    """
+    # Description:
+    This function opens the parquet dataset at `source` without reading any data.
+    `source` can be a single parquet file (the uploaded `data.parquet`), a
+    directory of parquet files, optionally hive-partitioned
+    (for example `analysis_idx=8095/lob=CA/part-0.parquet`), or the folder
+    of a versioned dataset.
+
+    # Parameters:
+        source: str
+            this is the path to the parquet file or directory
+        partitioning: str
+            this is the partitioning scheme of a directory dataset
+            defaults to 'hive'
+        version: int
+            this is the version of a versioned dataset to open
+            defaults to None for the latest version
+
+    # Returns:
+        pyarrow.dataset.Dataset
+            this is the lazily opened dataset
+    """
+    from .versioned_dataset import is_versioned_dataset, open_version
+
+    # a versioned dataset: the live rows of one version
+    if is_versioned_dataset(source):
+        return open_version(source, version)
+    if version is not None:
+        raise ValueError(f'{source} is not a versioned dataset, it has no version {version}')
+
+    return ds.dataset(source, format='parquet', partitioning=partitioning)
+
+
+def get_filter_expression(
+    analysis_idx_range: tuple = None,
+    lobs: list = None,
+    cig_types: list = None
+) -> ds.Expression:
+    """
+    # Description:
+    This function builds the `pyarrow.dataset` filter expression for the query.
+    Each argument left as None does not filter anything.
+
+    # Parameters:
+        analysis_idx_range: tuple
+            this is the inclusive (first, last) analysis_idx range,
+            either end may be None to leave it open.
+            an int selects a single analysis_idx
+            defaults to None
+        lobs: list
+            this is the list of LOB codes to keep
+            defaults to None
+        cig_types: list
+            this is the list of CIG file types to keep; only the rows of the
+            workbooks whose file type was known when they were read have a
+            `cig_type` (see `output_tbl_schema.normalize_dtypes`), so data
+            written without a CIG reference file cannot be filtered on it
+            defaults to None
+
+    # Returns:
+        pyarrow.dataset.Expression
+            this is the combined filter expression,
+            or None if no filter was requested
+    """
+    # collect the individual conditions, and combine them with "and" at the end
+    conditions = []
+
+    # analysis_idx range
+    if analysis_idx_range is not None:
+        # a single int selects exactly one quarter
+        if isinstance(analysis_idx_range, int):
+            analysis_idx_range = (analysis_idx_range, analysis_idx_range)
+
+        first, last = analysis_idx_range
+        if first is not None and last is not None and first > last:
+            raise ValueError(
+                f'analysis_idx_range is empty: {first} > {last}')
+        if first is not None:
+            conditions.append(ds.field(ANALYSIS_IDX_COLUMN) >= first)
+        if last is not None:
+            conditions.append(ds.field(ANALYSIS_IDX_COLUMN) <= last)
+
+    # LOB codes
+    if lobs is not None:
+        conditions.append(ds.field(LOB_COLUMN).isin(list(lobs)))
+
+    # CIG file types
+    if cig_types is not None:
+        conditions.append(ds.field(CIG_TYPE_COLUMN).isin(list(cig_types)))
+
+    # no conditions means no filter
+    if len(conditions) == 0:
+        return None
+
+    # combine the conditions
+    expression = conditions[0]
+    for condition in conditions[1:]:
+        expression = expression & condition
+    return expression
+
+
+def get_scanner(
+    source,
+    columns: list = None,
+    analysis_idx_range: tuple = None,
+    lobs: list = None,
+    cig_types: list = None,
+    batch_size: int = 131_072,
+    version: int = None
+) -> ds.Scanner:
+    """
+    # Description:
+    This function builds a lazy scanner over the dataset with the filters and
+    the column projection pushed down. Nothing is read until the scanner is
+    consumed (`to_table`, `to_batches`, `to_reader`, ...).
+
+    # Parameters:
+        source: str or pyarrow.dataset.Dataset
+            this is the path to the dataset, or an already opened dataset
+        columns: list
+            this is the list of columns to return
+            defaults to None for all columns
+        analysis_idx_range: tuple
+            see `get_filter_expression`
+        lobs: list
+            see `get_filter_expression`
+        cig_types: list
+            see `get_filter_expression`
+        batch_size: int
+            this is the maximum number of rows per record batch
+            defaults to 131,072
+        version: int
+            this is the version of a versioned dataset to read
+            defaults to None for the latest version
+
+    # Returns:
+        pyarrow.dataset.Scanner
+            this is the lazy scanner
+    """
+    # open the dataset unless we were handed one
+    dataset = (source if isinstance(source, ds.Dataset)
+               else get_dataset(source, version=version))
+
+    # build the filter
+    expression = get_filter_expression(analysis_idx_range, lobs, cig_types)
+
+    # fail early, with a readable message, when a filter or a requested column
+    # is not in the dataset, instead of pyarrow's expression binding error
+    schema_names = set(dataset.schema.names)
+    filter_columns = []
+    if analysis_idx_range is not None:
+        filter_columns.append(ANALYSIS_IDX_COLUMN)
+    if lobs is not None:
+        filter_columns.append(LOB_COLUMN)
+    if cig_types is not None:
+        filter_columns.append(CIG_TYPE_COLUMN)
+    if cig_types is not None and CIG_TYPE_COLUMN not in schema_names:
+        raise ValueError(
+            f'the dataset has no {CIG_TYPE_COLUMN} column to filter cig_types on: '
+            f'it was written without the CIG file types of the workbooks (no CIG '
+            f'reference file, or before they were recorded); filter on file_name instead')
+    missing = [column for column in filter_columns + list(columns or [])
+               if column not in schema_names]
+    if len(missing) > 0:
+        raise ValueError(f'columns not in the dataset: {missing}')
+
+    # the scanner applies the projection and the filter while reading
+    return dataset.scanner(
+        columns=columns,
+        filter=expression,
+        batch_size=batch_size
+    )
+
+
+def query_dataset(
+    source,
+    columns: list = None,
+    analysis_idx_range: tuple = None,
+    lobs: list = None,
+    cig_types: list = None,
+    output: str = 'pandas',
+    version: int = None
+):
+    """
+    # Description:
+    This function runs a query against the dataset and returns the result
+    as a pandas dataframe or a pyarrow table.
+
+    # Parameters:
+        source: str or pyarrow.dataset.Dataset
+            this is the path to the dataset, or an already opened dataset
+        columns: list
+            this is the list of columns to return
+            defaults to None for all columns
+        analysis_idx_range: tuple
+            see `get_filter_expression`
+        lobs: list
+            see `get_filter_expression`
+        cig_types: list
+            see `get_filter_expression`
+        output: str
+            this is either 'pandas' or 'arrow'
+            defaults to 'pandas'
+        version: int
+            this is the version of a versioned dataset to read, for
+            reproducible reports
+            defaults to None for the latest version
+
+    # Returns:
+        pd.DataFrame or pyarrow.Table
+            this is the filtered and projected data
+    """
+    if output not in ('pandas', 'arrow'):
+        raise ValueError(f"output must be 'pandas' or 'arrow', not {output}")
+
+    # build the scanner and materialize it
+    table: pa.Table = get_scanner(
+        source,
+        columns=columns,
+        analysis_idx_range=analysis_idx_range,
+        lobs=lobs,
+        cig_types=cig_types,
+        version=version
+    ).to_table()
+
+    # return in the requested format
+    if output == 'arrow':
+        return table
+    return table.to_pandas()
@@ -11,17 +11,20 @@ Module that finds all the CIG files starting in the root directory
 # and returns a dictionary with the filenames separated into the different categories
 
 import os
+import re
 import multiprocessing
 import concurrent.futures
 import pandas as pd
 
+from .instrumentation import instrumented
+
 
 def find_files_with_extension_in_single_folder(
     # input is a directory and a file extension
     directory: str = 'O:/STAFFHQ/SYMDATA/Actuarial/Reserving Applications/IBNR Allocation', extension: str = '.xlsb'
 
     # output is a list of the filenames that have the extension
-) -> list(str):
+) -> list:
     """
     # Description:
     Finds all the files in a directory that have a certain extension
@@ -55,10 +58,11 @@ def find_files_with_extension_in_single_folder(
     return files
 
 
+@instrumented('scan.walk')
 def find_files_with_extension(
   root_directory: str = 'O:/STAFFHQ/SYMDATA/Actuarial/Reserving Applications/IBNR Allocation',
   extension: str = '.xlsb', use_asynchronous: bool = True, use_multiprocessing: bool = True
-) -> list(str):
+) -> list:
   """
   # Description:
   Finds all the files in a directory
@@ -72,34 +76,77 @@ def find_files_with_extension(
   # Inputs:
   root_directory: *str* the root directory to search
                   default is the directory where the files are stored
+  extension: *str* the extension to search for, or a tuple of extensions
+              default is '.xlsb'
                   
   
   # Outputs:
   files: *list* a list of the filenames that have the extension
   """
-  # get a list of all the full file paths for all folders in the root directory
-  folders = [root_directory + '/' +
-      folder for folder in os.listdir(root_directory)]
-
-  # loop through each folder and keep adding subfolders to the list of folders until there are no more subfolders
-  while True:
-      
-    # initialize a list to store the subfolders
-    subfolders = []
-
-    # loop through each folder
-    for folder in folders:
-
-      # get a list of all the subfolders in the folder
-      subfolders += [folder + '/' + subfolder for subfolder in os.listdir(folder)]
-      
-      # if there are no subfolders, break out of the loop
-      if len(subfolders) == 0:
-        break
-      
-      
-            
-            
+  # the folders still to scan, one level of the tree at a time
+  folders = [root_directory]
+
+  # the full paths of the files found so far
+  files = []
+
+  # listing a folder on the network share is mostly waiting on the server,
+  # so the folders of one level are listed concurrently in threads
+  # (separate processes would not list any faster, so `use_multiprocessing`
+  # only matters through `use_asynchronous`)
+  max_workers = min(32, (multiprocessing.cpu_count() or 1) * 4) \
+    if use_asynchronous else 1
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+    # keep going down the tree until a level has no subfolders
+    while len(folders) > 0:
+
+      # list every folder of this level
+      subfolders = []
+      for folder_files, folder_subfolders in executor.map(
+          lambda folder: scan_folder(folder, extension), folders):
+        files += folder_files
+        subfolders += folder_subfolders
+
+      # move down to the next level
+      folders = subfolders
+
+  # return the list of full file paths
+  return files
+
+
+def scan_folder(
+  folder: str, extension: str = '.xlsb'
+) -> tuple:
+  """
+  # Description:
+  Lists a single folder once, with os.scandir, and returns both the full paths
+  of the files that have the extension and the full paths of the subfolders.
+  os.scandir returns the entry types with the listing, so no extra call
+  per entry is needed to tell files from folders.
+
+  # Inputs:
+  folder: *str* the folder to list
+  extension: *str* the extension to search for, or a tuple of extensions
+              default is '.xlsb'
+
+  # Outputs:
+  (files, subfolders): *tuple* the list of file paths and the list of subfolder paths
+  """
+  files = []
+  subfolders = []
+
+  with os.scandir(folder) as entries:
+    for entry in entries:
+      # subfolders are scanned on the next level
+      if entry.is_dir():
+        subfolders.append(folder + '/' + entry.name)
+
+      # files with the extension are kept
+      elif entry.is_file() and entry.name.endswith(extension):
+        files.append(folder + '/' + entry.name)
+
+  return files, subfolders
 
 
 def get_filenames(
@@ -108,7 +155,7 @@ def get_filenames(
     files: list, extension: str = '.xlsb'
 
     # output is a list of the filenames
-) -> list(str):
+) -> list:
     """
     # Description:
     Takes a list of file paths and the extension of the files
@@ -143,13 +190,52 @@ def get_filenames(
     return filenames
 
 
+def parse_year_quarter(
+    # input is a file path or file name
+    file_name: str
+
+    # output is the year and the quarter, or None
+) -> tuple:
+    """
+    # Description:
+    Takes one file path or file name and returns its year and quarter,
+    parsed in the same way as `get_year_quarter` ('2021Q2' or '3Q2023').
+    It is not instrumented: the parse stage tags every file it reads with
+    it, and that is not scan work.
+
+    # Inputs:
+    file_name: *str* a file path or file name
+
+    # Outputs:
+    (year, quarter): *tuple* of ints, or None if the name has no year and quarter
+
+    # Example:
+    parse_year_quarter('O:/2019/2019 Q2/test 2Q2020.xlsb')
+    (2020, 2)
+    """
+    file_name = os.path.basename(file_name)
+
+    # year is always 4 digits
+    year = re.search(r'(\d{4})', file_name)
+
+    # quarter after the year ('2021Q2'), otherwise before it ('3Q2023')
+    quarter = (re.search(r'\d{4}Q(\d)', file_name)
+               or re.search(r'(\d)Q\d{4}', file_name))
+
+    # no year / quarter in the file name
+    if year is None or quarter is None:
+        return None
+    return int(year.group(1)), int(quarter.group(1))
+
+
+@instrumented('scan.metadata_parse')
 def get_year_quarter(
     # input is a list of file paths and a file extension
     file_paths: list, extension: str = '.xlsb'
 
     # output is a pandas dataframe with
     # the file path, the file name, the year, and the quarter
-) -> pd.DataFrame(str, str, int, int):
+) -> pd.DataFrame:
     """
     # Description:
     Takes a list of file paths and returns
@@ -189,11 +275,12 @@ def get_year_quarter(
     df['year'] = df['year'].astype(int)
 
     # quarter may come before or after the year in the filename
-    # first try to extract the quarter after the year
-    df['quarter'] = df['file_name'].str.extract(r'Q(\d)')
+    # first try to extract the quarter after the year ('2021Q2')
+    df['quarter'] = df['file_name'].str.extract(r'\d{4}Q(\d)', expand=False)
 
-    # if quarter is not found after the year, try to extract the quarter before the year
-    df['quarter'] = df['quarter'].fillna(df['file_name'].str.extract(r'(\d)Q'))
+    # if quarter is not found after the year, try to extract the quarter before the year ('3Q2023')
+    df['quarter'] = df['quarter'].fillna(
+        df['file_name'].str.extract(r'(\d)Q\d{4}', expand=False))
 
     # column 'quarter' is a string, convert it to an integer
     df['quarter'] = df['quarter'].astype(int)
@@ -202,19 +289,20 @@ def get_year_quarter(
     return df
 
 
+@instrumented('scan.filter')
 def filter_year_quarter(
     # input is a data frame with
     # the file path, the file name, the year, and the quarter
     # and an optional `analysis_idx_filter` parameter
     # that defaults to (2021 * 4 + 4) for 2021Q4
-    df: pd.DataFrame(str, str, int, int), analysis_idx_filter: int = (2021 * 4 + 4)
+    df: pd.DataFrame, analysis_idx_filter: int = (2021 * 4 + 4)
 
     # output is a data frame with
     # the file path, the file name, the year, and the quarter
     # and the analysis index
     # filtered to only include files with indices
     # greater than or equal to the `analysis_idx_filter` parameter
-) -> pd.DataFrame(str, str, int, int, int):
+) -> pd.DataFrame:
     """
     # Description:
     Takes a data frame with the file path, the file name, the year, and the quarter
@@ -277,6 +365,7 @@ def filter_year_quarter(
 # "XQYYYY" where X is the quarter and YYYY is the year
 # and the file extension can be any excel file extension
 # the form of the filename is: "stem XQYYYY.xlsx"
+@instrumented('scan.stem_match')
 def get_cig_link_ratio_filenames(
     # input is a data frame with
     # the file path, the file name, the year, and the quarter
@@ -284,12 +373,12 @@ def get_cig_link_ratio_filenames(
     # `filename` and `type`
     # type is the cig filetype that gets filtered to only include
     # 'link ratio' and filename is the file stem for the cig filetype
-    df: pd.DataFrame(str, str, int, int, int), cig_filetypes: pd.DataFrame(str, str)
+    df: pd.DataFrame, cig_filetypes: pd.DataFrame = None
 
     # output is a data frame with
     # the file path, the file name, the year, and the quarter
     # filtered to only include cig link ratio file names
-) -> pd.DataFrame(str, str, int, int, int):
+) -> pd.DataFrame:
     """
     # Description:
     Takes a data frame with the file path, the file name, the year, and the quarter
@@ -306,6 +395,8 @@ def get_cig_link_ratio_filenames(
         `filename` and `type`
         type is the cig filetype that gets filtered to only include 
         'link ratio' and filename is the file stem for the cig filetype
+        default is None for the link ratio stems of the CIG reference file
+        (see `searching_inputs`), matched without case
 
     # Outputs:
     df: *pandas dataframe* a dataframe with the file path, file name, the year, and the quarter
@@ -324,6 +415,16 @@ def get_cig_link_ratio_filenames(
     - the third file has an index greater than or equal to the `analysis_idx_filter` parameter
     - the third file is the only file that is returned
     """
+    # match the file names with the precomputed stems of the reference file
+    if cig_filetypes is None:
+        from .searching_inputs import get_reference_data
+
+        # the pattern of the link ratio stems, built once per version of the file
+        type_patterns = get_reference_data().type_patterns
+        if 'link ratio' not in type_patterns:
+            return df.iloc[0:0]
+        return df[df['file_name'].str.contains(type_patterns['link ratio'])]
+
     # filter cig_filetypes to only include 'link ratio' file types
     cig_filetypes = cig_filetypes[cig_filetypes['type'] == 'link ratio']
 
@@ -7,20 +7,55 @@ The excel files only include an excel file with the "output_tbl" sheet, and whos
 file name does not have the substring "(not analyzed)" in it.
 """
 
-import os
-import pandas as pd
+# annotations are not evaluated at import time, so the office365 type paths
+# in the signatures below do not have to exist in every office365 version
+from __future__ import annotations
 
-# function that takes a file name as input and returns the dataframe from the "output_tbl" sheet in the excel file
-# unless the filename has the substring "(not analyzed)" in it, and then it returns None
-
-import office365
-from office365.runtime.auth.authentication_context import AuthenticationContext
-from office365.sharepoint.client_context import ClientContext
+import argparse
+import os
+import shutil
+import sqlite3
+import time
+from typing import TYPE_CHECKING, Tuple
+
+# pandas, pyarrow, office365 and the Excel engines are imported by the functions
+# that use them, so that importing this module (and `--help`) stays fast
+# the modules imported here only need the standard library
+from .instrumentation import (count, enable_instrumentation, finish_instrumentation, gauge,
+                              instrumented, stage)
+from .profiling import (add_profiling_results, disable_profiling, enable_profiling,
+                        get_profiling_settings, is_profiling, profile_file, profile_in_worker,
+                        write_profiling_report)
+from .run_journal import (DEFAULT_JOURNAL_PATH, DEFAULT_MAX_FAILURES, DEFAULT_WORK_DIR,
+                          RUN_FILE_KEY, finish_run, get_completed_stage, get_failure_count,
+                          is_quarantined, open_journal, record_failure, record_stage,
+                          release_if_changed, start_run)
+from .scheduler import (connection_slot, estimate_memory_cost, run_with_memory_budget,
+                        worker_slot)
+from .searching_inputs import get_file_type
+
+# for the annotations only
+if TYPE_CHECKING:
+    import office365
+    import pandas as pd
+
+    from .storage import StorageBackend, StorageFile
+
+# the extensions of the excel files that can have an "output_tbl" sheet
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsb', '.xlsm')
+
+# the folder of the run traces, in the work folder
+TRACE_DIR_NAME = 'traces'
+
+# environment variables of the sharepoint credentials used by the command line
+SHAREPOINT_USERNAME_VARIABLE = 'RESERVING_DASHBOARD_SHAREPOINT_USERNAME'
+SHAREPOINT_PASSWORD_VARIABLE = 'RESERVING_DASHBOARD_SHAREPOINT_PASSWORD'
 
 # function to take a sharepoint connection and a string representing a folder,
 # and return the list of files in the folder
 
 
+@instrumented('sharepoint.connect')
 def get_sharepoint_connection(
     site_url: str = 'https://cinfin.sharepoint.com/sites/PandCReserving',
     user_email: str = None,
@@ -46,6 +81,10 @@ def get_sharepoint_connection(
         requests.models.Response
             this is the connection to the sharepoint site
     """
+    # office365 is only loaded when a connection is made
+    from office365.runtime.auth.authentication_context import AuthenticationContext
+    from office365.sharepoint.client_context import ClientContext
+
     # create an authentication context object
     # this is used to authenticate the user
     auth_ctx = AuthenticationContext(site_url)
@@ -101,6 +140,7 @@ def get_sharepoint_connection(
 # returns an iterable of files in the folder
 
 
+@instrumented('sharepoint.list')
 def get_files_in_folder(
     # takes these inputs:
     client_context: office365.sharepoint.client_context.ClientContext,
@@ -146,18 +186,38 @@ def get_files_in_folder(
     # return the list of files
     return files
 
-
+# function that takes a file name as input and returns the dataframe from the "output_tbl" sheet in the excel file
+# unless the filename has the substring "(not analyzed)" in it, and then it returns None
 def get_dataframe_from_file(
-    file_name: str
+    file_name: str,
+    file_type: str = None,
+    projection: dict = None,
+    engine: str = None
 ) -> pd.DataFrame:
     """
     # Description:
     This function takes a file name as input and returns the dataframe from the "output_tbl" sheet in the excel file
     unless the filename has the substring "(not analyzed)" in it, and then it returns None.
+    Only the projected columns are read, and reading stops at the end of
+    the table (see the `output_tbl_reader` module).
+    The columns are cast to the dtypes declared for the CIG file type
+    in the `output_tbl_schema` registry.
 
     # Parameters:
         file_name: str
             this is the file name
+        file_type: str
+            this is the CIG file type of the workbook, used to pick the
+            schema and the configured projection
+            defaults to None for the file type of its stem in the CIG
+            reference file (see `searching_inputs`), if any; the columns
+            declared for every file type are typed either way
+        projection: dict
+            this is the projection (`columns`, `header_row`, `stop_at_blank_row`)
+            defaults to None for the projection configured for `file_type`
+        engine: str
+            this is the name of the reader engine
+            defaults to None for the engine picked by `reader_engines.select_engine`
 
     # Returns:
         pd.DataFrame
@@ -169,60 +229,637 @@ def get_dataframe_from_file(
         return None
     # otherwise
     else:
-        # read the "output_tbl" sheet in the excel file
-        temp_df = pd.read_excel(
-            # the file name
-            file_name,
+        # the readers load pandas, and the Excel engine when a sheet is read
+        from .output_tbl_reader import get_projection, read_output_tbl
+        from .output_tbl_schema import normalize_dtypes
 
-            # the sheet name
-            sheet_name='output_tbl',
+        # classify the file by its stem, when there is a reference file
+        if file_type is None:
+            file_type = get_file_type(file_name)
 
-            # the engine to use to read the excel file
-            # if the file is an ".xlsb" file, then use the "pyxlsb" engine
-            # otherwise, use the "openpyxl" engine
-            engine='pyxlsb' if file_name.endswith('.xlsb') else "openpyxl"
-        )
+        # profile the parse, when profiling is on (see the `profiling` module)
+        with profile_file(file_name, 'parse'):
+            # use the projection configured for the file type unless one was given
+            if projection is None:
+                projection = get_projection(file_type)
+
+            # read the "output_tbl" sheet in the excel file
+            # keeping only the projected columns, and stopping at the end of the table
+            # the engine is picked per extension and file size from the
+            # engine calibration, unless one was given
+            temp_df = read_output_tbl(file_name, projection, engine=engine)
+
+            # tag the rows with the analysis the file belongs to
+            temp_df = add_analysis_columns(temp_df, file_name)
+
+            # enforce the declared dtypes, so the frames are compact and concatenate cleanly
+            temp_df = normalize_dtypes(temp_df, file_type)
 
         # return the dataframe
         return temp_df
 
+
+def add_analysis_columns(
+    df: pd.DataFrame,
+    file_name: str
+) -> pd.DataFrame:
+    """
+    # Description:
+    This function adds the `file_name`, `year`, `quarter` and `analysis_idx`
+    columns to an output_tbl dataframe, parsed from the file name in the same
+    way as `find_cig_files.get_year_quarter` (with `parse_year_quarter`, which
+    is not timed as a scan stage).
+    The combined table is sorted and filtered on `analysis_idx`
+    (see the `dataset_query` module).
+    File names without a year and quarter are tagged with the file name only.
+
+    # Parameters:
+        df: pd.DataFrame
+            this is the dataframe from the "output_tbl" sheet
+        file_name: str
+            this is the file name the dataframe was read from
+
+    # Returns:
+        pd.DataFrame
+            this is the dataframe with the extra columns
+    """
+    from .dataset_query import ANALYSIS_IDX_COLUMN
+    from .find_cig_files import parse_year_quarter
+
+    # the file the rows came from
+    df['file_name'] = os.path.basename(file_name)
+
+    # parse the year and quarter from the file name
+    year_quarter = parse_year_quarter(file_name)
+
+    # no year / quarter in the file name
+    if year_quarter is None:
+        return df
+
+    # analysis_idx is year * 4 + quarter, as in `find_cig_files.filter_year_quarter`
+    df['year'], df['quarter'] = year_quarter
+    df[ANALYSIS_IDX_COLUMN] = df['year'] * 4 + df['quarter']
+
+    # return the dataframe
+    return df
+
+def get_analysis_idx(
+    file_name: str
+) -> int:
+    """
+    # Description:
+    This function returns the `analysis_idx` (year * 4 + quarter) of a file,
+    parsed from its name in the same way as `add_analysis_columns`.
+
+    # Parameters:
+        file_name: str
+            this is the file name
+
+    # Returns:
+        int
+            this is the analysis_idx, or None if the name has no year and quarter
+    """
+    from .find_cig_files import parse_year_quarter
+
+    year_quarter = parse_year_quarter(file_name)
+    if year_quarter is None:
+        return None
+    year, quarter = year_quarter
+    return year * 4 + quarter
+
 # function that loops over all files in the current folder, and if they are
 # excel files, read them if they have the "output_tbl" sheet and
 # do not have the substring "(not analyzed)" in the file name,
 # and then return a list of dataframes
 
 
-def get_dataframes_from_folder() -> list:
+def get_dataframes_from_folder(
+    # the folder to read
+    folder: str = '.',
+
+    # the maximum number of files parsed at a time
+    max_workers: int = 1,
+
+    # the memory the parses may use together
+    memory_budget: int = None
+) -> list:
     """
     # Description:
     This function loops over all files in the current folder, and if they are
     excel files, read them if they have the "output_tbl" sheet and
     do not have the substring "(not analyzed)" in the file name,
     and then return a single appended dataframe.
+    With `max_workers` above 1 the files are parsed in worker processes by
+    the memory-aware scheduler (see the `scheduler` module), largest first;
+    when profiling is on, the files are profiled in the worker processes and
+    their results sent back (see the `profiling` module).
 
     # Parameters:
-        None
+        folder: str
+            this is the folder to read
+            defaults to '.' for the current folder
+        max_workers: int
+            this is the maximum number of files parsed at a time
+            defaults to 1 for one file after the other
+        memory_budget: int
+            this is the memory, in bytes, the parses may use together
+            defaults to None for half the physical memory
 
     # Returns:
         pandas.DataFrame
             this is the dataframe from the "output_tbl" sheets
             in each excel file in the current folder
     """
-    # create an empty list to store the dataframes
-    dataframes = []
+    # the excel files in the folder, in folder order
+    file_names = [os.path.join(folder, file_name) for file_name in sorted(os.listdir(folder))
+                  if file_name.lower().endswith(EXCEL_EXTENSIONS)]
+
+    # one file after the other
+    if max_workers == 1:
+        dataframes = [get_dataframe_from_file(file_name) for file_name in file_names]
+
+    # parse the files in worker processes, within the memory budget
+    # profiled in the workers, which send their results back, when profiling is on
+    else:
+        settings = get_profiling_settings()
+        tasks = [{'key': index, 'cost': estimate_memory_cost(file_name),
+                  'args': (file_name,) if settings is None else (
+                      settings, get_dataframe_from_file, file_name)}
+                 for index, file_name in enumerate(file_names)]
+        function = get_dataframe_from_file if settings is None else profile_in_worker
+        dataframes = [None] * len(file_names)
+        for index, result, error in run_with_memory_budget(
+                tasks, function, memory_budget, max_workers, 'process'):
+            if error is not None:
+                add_profiling_results(getattr(error, 'profiling_results', []))
+                raise error
+            if settings is not None:
+                result, profiling_results = result
+                add_profiling_results(profiling_results)
+            dataframes[index] = result
+
+    # return the list of dataframes, without the files that are not analyzed
+    return [temp_df for temp_df in dataframes if temp_df is not None]
+
+
+def get_file_fingerprint(
+    file: StorageFile
+) -> str:
+    """
+    # Description:
+    This function returns a fingerprint of a storage file, which changes
+    whenever the contents of the file change. The run journal uses it to tell
+    whether an intermediate output was produced from the current version.
+
+    # Parameters:
+        file: StorageFile
+            this is the file, of any storage backend (see the `storage` module)
+
+    # Returns:
+        str
+            this is the ETag of the file, or its size and modification time
+    """
+    return file.fingerprint
+
+
+def get_parse_output_path(
+    work_dir: str,
+    file_name: str
+) -> str:
+    """
+    # Description:
+    Returns where the parsed dataframe of a file is kept, in `work_dir`.
+    """
+    return os.path.join(work_dir, 'parsed', file_name + '.parquet')
+
+
+def get_reusable_parse_output(
+    journal: sqlite3.Connection,
+    file: StorageFile,
+    run_id: str = None,
+    resume: bool = False,
+    incremental: bool = False
+) -> dict:
+    """
+    # Description:
+    This function looks up a parse output of the current version of a
+    storage file that the refresh can reuse: one recorded by this run
+    when it is resumed, or by any run when it is incremental.
+
+    # Parameters:
+        journal: sqlite3.Connection
+            this is the connection to the run journal, or None
+        file: StorageFile
+            this is the storage file
+        run_id: str
+            this is the run id
+            defaults to None
+        resume: bool
+            if True, reuse the outputs the run already recorded
+            defaults to False
+        incremental: bool
+            if True, reuse the parse output of any earlier run
+            defaults to False
+
+    # Returns:
+        dict
+            this is the parse stage record, whose `output_path` is None for
+            a file without an output, or None when there is nothing to reuse
+    """
+    if journal is None or not (resume or incremental):
+        return None
+
+    file_name = file.name
+    parsed = get_completed_stage(
+        journal, file_name, 'parse', get_file_fingerprint(file),
+        None if incremental else run_id)
+    if parsed is not None:
+        count('incremental.reused' if incremental else 'resume.reused', file=file_name)
+    return parsed
+
+
+def get_download_path(
+    work_dir: str,
+    file_name: str
+) -> str:
+    """
+    # Description:
+    Returns where the download of a file is kept, in `work_dir`.
+    """
+    return os.path.join(work_dir, 'downloads', file_name)
+
+
+def download_file(
+    file: StorageFile,
+    journal: sqlite3.Connection = None,
+    run_id: str = None,
+    work_dir: str = DEFAULT_WORK_DIR,
+    resume: bool = False
+) -> str:
+    """
+    # Description:
+    This function returns a local path to parse a storage file from.
+    A file the backend already has on the local disk (a local folder or a
+    mirror, see the `storage` module) is parsed where it is. Any other file
+    is downloaded to the `downloads` folder of `work_dir`, unless the
+    resumed run already downloaded this version of it, and the download is
+    recorded in the run journal.
+
+    # Parameters:
+        file: StorageFile
+            this is the storage file
+        journal: sqlite3.Connection
+            this is the connection to the run journal
+            defaults to None for no journal
+        run_id: str
+            this is the run id
+            defaults to None
+        work_dir: str
+            this is the folder of the downloads and intermediate outputs
+            defaults to './refresh_work'
+        resume: bool
+            if True, reuse the download the run already recorded
+            defaults to False
+
+    # Returns:
+        str
+            this is the local path of the file
+    """
+    # the file is on the local disk already
+    local_path = file.backend.get_local_path(file)
+    if local_path is not None:
+        return local_path
+
+    file_name = file.name
+    fingerprint = get_file_fingerprint(file)
+    download_path = get_download_path(work_dir, file_name)
+
+    # this run already downloaded this version of the file
+    if journal is not None and resume:
+        downloaded = get_completed_stage(
+            journal, file_name, 'download', fingerprint, run_id)
+        if downloaded is not None:
+            return download_path
+
+    os.makedirs(os.path.dirname(download_path), exist_ok=True)
+    with connection_slot(), stage('download', file=file_name) as span:
+        with file.open() as remote_file, open(download_path, 'wb') as local_file:
+            shutil.copyfileobj(remote_file, local_file, 1024 * 1024)
+        span.add(bytes=os.path.getsize(download_path))
+    if journal is not None:
+        record_stage(journal, run_id, file_name, 'download', fingerprint,
+                     download_path, reset_failures=False)
+    return download_path
+
+
+def get_dataframe_from_storage_file(
+    file: StorageFile,
+    journal: sqlite3.Connection = None,
+    run_id: str = None,
+    work_dir: str = DEFAULT_WORK_DIR,
+    resume: bool = False,
+    incremental: bool = False
+) -> pd.DataFrame:
+    """
+    # Description:
+    This function downloads a storage file and reads its "output_tbl" sheet,
+    recording each stage in the run journal. The parsed dataframe is kept as
+    a parquet file in `work_dir`, so that a resumed run can reuse it instead
+    of downloading and parsing the file again. An incremental run reuses it
+    in the same way, whichever run produced it, while the file is unchanged.
+
+    # Parameters:
+        file: StorageFile
+            this is the storage file
+        journal: sqlite3.Connection
+            this is the connection to the run journal
+            defaults to None for no journal
+        run_id: str
+            this is the run id
+            defaults to None
+        work_dir: str
+            this is the folder of the downloads and intermediate outputs
+            defaults to './refresh_work'
+        resume: bool
+            if True, reuse the outputs the run already recorded
+            defaults to False
+        incremental: bool
+            if True, reuse the parse output of any earlier run
+            for the same version of the file
+            defaults to False
+
+    # Returns:
+        pd.DataFrame
+            this is the dataframe from the "output_tbl" sheet,
+            or None if the file is not analyzed
+    """
+    file_name = file.name
+    fingerprint = get_file_fingerprint(file)
+
+    # "(not analyzed)" files are not downloaded at all
+    if "(not analyzed)" in file_name:
+        if journal is not None:
+            record_stage(journal, run_id, file_name, 'parse', fingerprint)
+        return None
+
+    # the parse stage of this version of the file already completed
+    # in this run, or in any run when the refresh is incremental
+    parsed = get_reusable_parse_output(journal, file, run_id, resume, incremental)
+    if parsed is not None:
+        # "(not analyzed)" files complete without an output
+        if parsed['output_path'] is None:
+            return None
+        import pandas as pd
+        return pd.read_parquet(parsed['output_path'])
+
+    # download the file, unless this run already downloaded this version
+    download_path = download_file(file, journal, run_id, work_dir, resume)
+
+    # get the dataframe from the file
+    with worker_slot(), stage('parse', file=file_name) as span:
+        temp_df = get_dataframe_from_file(download_path)
+        span.add(bytes=os.path.getsize(download_path),
+                 rows=0 if temp_df is None else len(temp_df))
+
+    # no journal, nothing to keep
+    if journal is None:
+        return temp_df
+
+    # keep the parsed dataframe, and record where it lives
+    parsed_path = None
+    if temp_df is not None:
+        parsed_path = get_parse_output_path(work_dir, file_name)
+        os.makedirs(os.path.dirname(parsed_path), exist_ok=True)
+        with stage('write_intermediate', file=file_name) as span:
+            temp_df.to_parquet(parsed_path)
+            span.add(bytes=os.path.getsize(parsed_path), rows=len(temp_df))
+    record_stage(journal, run_id, file_name, 'parse', fingerprint, parsed_path)
+
+    # the download is not needed once the file is parsed
+    # (a local or mirrored file is not a download, and stays)
+    if download_path == get_download_path(work_dir, file_name):
+        os.remove(download_path)
+
+    return temp_df
+
+
+def get_files_to_read(
+    folder_files: list,
+    journal: sqlite3.Connection = None
+) -> list:
+    """
+    # Description:
+    This function lists the files of a folder a refresh reads:
+    the excel files that are not quarantined, in folder order.
+    A quarantined file that changed since it was quarantined is released
+    and read again.
+
+    # Parameters:
+        folder_files: list
+            this is the `StorageFile`s of the folder (`storage.list(folder)`)
+        journal: sqlite3.Connection
+            this is the connection to the run journal
+            defaults to None for no journal
+
+    # Returns:
+        list
+            this is the list of storage files
+    """
+    files = []
+    for file in folder_files:
+        file_name = file.name
+
+        # only the excel files can have an "output_tbl" sheet
+        if not file_name.lower().endswith(EXCEL_EXTENSIONS):
+            continue
+
+        # a quarantined file that was fixed and uploaded again gets a fresh start
+        fingerprint = get_file_fingerprint(file)
+        if journal is not None and release_if_changed(journal, file_name, fingerprint):
+            print("Released changed file from quarantine:", file_name)
+            count('file.quarantine_released', file=file_name)
+
+        # skip the files that keep failing
+        if journal is not None and is_quarantined(journal, file_name, fingerprint):
+            print("Skipping quarantined file:", file_name)
+            count('file.quarantine_skipped', file=file_name)
+            continue
+
+        # a file that failed before is being retried
+        if journal is not None and get_failure_count(journal, file_name, fingerprint) > 0:
+            count('file.retry', file=file_name)
+
+        files.append(file)
+    return files
+
+
+def record_read_failure(
+    journal: sqlite3.Connection,
+    run_id: str,
+    file: StorageFile,
+    error: str,
+    max_failures: int = DEFAULT_MAX_FAILURES
+) -> None:
+    """
+    # Description:
+    This function records that a storage file could not be read, and
+    quarantines it once it failed `max_failures` times in a row.
+    """
+    file_name = file.name
+    quarantined = record_failure(
+        journal, run_id, file_name, 'parse', error,
+        get_file_fingerprint(file), max_failures)
+    print("Failed to read file:", file_name, error)
+    count('file.failed', file=file_name)
+    if quarantined:
+        print("Quarantined file:", file_name)
+        count('file.quarantined', file=file_name)
+
+
+def get_dataframes_from_storage(
+    # the files of the folder, of any storage backend
+    folder_files: list,
+
+    # the run journal
+    journal: sqlite3.Connection = None,
+
+    # the run id
+    run_id: str = None,
+
+    # the folder of the downloads and intermediate outputs
+    work_dir: str = DEFAULT_WORK_DIR,
+
+    # reuse the outputs the run already recorded
+    resume: bool = False,
+
+    # consecutive failures before a file is quarantined
+    max_failures: int = DEFAULT_MAX_FAILURES,
+
+    # the maximum number of files read at a time
+    max_workers: int = 1,
+
+    # the memory the reads may use together
+    memory_budget: int = None,
+
+    # reuse the outputs of earlier runs for the unchanged files
+    incremental: bool = False,
+
+    # key the dataframes by the file they were read from
+    by_file: bool = False
+) -> list:
+    """
+    # Description:
+    This function takes the files of a folder of any storage backend (see the
+    `storage` module) and reads them in in the same way as the
+    `get_dataframes_from_folder` function, and then returns the list of dataframes.
+
+    With a run journal, every stage of every file is recorded (see the
+    `run_journal` module): a resumed run picks up where the previous one
+    stopped, a file that fails is recorded and skipped instead of stopping
+    the run, and a file that failed `max_failures` times in a row is
+    quarantined and skipped by later runs.
+    Without a journal, the first failure stops the run.
+
+    With `max_workers` above 1 the files are downloaded and read several at
+    a time by the memory-aware scheduler (see the `scheduler` module),
+    largest first, within the memory budget; while profiling is on they are
+    read one at a time, so the profile of a file measures that file only.
+
+    # Parameters:
+        folder_files: list
+            this is the `StorageFile`s of the folder (`storage.list(folder)`)
+        journal: sqlite3.Connection
+            this is the connection to the run journal
+            defaults to None for no journal
+        run_id: str
+            this is the run id
+            defaults to None
+        work_dir: str
+            this is the folder of the downloads and intermediate outputs
+            defaults to './refresh_work'
+        resume: bool
+            if True, reuse the outputs the run already recorded
+            defaults to False
+        max_failures: int
+            this is the number of consecutive failures before quarantine
+            defaults to 3
+        max_workers: int
+            this is the maximum number of files read at a time
+            defaults to 1 for one file after the other
+        memory_budget: int
+            this is the memory, in bytes, the reads may use together
+            defaults to None for half the physical memory
+        incremental: bool
+            if True, reuse the parse outputs of earlier runs for the files
+            that did not change since
+            defaults to False
+        by_file: bool
+            if True, return the dict of file name to dataframe instead, for
+            the versioned dataset (see `versioned_dataset.write_version`)
+            defaults to False
+
+    # Returns:
+        list
+            this is the list of dataframes from the "output_tbl" sheets
+            in each excel file of the folder, or the dict of them by file
+            name with `by_file`; the files that were not read are left out
+    """
+    # the files to read, in folder order
+    files = get_files_to_read(folder_files, journal)
+
+    # download and read one file
+    # profiled as a whole, when profiling is on
+    def read_file(file):
+        with profile_file(file.name, 'storage'):
+            return get_dataframe_from_storage_file(
+                file, journal, run_id, work_dir, resume, incremental)
+
+    # one file after the other
+    # also while profiling, since cProfile and tracemalloc measure the whole process
+    if max_workers == 1 or is_profiling():
+        def read_files():
+            for index, file in enumerate(files):
+                gauge('queue_depth', len(files) - index, stage_name='parse')
+                try:
+                    yield index, read_file(file), None
+                except Exception as error:
+                    yield index, None, error
+        results = read_files()
+
+    # several files at a time, within the memory budget, largest first
+    # threads, because the backends (and their connections) cannot be sent to other processes
+    else:
+        tasks = [{'key': index,
+                  'cost': estimate_memory_cost(file.name, size=file.size),
+                  'args': (file,)}
+                 for index, file in enumerate(files)]
+        results = run_with_memory_budget(
+            tasks, read_file, memory_budget, max_workers, 'thread')
+
+    # collect the dataframes in folder order
+    dataframes = [None] * len(files)
+    for index, temp_df, error in results:
+        file = files[index]
+
+        # the file was read
+        if error is None:
+            dataframes[index] = temp_df
+            continue
 
-    # iterate over all files in the current folder
-    for file_name in os.listdir():
-        # get the dataframe from the file
-        temp_df = get_dataframe_from_file(file_name)
+        # without a journal there is nowhere to record the failure
+        if journal is None:
+            raise error
 
-        # if the dataframe is not None
-        if temp_df is not None:
-            # append the dataframe to the list of dataframes
-            dataframes.append(temp_df)
+        # record the failure, and move on to the next file
+        record_read_failure(journal, run_id, file, repr(error), max_failures)
 
-    # return the list of dataframes
-    return dataframes
+    # the dataframes by file, without the files that were not read
+    if by_file:
+        return {file.name: temp_df for file, temp_df in zip(files, dataframes)
+                if temp_df is not None}
+
+    # return the list of dataframes, without the files that were not read
+    return [temp_df for temp_df in dataframes if temp_df is not None]
 
 
 def get_dataframes_from_sharepoint(
@@ -230,43 +867,106 @@ def get_dataframes_from_sharepoint(
     client_context: office365.sharepoint.client_context.ClientContext,
 
     # the sharepoint folder
-    sharepoint_folder: office365.sharepoint.files.file_collection.FileCollection
-) -> pd.DataFrame:
+    sharepoint_folder: office365.sharepoint.files.file_collection.FileCollection,
+
+    # the options of `get_dataframes_from_storage`
+    *args,
+    **kwargs
+) -> list:
     """
     # Description:
-    This function takes a list of sharepoint files and reads them in in the same
-    way as the `get_dataframes_from_folder` function, and then returns a single
-    dataframe that is the result of appending all the dataframes in the list.
+    This function reads the files of a sharepoint folder listed by
+    `get_files_in_folder`, with `get_dataframes_from_storage`.
 
     # Parameters:
         client_context: office365.sharepoint.client_context.ClientContext
             this is the sharepoint connection context
         sharepoint_folder: office365.sharepoint.files.file_collection.FileCollection
             this is the sharepoint folder
+        *args, **kwargs
+            these are the options of `get_dataframes_from_storage`
 
     # Returns:
-        pandas.DataFrame
-            this is the dataframe from the "output_tbl" sheets
-            in each excel file in the list of sharepoint files
+        list
+            this is the list of dataframes from the "output_tbl" sheets
+    """
+    from .storage import SharePointBackend
+
+    storage = SharePointBackend(client_context)
+    return get_dataframes_from_storage(
+        [storage.wrap(file) for file in sharepoint_folder], *args, **kwargs)
+
+
+def write_parquet(
+    df: pd.DataFrame,
+    local_path: str
+) -> None:
+    """
+    # Description:
+    This function writes the combined dataframe to a parquet file, sorted by
+    analysis_idx / LOB / CIG type in small row groups, so that the row-group
+    statistics let `dataset_query` skip everything but the quarters and LOBs
+    a reader asks for.
     """
-    # create an empty list to store the dataframes
-    dataframes = []
+    from .dataset_query import ROW_GROUP_SIZE, sort_for_pushdown
 
-    # iterate over all files in the sharepoint folder
-    for file in sharepoint_folder:
-        # download the file
-        file.download(file.properties['Name'])
+    with stage('write') as span:
+        df = sort_for_pushdown(df)
+        df.to_parquet(local_path, row_group_size=ROW_GROUP_SIZE)
+        span.add(bytes=os.path.getsize(local_path), rows=len(df))
 
-        # get the dataframe from the file
-        temp_df = get_dataframe_from_file(file.properties['Name'])
 
-        # if the dataframe is not None
-        if temp_df is not None:
-            # append the dataframe to the list of dataframes
-            dataframes.append(temp_df)
+def dataframe_to_parquet_and_upload(
+    # the dataframe to convert to parquet
+    df: pd.DataFrame,
+
+    # the storage backend to upload to
+    storage: StorageBackend,
+
+    # the folder to upload to
+    output_folder: str,
+
+    # the name of the uploaded file
+    output_name: str = "data.parquet",
+
+    # the temporary local parquet file
+    local_path: str = "./data.parquet"
+) -> None:
+    """
+    # Description:
+    This function writes the dataframe to a parquet file and uploads it to a
+    folder of any storage backend (see the `storage` module).
+
+    # Parameters:
+        df: pd.DataFrame
+            this is the combined dataframe
+        storage: StorageBackend
+            this is the storage backend to upload to
+        output_folder: str
+            this is the folder to upload to
+        output_name: str
+            this is the name of the uploaded file
+            defaults to 'data.parquet'
+        local_path: str
+            this is the temporary local parquet file, which must be
+            different for refreshes that run at the same time
+            defaults to './data.parquet'
+
+    # Returns:
+        None
+    """
+    # make a temp file to upload
+    write_parquet(df, local_path)
+
+    # upload the temporary parquet file
+    with connection_slot(), stage('upload') as span:
+        with open(local_path, 'rb') as local_file:
+            storage.upload(output_folder, output_name, local_file.read())
+        span.add(bytes=os.path.getsize(local_path))
+
+    # delete the temporary parquet file
+    os.remove(local_path)
 
-    # return the list of dataframes
-    return dataframes
 
 # function that converts a data frame to parquet and reuploads it to sharepoint
 def dataframe_to_parquet_and_upload_to_sharepoint(
@@ -277,21 +977,64 @@ def dataframe_to_parquet_and_upload_to_sharepoint(
     client_context: office365.sharepoint.client_context.ClientContext,
 
     # the sharepoint folder
-    sharepoint_folder: office365.sharepoint.files.file_collection.FileCollection
-    
+    sharepoint_folder: office365.sharepoint.files.file_collection.FileCollection,
+
+    # the server relative url of the folder to upload to
+    output_folder: str = None,
+
+    # the name of the uploaded file
+    output_name: str = "data.parquet",
+
+    # the temporary local parquet file
+    local_path: str = "./data.parquet"
 ) -> None:
+    """
+    # Description:
+    This function writes the dataframe to a parquet file and uploads it to
+    sharepoint: to `output_folder` when it is given, otherwise to the
+    sharepoint folder the files were read from.
+
+    # Parameters:
+        df: pd.DataFrame
+            this is the combined dataframe
+        client_context: office365.sharepoint.client_context.ClientContext
+            this is the sharepoint connection context
+        sharepoint_folder: office365.sharepoint.files.file_collection.FileCollection
+            this is the sharepoint folder the files were read from
+        output_folder: str
+            this is the server relative url of the folder to upload to
+            defaults to None for `sharepoint_folder`
+        output_name: str
+            this is the name of the uploaded file
+            defaults to 'data.parquet'
+        local_path: str
+            this is the temporary local parquet file, which must be
+            different for refreshes that run at the same time
+            defaults to './data.parquet'
+
+    # Returns:
+        None
+    """
+    from .storage import SharePointBackend
+
+    # a folder given by its url goes through the storage backend
+    if output_folder is not None:
+        dataframe_to_parquet_and_upload(df, SharePointBackend(client_context),
+                                        output_folder, output_name, local_path)
+        return
+
     # make a temp file to upload
-    # convert the dataframe to parquet
-    df = df.to_parquet("./data.parquet")
-        
-    # upload the temporary parquet file to sharepoint
-    sharepoint_folder.upload_file("./data.parquet")
+    write_parquet(df, local_path)
+
+    # upload the temporary parquet file to the folder the files were read from
+    with connection_slot(), stage('upload') as span:
+        sharepoint_folder.upload_file(local_path)
+        span.add(bytes=os.path.getsize(local_path))
 
     # delete the temporary parquet file
-    os.remove("./data.parquet")
-    
-    
-    
+    os.remove(local_path)
+
+
 # function that gets the client context and sharepoint folder
 # needed above 
 def get_client_context_and_sharepoint_folder(
@@ -305,7 +1048,7 @@ def get_client_context_and_sharepoint_folder(
     sharepoint_password: str = None,
 
     # the sharepoint folder
-    sharepoint_folder: str
+    sharepoint_folder: str = "CIG Link Ratio Files"
 ) -> Tuple[office365.sharepoint.client_context.ClientContext, office365.sharepoint.files.file_collection.FileCollection]:
     """
     # Description:
@@ -330,7 +1073,7 @@ def get_client_context_and_sharepoint_folder(
     """
     # returns a ClientContext object representing
     # the sharepoint connection
-    client_context = get_sharepoint_client_context(
+    client_context = get_sharepoint_connection(
         # the sharepoint url
         sharepoint_url,
 
@@ -343,7 +1086,7 @@ def get_client_context_and_sharepoint_folder(
 
     # returns a FileCollection object representing
     # the sharepoint folder
-    sharepoint_folder = get_sharepoint_folder(
+    sharepoint_folder = get_files_in_folder(
         # the sharepoint client context
         client_context,
 
@@ -353,13 +1096,14 @@ def get_client_context_and_sharepoint_folder(
 
     # return the sharepoint client context and sharepoint folder
     return client_context, sharepoint_folder
-  
-  # function that puts it all together
-  # read the data, append it, and upload it to sharepoint
-  def folder_to_parquet(
-    # sharepoint folder 
-    sharepoint_folder: str = "CIG Link Ratio Files"
-    
+
+
+# function that puts it all together
+# read the data, append it, and upload it to sharepoint
+def folder_to_parquet(
+    # sharepoint folder
+    sharepoint_folder: str = "CIG Link Ratio Files",
+
     # the sharepoint url
     sharepoint_url: str = "https://cinfin.sharepoint.com/sites/PandCReserving",
 
@@ -369,13 +1113,63 @@ def get_client_context_and_sharepoint_folder(
     # the sharepoint password
     sharepoint_password: str = None,
 
-    # the sharepoint folder
-    sharepoint_folder_path: str = "Shared Documents/Dashboard Development/"
+    # continue the latest run that did not complete
+    resume: bool = False,
+
+    # the run journal
+    journal_path: str = DEFAULT_JOURNAL_PATH,
+
+    # the folder of the downloads and intermediate outputs
+    work_dir: str = DEFAULT_WORK_DIR,
+
+    # consecutive failures before a file is quarantined
+    max_failures: int = DEFAULT_MAX_FAILURES,
+
+    # the JSON-lines trace of the run
+    trace_path: str = None,
+
+    # the folder of the per-file profiles
+    profile_dir: str = None,
+
+    # the fraction of the files to profile
+    profile_sample_rate: float = 1.0,
+
+    # the maximum number of files read at a time
+    max_workers: int = 1,
+
+    # the memory the reads may use together
+    memory_budget: int = None,
+
+    # reuse the outputs of earlier runs for the unchanged files
+    incremental: bool = False,
+
+    # parse the files through the work queue of `work_dir`
+    work_queue: bool = False,
+
+    # the worker processes of the work queue started on this host
+    local_workers: int = 1,
+
+    # the storage backend to read from and upload to
+    storage: StorageBackend = None,
+
+    # the folder of a synced local copy of the files
+    mirror_dir: str = None,
+
+    # append a version to the versioned dataset instead of uploading data.parquet
+    versioned: bool = False,
+
+    # the folder of the versioned dataset, in `sharepoint_folder`
+    dataset_name: str = "dataset"
 ) -> None:
     """
     # Description:
     This function puts it all together.
-    
+    Every stage of the run is recorded in the run journal, so that a run that
+    fails part of the way through can be continued with `resume=True`
+    (see the `run_journal` module).
+    The files are read from, and the parquet file uploaded to, sharepoint or
+    any other storage backend (see the `storage` module).
+
     # Parameters:
         sharepoint_folder: str
             this is the folder in sharepoint to upload the data to
@@ -387,53 +1181,394 @@ def get_client_context_and_sharepoint_folder(
             
         sharepoint_password: str
             this is the sharepoint password
-        sharepoint_folder_path: str
-            this is the sharepoint folder path
+        resume: bool
+            if True, continue the latest run that did not complete,
+            reusing the files it already downloaded and parsed
+            defaults to False
+        journal_path: str
+            this is the path of the run journal
+            defaults to './refresh_journal.sqlite'
+        work_dir: str
+            this is the folder of the downloads and intermediate outputs
+            defaults to './refresh_work'
+        max_failures: int
+            this is the number of consecutive failures before a file is quarantined
+            defaults to 3
+        trace_path: str
+            this is the path of the JSON-lines trace of the run; when given,
+            every stage and file is timed (see the `instrumentation` module)
+            and a summary table is printed at the end of the run
+            defaults to None for no instrumentation
+        profile_dir: str
+            this is the folder of the per-file cProfile stats and of the
+            profiling report (see the `profiling` module)
+            defaults to None for no profiling
+        profile_sample_rate: float
+            this is the fraction of the files to profile
+            defaults to 1.0 for every file
+        max_workers: int
+            this is the maximum number of files downloaded and read at a time
+            defaults to 1 for one file after the other
+        memory_budget: int
+            this is the memory, in bytes, the reads may use together
+            defaults to None for half the physical memory
+        incremental: bool
+            if True, only download and parse the files that are new or
+            changed since an earlier run, and reuse the parse outputs of
+            that run for the others
+            defaults to False
+        work_queue: bool
+            if True, the files are parsed by the workers of the work queue
+            of `work_dir`, on this host and on any host sharing `work_dir`
+            (see the `work_queue` module); `max_workers` and
+            `memory_budget` do not apply
+            defaults to False
+        local_workers: int
+            this is the number of worker processes of the work queue started
+            on this host, 0 to leave the parsing to other hosts
+            defaults to 1
+        storage: StorageBackend
+            this is the storage backend to read the files from and upload the
+            parquet file to, with `sharepoint_folder` as a folder of it; it is
+            not closed at the end of the run
+            defaults to None for the sharepoint site `sharepoint_url`
+        mirror_dir: str
+            this is the folder of a synced local copy of the files: only the
+            files whose ETag changed since the last run are copied again, and
+            the files are parsed from the copy
+            defaults to None for no mirror
+        versioned: bool
+            if True, only the files that changed since the latest version of
+            the versioned dataset are read, and appended to it as a new
+            version, instead of uploading the whole combined data.parquet
+            (see the `versioned_dataset` module)
+            defaults to False
+        dataset_name: str
+            this is the folder of the versioned dataset, in `sharepoint_folder`
+            defaults to 'dataset'
 
     # Returns: 
         None
     """
-    # get the client context and sharepoint folder
-    client_context, sharepoint_folder = get_client_context_and_sharepoint_folder(
-        # the sharepoint url
-        sharepoint_url,
+    from .output_tbl_schema import concat_output_tbls
+    from .storage import MirrorBackend, SharePointBackend, join_path
+
+    # time the stages of the run
+    if trace_path is not None:
+        enable_instrumentation(trace_path)
+
+    # profile the files
+    if profile_dir is not None:
+        enable_profiling(profile_dir, profile_sample_rate)
+
+    # open the run journal, and start or continue the run
+    journal = open_journal(journal_path)
+    run_id = start_run(journal, resume)
+
+    # the backend is only closed at the end of the run when it was made here
+    source = storage
+    own_source = storage is None
+
+    try:
+        # connect to the sharepoint site, unless given another backend
+        if own_source:
+            source = SharePointBackend(get_sharepoint_connection(
+                # the sharepoint url
+                sharepoint_url,
+
+                # the sharepoint username
+                sharepoint_username,
+
+                # the sharepoint password
+                sharepoint_password
+            ))
+
+        # read through a synced local copy of the files
+        storage = source if mirror_dir is None else MirrorBackend(source, mirror_dir)
+
+        # list the files of the folder
+        with stage('storage.list'):
+            folder_files = storage.list(sharepoint_folder)
+
+        # the versioned dataset: the files whose current version is already
+        # in the latest version of the dataset are not read at all
+        files_to_read = folder_files
+        if versioned:
+            from .versioned_dataset import get_unchanged_files, read_manifest, write_version
+            dataset_folder = join_path(sharepoint_folder, dataset_name)
+            with stage('dataset.read_manifest'):
+                parent = read_manifest(storage, dataset_folder)
+            unchanged = get_unchanged_files(parent, folder_files)
+            count('dataset.unchanged_files', len(unchanged))
+            files_to_read = [file for file in folder_files if file.name not in unchanged]
+
+        # get the dataframes from the folder
+        # through the work queue, the workers parse the files
+        if work_queue:
+            from .work_queue import get_dataframes_from_work_queue
+            dataframes = get_dataframes_from_work_queue(
+                files_to_read, journal, run_id, work_dir, resume, max_failures,
+                incremental, local_workers, by_file=versioned)
+
+        # otherwise in this process, several files at a time within the memory budget
+        else:
+            dataframes = get_dataframes_from_storage(
+                # the files of the folder
+                files_to_read,
 
-        # the sharepoint username
-        sharepoint_username,
+                # record every stage in the run journal
+                journal,
+                run_id,
+                work_dir,
+                resume,
+                max_failures,
 
-        # the sharepoint password
-        sharepoint_password,
+                # read several files at a time within the memory budget
+                max_workers,
+                memory_budget,
 
-        # the sharepoint folder
-        sharepoint_folder
-    )
-    
-    # get the dataframes from the sharepoint folder
-    dataframes = get_dataframes_from_sharepoint(
-        # the sharepoint client context
-        client_context,
+                # reuse the outputs of earlier runs for the unchanged files
+                incremental,
 
-        # the sharepoint folder
-        sharepoint_folder
-    )
-    
-    # append the dataframes
-    df = pd.concat(dataframes)
-    
-    # convert the dataframe to parquet and upload it to sharepoint
-    dataframe_to_parquet_and_upload_to_sharepoint(
-        # the dataframe to convert to parquet
-        df,
+                # the versioned dataset needs to know which file each dataframe is from
+                by_file=versioned
+            )
 
-        # the sharepoint client context
-        client_context,
+        # append the files that were read to the versioned dataset
+        if versioned:
+            write_version(storage, dataset_folder, folder_files, dataframes, parent, work_dir)
+
+        # otherwise upload the whole combined table
+        else:
+            # append the dataframes, keeping the categorical columns categorical
+            with stage('concat') as span:
+                df = concat_output_tbls(dataframes)
+                span.add(rows=len(df))
+
+            # convert the dataframe to parquet and upload it to the folder
+            dataframe_to_parquet_and_upload(
+                # the dataframe to convert to parquet
+                df,
+
+                # the storage backend and its folder
+                storage,
+                sharepoint_folder
+            )
+        record_stage(journal, run_id, RUN_FILE_KEY, 'upload')
+
+    # leave the run unfinished in the journal, so it can be resumed
+    except BaseException:
+        finish_run(journal, run_id, 'failed')
+        journal.close()
+        raise
+
+    # close the sharepoint connection made here, write the trace and print
+    # the per-stage summary, even if the run failed
+    finally:
+        if own_source and source is not None:
+            source.close()
+        if trace_path is not None:
+            print(finish_instrumentation())
+        if profile_dir is not None:
+            print("Profiling report:", write_profiling_report(profile_dir))
+            disable_profiling()
+
+    # the run completed
+    finish_run(journal, run_id, 'completed')
+    journal.close()
 
-        # the sharepoint folder
-        sharepoint_folder
-    )
-    
-    # close the sharepoint connection
-    client_context.close()
-    
     # return None
     return None
+
+
+def add_sharepoint_arguments(
+    parser: argparse.ArgumentParser
+) -> None:
+    """
+    # Description:
+    This function adds the options of the sharepoint folder to a command line parser.
+    The credentials are read from the environment variables
+    RESERVING_DASHBOARD_SHAREPOINT_USERNAME and RESERVING_DASHBOARD_SHAREPOINT_PASSWORD,
+    so they do not show up in the process list; without them the Windows
+    credentials are used.
+    """
+    parser.add_argument('--sharepoint-folder', default="CIG Link Ratio Files")
+    parser.add_argument('--sharepoint-url',
+                        default="https://cinfin.sharepoint.com/sites/PandCReserving")
+
+
+def add_storage_arguments(
+    parser: argparse.ArgumentParser
+) -> None:
+    """
+    # Description:
+    This function adds the options of the storage backend to a command line
+    parser: the files are read from the sharepoint site by default, from a
+    local folder with `--local-root`, or from a folder served by the `serve`
+    command with `--http-url`; `--sharepoint-folder` is the folder within it.
+    """
+    backend = parser.add_mutually_exclusive_group()
+    backend.add_argument('--local-root', default=None,
+                         help='read from this local or mounted folder instead of sharepoint')
+    backend.add_argument('--http-url', default=None,
+                         help='read from the folder served at this url (see the serve command)')
+    parser.add_argument('--mirror-dir', default=None,
+                        help='keep a synced local copy of the files in this folder, and only '
+                             'copy the files whose ETag changed')
+
+
+def get_storage_from_arguments(
+    parsed: argparse.Namespace,
+    mirror: bool = True
+) -> StorageBackend:
+    """
+    # Description:
+    This function returns the storage backend of the options parsed by a
+    parser set up with `add_sharepoint_arguments` and `add_storage_arguments`,
+    connecting to the sharepoint site when no other backend is given.
+    With `mirror=False` the `--mirror-dir` option is left to the caller.
+    The caller closes it.
+    """
+    from .storage import HttpBackend, LocalBackend, MirrorBackend, SharePointBackend
+
+    if parsed.local_root is not None:
+        storage = LocalBackend(parsed.local_root)
+    elif parsed.http_url is not None:
+        storage = HttpBackend(parsed.http_url)
+    else:
+        storage = SharePointBackend(get_sharepoint_connection(
+            parsed.sharepoint_url, *get_sharepoint_credentials()))
+
+    if mirror and parsed.mirror_dir is not None:
+        storage = MirrorBackend(storage, parsed.mirror_dir)
+    return storage
+
+
+def get_sharepoint_credentials() -> Tuple[str, str]:
+    """
+    # Description:
+    This function returns the sharepoint username and password from the
+    environment, (None, None) to use the Windows credentials.
+    """
+    return (os.environ.get(SHAREPOINT_USERNAME_VARIABLE),
+            os.environ.get(SHAREPOINT_PASSWORD_VARIABLE))
+
+
+def get_trace_path(
+    work_dir: str = DEFAULT_WORK_DIR
+) -> str:
+    """
+    # Description:
+    This function returns the path of the trace of a new refresh run, in the
+    `traces` folder of `work_dir`, where `refresh_plan` reads the metrics of
+    the earlier runs from.
+    """
+    return os.path.join(work_dir, TRACE_DIR_NAME,
+                        time.strftime('refresh-%Y%m%d-%H%M%S') + '.jsonl')
+
+
+def add_refresh_arguments(
+    parser: argparse.ArgumentParser
+) -> None:
+    """
+    # Description:
+    This function adds the options of `folder_to_parquet` to a command line parser.
+    """
+    add_sharepoint_arguments(parser)
+    add_storage_arguments(parser)
+    parser.add_argument('--resume', action='store_true',
+                        help='continue the latest run that did not complete')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only download and parse the new and changed files')
+    parser.add_argument('--journal-path', default=DEFAULT_JOURNAL_PATH)
+    parser.add_argument('--work-dir', default=DEFAULT_WORK_DIR)
+    parser.add_argument('--max-failures', type=int, default=DEFAULT_MAX_FAILURES)
+    parser.add_argument('--trace-path', default=None,
+                        help='JSON-lines trace of the run (default: a new file in '
+                             'WORK_DIR/traces, read by the plan command)')
+    parser.add_argument('--no-trace', action='store_true',
+                        help='do not time the run')
+    parser.add_argument('--profile-dir', default=None,
+                        help='profile the files and write the reports to this folder')
+    parser.add_argument('--profile-sample-rate', type=float, default=1.0,
+                        help='fraction of the files to profile')
+    parser.add_argument('--max-workers', type=int, default=1,
+                        help='maximum number of files downloaded and read at a time')
+    parser.add_argument('--memory-budget-mb', type=int, default=None,
+                        help='memory the reads may use together (default: half the RAM)')
+    parser.add_argument('--work-queue', action='store_true',
+                        help='parse through the work queue of WORK_DIR, with the workers '
+                             'of every host sharing it (see the worker command)')
+    parser.add_argument('--local-workers', type=int, default=1,
+                        help='work-queue worker processes to start on this host')
+    parser.add_argument('--versioned', action='store_true',
+                        help='append the changed files to the versioned dataset as a new '
+                             'version, instead of uploading the whole data.parquet')
+    parser.add_argument('--dataset-name', default="dataset",
+                        help='folder of the versioned dataset, in the sharepoint folder')
+
+
+def refresh_from_arguments(
+    parsed: argparse.Namespace
+) -> None:
+    """
+    # Description:
+    This function runs `folder_to_parquet` with the options parsed by a
+    parser set up with `add_refresh_arguments`.
+    """
+    # time every run, unless told not to, so that `plan` can estimate the next one
+    trace_path = parsed.trace_path
+    if trace_path is None and not parsed.no_trace:
+        trace_path = get_trace_path(parsed.work_dir)
+    if trace_path is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(trace_path)), exist_ok=True)
+
+    # the other backends are opened here, sharepoint and the mirror by `folder_to_parquet`
+    storage = None
+    if parsed.local_root is not None or parsed.http_url is not None:
+        storage = get_storage_from_arguments(parsed, mirror=False)
+
+    sharepoint_username, sharepoint_password = get_sharepoint_credentials()
+    folder_to_parquet(
+        sharepoint_folder=parsed.sharepoint_folder,
+        sharepoint_url=parsed.sharepoint_url,
+        sharepoint_username=sharepoint_username,
+        sharepoint_password=sharepoint_password,
+        resume=parsed.resume,
+        incremental=parsed.incremental,
+        journal_path=parsed.journal_path,
+        work_dir=parsed.work_dir,
+        max_failures=parsed.max_failures,
+        trace_path=trace_path,
+        profile_dir=parsed.profile_dir,
+        profile_sample_rate=parsed.profile_sample_rate,
+        max_workers=parsed.max_workers,
+        memory_budget=(parsed.memory_budget_mb * 1_000_000
+                       if parsed.memory_budget_mb is not None else None),
+        work_queue=parsed.work_queue,
+        local_workers=parsed.local_workers,
+        storage=storage,
+        mirror_dir=parsed.mirror_dir,
+        versioned=parsed.versioned,
+        dataset_name=parsed.dataset_name
+    )
+
+
+def main(
+    args: list = None
+) -> None:
+    """
+    # Description:
+    Command line entry point: runs `folder_to_parquet`.
+    `--resume` continues the latest run that did not complete, and
+    `--incremental` only processes the new and changed files.
+    The same options are available as `reserving_dashboard_update refresh`.
+    """
+    parser = argparse.ArgumentParser(
+        description='combine the output_tbl sheets of a sharepoint folder into parquet')
+    add_refresh_arguments(parser)
+    refresh_from_arguments(parser.parse_args(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,430 @@
+"""
+# Description:
+Per-stage metrics and trace export for the refresh runs.
+
+The scan, sharepoint, download, parse and upload steps are wrapped in
+`stage(...)` blocks (or decorated with `instrumented(...)`), which record the
+wall time of each block, and the byte and row counts it reports. Counters
+(`count`) record retries and failures, and gauges (`gauge`) record queue depths.
+
+Instrumentation is off by default. While it is off, `stage` returns a shared
+do-nothing object and `count` / `gauge` return right away, so the calls cost
+a global lookup and a function call. `enable_instrumentation` turns it on,
+and `finish_instrumentation` writes the JSON-lines trace and returns the
+per-stage summary table.
+
+# Example:
+    enable_instrumentation('refresh_trace.jsonl')
+    with stage('download', file=file_name) as span:
+        ...
+        span.add(bytes=size)
+    print(finish_instrumentation())
+"""
+
+import functools
+import json
+import threading
+import time
+
+# the active recorder, None while instrumentation is off
+_recorder = None
+
+
+class _NullSpan:
+    """
+    # Description:
+    Do-nothing span returned by `stage` while instrumentation is off.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add(self, **counts):
+        pass
+
+    def set(self, **fields):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """
+    # Description:
+    Times one `stage` block, and collects the counts and fields reported
+    inside it. The event is recorded when the block exits.
+    """
+
+    def __init__(self, recorder, name, fields):
+        self.recorder = recorder
+        self.name = name
+        self.fields = fields
+        self.counts = {}
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        event = {
+            'type': 'stage',
+            'stage': self.name,
+            'start': self.recorder.get_offset(self.start),
+            'seconds': time.perf_counter() - self.start,
+            'ok': exc_type is None,
+            **self.fields,
+            **self.counts,
+        }
+        if exc_type is not None:
+            event['error'] = repr(exc_value)
+        self.recorder.record(event)
+        return False
+
+    def add(self, **counts):
+        """
+        # Description:
+        Adds to the counts of the block, for example `add(bytes=1024, rows=10)`.
+        """
+        for name, value in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def set(self, **fields):
+        """
+        # Description:
+        Sets fields of the event, for example `set(engine='calamine')`.
+        """
+        self.fields.update(fields)
+
+
+class _Recorder:
+    """
+    # Description:
+    Collects the events of a run, and streams them to the trace file.
+    """
+
+    def __init__(self, trace_path=None):
+        self.trace_path = trace_path
+        self.started = time.perf_counter()
+        self.events = []
+        self.lock = threading.Lock()
+        self.trace_file = None
+        if trace_path is not None:
+            self.trace_file = open(trace_path, 'w', encoding='utf-8')
+
+    def get_offset(self, perf_counter):
+        return perf_counter - self.started
+
+    def record(self, event):
+        with self.lock:
+            self.events.append(event)
+            if self.trace_file is not None:
+                self.trace_file.write(json.dumps(event, default=str) + '\n')
+
+    def close(self):
+        if self.trace_file is not None:
+            self.trace_file.close()
+            self.trace_file = None
+
+
+def enable_instrumentation(
+    trace_path: str = None
+) -> None:
+    """
+    # Description:
+    This function turns instrumentation on for a new run.
+
+    # Parameters:
+        trace_path: str
+            this is the path of the JSON-lines trace, written as the run goes
+            defaults to None to keep the events in memory only
+
+    # Returns:
+        None
+    """
+    global _recorder
+    if _recorder is not None:
+        _recorder.close()
+    _recorder = _Recorder(trace_path)
+
+
+def is_instrumentation_enabled() -> bool:
+    """
+    # Description:
+    This function checks whether instrumentation is on.
+
+    # Returns:
+        bool
+            True if instrumentation is on
+    """
+    return _recorder is not None
+
+
+def stage(
+    name: str,
+    **fields
+):
+    """
+    # Description:
+    This function returns a context manager that times a block of a stage.
+
+    # Parameters:
+        name: str
+            this is the name of the stage, for example 'download'
+        **fields:
+            these are extra fields of the event, for example file=file_name
+
+    # Returns:
+        context manager
+            this yields a span with `add(**counts)` and `set(**fields)`
+    """
+    recorder = _recorder
+    if recorder is None:
+        return _NULL_SPAN
+    return _Span(recorder, name, fields)
+
+
+def instrumented(
+    name: str
+):
+    """
+    # Description:
+    This function returns a decorator that wraps every call of a function
+    in `stage(name)`.
+
+    # Parameters:
+        name: str
+            this is the name of the stage
+
+    # Returns:
+        callable
+            this is the decorator
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return function(*args, **kwargs)
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(
+    name: str,
+    value: int = 1,
+    **fields
+) -> None:
+    """
+    # Description:
+    This function records a counter event, for example a retry or a failure.
+
+    # Parameters:
+        name: str
+            this is the name of the counter
+        value: int
+            this is the amount to count
+            defaults to 1
+        **fields:
+            these are extra fields of the event
+
+    # Returns:
+        None
+    """
+    recorder = _recorder
+    if recorder is None:
+        return
+    recorder.record({
+        'type': 'count',
+        'stage': name,
+        'start': recorder.get_offset(time.perf_counter()),
+        'value': value,
+        **fields,
+    })
+
+
+def gauge(
+    name: str,
+    value: float,
+    **fields
+) -> None:
+    """
+    # Description:
+    This function records the current value of a gauge, for example the
+    number of files still waiting in a queue.
+
+    # Parameters:
+        name: str
+            this is the name of the gauge
+        value: float
+            this is the current value
+        **fields:
+            these are extra fields of the event
+
+    # Returns:
+        None
+    """
+    recorder = _recorder
+    if recorder is None:
+        return
+    recorder.record({
+        'type': 'gauge',
+        'stage': name,
+        'start': recorder.get_offset(time.perf_counter()),
+        'value': value,
+        **fields,
+    })
+
+
+def get_events() -> list:
+    """
+    # Description:
+    This function returns a copy of the events recorded so far.
+
+    # Returns:
+        list
+            this is the list of event dicts
+    """
+    if _recorder is None:
+        return []
+    with _recorder.lock:
+        return list(_recorder.events)
+
+
+def read_trace(
+    trace_paths: list
+) -> list:
+    """
+    # Description:
+    This function reads the events of JSON-lines traces written by earlier
+    runs. A line cut short by a run that was killed is skipped.
+
+    # Parameters:
+        trace_paths: list
+            this is the list of trace paths, oldest first
+
+    # Returns:
+        list
+            this is the list of event dicts, in the order of the traces
+    """
+    events = []
+    for trace_path in trace_paths:
+        with open(trace_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    continue
+    return events
+
+
+def summarize_events(
+    events: list
+) -> list:
+    """
+    # Description:
+    This function aggregates events per stage: number of calls, total / mean /
+    max seconds, failures, bytes and rows for the stages; total for the
+    counters; last and max value for the gauges.
+
+    # Parameters:
+        events: list
+            this is the list of event dicts
+
+    # Returns:
+        list
+            this is the list of per-stage summary dicts, in order of first event
+    """
+    summaries = {}
+    for event in events:
+        key = (event['type'], event['stage'])
+        summary = summaries.setdefault(key, {
+            'type': event['type'], 'stage': event['stage'], 'calls': 0})
+        summary['calls'] += 1
+
+        if event['type'] == 'stage':
+            summary['seconds'] = summary.get('seconds', 0.0) + event['seconds']
+            summary['max_seconds'] = max(summary.get('max_seconds', 0.0), event['seconds'])
+            summary['failures'] = summary.get('failures', 0) + (not event['ok'])
+            for name in ('bytes', 'rows'):
+                if name in event:
+                    summary[name] = summary.get(name, 0) + event[name]
+
+        elif event['type'] == 'count':
+            summary['total'] = summary.get('total', 0) + event['value']
+
+        elif event['type'] == 'gauge':
+            summary['last'] = event['value']
+            summary['max'] = max(summary.get('max', event['value']), event['value'])
+
+    # mean seconds per call
+    for summary in summaries.values():
+        if 'seconds' in summary:
+            summary['mean_seconds'] = summary['seconds'] / summary['calls']
+
+    return list(summaries.values())
+
+
+def format_summary_table(
+    summaries: list
+) -> str:
+    """
+    # Description:
+    This function formats the per-stage summary as a text table.
+
+    # Parameters:
+        summaries: list
+            this is the list returned by `summarize_events`
+
+    # Returns:
+        str
+            this is the table
+    """
+    columns = ['stage', 'type', 'calls', 'seconds', 'mean_seconds', 'max_seconds',
+               'failures', 'bytes', 'rows', 'total', 'last', 'max']
+
+    def format_value(value):
+        if value is None:
+            return ''
+        if isinstance(value, float):
+            return f'{value:,.3f}'
+        if isinstance(value, int) and not isinstance(value, bool):
+            return f'{value:,}'
+        return str(value)
+
+    rows = [[format_value(summary.get(column)) for column in columns]
+            for summary in summaries]
+    widths = [max([len(column)] + [len(row[i]) for row in rows])
+              for i, column in enumerate(columns)]
+
+    lines = ['  '.join(column.ljust(width) for column, width in zip(columns, widths))]
+    for row in rows:
+        lines.append('  '.join(
+            value.ljust(width) if i < 2 else value.rjust(width)
+            for i, (value, width) in enumerate(zip(row, widths))))
+    return '\n'.join(lines)
+
+
+def finish_instrumentation() -> str:
+    """
+    # Description:
+    This function turns instrumentation off at the end of a run, closes the
+    trace file, and returns the per-stage summary table.
+
+    # Returns:
+        str
+            this is the summary table, empty if instrumentation was off
+    """
+    global _recorder
+    if _recorder is None:
+        return ''
+
+    recorder = _recorder
+    _recorder = None
+    recorder.close()
+    return format_summary_table(summarize_events(recorder.events))
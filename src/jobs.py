@@ -0,0 +1,442 @@
+"""
+# Description:
+Fan-out of the refresh over many sharepoint sites, folders and outputs.
+
+A job spec (JSON) lists the targets, each a sharepoint folder of workbooks
+and the folder its combined parquet file is published to, plus the global
+limits the targets share:
+
+    {
+        "limits": {
+            "max_targets": 3,           # targets refreshed at a time
+            "max_connections": 4,       # sharepoint downloads / uploads at a time
+            "max_workers": 8,           # parses at a time, over every target
+            "memory_budget_mb": 8000    # memory of the parses, over every target
+        },
+        "defaults": {
+            "sharepoint_url": "https://cinfin.sharepoint.com/sites/PandCReserving",
+            "incremental": true
+        },
+        "targets": [
+            {
+                "name": "CA link ratios",
+                "sharepoint_folder": "CIG Link Ratio Files/CA",
+                "output_folder": "Shared Documents/Dashboard Development/CA"
+            },
+            ...
+        ]
+    }
+
+Every target takes the `defaults` it does not set itself; a target parses
+as many files at a time as the global `max_workers` allows unless it sets
+`max_workers` itself. The targets of a site share one authenticated
+connection: each target works on a clone of it (its own query queue, the
+same authentication), closed when the target is done, so a site is logged
+into once. Every target has its own run journal and work folder under
+`work_dir/<target name>`, so the targets can be resumed one by one; two
+target names that give the same folder name are rejected.
+
+`run_jobs` returns, and writes, one consolidated report of the run.
+
+# Example:
+    report = run_jobs(load_job_spec('jobs.json'))
+    print(format_job_report(report))
+"""
+
+import concurrent.futures
+import json
+import os
+import re
+import threading
+import time
+
+from .folder_to_parquet import (EXCEL_EXTENSIONS, dataframe_to_parquet_and_upload,
+                                get_dataframes_from_storage, get_sharepoint_connection,
+                                get_sharepoint_credentials)
+from .instrumentation import enable_instrumentation, finish_instrumentation, stage
+from .run_journal import (DEFAULT_MAX_FAILURES, DEFAULT_WORK_DIR, RUN_FILE_KEY, finish_run,
+                          get_quarantine, get_run_summary, open_journal, record_stage, start_run)
+from .scheduler import get_default_memory_budget, set_global_limits
+
+# the options of a target, and their defaults
+TARGET_DEFAULTS = {
+    'sharepoint_url': "https://cinfin.sharepoint.com/sites/PandCReserving",
+    'output_name': "data.parquet",
+    'incremental': False,
+    'max_workers': None,
+    'max_failures': DEFAULT_MAX_FAILURES,
+}
+REQUIRED_TARGET_OPTIONS = ['name', 'sharepoint_folder', 'output_folder']
+
+# the global limits, and their defaults
+LIMIT_DEFAULTS = {
+    'max_targets': 2,
+    'max_connections': 4,
+    'max_workers': os.cpu_count() or 1,
+    'memory_budget_mb': None,
+}
+
+
+def load_job_spec(
+    path: str
+) -> dict:
+    """
+    # Description:
+    This function reads a job spec, and fills in the defaults.
+
+    # Parameters:
+        path: str
+            this is the path of the JSON job spec
+
+    # Returns:
+        dict
+            this is the spec, with `limits` and the complete `targets`
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        spec = json.load(file)
+    return validate_job_spec(spec)
+
+
+def validate_job_spec(
+    spec: dict
+) -> dict:
+    """
+    # Description:
+    This function checks a job spec, and fills in the defaults.
+
+    # Parameters:
+        spec: dict
+            this is the job spec
+
+    # Returns:
+        dict
+            this is the spec, with `limits` and the complete `targets`
+    """
+    unknown = set(spec.get('limits', {})) - set(LIMIT_DEFAULTS)
+    if len(unknown) > 0:
+        raise ValueError(f'unknown limits: {sorted(unknown)}')
+    limits = dict(LIMIT_DEFAULTS, **spec.get('limits', {}))
+
+    known_options = set(TARGET_DEFAULTS) | set(REQUIRED_TARGET_OPTIONS)
+    defaults = dict(TARGET_DEFAULTS, **spec.get('defaults', {}))
+    targets = []
+    for index, target in enumerate(spec.get('targets', [])):
+        target = dict(defaults, **target)
+        unknown = set(target) - known_options
+        if len(unknown) > 0:
+            raise ValueError(f'target {index}: unknown options {sorted(unknown)}')
+        missing = [option for option in REQUIRED_TARGET_OPTIONS if not target.get(option)]
+        if len(missing) > 0:
+            raise ValueError(f'target {index}: missing {missing}')
+        targets.append(target)
+
+    if len(targets) == 0:
+        raise ValueError('the job spec has no targets')
+    names = [target['name'] for target in targets]
+    if len(set(names)) != len(names):
+        raise ValueError('the target names must be unique')
+
+    # every target works in a folder of its own
+    # (folder names are compared ignoring case, as on Windows)
+    folders = {}
+    for name in names:
+        folder = get_target_folder_name(name).lower()
+        if folder in folders:
+            raise ValueError(f'the targets {folders[folder]!r} and {name!r} '
+                             'would share a work folder, rename one of them')
+        folders[folder] = name
+
+    return {'limits': limits, 'targets': targets}
+
+
+class SiteContexts:
+    """
+    # Description:
+    One authenticated sharepoint connection per site, shared by the targets
+    of the site. `get` returns a clone of it for a target, with its own
+    query queue, so the targets do not run each other's queries; `release`
+    closes the clone once the target is done.
+    """
+
+    def __init__(self, sharepoint_username=None, sharepoint_password=None):
+        self.sharepoint_username = sharepoint_username
+        self.sharepoint_password = sharepoint_password
+        self.contexts = {}
+        self.lock = threading.Lock()
+
+    def get(self, site_url):
+        # log into each site once, even when its targets start together
+        with self.lock:
+            if site_url not in self.contexts:
+                self.contexts[site_url] = get_sharepoint_connection(
+                    site_url, self.sharepoint_username, self.sharepoint_password)
+            context = self.contexts[site_url]
+
+        # older office365 versions cannot clone a context: share it
+        if hasattr(context, 'clone'):
+            return context.clone(site_url)
+        return context
+
+    def release(self, context):
+        # close a clone, never the shared connection of the site
+        if context not in self.contexts.values() and hasattr(context, 'close'):
+            context.close()
+
+    def close(self):
+        # only some office365 versions can close a context
+        for context in self.contexts.values():
+            if hasattr(context, 'close'):
+                context.close()
+        self.contexts = {}
+
+
+def get_target_folder_name(
+    name: str
+) -> str:
+    """
+    # Description:
+    Returns the folder name of a target name.
+    """
+    return re.sub(r'[^\w.-]+', '_', name)
+
+
+def get_target_work_dir(
+    work_dir: str,
+    target: dict
+) -> str:
+    """
+    # Description:
+    Returns the work folder of a target, named after it.
+    """
+    return os.path.join(work_dir, get_target_folder_name(target['name']))
+
+
+def run_target(
+    target: dict,
+    contexts: SiteContexts,
+    work_dir: str = DEFAULT_WORK_DIR,
+    resume: bool = False,
+    memory_budget: int = None
+) -> dict:
+    """
+    # Description:
+    This function refreshes one target: reads the workbooks of its
+    sharepoint folder, and publishes the combined parquet file to its
+    output folder. A failure is recorded in the report, not raised.
+
+    # Parameters:
+        target: dict
+            this is the target, as completed by `validate_job_spec`
+        contexts: SiteContexts
+            this is the shared connections of the sites
+        work_dir: str
+            this is the work folder of the job; the target works in a
+            folder of its own in it
+            defaults to './refresh_work'
+        resume: bool
+            if True, continue the latest run of the target that did not complete
+            defaults to False
+        memory_budget: int
+            this is the memory, in bytes, the parses of the target may use
+            defaults to None for half the physical memory
+
+    # Returns:
+        dict
+            this is the report of the target
+    """
+    target_work_dir = get_target_work_dir(work_dir, target)
+    os.makedirs(target_work_dir, exist_ok=True)
+    report = {
+        'name': target['name'],
+        'sharepoint_url': target['sharepoint_url'],
+        'sharepoint_folder': target['sharepoint_folder'],
+        'output': target['output_folder'].rstrip('/') + '/' + target['output_name'],
+        'status': 'failed',
+        'files': 0,
+        'files_read': 0,
+        'rows': 0,
+        'error': None,
+    }
+    start = time.perf_counter()
+    journal = open_journal(os.path.join(target_work_dir, 'refresh_journal.sqlite'))
+    run_id = start_run(journal, resume)
+    storage = None
+
+    try:
+        with stage('target', target=target['name']) as span:
+            from .storage import SharePointBackend
+
+            # the target's own clone of the site connection
+            storage = SharePointBackend(contexts.get(target['sharepoint_url']))
+            files = storage.list(target['sharepoint_folder'])
+            report['files'] = sum(1 for file in files
+                                  if file.name.lower().endswith(EXCEL_EXTENSIONS))
+
+            dataframes = get_dataframes_from_storage(
+                files, journal, run_id, target_work_dir, resume,
+                target['max_failures'], target['max_workers'], memory_budget,
+                target['incremental'])
+            report['files_read'] = len(dataframes)
+
+            from .output_tbl_schema import concat_output_tbls
+            df = concat_output_tbls(dataframes)
+            report['rows'] = len(df)
+            span.add(rows=len(df))
+
+            dataframe_to_parquet_and_upload(
+                df, storage, target['output_folder'], target['output_name'],
+                local_path=os.path.join(target_work_dir, target['output_name']))
+            record_stage(journal, run_id, RUN_FILE_KEY, 'upload')
+
+        finish_run(journal, run_id, 'completed')
+        report['status'] = 'completed'
+
+    except Exception as error:
+        finish_run(journal, run_id, 'failed')
+        report['error'] = repr(error)
+        print(f"Target {target['name']} failed:", repr(error))
+
+    finally:
+        summary = get_run_summary(journal, run_id)
+        report['failed_files'] = summary['failed_files']
+        report['quarantined'] = len(get_quarantine(journal))
+        report['run_id'] = run_id
+        report['seconds'] = time.perf_counter() - start
+        journal.close()
+
+        # the clones of the target's threads, and the target's own clone
+        if storage is not None:
+            storage.close_clones()
+            contexts.release(storage.client_context)
+
+    return report
+
+
+def run_jobs(
+    spec: dict,
+    work_dir: str = DEFAULT_WORK_DIR,
+    resume: bool = False,
+    trace_path: str = None,
+    report_path: str = None
+) -> dict:
+    """
+    # Description:
+    This function refreshes every target of a job spec, `max_targets` at a
+    time, under the global limits of the spec, and writes the consolidated
+    report of the run.
+
+    # Parameters:
+        spec: dict
+            this is the job spec, as returned by `load_job_spec`
+        work_dir: str
+            this is the work folder of the job
+            defaults to './refresh_work'
+        resume: bool
+            if True, continue the runs of the targets that did not complete
+            defaults to False
+        trace_path: str
+            this is the path of the JSON-lines trace of the job
+            defaults to None for no instrumentation
+        report_path: str
+            this is the path of the JSON report
+            defaults to None for `work_dir/job_report.json`
+
+    # Returns:
+        dict
+            this is the consolidated report: the limits, the report of every
+            target, and the totals
+    """
+    limits = spec['limits']
+    targets = spec['targets']
+    max_targets = max(1, min(limits['max_targets'], len(targets)))
+
+    # the memory budget is shared by the targets running at the same time
+    memory_budget = (limits['memory_budget_mb'] * 1_000_000
+                     if limits['memory_budget_mb'] is not None
+                     else get_default_memory_budget())
+    target_memory_budget = memory_budget // max_targets
+
+    if trace_path is not None:
+        enable_instrumentation(trace_path)
+    set_global_limits(limits['max_connections'], limits['max_workers'])
+    contexts = SiteContexts(*get_sharepoint_credentials())
+    start = time.perf_counter()
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_targets) as pool:
+            futures = [pool.submit(run_target, target, contexts, work_dir, resume,
+                                   target_memory_budget)
+                       for target in targets]
+            reports = [future.result() for future in futures]
+    finally:
+        contexts.close()
+        set_global_limits()
+        if trace_path is not None:
+            print(finish_instrumentation())
+
+    report = {
+        'limits': limits,
+        'targets': reports,
+        'totals': {
+            'targets': len(reports),
+            'completed': sum(target['status'] == 'completed' for target in reports),
+            'failed': sum(target['status'] != 'completed' for target in reports),
+            'files': sum(target['files'] for target in reports),
+            'files_read': sum(target['files_read'] for target in reports),
+            'failed_files': sum(len(target['failed_files']) for target in reports),
+            'rows': sum(target['rows'] for target in reports),
+            'seconds': time.perf_counter() - start,
+        },
+    }
+
+    # the consolidated report
+    report_path = report_path or os.path.join(work_dir, 'job_report.json')
+    os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+    with open(report_path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+
+    return report
+
+
+def format_job_report(
+    report: dict
+) -> str:
+    """
+    # Description:
+    This function formats the consolidated report of `run_jobs` as text.
+
+    # Parameters:
+        report: dict
+            this is the report
+
+    # Returns:
+        str
+            this is the text
+    """
+    columns = ['target', 'status', 'files', 'read', 'failed', 'quarantined', 'rows',
+               'seconds', 'output']
+    rows = [[target['name'], target['status'], f"{target['files']:,}",
+             f"{target['files_read']:,}", f"{len(target['failed_files']):,}",
+             f"{target['quarantined']:,}", f"{target['rows']:,}",
+             f"{target['seconds']:,.1f}", target['output']]
+            for target in report['targets']]
+    widths = [max([len(column)] + [len(row[i]) for row in rows])
+              for i, column in enumerate(columns)]
+
+    lines = ['  '.join(column.ljust(width) for column, width in zip(columns, widths))]
+    for row in rows:
+        lines.append('  '.join(
+            value.rjust(width) if 2 <= i <= 7 else value.ljust(width)
+            for i, (value, width) in enumerate(zip(row, widths))))
+
+    # the errors of the failed targets
+    for target in report['targets']:
+        if target['error'] is not None:
+            lines.append(f"{target['name']}: {target['error']}")
+
+    totals = report['totals']
+    lines.append(f"{totals['completed']} of {totals['targets']} targets completed, "
+                 f"{totals['files_read']:,} of {totals['files']:,} files read, "
+                 f"{totals['failed_files']:,} failed, {totals['rows']:,} rows, "
+                 f"{totals['seconds']:,.1f} s")
+    return '\n'.join(lines)
@@ -0,0 +1,325 @@
+"""
+# Description:
+Streaming reader for the "output_tbl" sheet with column and row projection.
+
+`pd.read_excel` materializes every column and every used row of the sheet,
+including helper columns and the blank or formula-junk rows below the table,
+and only then can we drop what we do not need. This module walks the sheet
+row by row (with the engines of the `reader_engines` registry), keeps only the
+requested columns, and stops at the end of the table, so everything else is
+skipped while parsing instead of being dropped afterwards.
+
+A projection is a dict with the keys:
+    columns: list of the headers to keep, None for every column
+    header_row: 0-based index of the header row in the sheet
+    stop_at_blank_row: stop at the first row whose kept columns are all blank
+
+Projections are configured per CIG file type, either with
+`register_projection` or from the optional `columns`, `header_row` and
+`stop_at_blank_row` columns of the `cig_filetypes` frame
+(see `register_projections_from_cig_filetypes`).
+"""
+
+import pandas as pd
+
+from . import reader_engines
+from .output_tbl_schema import normalize_column_name
+
+# projection used when the file type has none configured
+DEFAULT_PROJECTION = {
+    'columns': None,
+    'header_row': 0,
+    'stop_at_blank_row': True,
+}
+
+# configured projections, keyed by CIG file type
+OUTPUT_TBL_PROJECTIONS = {}
+
+
+def register_projection(
+    file_type: str,
+    columns: list = None,
+    header_row: int = 0,
+    stop_at_blank_row: bool = True
+) -> None:
+    """
+    # Description:
+    This function configures the projection used to read the output_tbl
+    sheet of a CIG file type.
+
+    # Parameters:
+        file_type: str
+            this is the CIG file type, as in the `type` column of `cig_filetypes`
+        columns: list
+            this is the list of headers to keep
+            defaults to None for every column
+        header_row: int
+            this is the 0-based index of the header row
+            defaults to 0
+        stop_at_blank_row: bool
+            if True, stop at the first row whose kept columns are all blank
+            defaults to True
+
+    # Returns:
+        None
+    """
+    if header_row < 0:
+        raise ValueError(f'header_row must be >= 0, not {header_row}')
+
+    OUTPUT_TBL_PROJECTIONS[file_type] = {
+        'columns': None if columns is None else list(columns),
+        'header_row': int(header_row),
+        'stop_at_blank_row': bool(stop_at_blank_row),
+    }
+
+
+def register_projections_from_cig_filetypes(
+    cig_filetypes: pd.DataFrame
+) -> None:
+    """
+    # Description:
+    This function configures the projections from the `cig_filetypes` frame.
+    Besides `filename` and `type`, the frame may have the optional columns
+    `columns` (comma-separated headers), `header_row` and `stop_at_blank_row`.
+    Rows without any of them leave the file type on the default projection.
+
+    # Parameters:
+        cig_filetypes: pd.DataFrame
+            this is the frame of CIG file types
+
+    # Returns:
+        None
+    """
+    optional_columns = ['columns', 'header_row', 'stop_at_blank_row']
+
+    # nothing to configure
+    if not any(column in cig_filetypes.columns for column in optional_columns):
+        return
+
+    # one projection per file type, the first row of each type wins
+    for file_type, rows in cig_filetypes.groupby('type', sort=False):
+        row = rows.iloc[0]
+
+        # read the optional settings, falling back to the defaults
+        columns = row.get('columns')
+        if columns is None or pd.isna(columns) or str(columns).strip() == '':
+            columns = None
+        else:
+            columns = [column.strip() for column in str(columns).split(',')
+                       if column.strip() != '']
+
+        header_row = row.get('header_row')
+        if header_row is None or pd.isna(header_row):
+            header_row = DEFAULT_PROJECTION['header_row']
+
+        stop_at_blank_row = row.get('stop_at_blank_row')
+        if stop_at_blank_row is None or pd.isna(stop_at_blank_row):
+            stop_at_blank_row = DEFAULT_PROJECTION['stop_at_blank_row']
+
+        register_projection(
+            file_type,
+            columns=columns,
+            header_row=int(header_row),
+            stop_at_blank_row=bool(stop_at_blank_row)
+        )
+
+
+def get_projection(
+    file_type: str = None
+) -> dict:
+    """
+    # Description:
+    This function returns the projection configured for a CIG file type,
+    or the default projection.
+
+    # Parameters:
+        file_type: str
+            this is the CIG file type
+            defaults to None for the default projection
+
+    # Returns:
+        dict
+            this is the projection
+    """
+    projection = dict(OUTPUT_TBL_PROJECTIONS.get(file_type, DEFAULT_PROJECTION))
+
+    # the caller may change the columns, not the configured projection
+    if projection['columns'] is not None:
+        projection['columns'] = list(projection['columns'])
+    return projection
+
+
+def _is_blank(
+    value
+) -> bool:
+    """
+    # Description:
+    Formula cells that evaluate to "" and cells holding only spaces
+    count as blank, like empty cells.
+    """
+    return value is None or (isinstance(value, str) and value.strip() == '')
+
+
+def iter_sheet_rows(
+    file_name: str,
+    sheet_name: str = 'output_tbl',
+    engine: str = None
+):
+    """
+    # Description:
+    This function yields the rows of a sheet as sequences of cell values,
+    using an engine of the `reader_engines` registry.
+
+    # Parameters:
+        file_name: str
+            this is the file name
+        sheet_name: str
+            this is the sheet to read
+            defaults to 'output_tbl'
+        engine: str
+            this is the name of the reader engine
+            defaults to None for the engine picked by `reader_engines.select_engine`
+
+    # Returns:
+        iterator
+            this yields one sequence of values per row
+    """
+    return reader_engines.iter_rows(file_name, sheet_name, engine)
+
+
+def rows_to_dataframe(
+    rows,
+    columns: list = None,
+    header_row: int = 0,
+    stop_at_blank_row: bool = True
+) -> pd.DataFrame:
+    """
+    # Description:
+    This function builds the output_tbl dataframe from an iterator of rows,
+    keeping only the requested columns and stopping at the end of the table.
+    The rows are consumed one at a time, so nothing past the end of the table
+    is parsed. Requested headers are matched ignoring case and spacing.
+    The cells are given the same types whichever engine read them, so the
+    frames of workbooks read by different engines have the same dtypes.
+
+    # Parameters:
+        rows: iterator
+            this yields one sequence of cell values per row
+        columns: list
+            this is the list of headers to keep
+            defaults to None for every column
+        header_row: int
+            this is the 0-based index of the header row
+            defaults to 0
+        stop_at_blank_row: bool
+            if True, stop at the first row whose kept columns are all blank
+            defaults to True
+
+    # Returns:
+        pd.DataFrame
+            this is the projected output_tbl dataframe
+    """
+    rows = iter(rows)
+
+    # skip the rows above the header, then read the header
+    header = None
+    for row_index, row in enumerate(rows):
+        if row_index == header_row:
+            header = list(row)
+            break
+    if header is None:
+        raise ValueError(f'the sheet has no header row {header_row}')
+
+    # drop the blank cells at the end of the header
+    while len(header) > 0 and _is_blank(header[-1]):
+        header.pop()
+
+    # name blank header cells the way pandas does
+    header = [f'Unnamed: {i}' if _is_blank(name) else str(name).strip()
+              for i, name in enumerate(header)]
+
+    # pick the positions of the kept columns
+    if columns is None:
+        positions = list(range(len(header)))
+    else:
+        position_by_name = {}
+        for position, name in enumerate(header):
+            position_by_name.setdefault(normalize_column_name(name), position)
+        missing = [column for column in columns
+                   if normalize_column_name(column) not in position_by_name]
+        if len(missing) > 0:
+            raise ValueError(f'columns not in the output_tbl header: {missing}')
+        positions = [position_by_name[normalize_column_name(column)]
+                     for column in columns]
+
+    # collect the kept values column by column
+    values = [[] for _ in positions]
+    try:
+        for row in rows:
+            # cells past the end of a short row are blank
+            kept = [row[position] if position < len(row) else None
+                    for position in positions]
+
+            # the end of the table
+            if stop_at_blank_row and all(_is_blank(value) for value in kept):
+                break
+
+            # blank cells are missing values, whichever engine read them
+            # (calamine reads empty cells as '', the others as None)
+            # Excel keeps every number as a double: openpyxl and pyxlsb give
+            # the whole ones back as int, calamine as float, so they are read
+            # as floats to get float64 columns from every engine
+            for column_values, value in zip(values, kept):
+                if _is_blank(value):
+                    value = None
+                elif type(value) is int:
+                    value = float(value)
+                column_values.append(value)
+    finally:
+        # stopping early must still close the workbook behind the iterator
+        if hasattr(rows, 'close'):
+            rows.close()
+
+    # build the dataframe
+    return pd.DataFrame(
+        {header[position]: column_values
+         for position, column_values in zip(positions, values)},
+        columns=[header[position] for position in positions]
+    )
+
+
+def read_output_tbl(
+    file_name: str,
+    projection: dict = None,
+    sheet_name: str = 'output_tbl',
+    engine: str = None
+) -> pd.DataFrame:
+    """
+    # Description:
+    This function reads the "output_tbl" sheet of an excel file with a projection.
+
+    # Parameters:
+        file_name: str
+            this is the file name
+        projection: dict
+            this is the projection (`columns`, `header_row`, `stop_at_blank_row`)
+            defaults to None for `DEFAULT_PROJECTION`
+        sheet_name: str
+            this is the sheet to read
+            defaults to 'output_tbl'
+        engine: str
+            this is the name of the reader engine
+            defaults to None for the engine picked by `reader_engines.select_engine`
+
+    # Returns:
+        pd.DataFrame
+            this is the projected output_tbl dataframe
+    """
+    projection = {**DEFAULT_PROJECTION, **(projection or {})}
+
+    return rows_to_dataframe(
+        iter_sheet_rows(file_name, sheet_name, engine),
+        columns=projection['columns'],
+        header_row=projection['header_row'],
+        stop_at_blank_row=projection['stop_at_blank_row']
+    )
@@ -0,0 +1,330 @@
+"""
+# Description:
+Schema registry for the "output_tbl" sheets, keyed by CIG file type.
+
+`pd.read_excel` infers the column types of every output_tbl on its own:
+strings come back as object columns, every number as float64, and a column
+with a stray text cell becomes an object column that later breaks `pd.concat`
+or multiplies the memory used by the combined table.
+
+The registry declares the dtype of every known output_tbl column
+(categoricals for LOB / state / type, nullable int16 for years and periods,
+float32 for factors where single precision is enough), `normalize_dtypes`
+enforces it on each frame as it is read, and `concat_output_tbls` combines
+the normalized frames without losing the categoricals.
+
+The columns are declared by the headers the workbooks write ('LOB',
+'Accident Year', 'Link Ratio', ...) and stored under their normalized names
+('lob', 'accident_year', 'link_ratio', ...). They are declared for every
+file type, so a workbook is typed the same way whether or not its file type
+is known: without a CIG reference file it never is. A file type only adds
+the columns of its own (`register_schema`).
+
+# Example:
+    register_schema('tail factor', {'Tail Factor': 'float32'})
+    df = normalize_dtypes(df, 'tail factor')
+"""
+
+import warnings
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# columns every output_tbl frame has, whatever the file type
+# `file_name`, `year`, `quarter` and `analysis_idx` are added by
+# `folder_to_parquet.add_analysis_columns`, `cig_type` by `normalize_dtypes`
+COMMON_SCHEMA = {
+    'file_name': 'category',
+    'cig_type': 'category',
+    'year': 'Int16',
+    'quarter': 'Int8',
+    'analysis_idx': 'Int32',
+}
+
+# the output_tbl headers, as the workbooks write them, and their dtypes
+# declared for every file type, since the file type is often unknown
+OUTPUT_TBL_COLUMNS = {
+    'LOB': 'category',
+    'State': 'category',
+    'Type': 'category',
+    'Accident Year': 'Int16',
+    'Development Period': 'Int16',
+    'Link Ratio': 'float32',
+    'Selected Link Ratio': 'float32',
+    'Paid Loss': 'float64',
+    'Reported Loss': 'float64',
+}
+
+# the headers of each CIG file type (the `type` column of `cig_filetypes`)
+# that are not in `OUTPUT_TBL_COLUMNS`
+# extend with `register_schema` rather than editing the frames afterwards
+OUTPUT_TBL_SCHEMAS = {}
+
+# the (file type, column) pairs already reported as not declared
+# each is reported once per process, not once per workbook
+_reported_unknown_columns = set()
+
+
+class UnknownColumnsWarning(UserWarning):
+    """
+    # Description:
+    Warning raised by `normalize_dtypes` when a frame has columns
+    that are not declared in the schema of its file type.
+    """
+
+
+class NonIntegerValuesWarning(UserWarning):
+    """
+    # Description:
+    Warning raised by `normalize_dtypes` when a column declared as an
+    integer has values with a fractional part, and is kept as floats.
+    """
+
+
+def register_schema(
+    file_type: str,
+    columns: dict,
+    replace: bool = False
+) -> None:
+    """
+    # Description:
+    This function declares the dtypes of the output_tbl columns of a CIG file type.
+    By default the columns are added to the existing schema of the file type.
+
+    # Parameters:
+        file_type: str
+            this is the CIG file type, as in the `type` column of `cig_filetypes`
+        columns: dict
+            this maps the output_tbl header (for example 'Tail Factor') to
+            pandas dtype name (for example 'category', 'Int16', 'float32')
+        replace: bool
+            if True, replace the schema of the file type instead of extending it
+            defaults to False
+
+    # Returns:
+        None
+    """
+    # check the dtype names now, instead of when the first file is read
+    for column, dtype in columns.items():
+        try:
+            pd.api.types.pandas_dtype(dtype)
+        except TypeError as error:
+            raise ValueError(
+                f'invalid dtype {dtype} for column {column}') from error
+
+    # add or replace the schema
+    if replace or file_type not in OUTPUT_TBL_SCHEMAS:
+        OUTPUT_TBL_SCHEMAS[file_type] = dict(columns)
+    else:
+        OUTPUT_TBL_SCHEMAS[file_type].update(columns)
+
+
+def get_schema(
+    file_type: str = None
+) -> dict:
+    """
+    # Description:
+    This function returns the declared dtypes of the output_tbl columns
+    of a CIG file type, by normalized column name: the common columns, the
+    output_tbl columns of every file type, and those of the file type.
+
+    # Parameters:
+        file_type: str
+            this is the CIG file type
+            defaults to None for an unknown file type
+
+    # Returns:
+        dict
+            this maps normalized column name to pandas dtype name
+    """
+    schema = dict(COMMON_SCHEMA)
+    for column, dtype in OUTPUT_TBL_COLUMNS.items():
+        schema[normalize_column_name(column)] = dtype
+
+    # a file type without columns of its own has the common ones only
+    for column, dtype in OUTPUT_TBL_SCHEMAS.get(file_type, {}).items():
+        schema[normalize_column_name(column)] = dtype
+    return schema
+
+
+def normalize_column_name(
+    column
+) -> str:
+    """
+    # Description:
+    This function lower-cases a header and replaces runs of spaces with one
+    underscore, so that 'LOB', ' lob ' and 'Accident Year' match
+    'lob' and 'accident_year'.
+
+    # Parameters:
+        column: str
+            this is the column header
+
+    # Returns:
+        str
+            this is the normalized header
+    """
+    return '_'.join(str(column).strip().lower().split())
+
+
+def _cast_column(
+    series: pd.Series,
+    dtype: str
+) -> pd.Series:
+    """
+    # Description:
+    Casts one column to its declared dtype.
+    Numeric columns go through `pd.to_numeric` first, so that text cells
+    ('n/a', '-', '#DIV/0!') become missing values instead of failing the cast.
+    An integer column with a fractional value is kept as nullable floats,
+    with a `NonIntegerValuesWarning`, rather than losing the fraction.
+    """
+    pandas_dtype = pd.api.types.pandas_dtype(dtype)
+
+    # categoricals: missing values stay missing, everything else becomes a category
+    if isinstance(pandas_dtype, pd.CategoricalDtype):
+        return series.astype('category')
+
+    # numeric columns
+    if pd.api.types.is_numeric_dtype(pandas_dtype):
+        numeric = pd.to_numeric(series, errors='coerce')
+
+        # integer columns must not silently lose a fractional part
+        # (nor fail the whole workbook): they are kept as floats
+        if pd.api.types.is_integer_dtype(pandas_dtype):
+            non_integral = numeric.notna() & (numeric % 1 != 0)
+            if non_integral.any():
+                warnings.warn(
+                    f'output_tbl column {series.name} is declared {dtype} but has '
+                    f'non-integer values, for example {numeric[non_integral].iloc[0]}; '
+                    'it is kept as Float64',
+                    NonIntegerValuesWarning,
+                    stacklevel=3
+                )
+                return numeric.astype('Float64')
+
+        return numeric.astype(pandas_dtype)
+
+    # anything else (strings, datetimes)
+    return series.astype(pandas_dtype)
+
+
+def normalize_dtypes(
+    df: pd.DataFrame,
+    file_type: str = None,
+    warn_unknown: bool = True
+) -> pd.DataFrame:
+    """
+    # Description:
+    This function enforces the declared dtypes of a CIG file type on a copy
+    of an output_tbl dataframe. Headers are matched to the declared column
+    names ignoring case and spacing, and renamed to the declared names.
+    When `file_type` is given, a `cig_type` column is added with it.
+    Columns that are not declared are kept as they are and reported with
+    an `UnknownColumnsWarning`, once per file type and column, except that
+    undeclared columns mixing numbers and text are converted to text so
+    they can be written to parquet.
+
+    # Parameters:
+        df: pd.DataFrame
+            this is the dataframe from the "output_tbl" sheet; it is not changed
+        file_type: str
+            this is the CIG file type of the workbook
+            defaults to None for an unknown file type
+        warn_unknown: bool
+            if True, warn about the columns that are not declared
+            defaults to True
+
+    # Returns:
+        pd.DataFrame
+            this is a new dataframe with the declared dtypes
+    """
+    schema = get_schema(file_type)
+
+    # rename headers that only differ from the declared names by case / spacing
+    # (`rename` returns a new frame, so the caller's frame is left as it is)
+    renames = {column: normalize_column_name(column) for column in df.columns
+               if normalize_column_name(column) in schema}
+    df = df.rename(columns=renames)
+
+    # tag the rows with their file type, so the combined table can be filtered on it
+    if file_type is not None:
+        df['cig_type'] = file_type
+
+    # cast the declared columns, and collect the unknown ones
+    unknown_columns = []
+    for column in df.columns:
+        if column in schema:
+            df[column] = _cast_column(df[column], schema[column])
+        else:
+            unknown_columns.append(column)
+
+            # an undeclared column mixing numbers and text cannot be written
+            # to parquet, so it is kept as text
+            if df[column].dtype == object and df[column].dropna().map(type).nunique() > 1:
+                df[column] = df[column].astype('string')
+
+    # report the columns that are not declared, the first time they are seen
+    unknown_columns = [column for column in unknown_columns
+                       if (file_type, column) not in _reported_unknown_columns]
+    if warn_unknown and len(unknown_columns) > 0:
+        _reported_unknown_columns.update((file_type, column) for column in unknown_columns)
+        warnings.warn(
+            f'output_tbl columns not declared for file type {file_type}: '
+            f'{unknown_columns}',
+            UnknownColumnsWarning,
+            stacklevel=2
+        )
+
+    # return the dataframe
+    return df
+
+
+def concat_output_tbls(
+    dataframes: list
+) -> pd.DataFrame:
+    """
+    # Description:
+    This function appends normalized output_tbl dataframes.
+    `pd.concat` turns a categorical column into an object column as soon as
+    two frames have different categories, so the categories of every
+    categorical column are unioned across the frames first.
+
+    # Parameters:
+        dataframes: list
+            this is the list of normalized output_tbl dataframes
+
+    # Returns:
+        pd.DataFrame
+            this is the appended dataframe
+    """
+    dataframes = [df for df in dataframes if df is not None]
+    if len(dataframes) == 0:
+        return pd.DataFrame()
+
+    # find the columns that are categorical in every frame that has them
+    categorical_columns = set()
+    for df in dataframes:
+        for column in df.columns:
+            if isinstance(df[column].dtype, pd.CategoricalDtype):
+                categorical_columns.add(column)
+    for df in dataframes:
+        for column in list(categorical_columns):
+            if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+                categorical_columns.discard(column)
+
+    # give every frame the same categories for each categorical column
+    # (the categories of an empty column have no dtype of their own, so they
+    # are left out of the union unless every column is empty)
+    for column in categorical_columns:
+        columns = [df[column] for df in dataframes if column in df.columns]
+        columns = [series for series in columns if len(series) > 0] or columns[:1]
+        categories = union_categoricals(columns, ignore_order=True).categories
+        dataframes = [
+            df.assign(**{column: df[column].cat.set_categories(categories)})
+            if column in df.columns else df
+            for df in dataframes
+        ]
+
+    # append the dataframes
+    return pd.concat(dataframes, ignore_index=True)
@@ -0,0 +1,359 @@
+"""
+# Description:
+Opt-in CPU and memory profiling of the workbook parsing, per file.
+
+Some output_tbl workbooks take many times longer to parse than the others,
+or use gigabytes of memory. With profiling on, every file read by
+`get_dataframe_from_file` and every file of the sharepoint loops is run under
+cProfile and tracemalloc; the cProfile stats of each file are saved as a
+`.prof` file, and `write_profiling_report` ranks the files by wall time and
+by peak memory and writes a report with the hottest functions of the worst
+offenders. The `.prof` files open with `python -m pstats` or snakeviz.
+
+Profiling is off by default, and `sample_rate` profiles a subset of the
+files: the choice is a hash of the file name, so the same files are
+profiled on every run and runs can be compared.
+
+cProfile and tracemalloc measure the whole process, so the profiled files of
+a process are profiled one at a time, and the refresh reads its files one at
+a time while profiling is on. Files parsed in worker processes are profiled
+there, by `profile_in_worker`, and their results sent back to the parent.
+
+# Example:
+    enable_profiling('profiles', sample_rate=0.25)
+    folder_to_parquet(...)
+    print(write_profiling_report())
+"""
+
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+import zlib
+
+# the profiling settings, None while profiling is off
+_settings = None
+
+# the results of the profiled files
+_results = []
+_results_lock = threading.Lock()
+
+# cProfile cannot nest, so the files read inside a profiled sharepoint
+# loop iteration are covered by the outer profile
+_active = threading.local()
+
+# cProfile and tracemalloc are per process, so one profiled file at a time
+_profile_lock = threading.Lock()
+
+
+def enable_profiling(
+    report_dir: str = 'profiles',
+    sample_rate: float = 1.0
+) -> None:
+    """
+    # Description:
+    This function turns profiling on, and clears the previous results.
+
+    # Parameters:
+        report_dir: str
+            this is the folder of the `.prof` files and of the report
+            defaults to 'profiles'
+        sample_rate: float
+            this is the fraction of the files to profile, between 0 and 1
+            defaults to 1.0 for every file
+
+    # Returns:
+        None
+    """
+    global _settings
+    if not 0 <= sample_rate <= 1:
+        raise ValueError(f'sample_rate must be between 0 and 1, not {sample_rate}')
+
+    os.makedirs(report_dir, exist_ok=True)
+    _settings = {'report_dir': report_dir, 'sample_rate': sample_rate}
+    with _results_lock:
+        _results.clear()
+
+
+def disable_profiling() -> None:
+    """
+    # Description:
+    This function turns profiling off. The results are kept for the report.
+    """
+    global _settings
+    _settings = None
+
+
+def is_profiling() -> bool:
+    """
+    # Description:
+    This function tells whether profiling is on.
+
+    # Returns:
+        bool
+            True if profiling is on
+    """
+    return _settings is not None
+
+
+def is_sampled(
+    file_name: str,
+    sample_rate: float
+) -> bool:
+    """
+    # Description:
+    This function decides whether a file is profiled, from a hash of its name.
+
+    # Parameters:
+        file_name: str
+            this is the file name
+        sample_rate: float
+            this is the fraction of the files to profile
+
+    # Returns:
+        bool
+            True if the file is profiled
+    """
+    if sample_rate >= 1:
+        return True
+    bucket = zlib.crc32(os.path.basename(file_name).encode('utf-8')) % 10_000
+    return bucket < sample_rate * 10_000
+
+
+def _get_profile_path(
+    report_dir: str,
+    file_name: str,
+    label: str
+) -> str:
+    """
+    # Description:
+    Builds the path of the `.prof` file of a profiled file.
+    """
+    safe_name = re.sub(r'[^\w.-]+', '_', os.path.basename(file_name))
+    return os.path.join(report_dir, f'{label}__{safe_name}.prof')
+
+
+@contextlib.contextmanager
+def profile_file(
+    file_name: str,
+    label: str = 'parse'
+):
+    """
+    # Description:
+    This function returns a context manager that profiles the processing of
+    one file, when profiling is on and the file is sampled.
+    Inside an already profiled block it does nothing.
+
+    # Parameters:
+        file_name: str
+            this is the file being processed
+        label: str
+            this is what is being done with the file, for example 'parse'
+            or 'sharepoint'
+            defaults to 'parse'
+
+    # Returns:
+        context manager
+    """
+    settings = _settings
+
+    # off, not sampled, or already profiled by an outer block
+    if (settings is None or getattr(_active, 'profiling', False)
+            or not is_sampled(file_name, settings['sample_rate'])):
+        yield
+        return
+
+    with _profile_lock:
+        # start tracing memory, or measure the peak from here if already tracing
+        started_tracemalloc = not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start()
+        else:
+            tracemalloc.reset_peak()
+        baseline_memory, _ = tracemalloc.get_traced_memory()
+
+        profiler = cProfile.Profile()
+        _active.profiling = True
+        start = time.perf_counter()
+        error = None
+        profiler.enable()
+        try:
+            yield
+        except BaseException as exception:
+            error = repr(exception)
+            raise
+        finally:
+            profiler.disable()
+            seconds = time.perf_counter() - start
+            _, peak_memory = tracemalloc.get_traced_memory()
+            if started_tracemalloc:
+                tracemalloc.stop()
+            _active.profiling = False
+
+            # save the stats, and record the result
+            profile_path = _get_profile_path(settings['report_dir'], file_name, label)
+            profiler.dump_stats(profile_path)
+            add_profiling_results([{
+                'file': file_name,
+                'label': label,
+                'seconds': seconds,
+                'peak_memory_bytes': max(0, peak_memory - baseline_memory),
+                'size_bytes': os.path.getsize(file_name) if os.path.exists(file_name) else None,
+                'profile_path': profile_path,
+                'error': error,
+            }])
+
+
+def profile_in_worker(
+    settings: dict,
+    function,
+    *args
+):
+    """
+    # Description:
+    This function runs `function(*args)` in a worker process with the
+    profiling settings of the parent, and returns the result together with
+    the results of the files profiled in the worker, for the parent to add
+    with `add_profiling_results`. When the function raises, the results are
+    attached to the exception as `profiling_results`.
+
+    # Parameters:
+        settings: dict
+            this is the profiling settings of the parent, `get_profiling_settings()`
+        function: callable
+            this is the module-level function to run
+        *args:
+            this is the arguments of the function
+
+    # Returns:
+        tuple
+            this is (the result of the function, the list of profiling results)
+    """
+    global _settings
+    _settings = settings
+    with _results_lock:
+        _results.clear()
+    try:
+        result = function(*args)
+    except BaseException as exception:
+        exception.profiling_results = get_profiling_results()
+        raise
+    return result, get_profiling_results()
+
+
+def get_profiling_settings() -> dict:
+    """
+    # Description:
+    This function returns the profiling settings, to send to worker processes.
+
+    # Returns:
+        dict
+            this is the settings (report_dir, sample_rate), None while profiling is off
+    """
+    return None if _settings is None else dict(_settings)
+
+
+def add_profiling_results(
+    results: list
+) -> None:
+    """
+    # Description:
+    This function adds the results of profiled files, for example the ones
+    sent back by `profile_in_worker`.
+
+    # Parameters:
+        results: list
+            this is the list of result dicts
+
+    # Returns:
+        None
+    """
+    with _results_lock:
+        _results.extend(results)
+
+
+def get_profiling_results() -> list:
+    """
+    # Description:
+    This function returns the results of the profiled files.
+
+    # Returns:
+        list
+            this is the list of result dicts (file, label, seconds,
+            peak_memory_bytes, size_bytes, profile_path, error)
+    """
+    with _results_lock:
+        return list(_results)
+
+
+def write_profiling_report(
+    report_dir: str = None,
+    top: int = 10,
+    functions: int = 15
+) -> str:
+    """
+    # Description:
+    This function ranks the profiled files by wall time and by peak memory,
+    and writes `profiling_report.json` (every result, and the rankings) and
+    `profiling_report.txt` (the rankings, and the hottest functions of the
+    `top` slowest files) to the report folder.
+
+    # Parameters:
+        report_dir: str
+            this is the folder of the report
+            defaults to None for the folder given to `enable_profiling`
+        top: int
+            this is the number of worst offenders to rank
+            defaults to 10
+        functions: int
+            this is the number of functions listed per slow file
+            defaults to 15
+
+    # Returns:
+        str
+            this is the path of the text report
+    """
+    if report_dir is None:
+        if _settings is None:
+            raise ValueError('profiling is off, report_dir must be given')
+        report_dir = _settings['report_dir']
+    os.makedirs(report_dir, exist_ok=True)
+
+    results = get_profiling_results()
+    slowest = sorted(results, key=lambda result: result['seconds'], reverse=True)[:top]
+    largest = sorted(results, key=lambda result: result['peak_memory_bytes'],
+                     reverse=True)[:top]
+
+    # the machine-readable report
+    with open(os.path.join(report_dir, 'profiling_report.json'), 'w', encoding='utf-8') as file:
+        json.dump({'results': results,
+                   'slowest': [result['file'] for result in slowest],
+                   'largest_peak_memory': [result['file'] for result in largest]},
+                  file, indent=2)
+
+    # the text report
+    lines = [f'profiled files: {len(results)}', '', f'slowest {len(slowest)} files:']
+    for result in slowest:
+        lines.append(f"  {result['seconds']:10.2f} s  {result['label']:<10}  {result['file']}")
+    lines += ['', f'largest peak memory {len(largest)} files:']
+    for result in largest:
+        lines.append(f"  {result['peak_memory_bytes'] / 1e6:10.1f} MB  "
+                     f"{result['label']:<10}  {result['file']}")
+
+    # the hottest functions of the slowest files
+    for result in slowest:
+        stream = io.StringIO()
+        stats = pstats.Stats(result['profile_path'], stream=stream)
+        stats.sort_stats('cumulative').print_stats(functions)
+        lines += ['', f"=== {result['file']} ({result['label']})", stream.getvalue()]
+
+    report_path = os.path.join(report_dir, 'profiling_report.txt')
+    with open(report_path, 'w', encoding='utf-8') as file:
+        file.write('\n'.join(lines))
+    return report_path
@@ -9,6 +9,15 @@ After getting the list of files in the SharePoint folder,
 gathers all "output_tbl" sheets from each excel file in
 the SP folder
 
+The dashboard host imports this module on every refresh, so the heavy
+dependencies (pandas, office365, the Excel engines) are imported by the
+functions that use them. `get_dashboard_data` reads the local parquet
+snapshot while it is fresh, which loads pandas and pyarrow only; office365
+and the Excel engines are loaded only when the snapshot has to be rebuilt.
+The rebuild reads the workbooks in the same way as the refresh (see
+`folder_to_parquet.get_dataframes_from_storage`), through a storage backend,
+into a temporary folder of its own.
+
 Author: Andy Weaver
 """
 
@@ -16,15 +25,33 @@ Author: Andy Weaver
 # "python.analysis.disabled": ["reportMissingImports"]
 # pylint: disable=invalid-name
 # module imports:
-import itertools
-import office365
-from office365.runtime.auth.authentication_context import AuthenticationContext
-from office365.sharepoint.client_context import ClientContext
+# annotations are not evaluated at import time, so office365 and pandas
+# do not have to be imported for the signatures below
+from __future__ import annotations
+
+import os
+import tempfile
+import time
+from typing import TYPE_CHECKING
+
+from .instrumentation import instrumented, stage
+
+# for the annotations only
+if TYPE_CHECKING:
+    import office365
+    import pandas as pd
+
+    from .storage import StorageBackend
+
+# the local copy of the combined output_tbl data, and how long it stays fresh
+SNAPSHOT_PATH = os.path.join('.', 'data.parquet')
+SNAPSHOT_MAX_AGE_HOURS = 24
 
 # function to take a sharepoint connection and a string representing a folder,
 # and return the list of files in the folder
 
 
+@instrumented('sharepoint.connect')
 def get_sharepoint_connection(
     site_url: str = 'https://cinfin.sharepoint.com/sites/PandCReserving',
     user_email: str = None,
@@ -50,6 +77,10 @@ def get_sharepoint_connection(
         requests.models.Response
             this is the connection to the sharepoint site
     """
+    # office365 is only loaded when a connection is made
+    from office365.runtime.auth.authentication_context import AuthenticationContext
+    from office365.sharepoint.client_context import ClientContext
+
     # create an authentication context object
     # this is used to authenticate the user
     auth_ctx = AuthenticationContext(site_url)
@@ -103,6 +134,7 @@ def get_sharepoint_connection(
     return ctx
 
 # returns an iterable of files in the folder
+@instrumented('sharepoint.list')
 def get_files_in_folder(
     # takes these inputs:
     client_context: office365.sharepoint.client_context.ClientContext,
@@ -152,60 +184,151 @@ def get_files_in_folder(
 # and returns a list of dataframes from the "output_tbl" sheets in each excel file
 def get_dataframes_from_files(
     files: list,
-    client_context: office365.sharepoint.client_context.ClientContext
+    client_context: office365.sharepoint.client_context.ClientContext,
+    work_dir: str = None
 ) -> list:
     """
     # Description: 
     This function takes the list of files and the sharepoint connection
-    and returns a list of dataframes from the "output_tbl" sheets in each excel file.
+    and returns a list of dataframes from the "output_tbl" sheets in each excel file
+    (".xlsx", ".xlsb" and ".xlsm"), read in the same way as the refresh.
 
     # Parameters: 
         files: list
             this is the list of files in the folder
         client_context: office365.sharepoint.client_context.ClientContext
             this is the connection to the sharepoint site
+        work_dir: str
+            this is the folder the files are downloaded to
+            defaults to None for a temporary folder, removed afterwards
 
     # Returns: 
         list
             this is the list of dataframes from the "output_tbl" sheets in each excel file
     """
-    # create an empty list to store the dataframes
-    dataframes = []
-    
-    # generate an iterator for the excel files in the folder
-    # with file extensions of ".xlsx", ".xlsb", and ".xlsm"
-    # using the `itertools` module
-    files_in_folder = itertools.chain(
-        files.get_by_file_extension('.xlsx'),
-        files.get_by_file_extension('.xlsb'),
-        files.get_by_file_extension('.xlsm')
-    )
-      
-    # iterate through the excel files
-    # reading the "output_tbl" sheet into a dataframe
-    # and appending the dataframe to the list of dataframes
-    for file in files_in_folder:
-        # get the file name
-        file_name = file.properties['Name']
-
-        # get the file url
-        
-        
-        # read the "output_tbl" sheet in the excel file
-        temp_df = pd.read_excel(
-            # the file url
-            file.properties['ServerRelativeUrl'],
-            
-            # the sheet name
-            sheet_name='output_tbl',
-            
-            # the engine to use to read the excel file
-            # if the file is an ".xlsb" file, then use the "pyxlsb" engine
-            # otherwise, use the "openpyxl" engine
-            engine='pyxlsb' if file.properties['Name'].endswith('.xlsb') else "openpyxl"
-        )
-        
-        # append the dataframe to the list of dataframes
-        dataframes.append(temp_df)
-        
-    
\ No newline at end of file
+    # the refresh loads pandas, and the Excel engine when a sheet is read
+    from .folder_to_parquet import get_dataframes_from_sharepoint
+
+    # a folder of this call's own, so that two dashboards refreshing at
+    # the same time do not download over each other's files
+    if work_dir is None:
+        with tempfile.TemporaryDirectory(prefix='dashboard_refresh_') as temporary_dir:
+            return get_dataframes_from_sharepoint(client_context, files, work_dir=temporary_dir)
+    return get_dataframes_from_sharepoint(client_context, files, work_dir=work_dir)
+
+
+def is_snapshot_fresh(
+    snapshot_path: str = SNAPSHOT_PATH,
+    max_age_hours: float = SNAPSHOT_MAX_AGE_HOURS
+) -> bool:
+    """
+    # Description:
+    This function checks whether the local snapshot exists and is younger
+    than `max_age_hours`.
+
+    # Parameters:
+        snapshot_path: str
+            this is the path of the parquet snapshot
+            defaults to './data.parquet'
+        max_age_hours: float
+            this is the age, in hours, after which the snapshot is stale
+            defaults to 24
+
+    # Returns:
+        bool
+            True if the snapshot can be used as is
+    """
+    try:
+        modified = os.path.getmtime(snapshot_path)
+    except OSError:
+        return False
+    return time.time() - modified < max_age_hours * 3600
+
+
+# function that returns the data the dashboard shows:
+# the local snapshot if it is fresh, otherwise the "output_tbl" sheets
+# read from sharepoint, saved as the new snapshot
+def get_dashboard_data(
+    snapshot_path: str = SNAPSHOT_PATH,
+    max_age_hours: float = SNAPSHOT_MAX_AGE_HOURS,
+    site_url: str = 'https://cinfin.sharepoint.com/sites/PandCReserving',
+    folder: str = 'CIG Link Ratio Files',
+    user_email: str = None,
+    password: str = None,
+    storage: StorageBackend = None
+) -> pd.DataFrame:
+    """
+    # Description:
+    This function returns the combined "output_tbl" data for the dashboard.
+    While the local snapshot is fresh it is read as is, without loading
+    office365 or the Excel engines. Otherwise the sheets are read from the
+    sharepoint folder, or from the folder of another storage backend,
+    combined, and written as the new snapshot.
+
+    # Parameters:
+        snapshot_path: str
+            this is the path of the parquet snapshot
+            defaults to './data.parquet'
+        max_age_hours: float
+            this is the age, in hours, after which the snapshot is rebuilt
+            defaults to 24
+        site_url: str
+            this is the url of the sharepoint site
+            defaults to 'https://cinfin.sharepoint.com/sites/PandCReserving'
+        folder: str
+            this is the sharepoint folder of the excel files
+            defaults to 'CIG Link Ratio Files'
+        user_email: *str*
+            this is the email of the user
+            defaults to None for the Windows credentials
+        password: *str*
+            this is the password of the user
+            defaults to None for the Windows credentials
+        storage: StorageBackend
+            this is the storage backend to read `folder` from (see the
+            `storage` module); it is not closed
+            defaults to None for the sharepoint site `site_url`, whose
+            connection is closed once the sheets are read
+
+    # Returns:
+        pd.DataFrame
+            this is the combined "output_tbl" data
+    """
+    import pandas as pd
+
+    # the snapshot is fresh: pandas and pyarrow only
+    if is_snapshot_fresh(snapshot_path, max_age_hours):
+        with stage('snapshot_read', file=snapshot_path) as span:
+            df = pd.read_parquet(snapshot_path)
+            span.add(bytes=os.path.getsize(snapshot_path), rows=len(df))
+        return df
+
+    from .dataset_query import ROW_GROUP_SIZE, sort_for_pushdown
+    from .folder_to_parquet import get_dataframes_from_storage
+    from .output_tbl_schema import concat_output_tbls
+    from .storage import SharePointBackend
+
+    # connect to the sharepoint site, unless given another backend
+    # (only the connection made here is closed here)
+    opened_storage = storage is None
+    if opened_storage:
+        storage = SharePointBackend(get_sharepoint_connection(site_url, user_email, password))
+
+    # read the sheets, downloading into a folder of this refresh's own
+    try:
+        with stage('storage.list'):
+            folder_files = storage.list(folder)
+        with tempfile.TemporaryDirectory(prefix='dashboard_refresh_') as work_dir:
+            dataframes = get_dataframes_from_storage(folder_files, work_dir=work_dir)
+    finally:
+        if opened_storage:
+            storage.close()
+
+    # combine them, and save the new snapshot
+    with stage('write', file=snapshot_path) as span:
+        df = sort_for_pushdown(concat_output_tbls(dataframes))
+        df.to_parquet(snapshot_path, row_group_size=ROW_GROUP_SIZE)
+        span.add(bytes=os.path.getsize(snapshot_path), rows=len(df))
+
+    # return the combined data
+    return df
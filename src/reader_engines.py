@@ -0,0 +1,534 @@
+"""
+# Description:
+Registry of the excel reader engines used to extract the "output_tbl" sheet.
+
+Every engine has the same interface: given a file name and a sheet name, it
+yields the rows of the sheet as sequences of cell values, which
+`output_tbl_reader.rows_to_dataframe` turns into the projected dataframe.
+
+Registered engines:
+    openpyxl_full: openpyxl, whole workbook loaded into memory
+    openpyxl_read_only: openpyxl, sheet parsed as it is iterated
+    pyxlsb: pyxlsb, ".xlsb" files only
+    calamine: python-calamine (Rust), only if it is installed
+
+Which engine is fastest depends on the file format and on the size of the
+workbook, so `calibrate_engines` benchmarks the available engines on sample
+workbooks, reading them the way the refresh does (with the projection of
+their file type), and records the fastest one per extension and size
+bucket. `select_engine` then picks the engine for each file from that
+record, falling back to `DEFAULT_ENGINES` when there is no calibration.
+The engines read the cells into the same types (see
+`output_tbl_reader.rows_to_dataframe`), so workbooks of different size
+buckets give frames with the same dtypes whichever engine was picked.
+
+# Calibration command:
+    python -m src.reader_engines "sample 2023Q4.xlsb" "other 4Q2023.xlsx" ...
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import time
+
+# where the calibration is recorded
+# can be moved with the RESERVING_DASHBOARD_ENGINE_CALIBRATION environment variable
+DEFAULT_CALIBRATION_PATH = os.path.join(
+    os.path.expanduser('~'), '.reserving_dashboard_update', 'engine_calibration.json')
+
+# upper bounds, in bytes, of the file size buckets, smallest first
+# files larger than the last bound are in the 'large' bucket
+SIZE_BUCKETS = [
+    ('small', 1_000_000),
+    ('medium', 20_000_000),
+]
+
+# engine used for each extension, in order of preference,
+# when there is no calibration for the extension and size bucket
+DEFAULT_ENGINES = {
+    '.xlsb': ['calamine', 'pyxlsb'],
+    '.xlsx': ['calamine', 'openpyxl_read_only', 'openpyxl_full'],
+    '.xlsm': ['calamine', 'openpyxl_read_only', 'openpyxl_full'],
+}
+
+
+def _iter_openpyxl_full_rows(
+    file_name: str,
+    sheet_name: str
+):
+    """
+    # Description:
+    Yields the rows of a sheet after loading the whole workbook with openpyxl.
+    """
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(file_name, data_only=True)
+    try:
+        for row in workbook[sheet_name].iter_rows(values_only=True):
+            yield row
+    finally:
+        workbook.close()
+
+
+def _iter_openpyxl_read_only_rows(
+    file_name: str,
+    sheet_name: str
+):
+    """
+    # Description:
+    Yields the rows of a sheet using openpyxl in read-only mode,
+    so the sheet is parsed as it is iterated.
+    """
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(
+        file_name, read_only=True, data_only=True)
+    try:
+        for row in workbook[sheet_name].iter_rows(values_only=True):
+            yield row
+    finally:
+        # read-only workbooks keep the file open until closed
+        workbook.close()
+
+
+def _iter_pyxlsb_rows(
+    file_name: str,
+    sheet_name: str
+):
+    """
+    # Description:
+    Yields the rows of a sheet of an ".xlsb" workbook as lists of values.
+    In sparse mode pyxlsb skips the rows that have no cells instead of
+    building them, so the gaps are yielded as empty rows to keep the row
+    positions right.
+    """
+    from pyxlsb import open_workbook
+
+    with open_workbook(file_name) as workbook:
+        with workbook.get_sheet(sheet_name) as sheet:
+            next_row = 0
+            for row in sheet.rows(sparse=True):
+                # rows that pyxlsb skipped are blank
+                row_index = row[0].r if len(row) > 0 else next_row
+                while next_row < row_index:
+                    yield []
+                    next_row += 1
+
+                yield [cell.v for cell in row]
+                next_row += 1
+
+
+def _iter_calamine_rows(
+    file_name: str,
+    sheet_name: str
+):
+    """
+    # Description:
+    Yields the rows of a sheet using python-calamine.
+    calamine starts the rows at the first used cell, so the rows and columns
+    above and left of it are added back as blanks to keep the positions right.
+    """
+    from python_calamine import CalamineWorkbook
+
+    workbook = CalamineWorkbook.from_path(file_name)
+    try:
+        sheet = workbook.get_sheet_by_name(sheet_name)
+        first_row, first_column = sheet.start or (0, 0)
+        for _ in range(first_row):
+            yield []
+        for row in sheet.iter_rows():
+            yield [None] * first_column + list(row)
+    finally:
+        workbook.close()
+
+
+# the registered engines
+# extensions: the file extensions the engine can read
+# module: the module that must be installed for the engine to be available
+# iter_rows: the function yielding the rows of a sheet
+ENGINES = {
+    'openpyxl_full': {
+        'extensions': ('.xlsx', '.xlsm'),
+        'module': 'openpyxl',
+        'iter_rows': _iter_openpyxl_full_rows,
+    },
+    'openpyxl_read_only': {
+        'extensions': ('.xlsx', '.xlsm'),
+        'module': 'openpyxl',
+        'iter_rows': _iter_openpyxl_read_only_rows,
+    },
+    'pyxlsb': {
+        'extensions': ('.xlsb',),
+        'module': 'pyxlsb',
+        'iter_rows': _iter_pyxlsb_rows,
+    },
+    'calamine': {
+        'extensions': ('.xlsx', '.xlsm', '.xlsb'),
+        'module': 'python_calamine',
+        'iter_rows': _iter_calamine_rows,
+    },
+}
+
+# the calibration loaded from disk, with the path and mtime it was loaded from
+_calibration_cache = {'path': None, 'mtime': None, 'calibration': {}}
+
+
+def register_engine(
+    name: str,
+    iter_rows,
+    extensions: tuple,
+    module: str = None
+) -> None:
+    """
+    # Description:
+    This function adds an engine to the registry, or replaces one.
+
+    # Parameters:
+        name: str
+            this is the name of the engine
+        iter_rows: callable
+            this takes (file_name, sheet_name) and yields the rows of the
+            sheet as sequences of cell values
+        extensions: tuple
+            this is the tuple of file extensions the engine can read
+        module: str
+            this is the module that must be installed for the engine to be available
+            defaults to None for always available
+
+    # Returns:
+        None
+    """
+    ENGINES[name] = {
+        'extensions': tuple(extensions),
+        'module': module,
+        'iter_rows': iter_rows,
+    }
+
+
+def is_engine_available(
+    name: str
+) -> bool:
+    """
+    # Description:
+    This function checks that an engine is registered and that its module
+    is installed, without importing the module.
+
+    # Parameters:
+        name: str
+            this is the name of the engine
+
+    # Returns:
+        bool
+            True if the engine can be used
+    """
+    if name not in ENGINES:
+        return False
+    module = ENGINES[name]['module']
+    return module is None or importlib.util.find_spec(module) is not None
+
+
+def get_available_engines(
+    extension: str
+) -> list:
+    """
+    # Description:
+    This function returns the names of the available engines that can read
+    files with an extension.
+
+    # Parameters:
+        extension: str
+            this is the file extension, for example '.xlsb'
+
+    # Returns:
+        list
+            this is the list of engine names
+    """
+    extension = extension.lower()
+    return [name for name, engine in ENGINES.items()
+            if extension in engine['extensions'] and is_engine_available(name)]
+
+
+def get_size_bucket(
+    size: int
+) -> str:
+    """
+    # Description:
+    This function returns the size bucket of a file size.
+
+    # Parameters:
+        size: int
+            this is the file size in bytes
+
+    # Returns:
+        str
+            this is 'small', 'medium' or 'large'
+    """
+    for bucket, upper_bound in SIZE_BUCKETS:
+        if size <= upper_bound:
+            return bucket
+    return 'large'
+
+
+def get_calibration_path() -> str:
+    """
+    # Description:
+    This function returns the path of the calibration file.
+
+    # Returns:
+        str
+            this is the path of the calibration file
+    """
+    return os.environ.get(
+        'RESERVING_DASHBOARD_ENGINE_CALIBRATION', DEFAULT_CALIBRATION_PATH)
+
+
+def load_calibration(
+    path: str = None
+) -> dict:
+    """
+    # Description:
+    This function loads the calibration file. The file is only read again
+    when its modification time changes.
+
+    # Parameters:
+        path: str
+            this is the path of the calibration file
+            defaults to None for `get_calibration_path()`
+
+    # Returns:
+        dict
+            this maps extension to size bucket to the calibration result,
+            empty if there is no calibration file
+    """
+    path = path or get_calibration_path()
+
+    # no calibration yet
+    if not os.path.exists(path):
+        return {}
+
+    # reuse the calibration if the file did not change
+    mtime = os.path.getmtime(path)
+    if _calibration_cache['path'] == path and _calibration_cache['mtime'] == mtime:
+        return _calibration_cache['calibration']
+
+    with open(path, 'r', encoding='utf-8') as file:
+        calibration = json.load(file)
+
+    _calibration_cache.update(path=path, mtime=mtime, calibration=calibration)
+    return calibration
+
+
+def select_engine(
+    file_name: str,
+    size: int = None,
+    calibration: dict = None
+) -> str:
+    """
+    # Description:
+    This function picks the engine to read a file with: the calibrated
+    fastest engine for its extension and size bucket if it is available,
+    otherwise the first available engine of `DEFAULT_ENGINES`.
+
+    # Parameters:
+        file_name: str
+            this is the file name
+        size: int
+            this is the file size in bytes
+            defaults to None for the size of the file on disk
+        calibration: dict
+            this is the calibration to use
+            defaults to None for `load_calibration()`
+
+    # Returns:
+        str
+            this is the name of the engine
+    """
+    extension = os.path.splitext(file_name)[1].lower()
+    if calibration is None:
+        calibration = load_calibration()
+
+    # the calibrated engine
+    if size is None and os.path.exists(file_name):
+        size = os.path.getsize(file_name)
+    if size is not None:
+        result = calibration.get(extension, {}).get(get_size_bucket(size))
+        if result is not None and is_engine_available(result['engine']):
+            return result['engine']
+
+    # the first available default engine
+    for name in DEFAULT_ENGINES.get(extension, []):
+        if is_engine_available(name):
+            return name
+
+    # any engine that can read the extension
+    available = get_available_engines(extension)
+    if len(available) == 0:
+        raise ValueError(f'no reader engine available for {extension} files')
+    return available[0]
+
+
+def iter_rows(
+    file_name: str,
+    sheet_name: str = 'output_tbl',
+    engine: str = None
+):
+    """
+    # Description:
+    This function yields the rows of a sheet with an engine.
+
+    # Parameters:
+        file_name: str
+            this is the file name
+        sheet_name: str
+            this is the sheet to read
+            defaults to 'output_tbl'
+        engine: str
+            this is the name of the engine
+            defaults to None for `select_engine(file_name)`
+
+    # Returns:
+        iterator
+            this yields one sequence of values per row
+    """
+    if engine is None:
+        engine = select_engine(file_name)
+    if not is_engine_available(engine):
+        raise ValueError(f'reader engine {engine} is not available')
+    return ENGINES[engine]['iter_rows'](file_name, sheet_name)
+
+
+def calibrate_engines(
+    sample_files: list,
+    sheet_name: str = 'output_tbl',
+    repeats: int = 3,
+    path: str = None,
+    projection: dict = None
+) -> dict:
+    """
+    # Description:
+    This function benchmarks every available engine on sample workbooks,
+    reading the output_tbl the way the refresh does (projected columns,
+    stopping at the end of the table) `repeats` times per engine and file,
+    and records the engine with the lowest median time per extension and
+    size bucket. An engine that fails on a sample is not picked for its
+    bucket, and the error is recorded under `failed`.
+    The result is merged into the calibration file, so calibrating with
+    ".xlsb" samples keeps the ".xlsx" calibration.
+
+    # Parameters:
+        sample_files: list
+            this is the list of sample workbook file names
+        sheet_name: str
+            this is the sheet to read
+            defaults to 'output_tbl'
+        repeats: int
+            this is the number of timed reads per engine and file
+            defaults to 3
+        path: str
+            this is the path of the calibration file
+            defaults to None for `get_calibration_path()`
+        projection: dict
+            this is the projection (`columns`, `header_row`, `stop_at_blank_row`)
+            defaults to None for the projection configured for the file type
+            of each sample, as in `folder_to_parquet.get_dataframe_from_file`
+
+    # Returns:
+        dict
+            this is the updated calibration
+    """
+    # the reader is built on this module, so it is imported here
+    from .output_tbl_reader import get_projection, read_output_tbl
+    from .searching_inputs import get_file_type
+
+    path = path or get_calibration_path()
+
+    # time every engine on every sample, grouped by extension and size bucket
+    # timings[(extension, bucket)][engine] is the list of median seconds per file
+    # failures[(extension, bucket)][engine] is the error of the engine
+    timings = {}
+    failures = {}
+    for file_name in sample_files:
+        extension = os.path.splitext(file_name)[1].lower()
+        bucket = get_size_bucket(os.path.getsize(file_name))
+        file_projection = projection or get_projection(get_file_type(file_name))
+
+        for engine in get_available_engines(extension):
+            seconds = []
+            try:
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    read_output_tbl(file_name, file_projection, sheet_name, engine)
+                    seconds.append(time.perf_counter() - start)
+            except Exception as error:
+                failures.setdefault((extension, bucket), {})[engine] = repr(error)
+                continue
+
+            timings.setdefault((extension, bucket), {}).setdefault(
+                engine, []).append(statistics.median(seconds))
+
+    # keep the fastest engine per extension and size bucket
+    # among the engines that read every sample of the bucket
+    # (a copy: the loaded calibration is cached)
+    calibration = {extension: dict(buckets)
+                   for extension, buckets in load_calibration(path).items()}
+    for key in set(timings) | set(failures):
+        extension, bucket = key
+        failed = failures.get(key, {})
+        total_seconds = {engine: sum(seconds)
+                         for engine, seconds in timings.get(key, {}).items()
+                         if engine not in failed}
+
+        # no engine can read the samples of the bucket: keep the defaults
+        if len(total_seconds) == 0:
+            calibration.get(extension, {}).pop(bucket, None)
+            continue
+
+        fastest = min(total_seconds, key=total_seconds.get)
+        calibration.setdefault(extension, {})[bucket] = {
+            'engine': fastest,
+            'seconds': total_seconds,
+            'files': len(timings[key][fastest]),
+            'failed': failed,
+        }
+
+    # write the calibration
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(calibration, file, indent=2, sort_keys=True)
+
+    return calibration
+
+
+def main(
+    args: list = None
+) -> None:
+    """
+    # Description:
+    Calibration command: benchmarks the engines on the sample workbooks
+    given on the command line and prints the fastest engine per extension
+    and size bucket.
+    """
+    parser = argparse.ArgumentParser(
+        description='benchmark the output_tbl reader engines on sample workbooks')
+    parser.add_argument('sample_files', nargs='+',
+                        help='sample workbooks to benchmark on')
+    parser.add_argument('--sheet-name', default='output_tbl')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--path', default=None,
+                        help='calibration file to update')
+    parsed = parser.parse_args(args)
+
+    calibration = calibrate_engines(
+        parsed.sample_files, parsed.sheet_name, parsed.repeats, parsed.path)
+
+    for extension, buckets in sorted(calibration.items()):
+        for bucket, result in sorted(buckets.items()):
+            print(f"{extension} {bucket}: {result['engine']}")
+            for engine, error in sorted(result.get('failed', {}).items()):
+                print(f"    {engine} failed: {error}")
+
+
+if __name__ == '__main__':
+    main()
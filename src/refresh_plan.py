@@ -0,0 +1,397 @@
+"""
+# Description:
+Dry run of a refresh: what `folder_to_parquet` would do, and how long it
+would take, without downloading or parsing anything.
+
+Every workbook of the sharepoint folder is compared with the run journal:
+    new: no parse output is recorded for the file
+    changed: the recorded parse output was produced from another version
+        of the file (different fingerprint)
+    unchanged: the recorded parse output is from the current version
+    skipped: the file is not an excel file, is "(not analyzed)", or is
+        quarantined
+
+or, for a refresh of the versioned dataset (`refresh --versioned`), with the
+manifest of its latest version: the file is unchanged when its current
+version is live in the dataset, and that refresh does not read it at all.
+
+and given the action the refresh would take in the chosen mode: download
+and parse it, parse a download the interrupted run already made (resume),
+reuse the recorded parse output (resume, incremental), or skip it.
+
+The parse and download times are estimated from the traces of the earlier
+runs (see the `instrumentation` module): the time of the same file scaled
+to its current size when it was parsed before, otherwise the seconds per
+byte of the files with the same extension, otherwise of all the files.
+The files the storage backend reads in place (a local folder, an up to
+date mirror) are not downloaded, and take no download time.
+
+# Example:
+    plan = plan_refresh(get_file_infos(sharepoint_folder), journal,
+                        incremental=True, rates=get_rates(read_trace(paths)))
+    print(format_plan(plan, summarize_plan(plan, max_workers=4)))
+
+    # the versioned dataset
+    plan = plan_refresh(get_file_infos(sharepoint_folder), journal,
+                        manifest=read_manifest(storage, dataset_folder), versioned=True)
+"""
+
+import glob
+import os
+import sqlite3
+
+from .folder_to_parquet import EXCEL_EXTENSIONS, TRACE_DIR_NAME, get_file_fingerprint
+from .run_journal import DEFAULT_WORK_DIR, get_completed_stage, get_resumable_run, is_quarantined
+from .versioned_dataset import get_live_sources
+
+# the actions, in the order they are listed
+ACTIONS = ['download+parse', 'parse', 'reuse', 'skip']
+
+# the statuses, in the order they are listed
+STATUSES = ['new', 'changed', 'unchanged', 'skipped']
+
+
+def get_file_infos(
+    folder_files: list
+) -> list:
+    """
+    # Description:
+    This function lists the files of a folder with the properties the plan needs.
+
+    # Parameters:
+        folder_files: list
+            this is the `StorageFile`s of the folder (`storage.list(folder)`)
+
+    # Returns:
+        list
+            this is the list of dicts (name, size, modified, fingerprint, and
+            download: whether reading the file downloads it)
+    """
+    return [{
+        'name': file.name,
+        'size': file.size,
+        'modified': file.modified,
+        'fingerprint': get_file_fingerprint(file),
+        'download': file.backend.needs_download(file),
+    } for file in folder_files]
+
+
+def find_trace_paths(
+    work_dir: str = DEFAULT_WORK_DIR,
+    history: int = 5
+) -> list:
+    """
+    # Description:
+    This function finds the traces of the latest refresh runs.
+
+    # Parameters:
+        work_dir: str
+            this is the work folder of the refresh runs
+            defaults to './refresh_work'
+        history: int
+            this is the number of latest runs to use
+            defaults to 5
+
+    # Returns:
+        list
+            this is the list of trace paths, oldest first
+    """
+    paths = sorted(glob.glob(os.path.join(work_dir, TRACE_DIR_NAME, '*.jsonl')),
+                   key=os.path.getmtime)
+    return paths[-history:] if history > 0 else []
+
+
+def get_rates(
+    events: list
+) -> dict:
+    """
+    # Description:
+    This function derives the parse and download rates from the events of
+    earlier runs.
+
+    # Parameters:
+        events: list
+            this is the list of event dicts, oldest first
+
+    # Returns:
+        dict
+            this is the dict with
+            `files`: the latest (seconds, bytes) of the parse of each file,
+            `parse_seconds_per_byte`: the rate per extension, and under
+            None for all the files,
+            `download_bytes_per_second`: the download rate (the downloads
+            and the copies to a mirror), None if unknown
+    """
+    files = {}
+    parse_totals = {}
+    download_seconds = 0.0
+    download_bytes = 0
+
+    for event in events:
+        if event.get('type') != 'stage' or not event.get('ok') or not event.get('bytes'):
+            continue
+
+        if event['stage'] == 'parse':
+            name = os.path.basename(str(event.get('file', '')))
+            files[name] = (event['seconds'], event['bytes'])
+            extension = os.path.splitext(name)[1].lower()
+            for key in (extension, None):
+                seconds, size = parse_totals.get(key, (0.0, 0))
+                parse_totals[key] = (seconds + event['seconds'], size + event['bytes'])
+
+        elif event['stage'] in ('download', 'mirror.copy'):
+            download_seconds += event['seconds']
+            download_bytes += event['bytes']
+
+    return {
+        'files': files,
+        'parse_seconds_per_byte': {key: seconds / size
+                                   for key, (seconds, size) in parse_totals.items()},
+        'download_bytes_per_second': (download_bytes / download_seconds
+                                      if download_seconds > 0 else None),
+    }
+
+
+def estimate_parse_seconds(
+    name: str,
+    size: int,
+    rates: dict
+) -> float:
+    """
+    # Description:
+    This function estimates the parse time of a file from the rates of `get_rates`.
+
+    # Returns:
+        float
+            this is the estimated seconds, or None without any earlier parse
+    """
+    # the same file, scaled to its current size
+    if name in rates['files']:
+        seconds, size_then = rates['files'][name]
+        return seconds * size / size_then
+
+    # the files with the same extension, otherwise all the files
+    parse_seconds_per_byte = rates['parse_seconds_per_byte']
+    extension = os.path.splitext(name)[1].lower()
+    rate = parse_seconds_per_byte.get(extension, parse_seconds_per_byte.get(None))
+    return None if rate is None else rate * size
+
+
+def plan_refresh(
+    file_infos: list,
+    journal: sqlite3.Connection = None,
+    incremental: bool = False,
+    resume: bool = False,
+    rates: dict = None,
+    manifest: dict = None,
+    versioned: bool = False
+) -> list:
+    """
+    # Description:
+    This function works out what a refresh would do with each file, in the
+    same way as `folder_to_parquet.get_dataframes_from_storage`.
+
+    # Parameters:
+        file_infos: list
+            this is the list of dicts returned by `get_file_infos`
+        journal: sqlite3.Connection
+            this is the connection to the run journal
+            defaults to None: every file is new
+        incremental: bool
+            if True, plan an incremental refresh
+            defaults to False
+        resume: bool
+            if True, plan the continuation of the latest run that did not complete
+            defaults to False
+        rates: dict
+            this is the rates returned by `get_rates`
+            defaults to None for no time estimates
+        manifest: dict
+            this is the manifest of the latest version of the versioned
+            dataset (`versioned_dataset.read_manifest`), None for a new dataset
+            defaults to None
+        versioned: bool
+            if True, plan a refresh of the versioned dataset: the status of
+            a file comes from `manifest`, and the unchanged files are skipped
+            defaults to False
+
+    # Returns:
+        list
+            this is the list of dicts, one per file: the file info, plus
+            `status`, `reason`, `action`, `download_bytes`,
+            `download_seconds` and `parse_seconds` (None when unknown)
+    """
+    rates = rates or get_rates([])
+    download_bytes_per_second = rates['download_bytes_per_second']
+    resume_run_id = get_resumable_run(journal) if journal is not None and resume else None
+    live_sources = get_live_sources(manifest) if versioned else None
+
+    plan = []
+    for info in file_infos:
+        name = info['name']
+        item = dict(info, status=None, reason=None, action='skip',
+                    download_bytes=0, download_seconds=0.0, parse_seconds=0.0)
+        plan.append(item)
+
+        # the files the refresh does not read
+        if not name.lower().endswith(EXCEL_EXTENSIONS):
+            item.update(status='skipped', reason='not an excel file')
+            continue
+        if "(not analyzed)" in name:
+            item.update(status='skipped', reason='not analyzed')
+            continue
+        if journal is not None and is_quarantined(journal, name, info['fingerprint']):
+            item.update(status='skipped', reason='quarantined')
+            continue
+
+        # new, changed or unchanged since the version of the dataset
+        # (`versioned_dataset.get_unchanged_files`): the unchanged files are not read
+        if versioned:
+            live = live_sources.get(name)
+            if live is None:
+                item['status'] = 'new'
+            elif live[1]['fingerprint'] != info['fingerprint']:
+                item['status'] = 'changed'
+            else:
+                item.update(status='unchanged', reason='in the dataset')
+                continue
+
+        # new, changed or unchanged since the last parse
+        else:
+            parsed = None if journal is None else get_completed_stage(journal, name, 'parse')
+            if parsed is None:
+                item['status'] = 'new'
+            elif parsed['fingerprint'] != info['fingerprint']:
+                item['status'] = 'changed'
+            else:
+                item['status'] = 'unchanged'
+
+        # what the refresh does with it
+        action = 'download+parse'
+        if resume_run_id is not None:
+            if get_completed_stage(journal, name, 'parse', info['fingerprint'],
+                                   resume_run_id) is not None:
+                action = 'reuse'
+            elif get_completed_stage(journal, name, 'download', info['fingerprint'],
+                                     resume_run_id) is not None:
+                action = 'parse'
+        if incremental and journal is not None and get_completed_stage(
+                journal, name, 'parse', info['fingerprint']) is not None:
+            action = 'reuse'
+        item['action'] = action
+
+        # what it costs: the files read in place are not downloaded
+        if action == 'download+parse' and info.get('download', True):
+            item['download_bytes'] = info['size']
+            item['download_seconds'] = (info['size'] / download_bytes_per_second
+                                        if download_bytes_per_second else None)
+        if action in ('download+parse', 'parse'):
+            item['parse_seconds'] = estimate_parse_seconds(name, info['size'], rates)
+
+    return plan
+
+
+def summarize_plan(
+    plan: list,
+    max_workers: int = 1
+) -> dict:
+    """
+    # Description:
+    This function totals a plan.
+
+    # Parameters:
+        plan: list
+            this is the list returned by `plan_refresh`
+        max_workers: int
+            this is the number of files the refresh reads at a time
+            defaults to 1
+
+    # Returns:
+        dict
+            this is the dict with the number of files per status and per
+            action, the bytes to download, the estimated download and parse
+            seconds, the number of files without an estimate, and the
+            estimated wall time with `max_workers` workers
+    """
+    summary = {
+        'files': len(plan),
+        'status': {status: 0 for status in STATUSES},
+        'action': {action: 0 for action in ACTIONS},
+        'download_bytes': 0,
+        'download_seconds': 0.0,
+        'parse_seconds': 0.0,
+        'files_without_estimate': 0,
+    }
+    for item in plan:
+        summary['status'][item['status']] += 1
+        summary['action'][item['action']] += 1
+        summary['download_bytes'] += item['download_bytes']
+        if item['download_seconds'] is None or item['parse_seconds'] is None:
+            summary['files_without_estimate'] += 1
+        summary['download_seconds'] += item['download_seconds'] or 0.0
+        summary['parse_seconds'] += item['parse_seconds'] or 0.0
+
+    # the files are spread over the workers
+    summary['max_workers'] = max_workers
+    summary['estimated_wall_seconds'] = (
+        summary['download_seconds'] + summary['parse_seconds']) / max(1, max_workers)
+    return summary
+
+
+def format_plan(
+    plan: list,
+    summary: dict,
+    show_files: bool = True
+) -> str:
+    """
+    # Description:
+    This function formats a plan and its totals as text.
+
+    # Parameters:
+        plan: list
+            this is the list returned by `plan_refresh`
+        summary: dict
+            this is the dict returned by `summarize_plan`
+        show_files: bool
+            if True, list every file before the totals
+            defaults to True
+
+    # Returns:
+        str
+            this is the text
+    """
+    def format_seconds(seconds):
+        return '?' if seconds is None else f'{seconds:,.1f}'
+
+    lines = []
+    if show_files:
+        columns = ['action', 'status', 'size_mb', 'parse_s', 'file']
+        rows = [[item['action'], item['reason'] or item['status'],
+                 f"{item['size'] / 1e6:,.2f}",
+                 (format_seconds(item['parse_seconds'])
+                  if item['action'] in ('download+parse', 'parse') else '-'),
+                 item['name']]
+                for item in sorted(plan, key=lambda item: (ACTIONS.index(item['action']),
+                                                           item['name']))]
+        widths = [max([len(column)] + [len(row[i]) for row in rows])
+                  for i, column in enumerate(columns)]
+        lines.append('  '.join(column.ljust(width) for column, width in zip(columns, widths)))
+        for row in rows:
+            lines.append('  '.join(
+                value.rjust(width) if i in (2, 3) else value.ljust(width)
+                for i, (value, width) in enumerate(zip(row, widths))))
+        lines.append('')
+
+    lines.append(f"files: {summary['files']:,}  " + '  '.join(
+        f'{status}: {number:,}' for status, number in summary['status'].items()))
+    lines.append('actions: ' + '  '.join(
+        f'{action}: {number:,}' for action, number in summary['action'].items()))
+    lines.append(f"to download: {summary['download_bytes'] / 1e6:,.1f} MB "
+                 f"(~{summary['download_seconds']:,.0f} s)")
+    lines.append(f"estimated parse time: ~{summary['parse_seconds']:,.0f} s")
+    lines.append(f"estimated wall time with {summary['max_workers']} worker(s): "
+                 f"~{summary['estimated_wall_seconds'] / 60:,.1f} min")
+    if summary['files_without_estimate'] > 0:
+        lines.append(f"{summary['files_without_estimate']:,} file(s) have no estimate: "
+                     "no earlier run metrics (run a refresh with a trace first)")
+    return '\n'.join(lines)
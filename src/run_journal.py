@@ -0,0 +1,623 @@
+"""
+# Description:
+Run journal for the refresh runs of `folder_to_parquet`.
+
+The journal is a small SQLite database that records, for every file of a run,
+which stages (download, parse) completed and where their intermediate output
+lives, plus the files that keep failing. With it a refresh that died on file
+300 of 400 (network blip, locked workbook, failed upload) can be resumed:
+`folder_to_parquet(resume=True)` reuses the outputs the interrupted run
+already produced and only processes the rest.
+
+A file whose contents changed since a stage completed is processed again,
+because every stage record carries the fingerprint (ETag, or size and
+modification time) of the file it was produced from.
+
+Files that fail `max_failures` times in a row are quarantined: they are
+skipped by later runs, instead of blocking them, until they are released
+with `release_from_quarantine` (the `quarantine release` command), or until
+they change. The failures and the quarantine are recorded with the
+fingerprint of the version of the file that failed, so a workbook that is
+fixed and uploaded again is released by the next run (see
+`release_if_changed`) and starts over with no failures.
+
+# Tables:
+    runs: one row per run (run_id, status, started_at, finished_at)
+    stages: one row per file and stage, the latest record wins
+    failures: consecutive failure count per file, and its fingerprint
+    quarantine: the quarantined files, and the fingerprint they failed with
+    watch_state: the position of each watched source in its change feed
+        (see the `watch` module)
+"""
+
+import os
+import sqlite3
+import time
+import uuid
+
+# default location of the journal and of the intermediate outputs
+DEFAULT_JOURNAL_PATH = os.path.join('.', 'refresh_journal.sqlite')
+DEFAULT_WORK_DIR = os.path.join('.', 'refresh_work')
+
+# number of consecutive failures after which a file is quarantined
+DEFAULT_MAX_FAILURES = 3
+
+# file key used for the stages that apply to the whole run (the upload)
+RUN_FILE_KEY = '__run__'
+
+_SCHEMA = """
+create table if not exists runs (
+    run_id text primary key,
+    status text not null,
+    started_at real not null,
+    finished_at real
+);
+create table if not exists stages (
+    file_key text not null,
+    stage text not null,
+    run_id text not null,
+    status text not null,
+    fingerprint text,
+    output_path text,
+    error text,
+    updated_at real not null,
+    primary key (file_key, stage)
+);
+create table if not exists failures (
+    file_key text primary key,
+    failures integer not null,
+    last_error text,
+    updated_at real not null,
+    fingerprint text
+);
+create table if not exists quarantine (
+    file_key text primary key,
+    failures integer not null,
+    last_error text,
+    quarantined_at real not null,
+    fingerprint text
+);
+create table if not exists watch_state (
+    source text primary key,
+    state text not null,
+    updated_at real not null
+);
+"""
+
+# the columns added to the tables of journals created by earlier versions
+_ADDED_COLUMNS = {
+    'failures': ['fingerprint text'],
+    'quarantine': ['fingerprint text'],
+}
+
+
+def open_journal(
+    path: str = DEFAULT_JOURNAL_PATH
+) -> sqlite3.Connection:
+    """
+    # Description:
+    This function opens the journal, creating it if needed.
+
+    # Parameters:
+        path: str
+            this is the path of the SQLite journal file
+            defaults to './refresh_journal.sqlite'
+
+    # Returns:
+        sqlite3.Connection
+            this is the connection to the journal
+    """
+    # make sure the folder exists
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+
+    # autocommit, so every record is on disk before the next file is processed
+    # the connection is shared by the download threads of the scheduler
+    connection = sqlite3.connect(
+        path, isolation_level=None, timeout=30, check_same_thread=False)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(_SCHEMA)
+
+    # bring a journal of an earlier version up to date
+    # (its failures and quarantine have no fingerprint, and match any version)
+    for table, columns in _ADDED_COLUMNS.items():
+        existing = {row['name'] for row in connection.execute(f'pragma table_info({table})')}
+        for column in columns:
+            if column.split()[0] not in existing:
+                connection.execute(f'alter table {table} add column {column}')
+    return connection
+
+
+def start_run(
+    journal: sqlite3.Connection,
+    resume: bool = False
+) -> str:
+    """
+    # Description:
+    This function starts a run. When resuming, the latest run that did not
+    complete is continued under its own run id, otherwise a new run is started.
+
+    # Parameters:
+        journal: sqlite3.Connection
+            this is the connection to the journal
+        resume: bool
+            if True, continue the latest run that did not complete
+            defaults to False
+
+    # Returns:
+        str
+            this is the run id
+    """
+    # the latest unfinished run
+    if resume:
+        run_id = get_resumable_run(journal)
+        if run_id is not None:
+            journal.execute(
+                "update runs set status = 'running', finished_at = null "
+                "where run_id = ?", (run_id,))
+            return run_id
+
+    # a new run
+    run_id = uuid.uuid4().hex
+    journal.execute(
+        "insert into runs (run_id, status, started_at) values (?, 'running', ?)",
+        (run_id, time.time()))
+    return run_id
+
+
+def get_resumable_run(
+    journal: sqlite3.Connection
+) -> str:
+    """
+    # Description:
+    This function returns the run `start_run(resume=True)` would continue.
+
+    # Parameters:
+        journal: sqlite3.Connection
+            this is the connection to the journal
+
+    # Returns:
+        str
+            this is the run id of the latest run that did not complete,
+            or None if every run completed
+    """
+    row = journal.execute(
+        "select run_id from runs where status != 'completed' "
+        "order by started_at desc limit 1").fetchone()
+    return None if row is None else row['run_id']
+
+
+def finish_run(
+    journal: sqlite3.Connection,
+    run_id: str,
+    status: str = 'completed'
+) -> None:
+    """
+    # Description:
+    This function records the end of a run.
+
+    # Parameters:
+        journal: sqlite3.Connection
+            this is the connection to the journal
+        run_id: str
+            this is the run id
+        status: str
+            this is 'completed' or 'failed'
+            defaults to 'completed'
+
+    # Returns:
+        None
+    """
+    journal.execute(
+        "update runs set status = ?, finished_at = ? where run_id = ?",
+        (status, time.time(), run_id))
+
+
+def record_stage(
+    journal: sqlite3.Connection,
+    run_id: str,
+    file_key: str,
+    stage: str,
+    fingerprint: str = None,
+    output_path: str = None,
+    reset_failures: bool = True
+) -> None:
+    """
+    # Description:
+    This function records that a stage of a file completed, and resets the
+    consecutive failure count of the file.
+
+    # Parameters:
+        journal: sqlite3.Connection
+            this is the connection to the journal
+        run_id: str
+            this is the run id
+        file_key: str
+            this is the key of the file, for example its name
+        stage: str
+            this is the stage, for example 'download' or 'parse'
+        fingerprint: str
+            this is the fingerprint of the file the stage was run on
+            defaults to None
+        output_path: str
+            this is where the intermediate output of the stage lives,
+            None if the stage has no output
+            defaults to None
+        reset_failures: bool
+            if False, keep the failure count, for the intermediate stages
+            of a file (a download that succeeds before every parse fails
+            must not keep the file out of quarantine)
+            defaults to True
+
+    # Returns:
+        None
+    """
+    journal.execute(
+        "insert or replace into stages "
+        "(file_key, stage, run_id, status, fingerprint, output_path, error, updated_at) "
+        "values (?, ?, ?, 'completed', ?, ?, null, ?)",
+        (file_key, stage, run_id, fingerprint, output_path, time.time()))
+    if reset_failures:
+        journal.execute("delete from failures where file_key = ?", (file_key,))
+
+
+def record_failure(
+    journal: sqlite3.Connection,
+    run_id: str,
+    file_key: str,
+    stage: str,
+    error: str,
+    fingerprint: str = None,
+    max_failures: int = DEFAULT_MAX_FAILURES
+) -> bool:
+    """
+    # Description:
+    This function records that a stage of a file failed, and quarantines the
+    file once it failed `max_failures` times in a row. A failure of another
+    version of the file (another fingerprint) starts the count over.
+
+    # Parameters:
+        journal: sqlite3.Connection
+            this is the connection to the journal
+        run_id: str
+            this is the run id
+        file_key: str
+            this is the key of the file
+        stage: str
+            this is the stage that failed
+        error: str
+            this is the error message
+        fingerprint: str
+            this is the fingerprint of the file
+            defaults to None
+        max_failures: int
+            this is the number of consecutive failures before quarantine
+            defaults to 3
+
+    # Returns:
+        bool
+            True if the file was quarantined
+    """
+    now = time.time()
+    journal.execute(
+        "insert or replace into stages "
+        "(file_key, stage, run_id, status, fingerprint, output_path, error, updated_at) "
+        "values (?, ?, ?, 'failed', ?, null, ?, ?)",
+        (file_key, stage, run_id, fingerprint, error, now))
+
+    # count the consecutive failures of this version of the file
+    journal.execute(
+        "insert into failures (file_key, failures, last_error, updated_at, fingerprint) "
+        "values (?, 1, ?, ?, ?) "
+        "on conflict (file_key) do update set "
+        "failures = case when fingerprint is excluded.fingerprint "
+        "then failures + 1 else 1 end, "
+        "last_error = excluded.last_error, updated_at = excluded.updated_at, "
+        "fingerprint = excluded.fingerprint",
+        (file_key, error, now, fingerprint))
+    failures = journal.execute(
+        "select failures from failures where file_key = ?",
+        (file_key,)).fetchone()['failures']
+
+    # quarantine the file
+    if failures >= max_failures:
+        journal.execute(
+            "insert or replace into quarantine "
+            "(file_key, failures, last_error, quarantined_at, fingerprint) "
+            "values (?, ?, ?, ?, ?)",
+            (file_key, failures, error, now, fingerprint))
+        return True
+    return False
+
+
+def get_completed_stage(
+    journal: sqlite3.Connection,
+    file_key: str,
+    stage: str,
+    fingerprint: str = None,
+    run_id: str = None
+) -> dict:
+    """
+    # Description:
+    This function looks up the completed record of a stage of a file.
+    A record produced from another version of the file (different fingerprint),
+    or whose output file no longer exists, does not count.
+
+    # Parameters:
+        journal: sqlite3.Connection
+            this is the connection to the journal
+        file_key: str
+            this is the key of the file
+        stage: str
+            this is the stage
+        fingerprint: str
+            this is the current fingerprint of the file
+            defaults to None to accept any fingerprint
+        run_id: str
+            this is the run the record must belong to
+            defaults to None for any run
+
+    # Returns:
+        dict
+            this is the record (run_id, fingerprint, output_path, updated_at),
+            or None if the stage has to be run
+    """
+    row = journal.execute(
+        "select run_id, fingerprint, output_path, updated_at from stages "
+        "where file_key = ? and stage = ? and status = 'completed'",
+        (file_key, stage)).fetchone()
+
+    # never completed
+    if row is None:
+        return None
+
+    # completed by another run, or for another version of the file
+    if run_id is not None and row['run_id'] != run_id:
+        return None
+    if fingerprint is not None and row['fingerprint'] != fingerprint:
+        return None
+
+    # the intermediate output was deleted
+    if row['output_path'] is not None and not os.path.exists(row['output_path']):
+        return None
+
+    return dict(row)
+
+
+def get_run_summary(
+    journal: sqlite3.Connection,
+    run_id: str
+) -> dict:
+    """
+    # Description:
+    This function summarizes the file stages recorded by a run.
+
+    # Parameters:
+        journal: sqlite3.Connection
+            this is the connection to the journal
+        run_id: str
+            this is the run id
+
+    # Returns:
+        dict
+            this is the dict with the run `status`, the number of `completed`
+            and `failed` stages per stage name, and the `failed_files`
+    """
+    run = journal.execute(
+        "select status from runs where run_id = ?", (run_id,)).fetchone()
+    rows = journal.execute(
+        "select stage, status, count(*) as files from stages "
+        "where run_id = ? and file_key != ? group by stage, status",
+        (run_id, RUN_FILE_KEY)).fetchall()
+    failed_files = journal.execute(
+        "select distinct file_key from stages where run_id = ? and status = 'failed' "
+        "order by file_key", (run_id,)).fetchall()
+
+    summary = {'status': None if run is None else run['status'],
+               'completed': {}, 'failed': {},
+               'failed_files': [row['file_key'] for row in failed_files]}
+    for row in rows:
+        summary[row['status']][row['stage']] = row['files']
+    return summary
+
+
+def get_failure_count(
+    journal: sqlite3.Connection,
+    file_key: str,
+    fingerprint: str = None
+) -> int:
+    """
+    # Description:
+    This function returns the number of consecutive failures of a file.
+
+    # Parameters:
+        journal: sqlite3.Connection
+            this is the connection to the journal
+        file_key: str
+            this is the key of the file
+        fingerprint: str
+            this is the current fingerprint of the file; the failures of
+            another version of it do not count
+            defaults to None for the failures of any version
+
+    # Returns:
+        int
+            this is the number of consecutive failures, 0 if the last attempt succeeded
+    """
+    row = journal.execute(
+        "select failures, fingerprint from failures where file_key = ?",
+        (file_key,)).fetchone()
+    if row is None or not _is_same_version(row['fingerprint'], fingerprint):
+        return 0
+    return row['failures']
+
+
+def _is_same_version(
+    recorded: str,
+    fingerprint: str
+) -> bool:
+    """
+    # Description:
+    Checks whether a record is about the version of a file with `fingerprint`.
+    A record, or a lookup, without a fingerprint is about every version.
+    """
+    return recorded is None or fingerprint is None or recorded == fingerprint
+
+
+def is_quarantined(
+    journal: sqlite3.Connection,
+    file_key: str,
+    fingerprint: str = None
+) -> bool:
+    """
+    # Description:
+    This function checks whether a version of a file is quarantined.
+    It does not change the journal, so a plan can ask too.
+
+    # Parameters:
+        journal: sqlite3.Connection
+            this is the connection to the journal
+        file_key: str
+            this is the key of the file
+        fingerprint: str
+            this is the current fingerprint of the file; a file quarantined
+            with another fingerprint changed since, and is not quarantined
+            defaults to None for any version
+
+    # Returns:
+        bool
+            True if the file is quarantined
+    """
+    row = journal.execute(
+        "select fingerprint from quarantine where file_key = ?", (file_key,)).fetchone()
+    return row is not None and _is_same_version(row['fingerprint'], fingerprint)
+
+
+def release_if_changed(
+    journal: sqlite3.Connection,
+    file_key: str,
+    fingerprint: str
+) -> bool:
+    """
+    # Description:
+    This function releases a file from quarantine when it changed since it
+    was quarantined (it was fixed and uploaded again), so that it is read
+    again, and fails its way back into quarantine only if it still fails.
+
+    # Parameters:
+        journal: sqlite3.Connection
+            this is the connection to the journal
+        file_key: str
+            this is the key of the file
+        fingerprint: str
+            this is the current fingerprint of the file
+
+    # Returns:
+        bool
+            True if the file was released
+    """
+    if fingerprint is None:
+        return False
+    released = journal.execute(
+        "delete from quarantine where file_key = ? "
+        "and fingerprint is not null and fingerprint != ?",
+        (file_key, fingerprint)).rowcount
+    if released > 0:
+        journal.execute("delete from failures where file_key = ?", (file_key,))
+    return released > 0
+
+
+def get_quarantine(
+    journal: sqlite3.Connection
+) -> list:
+    """
+    # Description:
+    This function lists the quarantined files.
+
+    # Parameters:
+        journal: sqlite3.Connection
+            this is the connection to the journal
+
+    # Returns:
+        list
+            this is the list of dicts
+            (file_key, failures, last_error, quarantined_at, fingerprint)
+    """
+    rows = journal.execute(
+        "select file_key, failures, last_error, quarantined_at, fingerprint from quarantine "
+        "order by quarantined_at").fetchall()
+    return [dict(row) for row in rows]
+
+
+def release_from_quarantine(
+    journal: sqlite3.Connection,
+    file_key: str
+) -> bool:
+    """
+    # Description:
+    This function releases a file from quarantine, so the next run tries it again.
+
+    # Parameters:
+        journal: sqlite3.Connection
+            this is the connection to the journal
+        file_key: str
+            this is the key of the file
+
+    # Returns:
+        bool
+            True if the file was quarantined
+    """
+    released = journal.execute(
+        "delete from quarantine where file_key = ?", (file_key,)).rowcount
+    journal.execute("delete from failures where file_key = ?", (file_key,))
+    return released > 0
+
+
+def get_watch_state(
+    journal: sqlite3.Connection,
+    source: str
+) -> str:
+    """
+    # Description:
+    This function returns the saved position of a watched source in its
+    change feed, for example a sharepoint change token.
+
+    # Parameters:
+        journal: sqlite3.Connection
+            this is the connection to the journal
+        source: str
+            this is the key of the watched source
+
+    # Returns:
+        str
+            this is the saved state, or None if the source was never watched
+    """
+    row = journal.execute(
+        "select state from watch_state where source = ?", (source,)).fetchone()
+    return None if row is None else row['state']
+
+
+def set_watch_state(
+    journal: sqlite3.Connection,
+    source: str,
+    state: str
+) -> None:
+    """
+    # Description:
+    This function saves the position of a watched source in its change feed,
+    once the changes up to it have been processed.
+
+    # Parameters:
+        journal: sqlite3.Connection
+            this is the connection to the journal
+        source: str
+            this is the key of the watched source
+        state: str
+            this is the state to save
+
+    # Returns:
+        None
+    """
+    journal.execute(
+        "insert or replace into watch_state (source, state, updated_at) values (?, ?, ?)",
+        (source, state, time.time()))
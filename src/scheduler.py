@@ -0,0 +1,422 @@
+"""
+# Description:
+Memory-aware adaptive scheduler for the download and parse stages.
+
+No fixed worker count fits our folders: the small link ratio workbooks can be
+parsed many at a time, but a few huge workbooks parsed at the same time run
+the machine out of memory. The scheduler:
+    - estimates the memory cost of each task from the file size and, when
+      the workbook is on disk, the dimensions of its output_tbl sheet
+    - starts the largest tasks first, so the run does not end on a long tail
+      of one huge workbook, and fills the gaps with smaller tasks
+    - admits a task only while the estimated cost of the running tasks fits
+      in the memory budget (one task always runs, however large)
+    - watches the memory the process (and its worker processes) actually
+      uses, and lowers the concurrency when it gets close to the budget,
+      raising it again when there is room
+
+The process memory is read with psutil when it is installed, otherwise
+from /proc (Linux); without either, only the estimates are used.
+
+When several refreshes run at the same time (see the `jobs` module),
+`set_global_limits` caps the sharepoint connections and the parses of all
+of them together: the downloads and uploads hold a `connection_slot()`, and
+the parses a `worker_slot()`. Without global limits both are free.
+
+# Example:
+    tasks = [{'key': path, 'cost': estimate_memory_cost(path), 'args': (path,)}
+             for path in paths]
+    for key, result, error in run_with_memory_budget(tasks, get_dataframe_from_file,
+                                                     memory_budget=8e9, max_workers=16):
+        ...
+"""
+
+import collections
+import concurrent.futures
+import contextlib
+import os
+import re
+import threading
+import zipfile
+
+from .instrumentation import gauge
+
+# bytes of python memory per cell of the output_tbl sheet, once read into a dataframe
+BYTES_PER_CELL = 100
+
+# ratio of parsing memory to file size, when the sheet dimensions are not known
+# (".xlsx" / ".xlsm" are zip-compressed xml, ".xlsb" is a denser binary format)
+MEMORY_PER_FILE_BYTE = {
+    '.xlsx': 12,
+    '.xlsm': 12,
+    '.xlsb': 6,
+}
+DEFAULT_MEMORY_PER_FILE_BYTE = 10
+
+# fixed memory cost of any task (the workbook objects, the reader)
+BASE_TASK_MEMORY = 30_000_000
+
+# fractions of the budget at which the concurrency goes down / up
+HIGH_WATER = 0.85
+LOW_WATER = 0.6
+
+# the global limits, None while there are none
+_connection_slots = None
+_worker_slots = None
+
+
+def get_total_memory() -> int:
+    """
+    # Description:
+    This function returns the physical memory of the machine.
+
+    # Returns:
+        int
+            this is the physical memory in bytes, or None if unknown
+    """
+    try:
+        import psutil
+        return int(psutil.virtual_memory().total)
+    except ImportError:
+        pass
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def get_default_memory_budget() -> int:
+    """
+    # Description:
+    This function returns the default memory budget: half the physical memory,
+    or 4 GB if it is unknown.
+
+    # Returns:
+        int
+            this is the memory budget in bytes
+    """
+    total = get_total_memory()
+    return total // 2 if total else 4_000_000_000
+
+
+def get_process_memory(
+    include_children: bool = True
+) -> int:
+    """
+    # Description:
+    This function returns the resident memory of this process and, with psutil,
+    of its worker processes.
+
+    # Parameters:
+        include_children: bool
+            if True, add the memory of the child processes (psutil only)
+            defaults to True
+
+    # Returns:
+        int
+            this is the resident memory in bytes, or None if it cannot be read
+    """
+    try:
+        import psutil
+        process = psutil.Process()
+        memory = process.memory_info().rss
+        if include_children:
+            for child in process.children(recursive=True):
+                try:
+                    memory += child.memory_info().rss
+                except psutil.Error:
+                    pass
+        return memory
+    except ImportError:
+        pass
+
+    # Linux without psutil: this process only
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            resident_pages = int(file.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def get_sheet_dimensions(
+    file_name: str,
+    sheet_name: str = 'output_tbl'
+) -> tuple:
+    """
+    # Description:
+    This function reads the dimensions (rows, columns) of a sheet without
+    parsing it: from the `<dimension>` element at the top of the sheet xml of
+    ".xlsx" / ".xlsm" files, and from the sheet header of ".xlsb" files.
+
+    # Parameters:
+        file_name: str
+            this is the file name
+        sheet_name: str
+            this is the sheet
+            defaults to 'output_tbl'
+
+    # Returns:
+        tuple
+            this is (rows, columns), or None if they cannot be read
+    """
+    try:
+        if file_name.endswith('.xlsb'):
+            from pyxlsb import open_workbook
+            with open_workbook(file_name) as workbook:
+                with workbook.get_sheet(sheet_name) as sheet:
+                    dimension = sheet.dimension
+                    return dimension.h, dimension.w
+
+        with zipfile.ZipFile(file_name) as archive:
+            # find the sheet xml through the workbook and its relationships
+            workbook_xml = archive.read('xl/workbook.xml').decode('utf-8')
+            match = re.search(
+                r'<sheet\b[^>]*\bname="' + re.escape(sheet_name) + r'"[^>]*\br:id="([^"]+)"',
+                workbook_xml)
+            if match is None:
+                return None
+            relationships = archive.read('xl/_rels/workbook.xml.rels').decode('utf-8')
+            target = re.search(
+                r'<Relationship\b[^>]*\bId="' + re.escape(match.group(1))
+                + r'"[^>]*\bTarget="([^"]+)"', relationships)
+            if target is None:
+                target = re.search(
+                    r'<Relationship\b[^>]*\bTarget="([^"]+)"[^>]*\bId="'
+                    + re.escape(match.group(1)) + '"', relationships)
+            if target is None:
+                return None
+            sheet_path = target.group(1).lstrip('/')
+            if not sheet_path.startswith('xl/'):
+                sheet_path = 'xl/' + sheet_path
+
+            # the dimension is in the first few hundred bytes of the sheet xml
+            with archive.open(sheet_path) as sheet_file:
+                head = sheet_file.read(4096).decode('utf-8', errors='ignore')
+            dimension = re.search(r'<dimension ref="([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?"', head)
+            if dimension is None or dimension.group(3) is None:
+                return None
+
+            def column_number(letters):
+                number = 0
+                for letter in letters:
+                    number = number * 26 + ord(letter) - ord('A') + 1
+                return number
+
+            rows = int(dimension.group(4)) - int(dimension.group(2)) + 1
+            columns = column_number(dimension.group(3)) - column_number(dimension.group(1)) + 1
+            return rows, columns
+
+    except Exception:
+        # an unreadable workbook is estimated from its size, and fails in the parse
+        return None
+
+
+def estimate_memory_cost(
+    file_name: str,
+    size: int = None,
+    sheet_name: str = 'output_tbl'
+) -> int:
+    """
+    # Description:
+    This function estimates the peak memory of parsing a workbook:
+    from the dimensions of its output_tbl sheet when the file is on disk and
+    they can be read, and from its size otherwise, whichever is larger.
+
+    # Parameters:
+        file_name: str
+            this is the file name (or the remote file name, with `size`)
+        size: int
+            this is the file size in bytes
+            defaults to None for the size of the file on disk
+        sheet_name: str
+            this is the sheet that will be parsed
+            defaults to 'output_tbl'
+
+    # Returns:
+        int
+            this is the estimated memory cost in bytes
+    """
+    on_disk = os.path.exists(file_name)
+    if size is None:
+        size = os.path.getsize(file_name) if on_disk else 0
+
+    extension = os.path.splitext(file_name)[1].lower()
+    estimate = size * MEMORY_PER_FILE_BYTE.get(extension, DEFAULT_MEMORY_PER_FILE_BYTE)
+
+    # the sheet dimensions give a better estimate when the decoy sheets
+    # make up most of the file
+    if on_disk:
+        dimensions = get_sheet_dimensions(file_name, sheet_name)
+        if dimensions is not None:
+            estimate = max(estimate, dimensions[0] * dimensions[1] * BYTES_PER_CELL)
+
+    return BASE_TASK_MEMORY + estimate
+
+
+def set_global_limits(
+    max_connections: int = None,
+    max_workers: int = None
+) -> None:
+    """
+    # Description:
+    This function caps the sharepoint connections and the parses across
+    every refresh of the process. `None` removes a limit.
+
+    # Parameters:
+        max_connections: int
+            this is the number of downloads and uploads at a time
+            defaults to None for no limit
+        max_workers: int
+            this is the number of parses at a time
+            defaults to None for no limit
+
+    # Returns:
+        None
+    """
+    global _connection_slots, _worker_slots
+    _connection_slots = None if max_connections is None else threading.BoundedSemaphore(
+        max(1, max_connections))
+    _worker_slots = None if max_workers is None else threading.BoundedSemaphore(
+        max(1, max_workers))
+
+
+@contextlib.contextmanager
+def _hold(slots):
+    """
+    # Description:
+    Holds one of the slots for the duration of the block, if there is a limit.
+    """
+    if slots is None:
+        yield
+        return
+    with slots:
+        yield
+
+
+def connection_slot():
+    """
+    # Description:
+    This function returns a context manager that holds one of the global
+    sharepoint connection slots, for a download or an upload.
+    """
+    return _hold(_connection_slots)
+
+
+def worker_slot():
+    """
+    # Description:
+    This function returns a context manager that holds one of the global
+    worker slots, for a parse.
+    """
+    return _hold(_worker_slots)
+
+
+def run_with_memory_budget(
+    tasks: list,
+    function,
+    memory_budget: int = None,
+    max_workers: int = None,
+    executor: str = 'thread',
+    poll_interval: float = 0.5
+):
+    """
+    # Description:
+    This function runs `function(*task['args'])` for every task, largest
+    estimated cost first, with as many tasks at a time as the memory budget
+    and the observed process memory allow, and yields the results as the
+    tasks complete.
+
+    # Parameters:
+        tasks: list
+            this is the list of task dicts with the keys
+            `key` (identifies the task in the results), `cost` (estimated
+            memory in bytes, see `estimate_memory_cost`) and `args`
+        function: callable
+            this is the function run for each task; with the 'process'
+            executor it must be a module-level function
+        memory_budget: int
+            this is the memory, in bytes, the tasks may use together
+            defaults to None for `get_default_memory_budget()`
+        max_workers: int
+            this is the maximum number of tasks at a time
+            defaults to None for the number of CPUs
+        executor: str
+            'thread' for I/O-bound tasks (downloads), 'process' for
+            CPU-bound tasks (parsing local files)
+            defaults to 'thread'
+        poll_interval: float
+            this is the number of seconds between memory checks
+            defaults to 0.5
+
+    # Returns:
+        iterator
+            this yields (key, result, error) per task, error is None on success
+    """
+    if executor not in ('thread', 'process'):
+        raise ValueError(f"executor must be 'thread' or 'process', not {executor}")
+    memory_budget = memory_budget or get_default_memory_budget()
+    max_workers = max(1, max_workers or os.cpu_count() or 1)
+
+    # the memory in use before any task, which the budget does not cover
+    baseline_memory = get_process_memory() or 0
+
+    # largest first
+    pending = collections.deque(
+        sorted(tasks, key=lambda task: task['cost'], reverse=True))
+    running = {}
+    reserved = 0
+    concurrency = max_workers
+
+    executor_class = (concurrent.futures.ThreadPoolExecutor if executor == 'thread'
+                      else concurrent.futures.ProcessPoolExecutor)
+
+    with executor_class(max_workers=max_workers) as pool:
+        while len(pending) > 0 or len(running) > 0:
+
+            # admit tasks while there is room
+            while len(pending) > 0 and len(running) < concurrency:
+                task = None
+
+                # nothing running: always start the largest task
+                if len(running) == 0:
+                    task = pending[0]
+
+                # otherwise the largest task that fits in the budget
+                else:
+                    for candidate in pending:
+                        if reserved + candidate['cost'] <= memory_budget:
+                            task = candidate
+                            break
+
+                # nothing fits until a task completes
+                if task is None:
+                    break
+
+                pending.remove(task)
+                future = pool.submit(function, *task['args'])
+                running[future] = task
+                reserved += task['cost']
+
+            gauge('queue_depth', len(pending), stage_name='scheduler')
+            gauge('scheduler.concurrency', len(running), stage_name='scheduler')
+
+            # wait for a task to complete, or for the next memory check
+            done, _ = concurrent.futures.wait(
+                running, timeout=poll_interval,
+                return_when=concurrent.futures.FIRST_COMPLETED)
+
+            for future in done:
+                task = running.pop(future)
+                reserved -= task['cost']
+                error = future.exception()
+                yield task['key'], None if error is not None else future.result(), error
+
+            # adapt the concurrency to the memory actually in use
+            observed = get_process_memory()
+            if observed is not None:
+                in_use = observed - baseline_memory
+                if in_use > HIGH_WATER * memory_budget and concurrency > 1:
+                    concurrency = max(1, min(concurrency, len(running)) - 1)
+                elif in_use < LOW_WATER * memory_budget and concurrency < max_workers:
+                    concurrency += 1
@@ -1,8 +1,368 @@
+"""
+# Description:
+Lookup functions for the inputs: the CIG file types and the CIG LOBs.
 
+The lookups are loaded once from a versioned local reference file, and kept
+as read-only indexes, so that classifying a file name or looking up a LOB
+code is a dictionary lookup instead of a filter over a frame:
 
-# this file contains the lookup functions for the inputs
+    stem -> file type: 'CA Link Ratios' -> 'link ratio'
+    file type -> stems, and the pattern that matches them in a file name column
+    LOB code -> attributes: 'CA' -> {'name': 'Commercial Auto', ...}
 
-# the functions are called from the main files
+The file is read again only when its modification time (or size) changes,
+so a new version of the lookups is picked up by a running dashboard or
+watch without a restart.
 
-# function that pulls a static 
-def cig_lobs():
+The reference file is JSON:
+
+    {
+        "version": "2024Q1",
+        "file_types": [
+            {"filename": "CA Link Ratios", "type": "link ratio"},
+            ...
+        ],
+        "lobs": [
+            {"code": "CA", "name": "Commercial Auto", ...},
+            ...
+        ]
+    }
+
+A file type row may also have the `columns`, `header_row` and
+`stop_at_blank_row` projection settings (see `output_tbl_reader`); they are
+registered when the file is loaded. The path of the file is read from the
+RESERVING_DASHBOARD_REFERENCE_PATH environment variable, and defaults to
+'./cig_reference.json'.
+
+# Example:
+    get_file_type('CA Link Ratios 2Q2021.xlsb')
+    'link ratio'
+    cig_lobs()['CA']['name']
+    'Commercial Auto'
+"""
+
+import functools
+import json
+import os
+import re
+import threading
+from types import MappingProxyType
+from typing import Mapping, NamedTuple
+
+# environment variable of the path of the reference file
+REFERENCE_PATH_VARIABLE = 'RESERVING_DASHBOARD_REFERENCE_PATH'
+
+# path of the reference file when the environment variable is not set
+DEFAULT_REFERENCE_PATH = os.path.join('.', 'cig_reference.json')
+
+# the analysis of a file name ('2021Q2' or '3Q2023'), which follows the stem
+_ANALYSIS_PATTERN = re.compile(r'\s*(?:\d{4}Q\d|\dQ\d{4})')
+
+# the projection settings a file type row may have
+_PROJECTION_KEYS = ('columns', 'header_row', 'stop_at_blank_row')
+
+
+class ReferenceData(NamedTuple):
+    """
+    # Description:
+    The indexes of one version of the reference file. Every mapping is
+    read-only, so the indexes can be shared by every caller and thread.
+    """
+    path: str
+    version: str
+    signature: tuple
+    file_types: tuple
+    stem_types: Mapping
+    type_stems: Mapping
+    stem_pattern: re.Pattern
+    type_patterns: Mapping
+    lobs: Mapping
+
+
+# the reference data of each path, and the lock of their (re)loads
+_reference_data = {}
+_reference_lock = threading.Lock()
+
+
+def get_reference_path(
+    path: str = None
+) -> str:
+    """
+    # Description:
+    Returns the path of the reference file: `path`, or the environment
+    variable, or './cig_reference.json'.
+    """
+    return path or os.environ.get(REFERENCE_PATH_VARIABLE) or DEFAULT_REFERENCE_PATH
+
+
+def get_stem(
+    file_name: str
+) -> str:
+    """
+    # Description:
+    This function returns the stem of a CIG file name: the part before the
+    analysis, as in "stem XQYYYY.xlsx", in lower case.
+
+    # Example:
+        get_stem('O:/2021/CA Link Ratios 2Q2021.xlsb')
+        'ca link ratios'
+    """
+    name = os.path.basename(file_name)
+    match = _ANALYSIS_PATTERN.search(name)
+    stem = name[:match.start()] if match is not None else os.path.splitext(name)[0]
+    return stem.strip().casefold()
+
+
+def load_reference_data(
+    path: str = None
+) -> ReferenceData:
+    """
+    # Description:
+    This function reads the reference file and builds its indexes.
+    Use `get_reference_data` to share the indexes between calls.
+
+    # Parameters:
+        path: str
+            this is the path of the reference file
+            defaults to None for the environment variable, or './cig_reference.json'
+
+    # Returns:
+        ReferenceData
+            this is the read-only indexes of the file
+    """
+    path = get_reference_path(path)
+    status = os.stat(path)
+    with open(path, 'r', encoding='utf-8') as file:
+        reference = json.load(file)
+
+    # the file types, and the indexes in both directions
+    file_types = []
+    stem_types = {}
+    type_stems = {}
+    for row in reference.get('file_types', []):
+        if 'filename' not in row or 'type' not in row:
+            raise ValueError(f'{path}: a file type needs `filename` and `type`: {row}')
+        file_types.append(MappingProxyType(dict(row)))
+        stem = row['filename'].strip().casefold()
+        if stem_types.setdefault(stem, row['type']) != row['type']:
+            raise ValueError(f"{path}: the stem {row['filename']!r} has two file types")
+        type_stems.setdefault(row['type'], []).append(row['filename'])
+
+    # the LOBs, by code
+    lobs = {}
+    for row in reference.get('lobs', []):
+        if 'code' not in row:
+            raise ValueError(f'{path}: a LOB needs a `code`: {row}')
+        if row['code'] in lobs:
+            raise ValueError(f"{path}: the LOB code {row['code']!r} is listed twice")
+        lobs[row['code']] = MappingProxyType(dict(row))
+
+    # the patterns that find the stems anywhere in a name, longest stem first
+    def get_pattern(stems):
+        return '|'.join(re.escape(stem) for stem in sorted(stems, key=len, reverse=True))
+
+    return ReferenceData(
+        path=path,
+        version=str(reference.get('version', '')),
+        signature=(status.st_mtime_ns, status.st_size),
+        file_types=tuple(file_types),
+        stem_types=MappingProxyType(stem_types),
+        type_stems=MappingProxyType({file_type: tuple(stems)
+                                     for file_type, stems in type_stems.items()}),
+        stem_pattern=re.compile(get_pattern(stem_types) or '(?!)', re.IGNORECASE),
+        type_patterns=MappingProxyType({file_type: '(?i)' + get_pattern(stems)
+                                        for file_type, stems in type_stems.items()}),
+        lobs=MappingProxyType(lobs),
+    )
+
+
+def get_reference_data(
+    path: str = None,
+    required: bool = True
+) -> ReferenceData:
+    """
+    # Description:
+    This function returns the indexes of the reference file, loading them
+    the first time, and again only when the file changed since.
+
+    # Parameters:
+        path: str
+            this is the path of the reference file
+            defaults to None for the environment variable, or './cig_reference.json'
+        required: bool
+            if False, return None instead of raising when the file does not exist
+            defaults to True
+
+    # Returns:
+        ReferenceData
+            this is the read-only indexes of the file
+    """
+    path = get_reference_path(path)
+    try:
+        status = os.stat(path)
+    except FileNotFoundError:
+        if required:
+            raise FileNotFoundError(
+                f'no CIG reference file at {path!r}: set {REFERENCE_PATH_VARIABLE} '
+                'to the path of the reference file') from None
+        return None
+
+    # the file did not change since it was loaded
+    reference_data = _reference_data.get(path)
+    if reference_data is not None and reference_data.signature == (
+            status.st_mtime_ns, status.st_size):
+        return reference_data
+
+    with _reference_lock:
+        # another thread may have loaded it in the meantime
+        reference_data = _reference_data.get(path)
+        if reference_data is None or reference_data.signature != (
+                status.st_mtime_ns, status.st_size):
+            reference_data = load_reference_data(path)
+            _reference_data[path] = reference_data
+
+            # the memoized lookups belong to the previous version
+            _get_file_type.cache_clear()
+            register_reference_projections(reference_data)
+
+    return reference_data
+
+
+def register_reference_projections(
+    reference_data: ReferenceData
+) -> None:
+    """
+    # Description:
+    This function registers the projections of the file types that have
+    projection settings (see `output_tbl_reader.register_projection`).
+    """
+    rows = [row for row in reference_data.file_types
+            if any(key in row for key in _PROJECTION_KEYS)]
+    if len(rows) == 0:
+        return
+
+    # the reader loads pandas, so it is only imported when there is something to register
+    import pandas as pd
+
+    from .output_tbl_reader import register_projections_from_cig_filetypes
+    register_projections_from_cig_filetypes(pd.DataFrame([dict(row) for row in rows]))
+
+
+@functools.lru_cache(maxsize=65536)
+def _get_file_type(
+    path: str,
+    signature: tuple,
+    file_name: str
+) -> str:
+    # `signature` is only part of the cache key, the cache is also cleared on a reload
+    reference_data = _reference_data[path]
+
+    # the stem before the analysis
+    file_type = reference_data.stem_types.get(get_stem(file_name))
+    if file_type is not None:
+        return file_type
+
+    # names of another form: the longest stem the name contains
+    match = reference_data.stem_pattern.search(os.path.basename(file_name))
+    return None if match is None else reference_data.stem_types[match.group(0).casefold()]
+
+
+def get_file_type(
+    file_name: str,
+    path: str = None
+) -> str:
+    """
+    # Description:
+    This function classifies a CIG file name by its stem. The lookups are
+    memoized for each version of the reference file.
+
+    # Parameters:
+        file_name: str
+            this is the file name or path
+        path: str
+            this is the path of the reference file
+            defaults to None for the environment variable, or './cig_reference.json'
+
+    # Returns:
+        str
+            this is the CIG file type, or None when the stem is unknown or
+            there is no reference file
+
+    # Example:
+        get_file_type('O:/2021/2021 Q2/CA Link Ratios 2Q2021.xlsb')
+        'link ratio'
+    """
+    reference_data = get_reference_data(path, required=False)
+    if reference_data is None:
+        return None
+    return _get_file_type(reference_data.path, reference_data.signature, file_name)
+
+
+def get_stems(
+    file_type: str,
+    path: str = None
+) -> tuple:
+    """
+    # Description:
+    This function returns the stems of a CIG file type, for example the
+    stems of the 'link ratio' files.
+    """
+    return get_reference_data(path).type_stems.get(file_type, ())
+
+
+def cig_lobs(
+    path: str = None
+) -> Mapping:
+    """
+    # Description:
+    This function returns the CIG LOBs of the reference file.
+
+    # Parameters:
+        path: str
+            this is the path of the reference file
+            defaults to None for the environment variable, or './cig_reference.json'
+
+    # Returns:
+        Mapping
+            this is the read-only mapping of LOB code to its attributes
+    """
+    return get_reference_data(path).lobs
+
+
+def get_lob(
+    code: str,
+    path: str = None
+) -> Mapping:
+    """
+    # Description:
+    This function looks up the attributes of a CIG LOB code.
+
+    # Returns:
+        Mapping
+            this is the read-only attributes, or None for an unknown code
+    """
+    return get_reference_data(path).lobs.get(code)
+
+
+def cig_filetypes(
+    path: str = None
+):
+    """
+    # Description:
+    This function returns the CIG file types of the reference file as the
+    `cig_filetypes` frame (`filename`, `type`, and the projection settings)
+    the functions of `find_cig_files` and `output_tbl_reader` take.
+
+    # Parameters:
+        path: str
+            this is the path of the reference file
+            defaults to None for the environment variable, or './cig_reference.json'
+
+    # Returns:
+        pd.DataFrame
+            this is a new frame, one row per stem
+    """
+    import pandas as pd
+
+    rows = [dict(row) for row in get_reference_data(path).file_types]
+    return pd.DataFrame(rows) if len(rows) > 0 else pd.DataFrame(columns=['filename', 'type'])
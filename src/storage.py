@@ -0,0 +1,660 @@
+"""
+# Description:
+Storage backends the refresh reads the workbooks from and uploads the
+combined parquet file to.
+
+Every backend has the same operations, on '/'-separated paths:
+    list(folder): the files of a folder, as `StorageFile`s
+    stat(path): one file
+    open(path): a binary file object to read the file from
+    upload(folder, name, content): write a file
+    delete(path): remove a file
+    ensure_folder(folder): create a folder, and its parents, if missing
+
+A missing file or folder raises FileNotFoundError on every backend.
+
+so `folder_to_parquet` runs the same code whatever the workbooks live on:
+    LocalBackend: a local or mounted folder (O:)
+    SharePointBackend: a sharepoint site, through an office365 client context
+    MirrorBackend: a synced local copy of another backend; a file is copied
+        again only when its ETag changed, so repeated runs read at disk speed
+    HttpBackend: a folder served over HTTP by `serve_folder`, a local
+        stand-in for sharepoint to run the whole pipeline against
+
+The backends whose files are already on the local disk (local, mirror)
+return their paths from `get_local_path`, and the refresh parses them where
+they are instead of downloading a copy.
+
+# Example:
+    storage = MirrorBackend(SharePointBackend(client_context), 'refresh_mirror')
+    files = storage.list('CIG Link Ratio Files')
+    with files[0].open() as file:
+        ...
+"""
+
+import contextlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import urllib.parse
+
+# urllib.request and http.server are imported by the functions that use them,
+# so that importing this module (and `--help`) stays fast
+from .instrumentation import count, stage
+
+# sharepoint downloads up to this size are kept in memory, larger ones on disk
+SPOOL_MAX_SIZE = 32 * 1024 * 1024
+
+# the index of the files of a mirror, in the mirror folder
+MIRROR_INDEX_NAME = '.mirror_index.json'
+
+
+def join_path(
+    folder: str,
+    name: str
+) -> str:
+    """
+    # Description:
+    Joins a folder and a name into a '/'-separated storage path.
+    """
+    folder = folder.strip('/')
+    return f'{folder}/{name}' if folder else name
+
+
+@contextlib.contextmanager
+def not_found_as_error(
+    path: str
+):
+    """
+    # Description:
+    Raises FileNotFoundError for the HTTP 404 of a request about `path`
+    (urllib errors, and the office365 request errors, are both OSErrors).
+    """
+    try:
+        yield
+    except OSError as error:
+        status = getattr(error, 'code', None) or getattr(
+            getattr(error, 'response', None), 'status_code', None)
+        if status == 404:
+            raise FileNotFoundError(f'no such file or folder: {path!r}') from error
+        raise
+
+
+class StorageFile:
+    """
+    # Description:
+    One file of a storage backend: its path, name, size, modification time
+    and ETag (None when the backend has none).
+    """
+
+    __slots__ = ('backend', 'path', 'name', 'size', 'modified', 'etag')
+
+    def __init__(self, backend, path, size, modified=None, etag=None, name=None):
+        self.backend = backend
+        self.path = path
+        self.name = name or path.rstrip('/').rsplit('/', 1)[-1]
+        self.size = int(size or 0)
+        self.modified = modified
+        self.etag = etag
+
+    @property
+    def fingerprint(self):
+        """
+        # Description:
+        Changes whenever the contents of the file change: the ETag of the
+        file, or its size and modification time. The run journal uses it to
+        tell whether an intermediate output was produced from the current version.
+        """
+        if self.etag:
+            return str(self.etag)
+        return f'{self.size}:{self.modified}'
+
+    def open(self):
+        return self.backend.open(self.path)
+
+    def to_dict(self):
+        return {'name': self.name, 'path': self.path, 'size': self.size,
+                'modified': self.modified, 'etag': self.etag}
+
+    def __repr__(self):
+        return f'StorageFile({self.path!r}, size={self.size}, etag={self.etag!r})'
+
+
+class StorageBackend:
+    """
+    # Description:
+    The operations every storage backend has.
+    """
+
+    def list(self, folder):
+        """
+        # Description:
+        Returns the files (not the subfolders) of a folder, sorted by name.
+        """
+        raise NotImplementedError
+
+    def stat(self, path):
+        """
+        # Description:
+        Returns the `StorageFile` of a path.
+        """
+        raise NotImplementedError
+
+    def open(self, path):
+        """
+        # Description:
+        Returns a binary file object to read a file from; close it after use.
+        """
+        raise NotImplementedError
+
+    def upload(self, folder, name, content):
+        """
+        # Description:
+        Writes `content` (bytes) to the file `name` of a folder.
+        """
+        raise NotImplementedError
+
+    def delete(self, path):
+        """
+        # Description:
+        Removes a file.
+        """
+        raise NotImplementedError
+
+    def ensure_folder(self, folder):
+        """
+        # Description:
+        Creates a folder, and its parents, when it does not exist yet.
+        """
+        pass
+
+    def get_local_path(self, file):
+        """
+        # Description:
+        Returns the path of the file on the local disk, or None when the
+        file has to be downloaded.
+        """
+        return None
+
+    def needs_download(self, file):
+        """
+        # Description:
+        Returns True when reading the file copies it from a remote store,
+        without copying it.
+        """
+        return True
+
+    def close(self):
+        pass
+
+
+class LocalBackend(StorageBackend):
+    """
+    # Description:
+    The files of a local or mounted folder. The paths are relative to `root`.
+    """
+
+    def __init__(self, root='.'):
+        self.root = root
+
+    def get_full_path(self, path):
+        parts = [part for part in path.split('/') if part not in ('', '.')]
+        if '..' in parts:
+            raise ValueError(f'the path {path!r} leaves the storage root')
+        return os.path.join(self.root, *parts)
+
+    def get_file(self, path, status):
+        # the modification time in nanoseconds and the size change with every save
+        return StorageFile(self, path, status.st_size, status.st_mtime,
+                           etag=f'"{status.st_mtime_ns}:{status.st_size}"')
+
+    def list(self, folder=''):
+        with os.scandir(self.get_full_path(folder)) as entries:
+            files = [self.get_file(join_path(folder, entry.name), entry.stat())
+                     for entry in entries if entry.is_file()]
+        return sorted(files, key=lambda file: file.name)
+
+    def stat(self, path):
+        return self.get_file(path, os.stat(self.get_full_path(path)))
+
+    def open(self, path):
+        return open(self.get_full_path(path), 'rb')
+
+    def upload(self, folder, name, content):
+        # write under a temporary name, so readers never see half a file
+        path = self.get_full_path(join_path(folder, name))
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as file:
+            file.write(content)
+        os.replace(temporary_path, path)
+
+    def delete(self, path):
+        os.remove(self.get_full_path(path))
+
+    def ensure_folder(self, folder):
+        os.makedirs(self.get_full_path(folder), exist_ok=True)
+
+    def get_local_path(self, file):
+        return self.get_full_path(file.path)
+
+    def needs_download(self, file):
+        return False
+
+
+class SharePointBackend(StorageBackend):
+    """
+    # Description:
+    The files of a sharepoint site, through an office365 client context.
+    The paths are server relative urls.
+
+    The query queue of a client context is not thread-safe, so every thread
+    runs its requests on a context of its own: the thread that made the
+    backend on `client_context`, the others on a clone of it
+    (`client_context.clone(site_url)`), which shares the login but not the
+    queue. Only with an office365 version that cannot clone a context do the
+    threads share it, and take turns.
+    """
+
+    def __init__(self, client_context):
+        self.client_context = client_context
+        self.owner = threading.get_ident()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.clones = []
+
+    def get_client_context(self):
+        """
+        # Description:
+        Returns the client context of the calling thread.
+        """
+        if threading.get_ident() == self.owner or not hasattr(self.client_context, 'clone'):
+            return self.client_context
+        client_context = getattr(self.local, 'client_context', None)
+        if client_context is None:
+            client_context = self.client_context.clone(self.client_context.base_url)
+            self.local.client_context = client_context
+            with self.lock:
+                self.clones.append(client_context)
+            count('sharepoint.context_cloned')
+        return client_context
+
+    @contextlib.contextmanager
+    def query(self):
+        """
+        # Description:
+        Yields the client context of the calling thread, to run a query on;
+        the shared context is used by one thread at a time.
+        """
+        client_context = self.get_client_context()
+        with self.lock if client_context is self.client_context else contextlib.nullcontext():
+            yield client_context
+
+    def wrap(self, file, folder=''):
+        """
+        # Description:
+        Returns the `StorageFile` of an office365 file.
+        """
+        properties = file.properties
+        return StorageFile(
+            self, properties.get('ServerRelativeUrl') or join_path(folder, properties['Name']),
+            properties.get('Length'), properties.get('TimeLastModified'),
+            properties.get('ETag'), properties['Name'])
+
+    def list(self, folder):
+        with self.query() as client_context, not_found_as_error(folder):
+            files = client_context.web.get_folder_by_server_relative_url(folder).files
+            client_context.load(files)
+            client_context.execute_query()
+        return sorted((self.wrap(file, folder) for file in files),
+                      key=lambda file: file.name)
+
+    def stat(self, path):
+        with self.query() as client_context, not_found_as_error(path):
+            file = client_context.web.get_file_by_server_relative_url(path)
+            client_context.load(file)
+            client_context.execute_query()
+        return self.wrap(file)
+
+    def open(self, path):
+        local_file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        try:
+            with self.query() as client_context, not_found_as_error(path):
+                client_context.web.get_file_by_server_relative_url(path).download(
+                    local_file).execute_query()
+        except BaseException:
+            local_file.close()
+            raise
+        local_file.seek(0)
+        return local_file
+
+    def upload(self, folder, name, content):
+        with self.query() as client_context:
+            client_context.web.get_folder_by_server_relative_url(folder).upload_file(
+                name, content).execute_query()
+
+    def delete(self, path):
+        with self.query() as client_context, not_found_as_error(path):
+            client_context.web.get_file_by_server_relative_url(
+                path).delete_object().execute_query()
+
+    def ensure_folder(self, folder):
+        with self.query() as client_context:
+            client_context.web.ensure_folder_path(folder).execute_query()
+
+    def close_clones(self):
+        """
+        # Description:
+        Closes the contexts cloned for the other threads.
+        """
+        with self.lock:
+            clones, self.clones = self.clones, []
+        # only some office365 versions can close a context
+        for client_context in clones:
+            if hasattr(client_context, 'close'):
+                client_context.close()
+
+    def close(self):
+        self.close_clones()
+        # only some office365 versions can close a context
+        if hasattr(self.client_context, 'close'):
+            self.client_context.close()
+
+
+class MirrorBackend(StorageBackend):
+    """
+    # Description:
+    A synced local copy of the files of another backend, in `mirror_dir`.
+    Listing asks the source; reading copies the file from the source only
+    when its ETag (fingerprint) changed since it was mirrored, and then
+    reads the local copy. Uploads go to the source.
+    """
+
+    def __init__(self, source, mirror_dir):
+        self.source = source
+        self.mirror_dir = mirror_dir
+        self.index_path = os.path.join(mirror_dir, MIRROR_INDEX_NAME)
+        self.lock = threading.Lock()
+        self.listed = {}
+
+        # the fingerprint of every mirrored file
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as file:
+                self.index = json.load(file)
+
+    def wrap(self, file):
+        mirrored = StorageFile(self, file.path, file.size, file.modified, file.etag, file.name)
+        self.listed[file.path] = mirrored
+        return mirrored
+
+    def list(self, folder):
+        return [self.wrap(file) for file in self.source.list(folder)]
+
+    def stat(self, path):
+        return self.wrap(self.source.stat(path))
+
+    def get_mirror_path(self, path):
+        parts = [part for part in path.split('/') if part not in ('', '.')]
+        if '..' in parts:
+            raise ValueError(f'the path {path!r} leaves the mirror')
+        return os.path.join(self.mirror_dir, *parts)
+
+    def save_index(self):
+        temporary_path = f'{self.index_path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            json.dump(self.index, file, indent=1, sort_keys=True)
+        os.replace(temporary_path, self.index_path)
+
+    def get_local_path(self, file):
+        mirror_path = self.get_mirror_path(file.path)
+
+        # the local copy is the current version
+        with self.lock:
+            if self.index.get(file.path) == file.fingerprint and os.path.exists(mirror_path):
+                count('mirror.reused', file=file.name)
+                return mirror_path
+
+        # copy the current version, under a temporary name
+        os.makedirs(os.path.dirname(mirror_path), exist_ok=True)
+        temporary_path = f'{mirror_path}.{threading.get_ident()}.tmp'
+        with stage('mirror.copy', file=file.name) as span:
+            with self.source.open(file.path) as source_file, \
+                    open(temporary_path, 'wb') as local_file:
+                shutil.copyfileobj(source_file, local_file, 1024 * 1024)
+            span.add(bytes=os.path.getsize(temporary_path))
+        os.replace(temporary_path, mirror_path)
+
+        with self.lock:
+            self.index[file.path] = file.fingerprint
+            self.save_index()
+        return mirror_path
+
+    def needs_download(self, file):
+        # only the files whose local copy is not the current version
+        with self.lock:
+            return not (self.index.get(file.path) == file.fingerprint
+                        and os.path.exists(self.get_mirror_path(file.path)))
+
+    def open(self, path):
+        file = self.listed.get(path) or self.stat(path)
+        return open(self.get_local_path(file), 'rb')
+
+    def upload(self, folder, name, content):
+        self.source.upload(folder, name, content)
+
+    def delete(self, path):
+        self.source.delete(path)
+        with self.lock:
+            self.listed.pop(path, None)
+            if self.index.pop(path, None) is not None:
+                self.save_index()
+            if os.path.exists(self.get_mirror_path(path)):
+                os.remove(self.get_mirror_path(path))
+
+    def ensure_folder(self, folder):
+        self.source.ensure_folder(folder)
+
+    def sync(self, folder):
+        """
+        # Description:
+        Brings the mirror of a folder up to date: copies the new and changed
+        files, and removes the copies of the files that are gone.
+
+        # Returns:
+            dict
+                this is the number of files `copied`, `reused` and `removed`
+        """
+        files = self.list(folder)
+        copied = 0
+        for file in files:
+            if self.index.get(file.path) != file.fingerprint:
+                copied += 1
+            self.get_local_path(file)
+
+        # the files that left the folder
+        prefix = folder.strip('/') + '/' if folder.strip('/') else ''
+        current = {file.path for file in files}
+        removed = [path for path in self.index
+                   if path.startswith(prefix) and '/' not in path[len(prefix):]
+                   and path not in current]
+        with self.lock:
+            for path in removed:
+                del self.index[path]
+                if os.path.exists(self.get_mirror_path(path)):
+                    os.remove(self.get_mirror_path(path))
+            self.save_index()
+
+        return {'copied': copied, 'reused': len(files) - copied, 'removed': len(removed)}
+
+    def close(self):
+        self.source.close()
+
+
+class HttpBackend(StorageBackend):
+    """
+    # Description:
+    The files of a folder served over HTTP by `serve_folder`:
+        GET  /list/<folder>: the files of the folder, as JSON
+        GET  /stat/<path>: one file, as JSON
+        GET  /files/<path>: the contents of a file
+        PUT  /files/<folder>/<name>: write a file
+        DELETE /files/<path>: remove a file
+    The server creates the folders of the files it is sent.
+    """
+
+    def __init__(self, base_url, timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def get_url(self, operation, path):
+        return f'{self.base_url}/{operation}/{urllib.parse.quote(path.strip("/"))}'
+
+    def get_file(self, info):
+        return StorageFile(self, info['path'], info['size'], info.get('modified'),
+                           info.get('etag'), info.get('name'))
+
+    def request(self, operation, path, content=None, method='GET'):
+        import urllib.request
+
+        with not_found_as_error(path):
+            return urllib.request.urlopen(
+                urllib.request.Request(self.get_url(operation, path), data=content,
+                                       method=method),
+                timeout=self.timeout)
+
+    def list(self, folder=''):
+        with self.request('list', folder) as response:
+            return [self.get_file(info) for info in json.load(response)]
+
+    def stat(self, path):
+        with self.request('stat', path) as response:
+            return self.get_file(json.load(response))
+
+    def open(self, path):
+        return self.request('files', path)
+
+    def upload(self, folder, name, content):
+        with self.request('files', join_path(folder, name), content, 'PUT'):
+            pass
+
+    def delete(self, path):
+        with self.request('files', path, method='DELETE'):
+            pass
+
+
+class _FolderRequestHandler:
+    """
+    # Description:
+    Serves the operations of `HttpBackend` over the `LocalBackend` of the
+    server; mixed into `http.server.BaseHTTPRequestHandler` by `serve_folder`.
+    """
+
+    def get_operation(self):
+        path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        operation, _, storage_path = path.lstrip('/').partition('/')
+        return operation, storage_path
+
+    def send_json(self, value):
+        body = json.dumps(value).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        storage = self.server.storage
+        operation, path = self.get_operation()
+        try:
+            if operation == 'list':
+                self.send_json([file.to_dict() for file in storage.list(path)])
+            elif operation == 'stat':
+                self.send_json(storage.stat(path).to_dict())
+            elif operation == 'files':
+                file = storage.stat(path)
+                self.send_response(200)
+                self.send_header('Content-Length', str(file.size))
+                self.send_header('ETag', file.etag)
+                self.end_headers()
+                with storage.open(path) as local_file:
+                    shutil.copyfileobj(local_file, self.wfile)
+            else:
+                self.send_error(404)
+        except (FileNotFoundError, NotADirectoryError):
+            self.send_error(404)
+        except ValueError:
+            self.send_error(400)
+
+    def do_PUT(self):
+        operation, path = self.get_operation()
+        folder, _, name = path.strip('/').rpartition('/')
+        if operation != 'files' or name == '':
+            self.send_error(404)
+            return
+        content = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            self.server.storage.upload(folder, name, content)
+        except ValueError:
+            self.send_error(400)
+            return
+        self.send_response(204)
+        self.end_headers()
+
+    def do_DELETE(self):
+        operation, path = self.get_operation()
+        if operation != 'files':
+            self.send_error(404)
+            return
+        try:
+            self.server.storage.delete(path)
+        except (FileNotFoundError, IsADirectoryError):
+            self.send_error(404)
+            return
+        except ValueError:
+            self.send_error(400)
+            return
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        # quiet: the refresh prints its own progress
+        pass
+
+
+def serve_folder(
+    root: str,
+    host: str = '127.0.0.1',
+    port: int = 0
+) -> 'http.server.ThreadingHTTPServer':
+    """
+    # Description:
+    This function serves a local folder to `HttpBackend`, as a stand-in for
+    sharepoint, in a background thread.
+
+    # Parameters:
+        root: str
+            this is the folder to serve
+        host: str
+            this is the address to listen on
+            defaults to '127.0.0.1'
+        port: int
+            this is the port to listen on
+            defaults to 0 for any free port
+
+    # Returns:
+        ThreadingHTTPServer
+            this is the running server; its `url` is the base url of the
+            `HttpBackend`, `thread` serves it, and `shutdown()` stops it
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    handler = type('FolderRequestHandler', (_FolderRequestHandler, BaseHTTPRequestHandler), {})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.storage = LocalBackend(root)
+    server.url = f'http://{server.server_address[0]}:{server.server_address[1]}'
+    server.thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server.thread.start()
+    return server
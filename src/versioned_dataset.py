@@ -0,0 +1,768 @@
+"""
+# Description:
+Versioned, append-only dataset of the combined output_tbl data, so that a
+refresh uploads what changed instead of the whole history every quarter,
+and a report can read the dataset exactly as it was at a given version.
+
+The dataset is a folder of any storage backend (see the `storage` module):
+
+    fragments/v000042-<digest>.parquet
+        the rows of the workbooks a refresh read, tagged with the
+        `dataset_version` they were written in; never changed once written
+    manifests/v000042.json
+        the fragments of version 42, the workbook (and its fingerprint) each
+        live row came from, and the tombstones of the rows that were replaced
+        or removed since
+    manifests/pins.json
+        the pinned versions (`pin_version`), which no compaction expires,
+        for example the versions the quarter-end reports were run on
+
+A refresh (`write_version`) only reads the workbooks whose fingerprint
+changed since the latest version, writes their rows as one new fragment,
+and tombstones the rows of the previous versions of those workbooks (and of
+the workbooks that are gone). The manifest is written last: a version
+exists once its manifest does, so a failed refresh leaves nothing behind
+that a reader can see.
+
+A tombstone is a (file_name, dataset_version) pair: the rows of that
+workbook written in that version are not live any more. Readers
+(`open_version`, `dataset_query.query_dataset(version=...)`) filter them out.
+
+`compact_dataset` merges the small fragments, and the fragments with
+tombstoned rows, into one fragment as a new version, then expires the old
+versions that are not pinned: their manifests, and the fragments no kept
+version uses.
+
+# Manifest:
+    {
+        "format": 1,
+        "version": 42,
+        "parent": 41,
+        "operation": "refresh",
+        "created": "2024-07-15T06:00:00",
+        "fragments": [
+            {"path": "fragments/v000042-1f0c....parquet", "rows": 1000, "bytes": 89863,
+             "sources": {"CA Link Ratios 2Q2024.xlsx":
+                         {"fingerprint": "\\"...\\"", "version": 42, "rows": 500}}},
+            ...
+        ],
+        "tombstones": [
+            {"file_name": "CA Link Ratios 2Q2024.xlsx", "version": 41,
+             "fragment": "fragments/v000041-....parquet", "removed_in": 42,
+             "reason": "replaced"},
+            ...
+        ]
+    }
+
+One refresh (or compaction) writes to a dataset at a time, as with the
+single `data.parquet` upload.
+
+# Example:
+    # the refresh
+    folder_to_parquet(versioned=True, mirror_dir='refresh_mirror')
+
+    # quarter-end reporting, pinned to version 42 of a local copy
+    pin_version(storage, 'CIG Link Ratio Files/dataset', 42, '2Q2024 reserve review')
+    download_version(storage, 'CIG Link Ratio Files/dataset', 'dataset_copy', 42)
+    df = query_dataset('dataset_copy', version=42, lobs=['CA'])
+"""
+
+import hashlib
+import io
+import json
+import os
+import re
+import time
+
+from .instrumentation import count, stage
+from .storage import join_path
+
+# the folders of the dataset
+FRAGMENT_FOLDER = 'fragments'
+MANIFEST_FOLDER = 'manifests'
+
+# the format of the manifests
+MANIFEST_FORMAT = 1
+
+# the name of the dataset folder, in the refreshed sharepoint folder
+DEFAULT_DATASET_NAME = 'dataset'
+
+# the column of the version a row was written in
+VERSION_COLUMN = 'dataset_version'
+
+# the column of the workbook a row came from (see `folder_to_parquet.add_analysis_columns`)
+FILE_NAME_COLUMN = 'file_name'
+
+# the versions compaction keeps, besides the pinned ones
+DEFAULT_KEEP_VERSIONS = 8
+
+# the fragments compaction merges, besides those with tombstoned rows
+DEFAULT_SMALL_FRAGMENT_BYTES = 16 * 1024 * 1024
+
+# the names of the manifests and fragments
+# the file of the pinned versions, in the manifest folder
+PINS_FILE_NAME = 'pins.json'
+
+_MANIFEST_PATTERN = re.compile(r'^v(\d+)\.json$')
+_FRAGMENT_PATTERN = re.compile(r'^v(\d+)-[0-9a-f]+\.parquet$')
+
+
+def get_manifest_path(
+    dataset_folder: str,
+    version: int
+) -> str:
+    """
+    # Description:
+    Returns the storage path of the manifest of a version.
+    """
+    return join_path(join_path(dataset_folder, MANIFEST_FOLDER), f'v{version:06d}.json')
+
+
+def list_versions(
+    storage,
+    dataset_folder: str
+) -> list:
+    """
+    # Description:
+    This function lists the versions of a dataset, oldest first.
+
+    # Parameters:
+        storage: StorageBackend
+            this is the storage backend of the dataset
+        dataset_folder: str
+            this is the folder of the dataset
+
+    # Returns:
+        list
+            this is the list of version numbers, empty for a new dataset
+    """
+    try:
+        files = storage.list(join_path(dataset_folder, MANIFEST_FOLDER))
+    except FileNotFoundError:
+        return []
+    matches = (_MANIFEST_PATTERN.match(file.name) for file in files)
+    return sorted(int(match.group(1)) for match in matches if match is not None)
+
+
+def read_manifest(
+    storage,
+    dataset_folder: str,
+    version: int = None
+) -> dict:
+    """
+    # Description:
+    This function reads the manifest of a version of a dataset.
+
+    # Parameters:
+        storage: StorageBackend
+            this is the storage backend of the dataset
+        dataset_folder: str
+            this is the folder of the dataset
+        version: int
+            this is the version to read
+            defaults to None for the latest version
+
+    # Returns:
+        dict
+            this is the manifest, or None for a new dataset
+    """
+    if version is None:
+        versions = list_versions(storage, dataset_folder)
+        if len(versions) == 0:
+            return None
+        version = versions[-1]
+
+    with storage.open(get_manifest_path(dataset_folder, version)) as file:
+        return json.load(file)
+
+
+def read_pins(
+    storage,
+    dataset_folder: str
+) -> dict:
+    """
+    # Description:
+    This function reads the pinned versions of a dataset.
+
+    # Parameters:
+        storage: StorageBackend
+            this is the storage backend of the dataset
+        dataset_folder: str
+            this is the folder of the dataset
+
+    # Returns:
+        dict
+            this is the dict of pinned version to its pin (note, pinned time)
+    """
+    try:
+        pins_path = join_path(join_path(dataset_folder, MANIFEST_FOLDER), PINS_FILE_NAME)
+        with storage.open(pins_path) as file:
+            pins = json.load(file)
+    except FileNotFoundError:
+        return {}
+    return {int(version): pin for version, pin in pins['pins'].items()}
+
+
+def _write_pins(
+    storage,
+    dataset_folder: str,
+    pins: dict
+) -> None:
+    """
+    # Description:
+    Uploads the pinned versions of a dataset.
+    """
+    content = json.dumps({'format': MANIFEST_FORMAT,
+                          'pins': {str(version): pin for version, pin in sorted(pins.items())}},
+                         indent=1).encode('utf-8')
+    storage.upload(join_path(dataset_folder, MANIFEST_FOLDER), PINS_FILE_NAME, content)
+
+
+def pin_version(
+    storage,
+    dataset_folder: str,
+    version: int,
+    note: str = None
+) -> bool:
+    """
+    # Description:
+    This function pins a version of a dataset: no compaction expires it
+    until it is unpinned.
+
+    # Parameters:
+        storage: StorageBackend
+            this is the storage backend of the dataset
+        dataset_folder: str
+            this is the folder of the dataset
+        version: int
+            this is the version to pin
+        note: str
+            this is why the version is pinned, for example the report run on it
+            defaults to None
+
+    # Returns:
+        bool
+            False if the version was pinned already
+    """
+    if version not in list_versions(storage, dataset_folder):
+        raise FileNotFoundError(f'no version {version} in {dataset_folder!r}')
+
+    pins = read_pins(storage, dataset_folder)
+    if version in pins:
+        return False
+    pins[version] = {'note': note, 'pinned': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    _write_pins(storage, dataset_folder, pins)
+    return True
+
+
+def unpin_version(
+    storage,
+    dataset_folder: str,
+    version: int
+) -> bool:
+    """
+    # Description:
+    This function unpins a version of a dataset; the next compaction
+    expires it unless it is among the latest versions.
+
+    # Returns:
+        bool
+            False if the version was not pinned
+    """
+    pins = read_pins(storage, dataset_folder)
+    if pins.pop(version, None) is None:
+        return False
+    _write_pins(storage, dataset_folder, pins)
+    return True
+
+
+def get_live_sources(
+    manifest: dict
+) -> dict:
+    """
+    # Description:
+    This function returns the workbooks whose rows are live in a version.
+
+    # Parameters:
+        manifest: dict
+            this is the manifest, or None for a new dataset
+
+    # Returns:
+        dict
+            this is the dict of file name to its fragment path and its
+            source entry (fingerprint, version, rows)
+    """
+    if manifest is None:
+        return {}
+    return {file_name: (fragment['path'], source)
+            for fragment in manifest['fragments']
+            for file_name, source in fragment['sources'].items()}
+
+
+def get_unchanged_files(
+    manifest: dict,
+    files: list
+) -> set:
+    """
+    # Description:
+    This function returns the names of the files whose current version is
+    already live in a version of the dataset: a refresh does not read them.
+
+    # Parameters:
+        manifest: dict
+            this is the manifest of the latest version, or None for a new dataset
+        files: list
+            this is the `StorageFile`s of the refreshed folder
+
+    # Returns:
+        set
+            this is the set of file names
+    """
+    live = get_live_sources(manifest)
+    return {file.name for file in files
+            if file.name in live and live[file.name][1]['fingerprint'] == file.fingerprint}
+
+
+def _upload_fragment(
+    storage,
+    dataset_folder: str,
+    df,
+    version: int,
+    local_dir: str
+) -> dict:
+    """
+    # Description:
+    Writes the rows of a new fragment, sorted for the row-group statistics,
+    and uploads it under a name made of its version and the digest of its
+    contents. Returns the fragment entry of the manifest, without `sources`.
+    """
+    from .dataset_query import ROW_GROUP_SIZE, sort_for_pushdown
+
+    os.makedirs(local_dir, exist_ok=True)
+    local_path = os.path.join(local_dir, f'fragment-{os.getpid()}.parquet')
+    with stage('dataset.write_fragment') as span:
+        sort_for_pushdown(df).to_parquet(local_path, row_group_size=ROW_GROUP_SIZE)
+        with open(local_path, 'rb') as local_file:
+            content = local_file.read()
+        span.add(bytes=len(content), rows=len(df))
+    os.remove(local_path)
+
+    name = f'v{version:06d}-{hashlib.sha256(content).hexdigest()[:16]}.parquet'
+    fragment_folder = join_path(dataset_folder, FRAGMENT_FOLDER)
+    with stage('dataset.upload_fragment') as span:
+        storage.upload(fragment_folder, name, content)
+        span.add(bytes=len(content), rows=len(df))
+
+    return {'path': join_path(FRAGMENT_FOLDER, name), 'rows': len(df), 'bytes': len(content)}
+
+
+def _commit_version(
+    storage,
+    dataset_folder: str,
+    manifest: dict
+) -> None:
+    """
+    # Description:
+    Uploads the manifest of a new version, which makes the version visible.
+    """
+    content = json.dumps(manifest, indent=1).encode('utf-8')
+    with stage('dataset.commit', version=manifest['version']):
+        storage.upload(join_path(dataset_folder, MANIFEST_FOLDER),
+                       f"v{manifest['version']:06d}.json", content)
+
+
+def _get_kept_tombstones(
+    tombstones: list,
+    fragments: list
+) -> list:
+    """
+    # Description:
+    Returns the tombstones whose fragment is still in the version: the
+    tombstones of a fragment that left the version are not needed any more.
+    """
+    paths = {fragment['path'] for fragment in fragments}
+    return [tombstone for tombstone in tombstones if tombstone['fragment'] in paths]
+
+
+def write_version(
+    storage,
+    dataset_folder: str,
+    files: list,
+    dataframes: dict,
+    parent: dict = None,
+    local_dir: str = '.'
+) -> dict:
+    """
+    # Description:
+    This function writes a new version of the dataset from a refresh of its
+    folder: the rows of the files that were read are appended as one new
+    fragment, and the rows of the earlier versions of the files that were
+    read, or that are gone from the folder, are tombstoned. The unchanged
+    files stay where they are, and so do the last rows read from a file that
+    changed but could not be read this time, until a refresh reads it.
+    A file read without any rows is recorded too, so it is not read again
+    while it does not change.
+    Nothing is written when nothing changed.
+
+    # Parameters:
+        storage: StorageBackend
+            this is the storage backend of the dataset
+        dataset_folder: str
+            this is the folder of the dataset
+        files: list
+            this is the `StorageFile`s of the refreshed folder
+        dataframes: dict
+            this is the dict of file name to the dataframe read from it, for
+            the files the refresh read, empty dataframes included (the files
+            of `get_unchanged_files` are not read), as returned by
+            `get_dataframes_from_storage(..., by_file=True)`
+        parent: dict
+            this is the manifest of the latest version
+            defaults to None for a new dataset
+        local_dir: str
+            this is the folder of the temporary fragment file
+            defaults to '.'
+
+    # Returns:
+        dict
+            this is the manifest of the new version, or `parent` when
+            nothing changed
+    """
+    version = 1 if parent is None else parent['version'] + 1
+    fingerprints = {file.name: file.fingerprint for file in files}
+
+    # a new dataset: some backends (sharepoint) only upload into existing folders
+    if parent is None:
+        storage.ensure_folder(join_path(dataset_folder, FRAGMENT_FOLDER))
+        storage.ensure_folder(join_path(dataset_folder, MANIFEST_FOLDER))
+
+    # the rows of the earlier versions that are not live any more
+    tombstones = []
+    dead = {}
+    for file_name, (fragment_path, source) in get_live_sources(parent).items():
+        if file_name in dataframes:
+            reason = 'replaced'
+        elif file_name not in fingerprints:
+            reason = 'removed'
+
+        # the same version of the file is still live, or the new version
+        # could not be read: the rows last read from it stay live
+        else:
+            if fingerprints[file_name] != source['fingerprint']:
+                count('dataset.kept_unread', file=file_name)
+            continue
+        tombstones.append({'file_name': file_name, 'version': source['version'],
+                           'fragment': fragment_path, 'removed_in': version,
+                           'reason': reason})
+        dead.setdefault(fragment_path, set()).add(file_name)
+        count(f'dataset.{reason}', file=file_name)
+
+    # nothing changed
+    if len(dataframes) == 0 and len(tombstones) == 0:
+        count('dataset.unchanged')
+        return parent
+
+    # the fragments of the parent, without their tombstoned files
+    fragments = []
+    for fragment in ([] if parent is None else parent['fragments']):
+        sources = {file_name: source for file_name, source in fragment['sources'].items()
+                   if file_name not in dead.get(fragment['path'], ())}
+        if len(sources) > 0:
+            fragments.append(dict(fragment, sources=sources))
+
+    # the rows of the files that were read, as one new fragment
+    if len(dataframes) > 0:
+        from .output_tbl_schema import concat_output_tbls
+
+        df = concat_output_tbls(list(dataframes.values()))
+        df[VERSION_COLUMN] = version
+        df[VERSION_COLUMN] = df[VERSION_COLUMN].astype('int32')
+        fragment = _upload_fragment(storage, dataset_folder, df, version, local_dir)
+        fragment['sources'] = {file_name: {'fingerprint': fingerprints.get(file_name),
+                                           'version': version, 'rows': len(temp_df)}
+                               for file_name, temp_df in dataframes.items()}
+        fragments.append(fragment)
+        count('dataset.appended', len(dataframes))
+
+    manifest = {
+        'format': MANIFEST_FORMAT,
+        'version': version,
+        'parent': None if parent is None else parent['version'],
+        'operation': 'refresh',
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'fragments': fragments,
+        'tombstones': _get_kept_tombstones(
+            ([] if parent is None else parent['tombstones']) + tombstones, fragments),
+    }
+    _commit_version(storage, dataset_folder, manifest)
+    return manifest
+
+
+def _read_fragment(
+    storage,
+    dataset_folder: str,
+    fragment: dict,
+    tombstones: list
+):
+    """
+    # Description:
+    Reads the live rows of a fragment, without its tombstoned rows.
+    """
+    import pandas as pd
+
+    with storage.open(join_path(dataset_folder, fragment['path'])) as file:
+        df = pd.read_parquet(io.BytesIO(file.read()))
+
+    for tombstone in tombstones:
+        if tombstone['fragment'] == fragment['path']:
+            df = df[~((df[FILE_NAME_COLUMN] == tombstone['file_name'])
+                      & (df[VERSION_COLUMN] == tombstone['version']))]
+    return df
+
+
+def _expire_versions(
+    storage,
+    dataset_folder: str,
+    keep_versions: int,
+    pinned: list
+) -> dict:
+    """
+    # Description:
+    Removes the manifests of the versions that are neither among the latest
+    `keep_versions` nor pinned (in `pinned`, or in the pins of the dataset),
+    then the fragments no kept version uses.
+    """
+    versions = list_versions(storage, dataset_folder)
+    pinned = set(pinned) | set(read_pins(storage, dataset_folder))
+    kept = set(versions[-keep_versions:]) | (pinned & set(versions))
+    expired = [version for version in versions if version not in kept]
+
+    # the fragments the kept versions use
+    used = set()
+    for version in kept:
+        manifest = read_manifest(storage, dataset_folder, version)
+        used.update(fragment['path'] for fragment in manifest['fragments'])
+
+    # the manifests first, so no reader can find a version without its fragments
+    for version in expired:
+        storage.delete(get_manifest_path(dataset_folder, version))
+
+    # the fragments of the expired versions, but not those of a refresh
+    # that is writing a version newer than the latest
+    latest = versions[-1] if len(versions) > 0 else 0
+    removed_fragments = 0
+    removed_bytes = 0
+    for file in storage.list(join_path(dataset_folder, FRAGMENT_FOLDER)):
+        match = _FRAGMENT_PATTERN.match(file.name)
+        path = join_path(FRAGMENT_FOLDER, file.name)
+        if match is None or int(match.group(1)) > latest or path in used:
+            continue
+        storage.delete(join_path(dataset_folder, path))
+        removed_fragments += 1
+        removed_bytes += file.size
+
+    return {'expired_versions': expired, 'kept_versions': sorted(kept),
+            'removed_fragments': removed_fragments, 'removed_bytes': removed_bytes}
+
+
+def compact_dataset(
+    storage,
+    dataset_folder: str,
+    keep_versions: int = DEFAULT_KEEP_VERSIONS,
+    pinned: list = None,
+    small_fragment_bytes: int = DEFAULT_SMALL_FRAGMENT_BYTES,
+    local_dir: str = '.'
+) -> dict:
+    """
+    # Description:
+    This function compacts a dataset: the small fragments of the latest
+    version, and its fragments with tombstoned rows, are merged into one
+    fragment without the tombstoned rows, as a new version with the same
+    rows; then the versions that are neither among the latest
+    `keep_versions` nor pinned (see `pin_version`) are expired, with the
+    fragments no kept version uses.
+
+    # Parameters:
+        storage: StorageBackend
+            this is the storage backend of the dataset
+        dataset_folder: str
+            this is the folder of the dataset
+        keep_versions: int
+            this is the number of latest versions to keep, at least 1
+            defaults to 8
+        pinned: list
+            this is the list of versions to keep this time, on top of the
+            pinned versions of the dataset, which are always kept
+            defaults to None for none
+        small_fragment_bytes: int
+            this is the size under which a fragment is merged
+            defaults to 16 MB
+        local_dir: str
+            this is the folder of the temporary fragment file
+            defaults to '.'
+
+    # Returns:
+        dict
+            this is the summary: the `version` after compaction, the
+            number of `merged_fragments`, and the expired versions and
+            removed fragments
+    """
+    if keep_versions < 1:
+        raise ValueError(f'keep_versions must be at least 1, not {keep_versions}')
+
+    manifest = read_manifest(storage, dataset_folder)
+    if manifest is None:
+        raise FileNotFoundError(f'no dataset versions in {dataset_folder!r}')
+
+    # the fragments to merge
+    tombstoned = {tombstone['fragment'] for tombstone in manifest['tombstones']}
+    merged = [fragment for fragment in manifest['fragments']
+              if fragment['path'] in tombstoned or fragment['bytes'] < small_fragment_bytes]
+    if len(merged) < 2 and len(tombstoned) == 0:
+        merged = []
+
+    # merge them as a new version
+    if len(merged) > 0:
+        from .output_tbl_schema import concat_output_tbls
+
+        with stage('dataset.compact', fragments=len(merged)) as span:
+            df = concat_output_tbls([_read_fragment(storage, dataset_folder, fragment,
+                                                    manifest['tombstones'])
+                                     for fragment in merged])
+            span.add(rows=len(df))
+        version = manifest['version'] + 1
+        fragment = _upload_fragment(storage, dataset_folder, df, version, local_dir)
+        fragment['sources'] = {file_name: source for old_fragment in merged
+                               for file_name, source in old_fragment['sources'].items()}
+
+        merged_paths = {old_fragment['path'] for old_fragment in merged}
+        fragments = [old_fragment for old_fragment in manifest['fragments']
+                     if old_fragment['path'] not in merged_paths] + [fragment]
+        manifest = {
+            'format': MANIFEST_FORMAT,
+            'version': version,
+            'parent': manifest['version'],
+            'operation': 'compact',
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'fragments': fragments,
+            'tombstones': _get_kept_tombstones(manifest['tombstones'], fragments),
+        }
+        _commit_version(storage, dataset_folder, manifest)
+
+    summary = {'version': manifest['version'], 'merged_fragments': len(merged)}
+    summary.update(_expire_versions(storage, dataset_folder, keep_versions, pinned or []))
+    return summary
+
+
+def download_version(
+    storage,
+    dataset_folder: str,
+    local_dir: str,
+    version: int = None
+) -> int:
+    """
+    # Description:
+    This function copies a version of a dataset to a local folder, for
+    `open_version` and `dataset_query`. The fragments never change once
+    written, so only the fragments the local folder does not have yet are
+    copied.
+
+    # Parameters:
+        storage: StorageBackend
+            this is the storage backend of the dataset
+        dataset_folder: str
+            this is the folder of the dataset
+        local_dir: str
+            this is the local folder
+        version: int
+            this is the version to copy
+            defaults to None for the latest version
+
+    # Returns:
+        int
+            this is the version copied
+    """
+    manifest = read_manifest(storage, dataset_folder, version)
+    if manifest is None:
+        raise FileNotFoundError(f'no dataset versions in {dataset_folder!r}')
+
+    for fragment in manifest['fragments']:
+        local_path = os.path.join(local_dir, *fragment['path'].split('/'))
+        if os.path.exists(local_path):
+            continue
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        with stage('dataset.download_fragment') as span:
+            with storage.open(join_path(dataset_folder, fragment['path'])) as file:
+                content = file.read()
+            with open(local_path + '.tmp', 'wb') as local_file:
+                local_file.write(content)
+            os.replace(local_path + '.tmp', local_path)
+            span.add(bytes=len(content))
+
+    # the manifest last, as on the storage
+    manifest_path = os.path.join(local_dir, MANIFEST_FOLDER, f"v{manifest['version']:06d}.json")
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    with open(manifest_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=1)
+    return manifest['version']
+
+
+def is_versioned_dataset(
+    path: str
+) -> bool:
+    """
+    # Description:
+    Returns whether a local path is the folder of a versioned dataset.
+    """
+    return os.path.isdir(os.path.join(path, MANIFEST_FOLDER))
+
+
+def open_version(
+    path: str,
+    version: int = None
+):
+    """
+    # Description:
+    This function opens a version of a local versioned dataset as a lazy
+    `pyarrow.dataset.Dataset` of its live rows, for the filters and
+    projections of `dataset_query`.
+
+    # Parameters:
+        path: str
+            this is the local folder of the dataset
+        version: int
+            this is the version to open
+            defaults to None for the latest version
+
+    # Returns:
+        pyarrow.dataset.Dataset
+            this is the lazily opened dataset, without the tombstoned rows
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    from .storage import LocalBackend
+
+    manifest = read_manifest(LocalBackend(path), '', version)
+    if manifest is None:
+        raise FileNotFoundError(f'no dataset versions in {path!r}')
+
+    # the fragments can have different columns (file types) and dictionary
+    # index widths, so their schemas are unified from the parquet footers
+    paths = [os.path.join(path, *fragment['path'].split('/'))
+             for fragment in manifest['fragments']]
+    if len(paths) == 0:
+        return ds.dataset([], schema=pa.schema([]))
+    schema = pa.unify_schemas([pq.read_schema(fragment_path) for fragment_path in paths],
+                              promote_options='permissive').remove_metadata()
+    dataset = ds.dataset(paths, schema=schema, format='parquet')
+
+    # leave out the tombstoned rows, by version
+    versions = {}
+    for tombstone in manifest['tombstones']:
+        versions.setdefault(tombstone['version'], set()).add(tombstone['file_name'])
+    for tombstone_version, file_names in versions.items():
+        dataset = dataset.filter(~((ds.field(VERSION_COLUMN) == tombstone_version)
+                                   & ds.field(FILE_NAME_COLUMN).isin(sorted(file_names))))
+    return dataset
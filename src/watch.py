@@ -0,0 +1,471 @@
+"""
+# Description:
+Watch mode: refresh only what changed, when it changed.
+
+Instead of a refresh on a timer, a watcher polls a change feed:
+    SharePointChangeSource: the change log of the sharepoint folder
+        (GetChanges), from the change token saved after the last refresh
+    LocalChangeSource: the modification times and sizes of the workbooks
+        of a local share (O:), walked with `find_cig_files`
+
+The changes are collected by a `Debouncer` until the folder has been quiet
+for `quiet_seconds` (or the first change has waited `max_wait_seconds`), so a
+burst of saves during close week triggers one refresh, not twenty. Then:
+    sharepoint: an incremental `folder_to_parquet` run, which downloads and
+        parses only the files whose fingerprint changed and re-publishes
+        the combined parquet file
+    local share: the changed workbooks are parsed again, and only the
+        `analysis_idx` partitions they belong to are rewritten in the
+        hive-partitioned publish folder (see `dataset_query.get_dataset`)
+
+The position in the change feed (the change token, or the modification
+times) is saved in the run journal once the changes up to it are
+processed, so a watcher that is restarted, or whose refresh failed, picks up
+the same changes again.
+
+# Example:
+    journal = open_journal()
+    source = LocalChangeSource('O:/', journal)
+    watch(source, LocalPartitionPublisher('published', journal, source))
+"""
+
+import json
+import os
+import shutil
+import time
+import zlib
+
+from .folder_to_parquet import (EXCEL_EXTENSIONS, folder_to_parquet, get_analysis_idx,
+                                get_dataframe_from_file)
+from .instrumentation import count, stage
+from .run_journal import (DEFAULT_MAX_FAILURES, DEFAULT_WORK_DIR, finish_run,
+                          get_completed_stage, get_watch_state, is_quarantined, record_failure,
+                          record_stage, release_if_changed, set_watch_state, start_run)
+
+# seconds between two polls of the change feed
+DEFAULT_POLL_INTERVAL = 30
+
+# seconds without a new change before the changes are processed
+DEFAULT_QUIET_SECONDS = 120
+
+# seconds the first change of a burst may wait, however busy the folder is
+DEFAULT_MAX_WAIT_SECONDS = 900
+
+
+class Debouncer:
+    """
+    # Description:
+    Collects the changed and deleted files of successive polls, and tells
+    when the burst of changes is over.
+    """
+
+    def __init__(self, quiet_seconds=DEFAULT_QUIET_SECONDS,
+                 max_wait_seconds=DEFAULT_MAX_WAIT_SECONDS):
+        self.quiet_seconds = quiet_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.changed = set()
+        self.deleted = set()
+        self.first_change = None
+        self.last_change = None
+
+    def add(self, changed, deleted, now):
+        """
+        # Description:
+        Adds the changes of a poll. A file changed after it was deleted is
+        changed, a file deleted after it changed is deleted.
+        """
+        if len(changed) == 0 and len(deleted) == 0:
+            return
+        self.changed = (self.changed - set(deleted)) | set(changed)
+        self.deleted = (self.deleted - set(changed)) | set(deleted)
+        if self.first_change is None:
+            self.first_change = now
+        self.last_change = now
+
+    def is_ready(self, now):
+        """
+        # Description:
+        True when there are changes, and the folder has been quiet long
+        enough or the oldest change waited long enough.
+        """
+        if self.first_change is None:
+            return False
+        return (now - self.last_change >= self.quiet_seconds
+                or now - self.first_change >= self.max_wait_seconds)
+
+    def take(self):
+        """
+        # Description:
+        Returns the collected (changed, deleted) files, and starts over.
+        """
+        changes = (self.changed, self.deleted)
+        self.changed, self.deleted = set(), set()
+        self.first_change = self.last_change = None
+        return changes
+
+
+class LocalChangeSource:
+    """
+    # Description:
+    Change feed of the workbooks of a local folder tree, from their
+    modification times and sizes. The first poll, without a saved state,
+    reports every workbook as changed. `extensions` is an extension or a
+    tuple of extensions, every excel extension by default.
+    """
+
+    def __init__(self, root, journal, extensions=EXCEL_EXTENSIONS):
+        self.root = root
+        self.journal = journal
+        self.extensions = extensions
+        self.key = 'local:' + os.path.abspath(root)
+        saved = get_watch_state(journal, self.key)
+        self.state = {} if saved is None else json.loads(saved)
+
+    def get_files(self):
+        """
+        # Description:
+        Returns {path: [modification time, size]} of the workbooks in the tree.
+        """
+        from .find_cig_files import find_files_with_extension
+
+        files = {}
+        for path in find_files_with_extension(self.root, self.extensions):
+            try:
+                status = os.stat(path)
+            except OSError:
+                # deleted while walking
+                continue
+            files[path] = [status.st_mtime, status.st_size]
+        return files
+
+    def poll(self):
+        """
+        # Description:
+        Returns the (changed, deleted) files since the previous poll.
+        """
+        files = self.get_files()
+        changed = {path for path, signature in files.items()
+                   if self.state.get(path) != signature}
+        deleted = set(self.state) - set(files)
+        self.state = files
+        return changed, deleted
+
+    def get_fingerprint(self, path):
+        """
+        # Description:
+        Returns the fingerprint of a file, as recorded in the run journal.
+        """
+        modified, size = self.state[path]
+        return f'{size}:{modified}'
+
+    def commit(self):
+        """
+        # Description:
+        Saves the current state, once the changes up to it are processed.
+        """
+        set_watch_state(self.journal, self.key, json.dumps(self.state))
+
+
+def get_change_token_value(
+    token
+) -> str:
+    """
+    # Description:
+    This function returns the string value of a change token, which is what
+    the run journal keeps and what a `ChangeToken` is restored from.
+
+    # Parameters:
+        token: ChangeToken, dict or str
+            this is the change token of a change, as the change log gives it
+
+    # Returns:
+        str
+            this is the string value, or None without a token
+    """
+    if isinstance(token, dict):
+        token = token.get('StringValue')
+    elif token is not None and not isinstance(token, str):
+        token = getattr(token, 'StringValue', None)
+    return token or None
+
+
+class SharePointChangeSource:
+    """
+    # Description:
+    Change feed of a sharepoint folder, from its change log. The change
+    token of the last processed change is saved in the run journal.
+    The first poll, without a saved token, reads the whole change log and
+    reports a change, so that the first refresh brings everything up to date.
+    """
+
+    def __init__(self, client_context, folder, journal):
+        self.client_context = client_context
+        self.folder = folder
+        self.journal = journal
+        self.key = 'sharepoint:' + folder
+
+        # the string value of the change token, as saved in the run journal
+        self.token = get_watch_state(journal, self.key)
+        self.pending_token = self.token
+
+    def poll(self):
+        """
+        # Description:
+        Returns the (changed, deleted) file names since the previous poll.
+        A change whose file name the change log does not give is reported as
+        the folder name, which makes the refresh check every file.
+        """
+        from office365.sharepoint.changes.query import ChangeQuery
+        from office365.sharepoint.changes.token import ChangeToken
+        from office365.sharepoint.changes.type import ChangeType
+
+        query = ChangeQuery(
+            Item=True, File=True, Add=True, Update=True, DeleteObject=True,
+            Rename=True, Move=True, Restore=True,
+            ChangeTokenStart=(None if not self.pending_token
+                              else ChangeToken(StringValue=self.pending_token)))
+        folder = self.client_context.web.get_folder_by_server_relative_url(self.folder)
+        changes = folder.get_changes(query)
+        self.client_context.execute_query()
+
+        changed, deleted = set(), set()
+        for change in changes:
+            token = get_change_token_value(change.properties.get('ChangeToken'))
+            if token:
+                self.pending_token = token
+
+            url = change.properties.get('ServerRelativeUrl')
+            name = os.path.basename(url) if url else self.folder
+            change_type = change.properties.get('ChangeType')
+            change_type = getattr(change_type, 'value', change_type)
+            if change_type in (ChangeType.DeleteObject.value, ChangeType.MoveAway.value):
+                deleted.add(name)
+            else:
+                changed.add(name)
+
+        # never watched: bring everything up to date
+        if self.token is None and len(changed) == 0 and len(deleted) == 0:
+            changed.add(self.folder)
+        if self.token is None:
+            self.token = self.pending_token or ''
+        return changed, deleted
+
+    def commit(self):
+        """
+        # Description:
+        Saves the change token, once the changes up to it are processed.
+        """
+        if self.pending_token:
+            set_watch_state(self.journal, self.key, self.pending_token)
+
+
+class SharePointRefresher:
+    """
+    # Description:
+    Processes the changes of a sharepoint folder with an incremental
+    `folder_to_parquet` run: only the files whose fingerprint changed are
+    downloaded and parsed, and the combined parquet file is re-published.
+    """
+
+    def __init__(self, **refresh_options):
+        self.refresh_options = dict(refresh_options, incremental=True)
+
+    def __call__(self, changed, deleted):
+        folder_to_parquet(**self.refresh_options)
+
+
+class LocalPartitionPublisher:
+    """
+    # Description:
+    Processes the changes of a local folder tree: parses the changed
+    workbooks again, and rewrites only the `analysis_idx` partitions they
+    (and the deleted workbooks) belong to, in a hive-partitioned folder
+    `publish_dir/analysis_idx=<n>/part-0.parquet`.
+    The parsed workbooks are kept in `work_dir`, so the unchanged workbooks
+    of a rewritten partition are not parsed again.
+    """
+
+    def __init__(self, publish_dir, journal, source,
+                 work_dir=DEFAULT_WORK_DIR, max_failures=DEFAULT_MAX_FAILURES):
+        self.publish_dir = publish_dir
+        self.journal = journal
+        self.source = source
+        self.work_dir = work_dir
+        self.max_failures = max_failures
+
+    def get_parsed_path(self, path):
+        """
+        # Description:
+        Returns where the parsed dataframe of a workbook is kept.
+        """
+        key = f'{zlib.crc32(path.encode("utf-8")):08x}'
+        return os.path.join(self.work_dir, 'parsed', f'{key}-{os.path.basename(path)}.parquet')
+
+    def read_file(self, path, run_id):
+        """
+        # Description:
+        Returns the dataframe of a workbook, parsed again only if it changed.
+        """
+        import pandas as pd
+
+        fingerprint = self.source.get_fingerprint(path)
+        parsed = get_completed_stage(self.journal, path, 'parse', fingerprint)
+        if parsed is not None:
+            return None if parsed['output_path'] is None else pd.read_parquet(
+                parsed['output_path'])
+
+        with stage('parse', file=path) as span:
+            df = get_dataframe_from_file(path)
+            span.add(bytes=os.path.getsize(path), rows=0 if df is None else len(df))
+
+        parsed_path = None
+        if df is not None:
+            parsed_path = self.get_parsed_path(path)
+            os.makedirs(os.path.dirname(parsed_path), exist_ok=True)
+            df.to_parquet(parsed_path)
+        record_stage(self.journal, run_id, path, 'parse', fingerprint, parsed_path)
+        return df
+
+    def write_partition(self, analysis_idx, dataframes):
+        """
+        # Description:
+        Replaces a partition with the given dataframes, or removes it.
+        """
+        from .dataset_query import ANALYSIS_IDX_COLUMN, ROW_GROUP_SIZE, sort_for_pushdown
+        from .output_tbl_schema import concat_output_tbls
+
+        partition_dir = os.path.join(self.publish_dir, f'{ANALYSIS_IDX_COLUMN}={analysis_idx}')
+        if len(dataframes) == 0:
+            shutil.rmtree(partition_dir, ignore_errors=True)
+            return
+
+        # the partition value is in the folder name, not in the file
+        df = sort_for_pushdown(concat_output_tbls(dataframes))
+        df = df.drop(columns=[ANALYSIS_IDX_COLUMN])
+
+        # write next to the partition and swap, so readers never see half a file
+        os.makedirs(partition_dir, exist_ok=True)
+        part_path = os.path.join(partition_dir, 'part-0.parquet')
+        with stage('publish_partition', analysis_idx=analysis_idx) as span:
+            df.to_parquet(part_path + '.tmp', row_group_size=ROW_GROUP_SIZE)
+            os.replace(part_path + '.tmp', part_path)
+            span.add(bytes=os.path.getsize(part_path), rows=len(df))
+
+    def __call__(self, changed, deleted):
+        # the partitions to rewrite
+        partitions = {get_analysis_idx(path) for path in set(changed) | set(deleted)}
+        if None in partitions:
+            partitions.discard(None)
+            print("Skipping the files without a year and quarter in their name")
+
+        # every current workbook of those partitions, but the quarantined
+        # ones, like `folder_to_parquet.get_files_to_read`
+        members = {analysis_idx: [] for analysis_idx in partitions}
+        for path in sorted(self.source.state):
+            if not path.lower().endswith(EXCEL_EXTENSIONS):
+                continue
+            analysis_idx = get_analysis_idx(path)
+            if analysis_idx not in members:
+                continue
+
+            # a quarantined workbook that was fixed gets a fresh start
+            fingerprint = self.source.get_fingerprint(path)
+            if release_if_changed(self.journal, path, fingerprint):
+                print("Released changed file from quarantine:", path)
+                count('file.quarantine_released', file=path)
+            if is_quarantined(self.journal, path, fingerprint):
+                print("Skipping quarantined file:", path)
+                count('file.quarantine_skipped', file=path)
+                continue
+            members[analysis_idx].append(path)
+
+        run_id = start_run(self.journal)
+        for analysis_idx, paths in sorted(members.items()):
+            dataframes = []
+            for path in paths:
+                try:
+                    df = self.read_file(path, run_id)
+                except Exception as error:
+                    # the partition is published without the workbook
+                    quarantined = record_failure(
+                        self.journal, run_id, path, 'parse', repr(error),
+                        self.source.get_fingerprint(path), self.max_failures)
+                    print("Failed to read file:", path, repr(error))
+                    count('file.failed', file=path)
+                    if quarantined:
+                        print("Quarantined file:", path)
+                        count('file.quarantined', file=path)
+                    continue
+                if df is not None:
+                    dataframes.append(df)
+            self.write_partition(analysis_idx, dataframes)
+        finish_run(self.journal, run_id)
+        print("Re-published partitions:", sorted(members))
+
+
+def watch(
+    source,
+    handle_changes,
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+    quiet_seconds: float = DEFAULT_QUIET_SECONDS,
+    max_wait_seconds: float = DEFAULT_MAX_WAIT_SECONDS,
+    max_polls: int = None
+) -> None:
+    """
+    # Description:
+    This function polls a change source, debounces the changes, and hands
+    each burst of changes to `handle_changes`. The position in the change
+    feed is saved once `handle_changes` returns; if it raises, the changes
+    are kept and handed over again after the next poll.
+
+    # Parameters:
+        source: LocalChangeSource or SharePointChangeSource
+            this is the change feed
+        handle_changes: callable
+            this is called with the (changed, deleted) files of a burst,
+            for example a `LocalPartitionPublisher` or a `SharePointRefresher`
+        poll_interval: float
+            this is the number of seconds between two polls
+            defaults to 30
+        quiet_seconds: float
+            this is the number of seconds without a new change before the
+            changes are processed
+            defaults to 120
+        max_wait_seconds: float
+            this is the number of seconds the oldest change may wait
+            defaults to 900
+        max_polls: int
+            this is the number of polls before returning
+            defaults to None to watch until interrupted
+
+    # Returns:
+        None
+    """
+    debouncer = Debouncer(quiet_seconds, max_wait_seconds)
+    polls = 0
+    while max_polls is None or polls < max_polls:
+        with stage('watch.poll') as span:
+            changed, deleted = source.poll()
+            span.add(changed=len(changed), deleted=len(deleted))
+        if len(changed) > 0 or len(deleted) > 0:
+            count('watch.changes', len(changed) + len(deleted))
+        now = time.monotonic()
+        debouncer.add(changed, deleted, now)
+
+        if debouncer.is_ready(now):
+            changed, deleted = debouncer.take()
+            print(f"Processing {len(changed)} changed and {len(deleted)} deleted file(s)")
+            try:
+                with stage('watch.refresh'):
+                    handle_changes(changed, deleted)
+            except Exception as error:
+                # keep the changes for the next attempt, without saving the position
+                print("Refresh failed, retrying after the next poll:", repr(error))
+                count('watch.failed')
+                debouncer.add(changed, deleted, now - quiet_seconds)
+            else:
+                source.commit()
+
+        polls += 1
+        if max_polls is None or polls < max_polls:
+            time.sleep(poll_interval)
@@ -0,0 +1,747 @@
+"""
+# Description:
+Work queue for the parse stage of `folder_to_parquet`, so a refresh can use
+the cores of several processes or machines.
+
+The queue is a SQLite database in the work folder, so it needs no service:
+every process that can open the work folder (this host, or other hosts that
+mount the same share) can work on it.
+
+    coordinator (`folder_to_parquet(work_queue=True)`):
+        lists the folder, downloads the new and changed files to the work
+        folder (see the `storage` module), and queues one parse task per file as soon as it is
+        downloaded; then waits for the tasks, records them in the run
+        journal, and combines the parsed fragments into the dataset it uploads
+    workers (`run_worker`, or `reserving_dashboard_update worker`):
+        claim a task with a lease, parse the file, write its dataframe as a
+        parquet fragment in the work folder, and report back
+
+A worker renews the lease of its task while it parses. A task whose lease
+ran out (its worker died, or lost the share) goes back to the queue, up to
+`max_attempts` claims; a file that cannot be parsed fails once, and the run
+journal counts the failure towards its quarantine as usual. The coordinator
+expires the leases too, and watches its local workers: the tasks of a
+local worker that died go back to the queue at once, and the run fails when
+every local worker died with tasks left (with no local worker, the run
+waits for the workers of the other hosts).
+
+The paths of the tasks are relative to the work folder, so hosts that mount
+the share at different places see the same files. The files of a local or
+mirrored backend are parsed where they are, so with several hosts keep the
+mirror in the shared work folder. The leases use the clock
+of each host: keep the hosts in time, and the lease much longer than the
+clock difference.
+
+# Tables:
+    tasks: one row per run and file (status pending, claimed, done or failed)
+
+# Example:
+    # on any number of hosts sharing //server/refresh_work
+    run_worker('//server/refresh_work')
+"""
+
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from .instrumentation import count, gauge
+from .run_journal import DEFAULT_MAX_FAILURES, DEFAULT_WORK_DIR, record_stage
+
+# the file name of the queue, in the work folder
+QUEUE_FILE_NAME = 'work_queue.sqlite'
+
+# seconds a claimed task belongs to its worker without a renewal
+DEFAULT_LEASE_SECONDS = 300
+
+# number of times a task is claimed before its file is given up
+DEFAULT_MAX_ATTEMPTS = 3
+
+# seconds between two looks at the queue
+DEFAULT_POLL_INTERVAL = 2.0
+
+_SCHEMA = """
+create table if not exists tasks (
+    task_id integer primary key,
+    run_id text not null,
+    file_key text not null,
+    fingerprint text,
+    input_path text not null,
+    output_path text,
+    status text not null,
+    worker text,
+    lease_expires real,
+    attempts integer not null default 0,
+    rows integer,
+    bytes integer,
+    seconds real,
+    error text,
+    updated_at real not null,
+    unique (run_id, file_key)
+);
+create index if not exists tasks_status on tasks (status, lease_expires);
+"""
+
+
+def open_work_queue(
+    work_dir: str = DEFAULT_WORK_DIR
+) -> sqlite3.Connection:
+    """
+    # Description:
+    This function opens the work queue of a work folder, creating it if needed.
+
+    # Parameters:
+        work_dir: str
+            this is the work folder shared by the coordinator and the workers
+            defaults to './refresh_work'
+
+    # Returns:
+        sqlite3.Connection
+            this is the connection to the queue
+    """
+    os.makedirs(work_dir, exist_ok=True)
+
+    # autocommit, and a long timeout: the workers of every host take turns
+    # on the same database file
+    connection = sqlite3.connect(
+        os.path.join(work_dir, QUEUE_FILE_NAME), isolation_level=None, timeout=60)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def get_worker_id(
+    pid: int = None
+) -> str:
+    """
+    # Description:
+    Returns the id of a worker process: the host name and the process id,
+    of this process by default.
+    """
+    return f'{socket.gethostname()}:{os.getpid() if pid is None else pid}'
+
+
+def clear_other_runs(
+    queue: sqlite3.Connection,
+    run_id: str
+) -> None:
+    """
+    # Description:
+    This function removes the tasks of the runs other than `run_id`, which
+    nobody will collect any more.
+    """
+    queue.execute("delete from tasks where run_id != ?", (run_id,))
+
+
+def enqueue_task(
+    queue: sqlite3.Connection,
+    run_id: str,
+    file_key: str,
+    fingerprint: str,
+    input_path: str,
+    output_path: str
+) -> None:
+    """
+    # Description:
+    This function queues the parse of a file. A task this run already
+    completed for the same version of the file is kept as it is, so a
+    resumed coordinator does not parse it again.
+
+    # Parameters:
+        queue: sqlite3.Connection
+            this is the connection to the queue
+        run_id: str
+            this is the run id
+        file_key: str
+            this is the key of the file, its name
+        fingerprint: str
+            this is the fingerprint of the file
+        input_path: str
+            this is the path of the file to parse, relative to the work folder
+        output_path: str
+            this is the path of the fragment to write, relative to the work folder
+
+    # Returns:
+        None
+    """
+    queue.execute(
+        "insert into tasks (run_id, file_key, fingerprint, input_path, output_path, "
+        "status, updated_at) values (?, ?, ?, ?, ?, 'pending', ?) "
+        "on conflict (run_id, file_key) do update set "
+        "fingerprint = excluded.fingerprint, input_path = excluded.input_path, "
+        "output_path = excluded.output_path, status = 'pending', worker = null, "
+        "lease_expires = null, attempts = 0, error = null, updated_at = excluded.updated_at "
+        "where tasks.status != 'done' or tasks.fingerprint is not excluded.fingerprint",
+        (run_id, file_key, fingerprint, input_path, output_path, time.time()))
+
+
+def expire_leases(
+    queue: sqlite3.Connection,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    worker_id: str = None
+) -> int:
+    """
+    # Description:
+    This function puts the claimed tasks whose lease ran out back in the
+    queue, and fails the ones whose lease ran out `max_attempts` times.
+
+    # Parameters:
+        queue: sqlite3.Connection
+            this is the connection to the queue
+        max_attempts: int
+            this is the number of claims before a task is failed
+            defaults to 3
+        worker_id: str
+            this is a worker known to be dead, whose leases run out now
+            defaults to None
+
+    # Returns:
+        int
+            this is the number of tasks expired
+    """
+    now = time.time()
+    lease_expired = "status = 'claimed' and (lease_expires < ? or worker is ?)"
+
+    # give up the tasks whose workers keep dying
+    failed = queue.execute(
+        "update tasks set status = 'failed', worker = null, lease_expires = null, "
+        "error = 'the lease ran out ' || attempts || ' times', updated_at = ? "
+        f"where {lease_expired} and attempts >= ?",
+        (now, now, worker_id, max_attempts)).rowcount
+
+    # and queue the others again
+    requeued = queue.execute(
+        "update tasks set status = 'pending', worker = null, lease_expires = null, "
+        f"updated_at = ? where {lease_expired}",
+        (now, now, worker_id)).rowcount
+    return failed + requeued
+
+
+def claim_task(
+    queue: sqlite3.Connection,
+    worker_id: str,
+    lease_seconds: float = DEFAULT_LEASE_SECONDS,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS
+) -> dict:
+    """
+    # Description:
+    This function claims the next task for a worker: a pending task, or a
+    claimed task whose lease ran out. A task whose lease ran out
+    `max_attempts` times is failed instead.
+
+    # Parameters:
+        queue: sqlite3.Connection
+            this is the connection to the queue
+        worker_id: str
+            this is the id of the worker
+        lease_seconds: float
+            this is the number of seconds the task belongs to the worker
+            defaults to 300
+        max_attempts: int
+            this is the number of claims before a task is failed
+            defaults to 3
+
+    # Returns:
+        dict
+            this is the task, or None when there is nothing to do
+    """
+    now = time.time()
+
+    # one claim at a time, over every process of every host
+    queue.execute("begin immediate")
+    try:
+        expire_leases(queue, max_attempts)
+        task = queue.execute(
+            "select * from tasks where status = 'pending' "
+            "order by task_id limit 1").fetchone()
+        if task is not None:
+            queue.execute(
+                "update tasks set status = 'claimed', worker = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated_at = ? where task_id = ?",
+                (worker_id, now + lease_seconds, now, task['task_id']))
+        queue.execute("commit")
+    except BaseException:
+        queue.execute("rollback")
+        raise
+
+    if task is None:
+        return None
+    return dict(task, status='claimed', worker=worker_id, lease_expires=now + lease_seconds,
+                attempts=task['attempts'] + 1)
+
+
+def renew_lease(
+    queue: sqlite3.Connection,
+    task_id: int,
+    worker_id: str,
+    lease_seconds: float = DEFAULT_LEASE_SECONDS
+) -> bool:
+    """
+    # Description:
+    This function extends the lease of a task the worker is still working on.
+
+    # Returns:
+        bool
+            False if the task no longer belongs to the worker
+    """
+    cursor = queue.execute(
+        "update tasks set lease_expires = ?, updated_at = ? "
+        "where task_id = ? and worker = ? and status = 'claimed'",
+        (time.time() + lease_seconds, time.time(), task_id, worker_id))
+    return cursor.rowcount == 1
+
+
+def complete_task(
+    queue: sqlite3.Connection,
+    task_id: int,
+    worker_id: str,
+    rows: int,
+    size: int,
+    seconds: float,
+    has_output: bool = True
+) -> bool:
+    """
+    # Description:
+    This function reports that a worker parsed the file of its task.
+
+    # Parameters:
+        queue: sqlite3.Connection
+            this is the connection to the queue
+        task_id: int
+            this is the task
+        worker_id: str
+            this is the id of the worker
+        rows: int
+            this is the number of rows parsed
+        size: int
+            this is the size of the file, in bytes
+        seconds: float
+            this is the parse time
+        has_output: bool
+            if False, the file has no output and no fragment was written
+            defaults to True
+
+    # Returns:
+        bool
+            False if the task no longer belonged to the worker: another
+            worker claimed it after the lease ran out, and reports it
+    """
+    cursor = queue.execute(
+        "update tasks set status = 'done', lease_expires = null, rows = ?, bytes = ?, "
+        "seconds = ?, output_path = case when ? then output_path end, updated_at = ? "
+        "where task_id = ? and worker = ? and status = 'claimed'",
+        (rows, size, seconds, has_output, time.time(), task_id, worker_id))
+    return cursor.rowcount == 1
+
+
+def fail_task(
+    queue: sqlite3.Connection,
+    task_id: int,
+    worker_id: str,
+    error: str
+) -> bool:
+    """
+    # Description:
+    This function reports that a worker could not parse the file of its task.
+    The file is not retried in this run: the run journal counts the failure
+    towards its quarantine.
+
+    # Returns:
+        bool
+            False if the task no longer belonged to the worker
+    """
+    cursor = queue.execute(
+        "update tasks set status = 'failed', lease_expires = null, error = ?, "
+        "updated_at = ? where task_id = ? and worker = ? and status = 'claimed'",
+        (error, time.time(), task_id, worker_id))
+    return cursor.rowcount == 1
+
+
+def get_queue_counts(
+    queue: sqlite3.Connection,
+    run_id: str = None
+) -> dict:
+    """
+    # Description:
+    This function counts the tasks per status.
+
+    # Parameters:
+        queue: sqlite3.Connection
+            this is the connection to the queue
+        run_id: str
+            this is the run id
+            defaults to None for every run
+
+    # Returns:
+        dict
+            this is the number of tasks per status
+    """
+    counts = {'pending': 0, 'claimed': 0, 'done': 0, 'failed': 0}
+    rows = queue.execute(
+        "select status, count(*) as tasks from tasks "
+        "where ? is null or run_id = ? group by status", (run_id, run_id)).fetchall()
+    for row in rows:
+        counts[row['status']] = row['tasks']
+    return counts
+
+
+def _keep_lease(work_dir, task_id, worker_id, lease_seconds, stop):
+    # renew the lease a few times per lease, on a connection of its own
+    queue = open_work_queue(work_dir)
+    try:
+        while not stop.wait(lease_seconds / 3):
+            if not renew_lease(queue, task_id, worker_id, lease_seconds):
+                return
+    finally:
+        queue.close()
+
+
+def process_task(
+    work_dir: str,
+    queue: sqlite3.Connection,
+    task: dict,
+    worker_id: str,
+    lease_seconds: float = DEFAULT_LEASE_SECONDS
+) -> bool:
+    """
+    # Description:
+    This function parses the file of a claimed task, writes its dataframe
+    as a parquet fragment, and reports back.
+
+    # Parameters:
+        work_dir: str
+            this is the work folder, as this host sees it
+        queue: sqlite3.Connection
+            this is the connection to the queue
+        task: dict
+            this is the task returned by `claim_task`
+        worker_id: str
+            this is the id of the worker
+        lease_seconds: float
+            this is the lease of the task, renewed while the file is parsed
+            defaults to 300
+
+    # Returns:
+        bool
+            True if the file was parsed
+    """
+    from .folder_to_parquet import get_dataframe_from_file
+
+    input_path = os.path.join(work_dir, task['input_path'])
+    output_path = os.path.join(work_dir, task['output_path'])
+
+    stop = threading.Event()
+    keeper = threading.Thread(
+        target=_keep_lease, args=(work_dir, task['task_id'], worker_id, lease_seconds, stop),
+        daemon=True)
+    keeper.start()
+    start = time.perf_counter()
+    try:
+        temp_df = get_dataframe_from_file(input_path)
+
+        # write the fragment under a temporary name, so that a fragment
+        # is either complete or missing
+        if temp_df is not None:
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            temporary_path = f'{output_path}.{os.getpid()}.tmp'
+            temp_df.to_parquet(temporary_path)
+            os.replace(temporary_path, output_path)
+
+    except Exception as error:
+        fail_task(queue, task['task_id'], worker_id, repr(error))
+        print("Failed to parse file:", task['file_key'], repr(error))
+        return False
+
+    finally:
+        stop.set()
+        keeper.join()
+
+    complete_task(queue, task['task_id'], worker_id,
+                  rows=0 if temp_df is None else len(temp_df),
+                  size=os.path.getsize(input_path),
+                  seconds=time.perf_counter() - start,
+                  has_output=temp_df is not None)
+    return True
+
+
+def run_worker(
+    work_dir: str = DEFAULT_WORK_DIR,
+    lease_seconds: float = DEFAULT_LEASE_SECONDS,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+    idle_timeout: float = None,
+    stop_event=None
+) -> int:
+    """
+    # Description:
+    This function works on the queue of a work folder: claims the tasks one
+    after the other and parses their files, until it is stopped.
+
+    # Parameters:
+        work_dir: str
+            this is the work folder shared with the coordinator, as this
+            host sees it
+            defaults to './refresh_work'
+        lease_seconds: float
+            this is the lease of a task
+            defaults to 300
+        max_attempts: int
+            this is the number of claims before a task is failed
+            defaults to 3
+        poll_interval: float
+            this is the number of seconds between two looks at an empty queue
+            defaults to 2
+        idle_timeout: float
+            this is the number of seconds without a task before the worker stops
+            defaults to None to keep working until interrupted
+        stop_event: multiprocessing.Event
+            this is set by the coordinator to stop its local workers
+            defaults to None
+
+    # Returns:
+        int
+            this is the number of tasks the worker processed
+    """
+    worker_id = get_worker_id()
+    queue = open_work_queue(work_dir)
+    processed = 0
+    idle_since = time.monotonic()
+
+    try:
+        while stop_event is None or not stop_event.is_set():
+            task = claim_task(queue, worker_id, lease_seconds, max_attempts)
+
+            # nothing to do: wait, or stop after a while
+            if task is None:
+                if idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                    break
+                if stop_event is not None:
+                    stop_event.wait(poll_interval)
+                else:
+                    time.sleep(poll_interval)
+                continue
+
+            process_task(work_dir, queue, task, worker_id, lease_seconds)
+            processed += 1
+            idle_since = time.monotonic()
+    finally:
+        queue.close()
+
+    return processed
+
+
+def start_local_workers(
+    work_dir: str,
+    number: int,
+    lease_seconds: float = DEFAULT_LEASE_SECONDS,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    poll_interval: float = DEFAULT_POLL_INTERVAL
+) -> tuple:
+    """
+    # Description:
+    This function starts worker processes on this host.
+
+    # Returns:
+        tuple
+            this is the list of processes, and the event that stops them
+    """
+    stop_event = multiprocessing.Event()
+    processes = [multiprocessing.Process(
+        target=run_worker,
+        args=(work_dir, lease_seconds, max_attempts, poll_interval, None, stop_event),
+        daemon=True) for _ in range(number)]
+    for process in processes:
+        process.start()
+    return processes, stop_event
+
+
+def get_dataframes_from_work_queue(
+    folder_files: list,
+    journal: sqlite3.Connection,
+    run_id: str,
+    work_dir: str = DEFAULT_WORK_DIR,
+    resume: bool = False,
+    max_failures: int = DEFAULT_MAX_FAILURES,
+    incremental: bool = False,
+    local_workers: int = 1,
+    lease_seconds: float = DEFAULT_LEASE_SECONDS,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+    by_file: bool = False
+) -> list:
+    """
+    # Description:
+    This function is the coordinator of a work-queue refresh: it reads the
+    files of a folder in the same way as
+    `folder_to_parquet.get_dataframes_from_storage`, but the files are
+    parsed by the workers of the queue, on any host sharing `work_dir`.
+
+    The files are downloaded one after the other, and queued as soon as they
+    are downloaded, so the workers start parsing during the downloads. The
+    fragments of the workers are kept as the parse outputs of the run
+    journal, so resumed and incremental runs reuse them.
+
+    # Parameters:
+        folder_files: list
+            this is the `StorageFile`s of the folder (`storage.list(folder)`)
+        journal: sqlite3.Connection
+            this is the connection to the run journal
+        run_id: str
+            this is the run id
+        work_dir: str
+            this is the work folder shared with the workers
+            defaults to './refresh_work'
+        resume: bool
+            if True, reuse the outputs the run already recorded
+            defaults to False
+        max_failures: int
+            this is the number of consecutive failures before quarantine
+            defaults to 3
+        incremental: bool
+            if True, reuse the parse outputs of earlier runs for the files
+            that did not change since
+            defaults to False
+        local_workers: int
+            this is the number of worker processes to start on this host,
+            0 to leave the parsing to the workers of other hosts; the run
+            fails when every local worker stopped with tasks left
+            defaults to 1
+        lease_seconds: float
+            this is the lease of a task
+            defaults to 300
+        max_attempts: int
+            this is the number of claims before a task is failed
+            defaults to 3
+        poll_interval: float
+            this is the number of seconds between two looks at the queue
+            defaults to 2
+        by_file: bool
+            if True, return the dict of file name to dataframe instead
+            defaults to False
+
+    # Returns:
+        list
+            this is the list of dataframes, in folder order, or the dict of
+            them by file name with `by_file`; the files that were not read
+            are left out
+    """
+    import pandas as pd
+
+    from .folder_to_parquet import (download_file, get_download_path, get_file_fingerprint,
+                                    get_files_to_read, get_parse_output_path,
+                                    get_reusable_parse_output, record_read_failure)
+
+    queue = open_work_queue(work_dir)
+    clear_other_runs(queue, run_id)
+    processes, stop_event = start_local_workers(
+        work_dir, local_workers, lease_seconds, max_attempts, poll_interval)
+
+    try:
+        # download the files, and queue them
+        files = get_files_to_read(folder_files, journal)
+        outputs = [None] * len(files)
+        queued = {}
+        for index, file in enumerate(files):
+            file_name = file.name
+            fingerprint = get_file_fingerprint(file)
+
+            # "(not analyzed)" files are not downloaded at all
+            if "(not analyzed)" in file_name:
+                record_stage(journal, run_id, file_name, 'parse', fingerprint)
+                continue
+
+            # the parse output of this version of the file can be reused
+            parsed = get_reusable_parse_output(journal, file, run_id, resume, incremental)
+            if parsed is not None:
+                outputs[index] = parsed['output_path']
+                continue
+
+            try:
+                download_path = download_file(file, journal, run_id, work_dir, resume)
+            except Exception as error:
+                record_read_failure(journal, run_id, file, repr(error), max_failures)
+                continue
+
+            # a local or mirrored file outside the work folder keeps its absolute path
+            input_path = os.path.relpath(download_path, work_dir)
+            if input_path.startswith(os.pardir):
+                input_path = os.path.abspath(download_path)
+            enqueue_task(queue, run_id, file_name, fingerprint, input_path,
+                         os.path.relpath(get_parse_output_path(work_dir, file_name), work_dir))
+            queued[file_name] = index
+            gauge('queue_depth', get_queue_counts(queue, run_id)['pending'],
+                  stage_name='work_queue')
+
+        # wait for the workers
+        dead = set()
+        while True:
+            # the tasks of the local workers that died go back to the queue
+            # at once, the others when their lease runs out
+            for process in processes:
+                if process.pid not in dead and not process.is_alive():
+                    dead.add(process.pid)
+                    print(f"Worker process {process.pid} stopped "
+                          f"(exit code {process.exitcode})")
+                    count('work_queue.worker_died', worker=get_worker_id(process.pid))
+                    expire_leases(queue, max_attempts, get_worker_id(process.pid))
+            if expire_leases(queue, max_attempts) > 0:
+                count('work_queue.lease_expired')
+
+            counts = get_queue_counts(queue, run_id)
+            gauge('queue_depth', counts['pending'], stage_name='work_queue')
+            if counts['pending'] + counts['claimed'] == 0:
+                break
+
+            # nobody is left to parse the files
+            if len(processes) > 0 and len(dead) == len(processes):
+                raise RuntimeError(
+                    f"every local worker of the work queue stopped, with "
+                    f"{counts['pending'] + counts['claimed']} task(s) left")
+            time.sleep(poll_interval)
+
+    except BaseException:
+        queue.close()
+        raise
+
+    finally:
+        stop_event.set()
+        for process in processes:
+            process.join()
+
+    # record the tasks in the run journal
+    tasks = queue.execute(
+        "select * from tasks where run_id = ?", (run_id,)).fetchall()
+    queue.close()
+    for task in tasks:
+        if task['file_key'] not in queued:
+            continue
+        index = queued[task['file_key']]
+        file = files[index]
+
+        if task['status'] == 'failed':
+            record_read_failure(journal, run_id, file, task['error'], max_failures)
+            count('work_queue.failed', file=task['file_key'])
+            continue
+
+        output_path = (None if task['output_path'] is None
+                       else os.path.join(work_dir, task['output_path']))
+        record_stage(journal, run_id, task['file_key'], 'parse', task['fingerprint'],
+                     output_path)
+        count('work_queue.done', file=task['file_key'], worker=task['worker'])
+        outputs[index] = output_path
+
+        # the download is not needed once the file is parsed
+        # (a local or mirrored file is not a download, and stays)
+        download_path = get_download_path(work_dir, task['file_key'])
+        if os.path.exists(download_path):
+            os.remove(download_path)
+
+    # read the fragments, by file
+    if by_file:
+        return {file.name: pd.read_parquet(output_path)
+                for file, output_path in zip(files, outputs) if output_path is not None}
+
+    # read the fragments, in folder order
+    return [pd.read_parquet(output_path) for output_path in outputs if output_path is not None]
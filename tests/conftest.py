@@ -0,0 +1,218 @@
+"""
+# Description:
+Shared fixtures of the tests.
+
+The tests run from a checkout, like the benchmarks: the package is imported
+as `src`, and the synthetic workbooks are built with `benchmarks/fixtures.py`.
+
+Every test runs in its own temporary folder, without a CIG reference file or
+an engine calibration, so the defaults of the refresh (`./refresh_journal.sqlite`,
+`./data.parquet`, ...) and the files of the machine never leak into a test.
+
+# Usage (from the repository root):
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+# the tests run from a checkout, not from an installed package
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_ROOT)
+sys.path.insert(0, os.path.join(REPOSITORY_ROOT, 'benchmarks'))
+
+import fixtures  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def isolated_run(tmp_path, monkeypatch):
+    """
+    # Description:
+    Runs the test in an empty folder, with no reference file, no engine
+    calibration, and instrumentation off at the end.
+    """
+    from src.instrumentation import finish_instrumentation
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('RESERVING_DASHBOARD_REFERENCE_PATH',
+                       str(tmp_path / 'no_cig_reference.json'))
+    monkeypatch.setenv('RESERVING_DASHBOARD_ENGINE_CALIBRATION',
+                       str(tmp_path / 'no_engine_calibration.json'))
+    yield
+    finish_instrumentation()
+
+
+@pytest.fixture
+def workbook_folder(tmp_path):
+    """
+    # Description:
+    A folder of three small CIG-style workbooks, with 20 output_tbl rows each.
+    """
+    folder = tmp_path / 'workbooks'
+    fixtures.build_workbooks(str(folder), count=3, rows=20, decoy_sheets=0)
+    return folder
+
+
+class _FakeQuery:
+    """
+    # Description:
+    A pending office365 query: runs when `execute_query` is called.
+    """
+
+    def __init__(self, context, run):
+        self.context = context
+        self.run = run
+
+    def execute_query(self):
+        self.run()
+        return self
+
+
+class FakeSharePointFile:
+    """
+    # Description:
+    An office365 file of `FakeClientContext`: its properties, and its download.
+    """
+
+    def __init__(self, context, url):
+        self.context = context
+        self.url = url.strip('/')
+        self.properties = {}
+
+    def get_path(self):
+        return os.path.join(self.context.root, *self.url.split('/'))
+
+    def load(self):
+        status = os.stat(self.get_path())
+        self.properties = {
+            'Name': os.path.basename(self.get_path()), 'ServerRelativeUrl': self.url,
+            'Length': status.st_size, 'TimeLastModified': status.st_mtime,
+            'ETag': f'"{status.st_mtime_ns}:{status.st_size}"'}
+
+    def download(self, local_file):
+        def run():
+            self.context.check_thread()
+            with open(self.get_path(), 'rb') as file:
+                local_file.write(file.read())
+        return _FakeQuery(self.context, run)
+
+
+class FakeSharePointFolder:
+    """
+    # Description:
+    An office365 folder of `FakeClientContext`: its files, and uploads.
+    """
+
+    def __init__(self, context, url):
+        self.context = context
+        self.url = url.strip('/')
+        self.files = []
+
+    def load(self):
+        folder = os.path.join(self.context.root, *self.url.split('/'))
+        self.files = []
+        for name in sorted(os.listdir(folder)):
+            if os.path.isfile(os.path.join(folder, name)):
+                file = FakeSharePointFile(self.context, f'{self.url}/{name}')
+                file.load()
+                self.files.append(file)
+
+    def upload_file(self, name, content):
+        def run():
+            folder = os.path.join(self.context.root, *self.url.split('/'))
+            with open(os.path.join(folder, name), 'wb') as file:
+                file.write(content)
+        return _FakeQuery(self.context, run)
+
+
+class FakeClientContext:
+    """
+    # Description:
+    A stand-in for an office365 `ClientContext` over a local folder, with the
+    calls the storage backend makes. Like the real one, a context must not be
+    used by two threads at the same time; doing so fails the test. `site`
+    counts the downloads running at the same time, over every clone, and
+    `closed` tells whether the context was closed.
+    """
+
+    def __init__(self, root, base_url='https://example.sharepoint.com/sites/test', site=None):
+        self.root = root
+        self.base_url = base_url
+        self.web = self
+        self.pending = []
+        self.busy = threading.Lock()
+        self.clones = []
+        self.closed = False
+        self.site = site or {'lock': threading.Lock(), 'active': 0, 'max_active': 0}
+
+    def check_thread(self):
+        if self.closed:
+            raise AssertionError('a closed client context was used')
+        if not self.busy.acquire(blocking=False):
+            raise AssertionError('a client context was used by two threads at once')
+        site = self.site
+        with site['lock']:
+            site['active'] += 1
+            site['max_active'] = max(site['max_active'], site['active'])
+        time.sleep(0.05)
+        with site['lock']:
+            site['active'] -= 1
+        self.busy.release()
+
+    def clone(self, url):
+        clone = FakeClientContext(self.root, url, self.site)
+        self.clones.append(clone)
+        return clone
+
+    def close(self):
+        self.closed = True
+
+    def get_folder_by_server_relative_url(self, url):
+        folder = FakeSharePointFolder(self, url)
+        folder.files = _FakeFiles(folder)
+        return folder
+
+    def get_file_by_server_relative_url(self, url):
+        return FakeSharePointFile(self, url)
+
+    def load(self, item):
+        self.pending.append(item)
+
+    def execute_query(self):
+        # the queue is emptied even when a query fails
+        pending, self.pending = self.pending, []
+        for item in pending:
+            item.load()
+
+
+class _FakeFiles(list):
+    """
+    # Description:
+    The files of a folder, listed when the query is executed.
+    """
+
+    def __init__(self, folder):
+        super().__init__()
+        self.folder = folder
+
+    def load(self):
+        self.folder.load()
+        self[:] = self.folder.files
+
+
+@pytest.fixture
+def sharepoint_context(workbook_folder):
+    """
+    # Description:
+    A fake sharepoint site whose 'CIG Link Ratio Files' folder holds the
+    workbooks of `workbook_folder`.
+    """
+    root = workbook_folder.parent / 'site'
+    os.makedirs(root / 'CIG Link Ratio Files')
+    for path in workbook_folder.iterdir():
+        os.link(path, root / 'CIG Link Ratio Files' / path.name)
+    return FakeClientContext(str(root))
@@ -0,0 +1,90 @@
+"""
+# Description:
+Tests of the benchmark suite: the synthetic fixtures look like the real
+folders, and a small run of every stage saves and compares a baseline.
+"""
+
+import json
+import os
+
+import fixtures
+import run_benchmarks
+from src import find_cig_files
+from src.output_tbl_reader import read_output_tbl
+
+
+def test_directory_tree_has_both_name_forms(tmp_path):
+    paths = fixtures.build_directory_tree(str(tmp_path / 'tree'), 2021, 2022,
+                                          files_per_quarter=20, decoys_per_quarter=5)
+    assert len(paths) == 2 * 4 * 20
+    names = [os.path.basename(path) for path in paths]
+    assert any('2021Q1' in name for name in names)
+    assert any('1Q2021' in name for name in names)
+
+    # the walk finds the CIG files and skips the decoys
+    found = find_cig_files.find_files_with_extension(str(tmp_path / 'tree'), '.xlsb')
+    assert sorted(os.path.basename(path) for path in found) == sorted(names)
+
+    # and every name gives back its folder's year and quarter
+    for path in paths:
+        folder = os.path.basename(os.path.dirname(path))
+        year, quarter = find_cig_files.parse_year_quarter(path)
+        assert folder == f'{year} Q{quarter}'
+
+
+def test_workbook_has_decoy_sheets_and_trailing_junk(tmp_path):
+    import openpyxl
+
+    path = fixtures.build_workbook(str(tmp_path / 'book.xlsx'), rows=30, decoy_sheets=2,
+                                   decoy_rows=10, trailing_blank_rows=15)
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    try:
+        assert workbook.sheetnames == ['calc_0', 'calc_1', 'output_tbl']
+    finally:
+        workbook.close()
+
+    # the junk rows below the table are not read
+    assert len(read_output_tbl(path)) == 30
+
+
+def test_fixtures_are_reproducible(tmp_path):
+    first = fixtures.build_workbooks(str(tmp_path / 'a'), count=2, rows=5, decoy_sheets=0)
+    second = fixtures.build_workbooks(str(tmp_path / 'b'), count=2, rows=5, decoy_sheets=0)
+    assert [os.path.basename(path) for path in first] == [
+        os.path.basename(path) for path in second]
+    for path_a, path_b in zip(first, second):
+        assert read_output_tbl(path_a).equals(read_output_tbl(path_b))
+
+
+def test_run_saves_and_compares_a_baseline(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(run_benchmarks, 'BASELINE_DIR', str(tmp_path / 'baselines'))
+    arguments = ['--work-dir', str(tmp_path / 'work'), '--first-year', '2022',
+                 '--last-year', '2022', '--files-per-quarter', '10', '--workbooks', '2',
+                 '--rows', '20', '--decoy-sheets', '0', '--repeats', '1']
+
+    reference_path = os.environ['RESERVING_DASHBOARD_REFERENCE_PATH']
+    assert run_benchmarks.main(arguments + ['--save-baseline', 'main']) == 0
+    # the indexed stem match sets the reference path for its own stage only
+    assert os.environ['RESERVING_DASHBOARD_REFERENCE_PATH'] == reference_path
+    with open(tmp_path / 'baselines' / 'main.json', encoding='utf-8') as file:
+        baseline = json.load(file)
+    assert [result['stage'] for result in baseline] == [
+        'walk', 'metadata_parse', 'stem_match', 'stem_match_indexed', 'sheet_read',
+        'concat_write']
+    assert baseline[0]['items'] == 4 * 10
+    assert all(result['peak_memory_mb'] >= 0 for result in baseline)
+
+    # a run within the tolerance is no regression
+    assert run_benchmarks.main(arguments + ['--compare', 'main', '--tolerance', '1000']) == 0
+    assert 'no regressions against main' in capsys.readouterr().out
+
+
+def test_slower_stage_is_a_regression():
+    baseline = [{'stage': 'walk', 'seconds': 1.0, 'peak_memory_mb': 10.0}]
+    assert run_benchmarks.compare_to_baseline(
+        [{'stage': 'walk', 'seconds': 1.1, 'peak_memory_mb': 10.0}], baseline) == []
+    regressions = run_benchmarks.compare_to_baseline(
+        [{'stage': 'walk', 'seconds': 1.5, 'peak_memory_mb': 13.0},
+         {'stage': 'new_stage', 'seconds': 9.0, 'peak_memory_mb': 9.0}], baseline)
+    assert regressions == ['walk: seconds 1 -> 1.5 (+50%)',
+                           'walk: peak_memory_mb 10 -> 13 (+30%)']
@@ -0,0 +1,57 @@
+"""
+# Description:
+Tests of the analysis columns the parse adds, and of the lazy dataset query.
+"""
+
+import pandas as pd
+import pytest
+
+from src import find_cig_files
+from src.dataset_query import query_dataset
+from src.folder_to_parquet import add_analysis_columns, get_analysis_idx, get_dataframes_from_folder
+from src.instrumentation import enable_instrumentation, get_events
+from src.output_tbl_schema import concat_output_tbls
+
+
+def test_parse_year_quarter_matches_get_year_quarter():
+    paths = ['O:/2019/2019 Q1/test 2019Q1.xlsb', 'O:/2019/2019 Q2/test 2Q2020.xlsb']
+    expected = find_cig_files.get_year_quarter(paths)
+    assert [find_cig_files.parse_year_quarter(path) for path in paths] == list(
+        zip(expected['year'], expected['quarter']))
+    assert find_cig_files.parse_year_quarter('notes.xlsx') is None
+
+
+def test_add_analysis_columns():
+    df = add_analysis_columns(pd.DataFrame({'LOB': ['CA']}), 'O:/x/CA Link Ratios 3Q2023.xlsx')
+    assert df.loc[0, 'file_name'] == 'CA Link Ratios 3Q2023.xlsx'
+    assert df.loc[0, 'analysis_idx'] == 2023 * 4 + 3
+    assert get_analysis_idx('CA Link Ratios 3Q2023.xlsx') == 2023 * 4 + 3
+    assert get_analysis_idx('notes.xlsx') is None
+    assert 'analysis_idx' not in add_analysis_columns(pd.DataFrame({'LOB': ['CA']}), 'notes.xlsx')
+
+
+def test_parse_is_not_timed_as_a_scan_stage(workbook_folder):
+    enable_instrumentation()
+    get_dataframes_from_folder(str(workbook_folder))
+    assert [event for event in get_events() if event['stage'].startswith('scan.')] == []
+
+
+def test_query_pushes_down_filters_and_columns(workbook_folder, tmp_path):
+    df = concat_output_tbls(get_dataframes_from_folder(str(workbook_folder)))
+    df.to_parquet(tmp_path / 'data.parquet')
+    first = int(df['analysis_idx'].min())
+
+    result = query_dataset(str(tmp_path / 'data.parquet'), columns=['lob', 'analysis_idx'],
+                           analysis_idx_range=first, lobs=['CA'])
+    assert list(result.columns) == ['lob', 'analysis_idx']
+    assert len(result) == ((df['analysis_idx'] == first) & (df['lob'] == 'CA')).sum()
+
+
+def test_query_without_cig_type_has_a_clear_error(workbook_folder, tmp_path):
+    # no reference file: the file types of the workbooks are unknown
+    df = concat_output_tbls(get_dataframes_from_folder(str(workbook_folder)))
+    assert 'cig_type' not in df.columns
+    df.to_parquet(tmp_path / 'data.parquet')
+
+    with pytest.raises(ValueError, match='no cig_type column'):
+        query_dataset(str(tmp_path / 'data.parquet'), cig_types=['link ratio'])
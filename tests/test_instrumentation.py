@@ -0,0 +1,61 @@
+"""
+# Description:
+Tests of the instrumentation: the stages, counters and gauges of a run,
+its JSON-lines trace, and the summary of the refresh.
+"""
+
+import pytest
+
+from src.folder_to_parquet import get_dataframes_from_storage
+from src.instrumentation import (count, enable_instrumentation, finish_instrumentation, gauge,
+                                 get_events, read_trace, stage, summarize_events)
+from src.output_tbl_schema import UnknownColumnsWarning
+from src.storage import LocalBackend
+
+pytestmark = pytest.mark.filterwarnings('ignore', category=UnknownColumnsWarning)
+
+
+def test_off_by_default_records_nothing():
+    with stage('parse') as span:
+        span.add(rows=1)
+    count('file.failed')
+    assert get_events() == []
+    assert finish_instrumentation() == ''
+
+
+def test_trace_round_trips(tmp_path):
+    trace_path = str(tmp_path / 'trace.jsonl')
+    enable_instrumentation(trace_path)
+    with stage('download', file='a.xlsx') as span:
+        span.add(bytes=100)
+    with pytest.raises(ValueError):
+        with stage('parse', file='a.xlsx'):
+            raise ValueError('broken')
+    count('file.failed', file='a.xlsx')
+    gauge('queue_depth', 3)
+    gauge('queue_depth', 1)
+    table = finish_instrumentation()
+
+    # a line cut short by a killed run is skipped
+    with open(trace_path, 'a', encoding='utf-8') as file:
+        file.write('{"type": "stage", "sta')
+    events = read_trace([trace_path])
+    assert [(event['type'], event['stage']) for event in events] == [
+        ('stage', 'download'), ('stage', 'parse'), ('count', 'file.failed'),
+        ('gauge', 'queue_depth'), ('gauge', 'queue_depth')]
+
+    summaries = {summary['stage']: summary for summary in summarize_events(events)}
+    assert summaries['download']['bytes'] == 100
+    assert summaries['parse']['failures'] == 1
+    assert summaries['file.failed']['total'] == 1
+    assert (summaries['queue_depth']['last'], summaries['queue_depth']['max']) == (1, 3)
+    assert 'download' in table and 'queue_depth' in table
+
+
+def test_refresh_stages_are_recorded(workbook_folder, tmp_path):
+    enable_instrumentation()
+    get_dataframes_from_storage(LocalBackend(str(workbook_folder)).list(''),
+                                work_dir=str(tmp_path / 'work'))
+    parses = [event for event in get_events() if event['stage'] == 'parse']
+    assert len(parses) == 3
+    assert all(event['ok'] and event['rows'] == 20 and event['bytes'] > 0 for event in parses)
@@ -0,0 +1,152 @@
+"""
+# Description:
+Tests of the multi-site jobs: the job spec, one login per site and one
+clone per target, the global limits over every target, and the
+consolidated report.
+"""
+
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from conftest import FakeClientContext
+from src import folder_to_parquet, jobs
+from src.jobs import format_job_report, get_target_work_dir, run_jobs, validate_job_spec
+from src.output_tbl_schema import UnknownColumnsWarning
+
+pytestmark = pytest.mark.filterwarnings('ignore', category=UnknownColumnsWarning)
+
+SITE_A = 'https://example.sharepoint.com/sites/a'
+SITE_B = 'https://example.sharepoint.com/sites/b'
+
+
+def get_spec(limits=None):
+    return validate_job_spec({
+        'limits': dict({'max_targets': 3}, **(limits or {})),
+        'defaults': {'sharepoint_url': SITE_A, 'output_folder': 'out'},
+        'targets': [
+            {'name': 'CA', 'sharepoint_folder': 'CA', 'output_name': 'ca.parquet'},
+            {'name': 'WC', 'sharepoint_folder': 'WC', 'output_name': 'wc.parquet'},
+            {'name': 'GL', 'sharepoint_folder': 'GL', 'output_name': 'gl.parquet',
+             'sharepoint_url': SITE_B},
+        ],
+    })
+
+
+@pytest.fixture
+def sites(workbook_folder, tmp_path, monkeypatch):
+    """
+    # Description:
+    Two fake sharepoint sites: CA and WC on site a, GL on site b, each a
+    folder of the three workbooks. Returns the logins made, per site.
+    """
+    site = {'lock': threading.Lock(), 'active': 0, 'max_active': 0}
+    logins = {}
+    for url, folders in ((SITE_A, ['CA', 'WC']), (SITE_B, ['GL'])):
+        root = tmp_path / url.rsplit('/', 1)[-1]
+        os.makedirs(root / 'out')
+        for folder in folders:
+            os.makedirs(root / folder)
+            for path in workbook_folder.iterdir():
+                os.link(path, root / folder / path.name)
+        logins[url] = []
+
+    def get_sharepoint_connection(site_url, username, password):
+        context = FakeClientContext(str(tmp_path / site_url.rsplit('/', 1)[-1]), site_url, site)
+        logins[site_url].append(context)
+        return context
+
+    monkeypatch.setattr(jobs, 'get_sharepoint_connection', get_sharepoint_connection)
+    return {'logins': logins, 'site': site}
+
+
+def test_spec_defaults_and_errors():
+    spec = get_spec()
+    assert spec['limits']['max_connections'] == 4
+    assert [target['sharepoint_url'] for target in spec['targets']] == [SITE_A, SITE_A, SITE_B]
+    # the global limit decides how many files a target parses at a time
+    assert all(target['max_workers'] is None for target in spec['targets'])
+
+    for spec, message in (
+            ({'targets': []}, 'no targets'),
+            ({'limits': {'max_threads': 1}, 'targets': [{}]}, 'unknown limits'),
+            ({'targets': [{'name': 'CA', 'sharepoint_folder': 'CA'}]}, 'missing'),
+            ({'targets': [{'name': 'CA', 'sharepoint_folder': 'CA', 'output_folder': 'out',
+                           'colour': 'red'}]}, 'unknown options')):
+        with pytest.raises(ValueError, match=message):
+            validate_job_spec(spec)
+
+
+def test_names_sharing_a_work_folder_are_rejected():
+    target = {'sharepoint_folder': 'CA', 'output_folder': 'out'}
+    for names in (['CA', 'CA'], ['CA/LR', 'CA LR'], ['ca lr', 'CA LR']):
+        with pytest.raises(ValueError):
+            validate_job_spec({'targets': [dict(target, name=name) for name in names]})
+
+    spec = validate_job_spec({'targets': [dict(target, name=name) for name in ('CA', 'CA2')]})
+    assert len({get_target_work_dir('work', target) for target in spec['targets']}) == 2
+
+
+def test_one_login_per_site_and_one_clone_per_target(sites, tmp_path):
+    report = run_jobs(get_spec(), str(tmp_path / 'work'))
+    assert report['totals']['completed'] == 3
+    assert report['totals']['rows'] == 3 * 3 * 20
+
+    logins = sites['logins']
+    assert [len(logins[url]) for url in (SITE_A, SITE_B)] == [1, 1]
+    site_a, site_b = logins[SITE_A][0], logins[SITE_B][0]
+    assert (len(site_a.clones), len(site_b.clones)) == (2, 1)
+
+    # every context closed at the end: the sites, the targets', their threads'
+    clones = site_a.clones + site_b.clones
+    clones += [clone for target_clone in clones for clone in target_clone.clones]
+    assert all(context.closed for context in [site_a, site_b] + clones)
+    assert os.path.exists(tmp_path / 'a' / 'out' / 'ca.parquet')
+    assert os.path.exists(tmp_path / 'b' / 'out' / 'gl.parquet')
+
+
+def test_global_limits_hold_over_every_target(sites, tmp_path, monkeypatch):
+    # the parses running at the same time, over every target
+    parses = {'lock': threading.Lock(), 'active': 0, 'max_active': 0}
+    get_dataframe_from_file = folder_to_parquet.get_dataframe_from_file
+
+    def counting_get_dataframe_from_file(file_name, *args, **kwargs):
+        with parses['lock']:
+            parses['active'] += 1
+            parses['max_active'] = max(parses['max_active'], parses['active'])
+        time.sleep(0.05)
+        try:
+            return get_dataframe_from_file(file_name, *args, **kwargs)
+        finally:
+            with parses['lock']:
+                parses['active'] -= 1
+
+    monkeypatch.setattr(folder_to_parquet, 'get_dataframe_from_file',
+                        counting_get_dataframe_from_file)
+
+    report = run_jobs(get_spec({'max_connections': 1, 'max_workers': 2}),
+                      str(tmp_path / 'work'))
+    assert report['totals']['completed'] == 3
+    assert sites['site']['max_active'] == 1
+    assert parses['max_active'] == 2
+
+
+def test_failing_target_is_in_the_report(sites, tmp_path):
+    spec = get_spec()
+    spec['targets'][1]['sharepoint_folder'] = 'missing'
+    report_path = str(tmp_path / 'job_report.json')
+    report = run_jobs(spec, str(tmp_path / 'work'), report_path=report_path)
+
+    totals = report['totals']
+    assert (totals['completed'], totals['failed']) == (2, 1)
+    failed = report['targets'][1]
+    assert failed['status'] == 'failed' and failed['error'] is not None
+    with open(report_path, encoding='utf-8') as file:
+        assert json.load(file)['totals']['failed'] == 1
+
+    text = format_job_report(report)
+    assert f"WC: {failed['error']}" in text
+    assert '2 of 3 targets completed, 6 of 6 files read' in text
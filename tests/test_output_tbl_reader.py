@@ -0,0 +1,143 @@
+"""
+# Description:
+Tests of the output_tbl projection: the columns kept, the header row, the
+end of the table, and the projections configured per CIG file type.
+"""
+
+import pandas as pd
+import pytest
+
+from src import output_tbl_reader
+from src.folder_to_parquet import get_dataframe_from_file
+from src.output_tbl_reader import (DEFAULT_PROJECTION, get_projection, read_output_tbl,
+                                   register_projection, register_projections_from_cig_filetypes,
+                                   rows_to_dataframe)
+from src.output_tbl_schema import UnknownColumnsWarning
+
+pytestmark = pytest.mark.filterwarnings('ignore', category=UnknownColumnsWarning)
+
+# a sheet with a title above the header, a blank row inside the table, and junk below it
+ROWS = [
+    ['CA link ratios', None, None],
+    ['LOB', ' Link  Ratio ', 'helper', None],
+    ['CA', 1, 'x'],
+    ['GL', 1.25],
+    [None, '', '  '],
+    ['WC', 1.5, 'y'],
+]
+
+
+class ClosingRows:
+    """
+    # Description:
+    The rows of a sheet, like the iterators of the reader engines, which
+    must be closed when the reader stops early.
+    """
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.rows)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def no_projections(monkeypatch):
+    monkeypatch.setattr(output_tbl_reader, 'OUTPUT_TBL_PROJECTIONS', {})
+
+
+def test_columns_are_selected_by_header():
+    df = rows_to_dataframe(ROWS, columns=['link ratio', 'LOB'], header_row=1)
+    # in the requested order, under the headers of the sheet
+    assert list(df.columns) == ['Link  Ratio', 'LOB']
+    assert df['LOB'].tolist() == ['CA', 'GL']
+    # whole numbers are read as floats, like every engine gives them
+    assert df['Link  Ratio'].tolist() == [1.0, 1.25]
+
+    with pytest.raises(ValueError, match=r"\['Paid Loss'\]"):
+        rows_to_dataframe(ROWS, columns=['LOB', 'Paid Loss'], header_row=1)
+
+
+def test_header_row():
+    # the title row is taken as the header when the header row is wrong
+    df = rows_to_dataframe(ROWS, header_row=0)
+    assert list(df.columns) == ['CA link ratios']
+
+    with pytest.raises(ValueError, match='no header row 10'):
+        rows_to_dataframe(ROWS, header_row=10)
+
+
+def test_blank_row_ends_the_table():
+    rows = ClosingRows(ROWS)
+    df = rows_to_dataframe(rows, header_row=1)
+    assert df['LOB'].tolist() == ['CA', 'GL']
+    # the short row is padded, and the reader closed the rows it stopped reading
+    assert df['helper'].isna().tolist() == [False, True]
+    assert rows.closed
+
+    # without the stop, the blank row is a row of missing values
+    df = rows_to_dataframe(ROWS, header_row=1, stop_at_blank_row=False)
+    assert df['LOB'].fillna('').tolist() == ['CA', 'GL', '', 'WC']
+
+    # only the kept columns decide where the table ends
+    df = rows_to_dataframe(ROWS + [[None, 2.0]], columns=['LOB'], header_row=1)
+    assert len(df) == 2
+
+
+def test_register_projection():
+    register_projection('link ratio', ['LOB', 'Link Ratio'], header_row=2,
+                        stop_at_blank_row=False)
+    projection = get_projection('link ratio')
+    assert projection == {'columns': ['LOB', 'Link Ratio'], 'header_row': 2,
+                          'stop_at_blank_row': False}
+    # a copy, not the registered projection
+    projection['columns'].append('State')
+    assert get_projection('link ratio')['columns'] == ['LOB', 'Link Ratio']
+    assert get_projection('unknown') == DEFAULT_PROJECTION
+
+    with pytest.raises(ValueError, match='header_row'):
+        register_projection('link ratio', header_row=-1)
+
+
+def test_projections_from_cig_filetypes():
+    register_projections_from_cig_filetypes(pd.DataFrame({
+        'filename': ['CA Link Ratios', 'GL Link Ratios', 'CA Reserves', 'CA Triangles'],
+        'type': ['link ratio', 'link ratio', 'reserves', 'triangle'],
+        'columns': ['LOB, Link Ratio,', 'State', None, ''],
+        'header_row': [1, 3, None, 2],
+        'stop_at_blank_row': [False, True, None, None],
+    }))
+    # the first row of each type wins
+    assert get_projection('link ratio') == {'columns': ['LOB', 'Link Ratio'], 'header_row': 1,
+                                            'stop_at_blank_row': False}
+    # the settings a row leaves out take their defaults
+    assert get_projection('reserves') == DEFAULT_PROJECTION
+    assert get_projection('triangle') == dict(DEFAULT_PROJECTION, header_row=2)
+
+    # a frame without any projection setting configures nothing
+    output_tbl_reader.OUTPUT_TBL_PROJECTIONS.clear()
+    register_projections_from_cig_filetypes(
+        pd.DataFrame({'filename': ['CA Link Ratios'], 'type': ['link ratio']}))
+    assert output_tbl_reader.OUTPUT_TBL_PROJECTIONS == {}
+
+
+def test_workbook_is_read_with_the_projection_of_its_file_type(workbook_folder):
+    path = str(sorted(workbook_folder.iterdir())[0])
+    df = read_output_tbl(path, {'columns': ['Link Ratio', 'LOB']})
+    assert list(df.columns) == ['Link Ratio', 'LOB']
+    # the junk rows below the table are not read
+    assert len(df) == 20
+
+    register_projections_from_cig_filetypes(pd.DataFrame({
+        'filename': ['CA Link Ratios'], 'type': ['link ratio'], 'columns': ['LOB, Link Ratio']}))
+    df = get_dataframe_from_file(path, 'link ratio')
+    assert list(df.columns) == ['lob', 'link_ratio', 'file_name', 'year', 'quarter',
+                                'analysis_idx', 'cig_type']
+    assert len(df) == 20
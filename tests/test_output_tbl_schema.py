@@ -0,0 +1,116 @@
+"""
+# Description:
+Tests of the output_tbl dtype schema: casting, the warning about undeclared
+columns, and the concatenation of the normalized frames.
+"""
+
+import warnings
+
+import pandas as pd
+import pytest
+
+from src import output_tbl_schema
+from src.folder_to_parquet import get_dataframe_from_file
+from src.output_tbl_schema import (NonIntegerValuesWarning, UnknownColumnsWarning,
+                                   concat_output_tbls, normalize_dtypes, register_schema)
+
+
+@pytest.fixture(autouse=True)
+def fresh_registry(monkeypatch):
+    # every test starts with no file type schemas and nothing reported
+    monkeypatch.setattr(output_tbl_schema, 'OUTPUT_TBL_SCHEMAS', {})
+    monkeypatch.setattr(output_tbl_schema, '_reported_unknown_columns', set())
+
+
+def get_output_tbl():
+    return pd.DataFrame({
+        'LOB': ['CA', 'GL', None],
+        'Accident Year': [2020.0, 2021.0, None],
+        'Link Ratio': [1.25, 'n/a', 1.5],
+        'Paid Loss': [10.5, 20.25, 30.0],
+        'helper 0': [1, 'x', None],
+    })
+
+
+def test_real_headers_are_typed_without_a_file_type():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UnknownColumnsWarning)
+        df = normalize_dtypes(get_output_tbl())
+
+    assert list(df.columns) == ['lob', 'accident_year', 'link_ratio', 'paid_loss', 'helper 0']
+    assert isinstance(df['lob'].dtype, pd.CategoricalDtype)
+    assert df['accident_year'].dtype == 'Int16'
+    assert df['link_ratio'].dtype == 'float32'
+    assert df['paid_loss'].dtype == 'float64'
+    # text cells in a numeric column become missing values
+    assert df['link_ratio'].isna().tolist() == [False, True, False]
+    # an undeclared column mixing numbers and text is kept as text
+    assert df['helper 0'].dtype == 'string'
+    assert 'cig_type' not in df.columns
+
+
+def test_the_callers_frame_is_not_changed():
+    original = get_output_tbl()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UnknownColumnsWarning)
+        normalize_dtypes(original, 'link ratio')
+    pd.testing.assert_frame_equal(original, get_output_tbl())
+
+
+def test_unknown_columns_are_reported_once_per_file_type():
+    with pytest.warns(UnknownColumnsWarning, match='helper 0'):
+        normalize_dtypes(get_output_tbl())
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', UnknownColumnsWarning)
+        normalize_dtypes(get_output_tbl())
+    with pytest.warns(UnknownColumnsWarning):
+        normalize_dtypes(get_output_tbl(), 'link ratio')
+
+
+def test_file_type_schema_and_cig_type():
+    register_schema('link ratio', {'Helper 0': 'string'})
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', UnknownColumnsWarning)
+        df = normalize_dtypes(get_output_tbl(), 'link ratio')
+    assert df['helper_0'].dtype == 'string'
+    assert df['cig_type'].tolist() == ['link ratio'] * 3
+
+    with pytest.raises(ValueError, match='invalid dtype'):
+        register_schema('link ratio', {'Tail': 'not a dtype'})
+
+
+def test_integer_columns_do_not_lose_fractions():
+    # the workbook is still read, with the column as floats
+    with pytest.warns(NonIntegerValuesWarning, match='accident_year'):
+        df = normalize_dtypes(pd.DataFrame({'Accident Year': [2020.0, 2020.5, None],
+                                            'Development Period': [1.0, 2.0, 3.0]}))
+    assert df['accident_year'].dtype == 'Float64'
+    assert df['accident_year'].tolist()[:2] == [2020.0, 2020.5]
+    assert df['development_period'].dtype == 'Int16'
+
+    # and it concatenates with the frames that were typed as declared
+    typed = normalize_dtypes(pd.DataFrame({'Accident Year': [2021.0]}))
+    assert concat_output_tbls([df, typed])['accident_year'].dtype == 'Float64'
+
+
+def test_concat_keeps_the_categoricals():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UnknownColumnsWarning)
+        first = normalize_dtypes(pd.DataFrame({'LOB': ['CA'], 'Paid Loss': [1.0]}))
+        second = normalize_dtypes(pd.DataFrame({'LOB': ['WC'], 'Paid Loss': [2.0]}))
+        empty = normalize_dtypes(pd.DataFrame({'LOB': [], 'Paid Loss': []}, dtype=object))
+    df = concat_output_tbls([first, None, empty, second])
+    assert isinstance(df['lob'].dtype, pd.CategoricalDtype)
+    assert df['lob'].tolist() == ['CA', 'WC']
+    assert concat_output_tbls([]).empty
+    assert isinstance(concat_output_tbls([empty, empty])['lob'].dtype, pd.CategoricalDtype)
+
+
+def test_workbooks_are_typed_end_to_end(workbook_folder):
+    path = sorted(workbook_folder.iterdir())[0]
+    with pytest.warns(UnknownColumnsWarning):
+        df = get_dataframe_from_file(str(path))
+    assert df['link_ratio'].dtype == 'float32'
+    assert df['development_period'].dtype == 'Int16'
+    assert isinstance(df['state'].dtype, pd.CategoricalDtype)
+    assert df['analysis_idx'].dtype == 'Int32'
@@ -0,0 +1,142 @@
+"""
+# Description:
+Tests of the per-file profiling: the ranking and the report files, and the
+profiles of files parsed in threads and in worker processes.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from src import folder_to_parquet
+from src.folder_to_parquet import get_dataframes_from_folder, get_dataframes_from_storage
+from src.output_tbl_schema import UnknownColumnsWarning
+from src.profiling import (disable_profiling, enable_profiling, get_profiling_results,
+                           is_sampled, profile_file, write_profiling_report)
+from src.storage import LocalBackend
+
+pytestmark = pytest.mark.filterwarnings('ignore', category=UnknownColumnsWarning)
+
+
+@pytest.fixture(autouse=True)
+def profiling_off():
+    yield
+    disable_profiling()
+
+
+def allocate(size, seconds=0.0):
+    # keeps `size` bytes alive while it waits
+    block = bytearray(size)
+    time.sleep(seconds)
+    return len(block)
+
+
+def test_ranking_and_report_files(tmp_path):
+    report_dir = str(tmp_path / 'profiles')
+    enable_profiling(report_dir)
+    for name, size, seconds in (('fast.xlsx', 10_000_000, 0.0), ('slow.xlsx', 1_000, 0.2)):
+        with profile_file(name):
+            allocate(size, seconds)
+    with pytest.raises(ValueError):
+        with profile_file('broken.xlsx'):
+            raise ValueError('cannot parse')
+
+    report_path = write_profiling_report(top=2)
+    with open(os.path.join(report_dir, 'profiling_report.json'), encoding='utf-8') as file:
+        report = json.load(file)
+    assert report['slowest'] == ['slow.xlsx', 'fast.xlsx']
+    assert report['largest_peak_memory'][0] == 'fast.xlsx'
+    errors = {result['file']: result['error'] for result in report['results']}
+    assert errors['broken.xlsx'] == "ValueError('cannot parse')"
+
+    # the text report ranks the files, and lists the hottest functions of the slowest
+    with open(report_path, encoding='utf-8') as file:
+        text = file.read()
+    assert 'profiled files: 3' in text
+    assert '=== slow.xlsx (parse)' in text and 'allocate' in text
+    assert sorted(os.listdir(report_dir)) == [
+        'parse__broken.xlsx.prof', 'parse__fast.xlsx.prof', 'parse__slow.xlsx.prof',
+        'profiling_report.json', 'profiling_report.txt']
+
+
+def test_sampling_is_stable_and_nested_blocks_are_not_profiled(tmp_path):
+    names = [f'file_{index}.xlsx' for index in range(200)]
+    sampled = [name for name in names if is_sampled(name, 0.25)]
+    assert sampled == [name for name in names if is_sampled(name, 0.25)]
+    assert 0 < len(sampled) < len(names)
+
+    enable_profiling(str(tmp_path))
+    with profile_file('outer.xlsx', 'storage'):
+        with profile_file('outer.xlsx', 'parse'):
+            pass
+    assert [result['label'] for result in get_profiling_results()] == ['storage']
+
+
+def test_concurrent_threads_take_turns(tmp_path):
+    enable_profiling(str(tmp_path))
+    barrier = threading.Barrier(4)
+
+    def profiled(index):
+        barrier.wait()
+        with profile_file(f'file_{index}.xlsx'):
+            allocate(2_000_000, 0.05)
+
+    threads = [threading.Thread(target=profiled, args=(index,)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # every file measured on its own: none traced by another, none reset by another
+    peaks = [result['peak_memory_bytes'] for result in get_profiling_results()]
+    assert len(peaks) == 4
+    assert all(2_000_000 <= peak < 3_000_000 for peak in peaks)
+
+
+def test_storage_parses_are_profiled_one_at_a_time(workbook_folder, tmp_path, monkeypatch):
+    # the number of files being read at the same time
+    active = {'now': 0, 'max': 0}
+
+    @contextlib.contextmanager
+    def counting_profile_file(file_name, label='parse'):
+        if label != 'storage':
+            with profile_file(file_name, label):
+                yield
+            return
+        active['now'] += 1
+        active['max'] = max(active['max'], active['now'])
+        try:
+            with profile_file(file_name, label):
+                yield
+        finally:
+            active['now'] -= 1
+
+    monkeypatch.setattr(folder_to_parquet, 'profile_file', counting_profile_file)
+
+    enable_profiling(str(tmp_path / 'profiles'))
+    dataframes = get_dataframes_from_storage(LocalBackend(str(workbook_folder)).list(''),
+                                             work_dir=str(tmp_path / 'work'), max_workers=4)
+    assert [len(df) for df in dataframes] == [20, 20, 20]
+    assert active['max'] == 1
+    results = get_profiling_results()
+    assert sorted(result['label'] for result in results) == ['storage'] * 3
+    assert all(result['peak_memory_bytes'] > 0 for result in results)
+
+
+def test_pooled_parses_send_their_results_back(workbook_folder, tmp_path):
+    report_dir = str(tmp_path / 'profiles')
+    enable_profiling(report_dir)
+    dataframes = get_dataframes_from_folder(str(workbook_folder), max_workers=2)
+    assert [len(df) for df in dataframes] == [20, 20, 20]
+
+    results = get_profiling_results()
+    assert sorted(os.path.basename(result['file']) for result in results) == sorted(
+        os.listdir(workbook_folder))
+    assert all(result['label'] == 'parse' and result['peak_memory_bytes'] > 0
+               for result in results)
+    assert all(os.path.exists(result['profile_path']) for result in results)
+    assert 'profiled files: 3' in open(write_profiling_report(), encoding='utf-8').read()
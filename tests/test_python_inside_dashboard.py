@@ -0,0 +1,136 @@
+"""
+# Description:
+Tests of the dashboard data: the fresh snapshot is read as is, and a stale
+or missing snapshot is rebuilt from the workbooks of the storage backend.
+"""
+
+import os
+import tempfile
+import time
+
+import import_time
+import pandas as pd
+import pytest
+
+from src import python_inside_dashboard
+from src.output_tbl_schema import UnknownColumnsWarning
+from src.python_inside_dashboard import (get_dashboard_data, get_dataframes_from_files,
+                                         get_files_in_folder, is_snapshot_fresh)
+from src.storage import (HttpBackend, LocalBackend, SharePointBackend, StorageBackend,
+                         serve_folder)
+
+pytestmark = pytest.mark.filterwarnings('ignore', category=UnknownColumnsWarning)
+
+
+@pytest.fixture
+def served_workbooks(workbook_folder):
+    # the workbooks behind HTTP, so the rebuild downloads them like from sharepoint
+    server = serve_folder(str(workbook_folder))
+    yield HttpBackend(server.url)
+    server.shutdown()
+
+
+@pytest.fixture
+def temporary_dir(tmp_path, monkeypatch):
+    # the temporary folders of the rebuild, to check that they are removed
+    folder = tmp_path / 'tmp'
+    folder.mkdir()
+    monkeypatch.setattr(tempfile, 'tempdir', str(folder))
+    return folder
+
+
+class UnreachableBackend(StorageBackend):
+    def list(self, folder):
+        raise AssertionError('a fresh snapshot must not touch the storage')
+
+
+def test_missing_snapshot_is_built(served_workbooks, temporary_dir, tmp_path):
+    snapshot_path = str(tmp_path / 'data.parquet')
+    df = get_dashboard_data(snapshot_path, folder='', storage=served_workbooks)
+
+    assert len(df) == 3 * 20
+    assert sorted(df['file_name'].unique()) == sorted(os.listdir(tmp_path / 'workbooks'))
+    assert df['link_ratio'].dtype == 'float32'
+    assert is_snapshot_fresh(snapshot_path)
+    pd.testing.assert_frame_equal(pd.read_parquet(snapshot_path), df)
+
+    # the downloads went to a folder of the rebuild's own, which is gone
+    assert list(temporary_dir.iterdir()) == []
+
+
+def test_stale_snapshot_is_rebuilt(served_workbooks, workbook_folder, temporary_dir, tmp_path):
+    snapshot_path = str(tmp_path / 'data.parquet')
+    get_dashboard_data(snapshot_path, folder='', storage=served_workbooks)
+
+    # a day later, one of the workbooks is gone
+    stale = time.time() - 25 * 3600
+    os.utime(snapshot_path, (stale, stale))
+    assert not is_snapshot_fresh(snapshot_path)
+    removed = sorted(workbook_folder.iterdir())[0]
+    removed.unlink()
+
+    df = get_dashboard_data(snapshot_path, folder='', storage=served_workbooks)
+    assert len(df) == 2 * 20
+    assert removed.name not in set(df['file_name'])
+    assert is_snapshot_fresh(snapshot_path)
+
+
+def test_fresh_snapshot_is_read_as_is(workbook_folder, tmp_path):
+    snapshot_path = str(tmp_path / 'data.parquet')
+    built = get_dashboard_data(snapshot_path, folder='',
+                               storage=LocalBackend(str(workbook_folder)))
+
+    df = get_dashboard_data(snapshot_path, folder='', storage=UnreachableBackend())
+    pd.testing.assert_frame_equal(df, built)
+
+
+def test_sharepoint_files_are_read(sharepoint_context, temporary_dir):
+    folder = os.path.join(sharepoint_context.root, 'CIG Link Ratio Files')
+    with open(os.path.join(folder, 'notes.txt'), 'w') as file:
+        file.write('not a workbook')
+
+    files = get_files_in_folder(sharepoint_context, 'CIG Link Ratio Files')
+    dataframes = get_dataframes_from_files(files, sharepoint_context)
+    assert [len(df) for df in dataframes] == [20, 20, 20]
+    assert list(temporary_dir.iterdir()) == []
+
+
+def test_sharepoint_connection_is_closed(sharepoint_context, tmp_path, monkeypatch):
+    # the connection the rebuild opened itself, when it succeeds and when it fails
+    monkeypatch.setattr(python_inside_dashboard, 'get_sharepoint_connection',
+                        lambda *args: sharepoint_context)
+    df = get_dashboard_data(str(tmp_path / 'data.parquet'))
+    assert len(df) == 3 * 20
+    assert sharepoint_context.closed
+
+    sharepoint_context.closed = False
+    with pytest.raises(FileNotFoundError):
+        get_dashboard_data(str(tmp_path / 'missing.parquet'), folder='missing')
+    assert sharepoint_context.closed
+
+    # a backend given by the caller stays open
+    sharepoint_context.closed = False
+    get_dashboard_data(str(tmp_path / 'given.parquet'),
+                       storage=SharePointBackend(sharepoint_context))
+    assert not sharepoint_context.closed
+
+
+def test_cold_start_is_within_the_import_budget(tmp_path):
+    # the median of a few imports in fresh interpreters, without any heavy module
+    result = import_time.run_check('import_dashboard', 'import src.python_inside_dashboard',
+                                   import_time.HEAVY_MODULES, import_time.IMPORT_BUDGET_MS,
+                                   repeats=3)
+    assert result['loaded'] == []
+    assert result['median_ms'] <= import_time.IMPORT_BUDGET_MS
+
+    # a refresh from a fresh snapshot, without sharepoint or the Excel engines
+    snapshot_path = str(tmp_path / 'data.parquet')
+    import_time.write_snapshot(snapshot_path)
+    result = import_time.run_check(
+        'fresh_snapshot_refresh',
+        'from src.python_inside_dashboard import get_dashboard_data\n'
+        f'get_dashboard_data({snapshot_path!r})',
+        import_time.SHAREPOINT_MODULES + import_time.EXCEL_ENGINE_MODULES,
+        import_time.REFRESH_BUDGET_MS, repeats=1)
+    assert result['loaded'] == []
+    assert result['median_ms'] <= import_time.REFRESH_BUDGET_MS
@@ -0,0 +1,80 @@
+"""
+# Description:
+Tests of the reader engines: the same workbook gives the same frame with
+every engine, and the calibration reads the way the refresh does.
+"""
+
+import json
+
+import pandas as pd
+import pytest
+
+from src import reader_engines
+from src.folder_to_parquet import get_dataframe_from_file
+from src.output_tbl_reader import read_output_tbl
+from src.output_tbl_schema import UnknownColumnsWarning
+
+pytestmark = pytest.mark.filterwarnings('ignore', category=UnknownColumnsWarning)
+
+
+def get_workbook(workbook_folder):
+    return str(sorted(workbook_folder.iterdir())[0])
+
+
+def test_every_engine_gives_the_same_dtypes(workbook_folder):
+    file_name = get_workbook(workbook_folder)
+    engines = reader_engines.get_available_engines('.xlsx')
+    assert len(engines) > 1
+
+    raw = [read_output_tbl(file_name, engine=engine) for engine in engines]
+    normalized = [get_dataframe_from_file(file_name, engine=engine) for engine in engines]
+    for df in raw[1:]:
+        pd.testing.assert_series_equal(df.dtypes, raw[0].dtypes)
+    for df in normalized[1:]:
+        pd.testing.assert_frame_equal(df, normalized[0])
+
+
+def test_calibration_uses_the_projection(workbook_folder, tmp_path, monkeypatch):
+    file_name = get_workbook(workbook_folder)
+    reads = []
+    monkeypatch.setattr(reader_engines, 'ENGINES', {
+        name: engine for name, engine in reader_engines.ENGINES.items()
+        if name in ('openpyxl_read_only', 'calamine')})
+
+    import src.output_tbl_reader as output_tbl_reader
+    original = output_tbl_reader.read_output_tbl
+
+    def recording_read(file_name, projection=None, sheet_name='output_tbl', engine=None):
+        reads.append((engine, projection['columns']))
+        return original(file_name, projection, sheet_name, engine)
+    monkeypatch.setattr(output_tbl_reader, 'read_output_tbl', recording_read)
+
+    path = tmp_path / 'calibration.json'
+    calibration = reader_engines.calibrate_engines(
+        [file_name], repeats=1, path=str(path),
+        projection={'columns': ['LOB', 'Link Ratio']})
+
+    assert {engine for engine, _columns in reads} == {'openpyxl_read_only', 'calamine'}
+    assert all(columns == ['LOB', 'Link Ratio'] for _engine, columns in reads)
+    assert calibration['.xlsx']['small']['engine'] in ('openpyxl_read_only', 'calamine')
+    assert json.loads(path.read_text()) == calibration
+
+
+def test_a_failing_engine_is_disqualified(workbook_folder, tmp_path):
+    file_name = get_workbook(workbook_folder)
+
+    def failing_rows(file_name, sheet_name):
+        raise RuntimeError('cannot read this workbook')
+        yield
+
+    reader_engines.register_engine('failing', failing_rows, ('.xlsx',))
+    try:
+        calibration = reader_engines.calibrate_engines(
+            [file_name], repeats=1, path=str(tmp_path / 'calibration.json'))
+    finally:
+        del reader_engines.ENGINES['failing']
+
+    result = calibration['.xlsx']['small']
+    assert result['engine'] != 'failing'
+    assert 'failing' not in result['seconds']
+    assert 'cannot read this workbook' in result['failed']['failing']
@@ -0,0 +1,89 @@
+"""
+# Description:
+Tests of the refresh plan: the status of the files from the run journal or
+from the versioned dataset, and the download estimates.
+"""
+
+import json
+
+import pytest
+
+from src.__main__ import main
+from src.output_tbl_schema import UnknownColumnsWarning
+from src.refresh_plan import get_file_infos, get_rates, plan_refresh, summarize_plan
+from src.storage import LocalBackend, MirrorBackend
+
+pytestmark = pytest.mark.filterwarnings('ignore', category=UnknownColumnsWarning)
+
+# a download and a parse of earlier runs
+EVENTS = [
+    {'type': 'stage', 'stage': 'download', 'ok': True, 'seconds': 1.0, 'bytes': 1_000_000},
+    {'type': 'stage', 'stage': 'parse', 'ok': True, 'seconds': 2.0, 'bytes': 1_000_000,
+     'file': 'x.xlsx'},
+]
+
+
+def get_plan(capsys, *args):
+    assert main(['plan', '--sharepoint-folder', '', '--json', *args]) == 0
+    output = json.loads(capsys.readouterr().out)
+    return {item['name']: item for item in output['files']}, output['summary']
+
+
+def test_local_files_take_no_download_time(workbook_folder):
+    # no download in the traces, and none needed either
+    file_infos = get_file_infos(LocalBackend(str(workbook_folder)).list(''))
+    plan = plan_refresh(file_infos, rates=get_rates(EVENTS[1:]))
+    summary = summarize_plan(plan)
+
+    assert [item['action'] for item in plan] == ['download+parse'] * 3
+    assert summary['download_bytes'] == 0
+    assert summary['download_seconds'] == 0
+    assert summary['files_without_estimate'] == 0
+
+
+def test_remote_files_are_estimated_from_the_downloads(workbook_folder, tmp_path):
+    mirror = MirrorBackend(LocalBackend(str(workbook_folder)), str(tmp_path / 'mirror'))
+    file_infos = get_file_infos(mirror.list(''))
+    size = sum(info['size'] for info in file_infos)
+
+    summary = summarize_plan(plan_refresh(file_infos, rates=get_rates(EVENTS)))
+    assert summary['download_bytes'] == size
+    assert summary['download_seconds'] == pytest.approx(size / 1_000_000)
+
+    # without a download rate, the time is unknown
+    summary = summarize_plan(plan_refresh(file_infos, rates=get_rates(EVENTS[1:])))
+    assert summary['files_without_estimate'] == 3
+
+    # mirrored: read in place
+    for file in mirror.list(''):
+        mirror.get_local_path(file)
+    summary = summarize_plan(plan_refresh(get_file_infos(mirror.list('')),
+                                          rates=get_rates(EVENTS[1:])))
+    assert summary['download_bytes'] == 0
+    assert summary['files_without_estimate'] == 0
+
+
+def test_versioned_plan_follows_the_dataset(workbook_folder, capsys):
+    root = str(workbook_folder)
+    plan, _summary = get_plan(capsys, '--local-root', root, '--versioned')
+    assert {item['status'] for item in plan.values()} == {'new'}
+
+    assert main(['refresh', '--local-root', root, '--sharepoint-folder', '',
+                 '--versioned']) == 0
+    capsys.readouterr()
+
+    # one workbook changes after the refresh
+    changed = sorted(workbook_folder.iterdir())[0]
+    changed.write_bytes(changed.read_bytes() + b'\0')
+
+    plan, summary = get_plan(capsys, '--local-root', root, '--versioned')
+    assert plan[changed.name]['status'] == 'changed'
+    assert plan[changed.name]['action'] == 'download+parse'
+    unchanged = [item for name, item in plan.items() if name != changed.name]
+    assert [(item['status'], item['action']) for item in unchanged] == [('unchanged', 'skip')] * 2
+    assert summary['action']['download+parse'] == 1
+
+    # without --versioned, the plan goes by the run journal
+    plan, _summary = get_plan(capsys, '--local-root', root)
+    assert plan[changed.name]['status'] == 'changed'
+    assert {item['status'] for item in unchanged} == {'unchanged'}
@@ -0,0 +1,161 @@
+"""
+# Description:
+Tests of the run journal: resuming a run, and the quarantine of the files
+that keep failing, keyed on the version of the file.
+"""
+
+import sqlite3
+
+import pytest
+
+from src import folder_to_parquet
+from src.__main__ import main
+from src.folder_to_parquet import get_dataframes_from_storage, get_files_to_read
+from src.instrumentation import enable_instrumentation, get_events
+from src.output_tbl_schema import UnknownColumnsWarning
+from src.run_journal import (finish_run, get_completed_stage, get_failure_count, get_quarantine,
+                             is_quarantined, open_journal, record_failure, record_stage,
+                             release_if_changed, start_run)
+from src.storage import LocalBackend
+
+pytestmark = pytest.mark.filterwarnings('ignore', category=UnknownColumnsWarning)
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = open_journal(str(tmp_path / 'journal.sqlite'))
+    yield journal
+    journal.close()
+
+
+def test_resume_continues_the_unfinished_run(journal):
+    run_id = start_run(journal)
+    record_stage(journal, run_id, 'a.xlsx', 'parse', '"1"')
+    finish_run(journal, run_id, 'failed')
+
+    assert start_run(journal, resume=True) == run_id
+    assert get_completed_stage(journal, 'a.xlsx', 'parse', '"1"', run_id) is not None
+    # another version of the file has to be parsed again
+    assert get_completed_stage(journal, 'a.xlsx', 'parse', '"2"', run_id) is None
+
+    finish_run(journal, run_id)
+    assert start_run(journal, resume=True) != run_id
+
+
+def test_resume_reuses_the_parsed_files(journal, workbook_folder, tmp_path):
+    storage = LocalBackend(str(workbook_folder))
+    work_dir = str(tmp_path / 'work')
+    run_id = start_run(journal)
+    first = get_dataframes_from_storage(storage.list(''), journal, run_id, work_dir)
+    finish_run(journal, run_id, 'failed')
+
+    # the resumed run reads the parse outputs, not the workbooks
+    enable_instrumentation()
+    run_id = start_run(journal, resume=True)
+    resumed = get_dataframes_from_storage(storage.list(''), journal, run_id, work_dir,
+                                          resume=True)
+    stages = [event['stage'] for event in get_events()]
+    assert stages.count('resume.reused') == 3
+    assert 'parse' not in stages
+    assert sum(len(df) for df in resumed) == sum(len(df) for df in first)
+
+
+def test_failed_run_closes_its_sharepoint_connection(sharepoint_context, tmp_path,
+                                                     monkeypatch):
+    monkeypatch.setattr(folder_to_parquet, 'get_sharepoint_connection',
+                        lambda *args: sharepoint_context)
+    journal_path = str(tmp_path / 'journal.sqlite')
+    with pytest.raises(FileNotFoundError):
+        folder_to_parquet.folder_to_parquet('missing', journal_path=journal_path,
+                                            work_dir=str(tmp_path / 'work'))
+    assert sharepoint_context.closed
+
+    # the failed run is left to be resumed
+    journal = open_journal(journal_path)
+    try:
+        assert journal.execute('select status from runs').fetchone()['status'] == 'failed'
+    finally:
+        journal.close()
+
+
+def test_quarantine_is_keyed_on_the_version(journal):
+    run_id = start_run(journal)
+    for attempt in range(3):
+        quarantined = record_failure(journal, run_id, 'a.xlsx', 'parse', 'boom', '"1"', 3)
+    assert quarantined
+    assert is_quarantined(journal, 'a.xlsx', '"1"')
+    assert is_quarantined(journal, 'a.xlsx')
+
+    # the fixed workbook is not quarantined, and is released by the next run
+    assert not is_quarantined(journal, 'a.xlsx', '"2"')
+    assert not release_if_changed(journal, 'a.xlsx', '"1"')
+    assert release_if_changed(journal, 'a.xlsx', '"2"')
+    assert get_quarantine(journal) == []
+    assert get_failure_count(journal, 'a.xlsx') == 0
+
+
+def test_failures_of_another_version_start_over(journal):
+    run_id = start_run(journal)
+    record_failure(journal, run_id, 'a.xlsx', 'parse', 'boom', '"1"', 3)
+    record_failure(journal, run_id, 'a.xlsx', 'parse', 'boom', '"1"', 3)
+    assert get_failure_count(journal, 'a.xlsx', '"1"') == 2
+    assert get_failure_count(journal, 'a.xlsx', '"2"') == 0
+
+    assert not record_failure(journal, run_id, 'a.xlsx', 'parse', 'boom', '"2"', 3)
+    assert get_failure_count(journal, 'a.xlsx', '"2"') == 1
+
+
+def test_fixed_workbook_leaves_quarantine(journal, workbook_folder, tmp_path):
+    broken = workbook_folder / 'GL Link Ratios 2021Q1.xlsx'
+    broken.write_bytes(b'not a workbook')
+    storage = LocalBackend(str(workbook_folder))
+    work_dir = str(tmp_path / 'work')
+
+    # three failing runs quarantine the broken workbook
+    for _ in range(3):
+        run_id = start_run(journal)
+        dataframes = get_dataframes_from_storage(storage.list(''), journal, run_id, work_dir,
+                                                 max_failures=3)
+        assert len(dataframes) == 3
+    assert broken.name not in [file.name for file in get_files_to_read(storage.list(''), journal)]
+
+    # fixed and uploaded again: read by the next run
+    broken.write_bytes(sorted(workbook_folder.glob('CA*'))[0].read_bytes())
+    run_id = start_run(journal)
+    assert len(get_dataframes_from_storage(storage.list(''), journal, run_id, work_dir)) == 4
+    assert get_quarantine(journal) == []
+
+
+def test_journal_of_an_earlier_version_is_upgraded(tmp_path):
+    path = str(tmp_path / 'old.sqlite')
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        create table quarantine (file_key text primary key, failures integer not null,
+                                 last_error text, quarantined_at real not null);
+        insert into quarantine values ('a.xlsx', 3, 'boom', 0);
+    """)
+    connection.close()
+
+    journal = open_journal(path)
+    try:
+        # quarantined without a fingerprint: every version stays quarantined
+        assert is_quarantined(journal, 'a.xlsx', '"2"')
+        assert not release_if_changed(journal, 'a.xlsx', '"2"')
+    finally:
+        journal.close()
+
+
+def test_quarantine_command(journal, tmp_path, capsys):
+    path = str(tmp_path / 'journal.sqlite')
+    run_id = start_run(journal)
+    for file_key in ('a.xlsx', 'b.xlsx'):
+        record_failure(journal, run_id, file_key, 'parse', 'boom', '"1"', 1)
+
+    assert main(['quarantine', 'list', '--journal-path', path]) == 0
+    assert '2 quarantined file(s)' in capsys.readouterr().out
+
+    assert main(['quarantine', 'release', 'a.xlsx', '--journal-path', path]) == 0
+    assert [row['file_key'] for row in get_quarantine(journal)] == ['b.xlsx']
+    assert main(['quarantine', 'release', 'a.xlsx', '--journal-path', path]) == 1
+    assert main(['quarantine', 'release', '--all', '--journal-path', path]) == 0
+    assert get_quarantine(journal) == []
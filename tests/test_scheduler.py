@@ -0,0 +1,121 @@
+"""
+# Description:
+Tests of the memory-aware scheduler: the tasks run within the memory
+budget, largest first, and the global limits cap every refresh together.
+"""
+
+import os
+import threading
+import time
+
+import pytest
+
+from src import scheduler
+from src.scheduler import (estimate_memory_cost, get_sheet_dimensions, run_with_memory_budget,
+                           set_global_limits)
+
+
+class Tracker:
+    """
+    # Description:
+    A task function that records the order the tasks start in, and how
+    many run at the same time.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = []
+        self.active = 0
+        self.max_active = 0
+
+    def __call__(self, key, seconds=0.1):
+        with self.lock:
+            self.started.append(key)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(seconds)
+        with self.lock:
+            self.active -= 1
+        if key == 'broken':
+            raise ValueError('cannot parse')
+        return key
+
+
+@pytest.fixture(autouse=True)
+def no_process_memory(monkeypatch):
+    # the estimates alone decide, whatever the memory of the test process
+    monkeypatch.setattr(scheduler, 'get_process_memory', lambda *args: None)
+
+
+def get_tasks(costs):
+    return [{'key': key, 'cost': cost, 'args': (key,)} for key, cost in costs.items()]
+
+
+def test_tasks_run_within_the_budget_largest_first():
+    tracker = Tracker()
+    tasks = get_tasks({'small_1': 30, 'large': 60, 'small_2': 30})
+    results = list(run_with_memory_budget(tasks, tracker, memory_budget=100, max_workers=3,
+                                          poll_interval=0.01))
+
+    # the large task first, then the one small task that fits beside it
+    assert tracker.started[0] == 'large'
+    assert tracker.max_active == 2
+    assert sorted(key for key, _result, _error in results) == ['large', 'small_1', 'small_2']
+
+
+def test_task_over_the_budget_runs_alone():
+    tracker = Tracker()
+    results = list(run_with_memory_budget(get_tasks({'huge': 500, 'small': 10}), tracker,
+                                          memory_budget=100, max_workers=2,
+                                          poll_interval=0.01))
+    assert tracker.max_active == 1
+    assert [key for key, _result, _error in results] == ['huge', 'small']
+
+
+def test_errors_are_yielded_not_raised():
+    results = {key: (result, error) for key, result, error in run_with_memory_budget(
+        get_tasks({'broken': 1, 'fine': 1}), Tracker(), memory_budget=100, poll_interval=0.01)}
+    assert results['fine'] == ('fine', None)
+    assert isinstance(results['broken'][1], ValueError)
+
+
+def test_global_limits_cap_every_refresh():
+    tracker = Tracker()
+    set_global_limits(max_workers=1)
+    try:
+        def parse(key):
+            with scheduler.worker_slot():
+                return tracker(key)
+
+        # two refreshes at the same time
+        threads = [threading.Thread(target=lambda tasks=tasks: list(run_with_memory_budget(
+            tasks, parse, memory_budget=100, max_workers=2, poll_interval=0.01)))
+            for tasks in (get_tasks({'a': 1, 'b': 1}), get_tasks({'c': 1}))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        set_global_limits()
+    assert sorted(tracker.started) == ['a', 'b', 'c']
+    assert tracker.max_active == 1
+
+
+def test_cost_comes_from_the_sheet_dimensions(tmp_path):
+    import openpyxl
+
+    # a compact file whose output_tbl is large once parsed
+    workbook = openpyxl.Workbook()
+    workbook.active.title = 'calc'
+    sheet = workbook.create_sheet('output_tbl')
+    for _ in range(5_000):
+        sheet.append([1] * 10)
+    path = str(tmp_path / 'book.xlsx')
+    workbook.save(path)
+
+    assert get_sheet_dimensions(path) == (5_000, 10)
+    assert get_sheet_dimensions(path, 'missing') is None
+    size_estimate = estimate_memory_cost('remote.xlsx', os.path.getsize(path))
+    assert estimate_memory_cost(path) == (scheduler.BASE_TASK_MEMORY
+                                          + 5_000 * 10 * scheduler.BYTES_PER_CELL)
+    assert estimate_memory_cost(path) > size_estimate
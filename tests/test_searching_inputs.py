@@ -0,0 +1,142 @@
+"""
+# Description:
+Tests of the CIG reference file: its checks, the classification of the file
+names, the reload of a new version, and the lookups built on it.
+"""
+
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from src import output_tbl_reader, searching_inputs
+from src.find_cig_files import get_cig_link_ratio_filenames
+from src.output_tbl_reader import get_projection
+from src.searching_inputs import (cig_filetypes, cig_lobs, get_file_type, get_lob,
+                                  get_reference_data, get_stem, get_stems,
+                                  load_reference_data)
+
+REFERENCE = {
+    'version': '2024Q1',
+    'file_types': [
+        {'filename': 'CA Link Ratios', 'type': 'link ratio'},
+        {'filename': 'CA Link Ratios Paid', 'type': 'paid link ratio'},
+        {'filename': 'GL Link Ratios', 'type': 'link ratio',
+         'columns': 'LOB, Link Ratio', 'header_row': 1, 'stop_at_blank_row': False},
+        {'filename': 'CA Reserves', 'type': 'reserves'},
+    ],
+    'lobs': [
+        {'code': 'CA', 'name': 'Commercial Auto'},
+        {'code': 'GL', 'name': 'General Liability'},
+    ],
+}
+
+
+def write_reference(path, reference=None, mtime_ns=None):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(reference or REFERENCE, file)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def reference_path(tmp_path, monkeypatch):
+    # the reference file of the tests, and no projection left from another test
+    monkeypatch.setattr(output_tbl_reader, 'OUTPUT_TBL_PROJECTIONS', {})
+    path = write_reference(tmp_path / 'cig_reference.json')
+    monkeypatch.setenv('RESERVING_DASHBOARD_REFERENCE_PATH', path)
+    return path
+
+
+def test_reference_is_checked(tmp_path):
+    rows = {'filename': 'CA Link Ratios', 'type': 'link ratio'}
+    for reference, message in (
+            ({'file_types': [rows, dict(rows, filename='ca link ratios ', type='reserves')]},
+             'two file types'),
+            ({'file_types': [{'filename': 'CA Link Ratios'}]}, 'needs `filename` and `type`'),
+            ({'lobs': [{'code': 'CA'}, {'code': 'CA', 'name': 'again'}]}, 'listed twice'),
+            ({'lobs': [{'name': 'Commercial Auto'}]}, 'needs a `code`')):
+        with pytest.raises(ValueError, match=message):
+            load_reference_data(write_reference(tmp_path / 'bad.json', reference))
+
+    # the same stem listed twice with the same type is fine
+    reference_data = load_reference_data(
+        write_reference(tmp_path / 'twice.json', {'file_types': [rows, rows]}))
+    assert reference_data.type_stems['link ratio'] == ('CA Link Ratios', 'CA Link Ratios')
+
+
+def test_missing_reference(tmp_path):
+    missing = str(tmp_path / 'missing.json')
+    assert get_file_type('CA Link Ratios 2Q2021.xlsb', missing) is None
+    with pytest.raises(FileNotFoundError, match='RESERVING_DASHBOARD_REFERENCE_PATH'):
+        cig_lobs(missing)
+
+
+def test_stems_of_both_name_forms():
+    assert get_stem('O:/2021/2021 Q2/CA Link Ratios 2021Q2.xlsb') == 'ca link ratios'
+    assert get_stem('O:/2023/2023 Q3/CA Link Ratios 3Q2023.xlsx') == 'ca link ratios'
+    assert get_stem('CA Link Ratios.xlsx') == 'ca link ratios'
+
+    assert get_file_type('O:/2021/2021 Q2/CA Link Ratios 2021Q2.xlsb') == 'link ratio'
+    assert get_file_type('O:/2023/2023 Q3/ca link ratios paid 3Q2023.xlsb') == 'paid link ratio'
+    assert get_file_type('Unknown Workbook 3Q2023.xlsb') is None
+
+
+def test_longest_stem_of_another_name_form():
+    # the stem is not before the analysis: the longest stem in the name wins
+    assert get_file_type('Copy of CA Link Ratios Paid - 3Q2023.xlsb') == 'paid link ratio'
+    assert get_file_type('Copy of CA Link Ratios - 3Q2023.xlsb') == 'link ratio'
+
+
+def test_new_version_is_reloaded(reference_path):
+    first = get_reference_data()
+    assert get_reference_data() is first
+    assert get_file_type('CA Reserves 2021Q2.xlsb') == 'reserves'
+
+    # another type of the same length: the same size, another modification time
+    reference = json.loads(json.dumps(REFERENCE))
+    reference['file_types'][3]['type'] = 'triangle'
+    write_reference(reference_path, reference, first.signature[0] + 1_000_000_000)
+    second = get_reference_data()
+    assert second is not first and second.signature[1] == first.signature[1]
+    # the memoized lookups of the previous version are dropped
+    assert searching_inputs._get_file_type.cache_info().currsize == 0
+    assert get_file_type('CA Reserves 2021Q2.xlsb') == 'triangle'
+
+
+def test_projections_are_registered_from_the_reference():
+    assert get_projection('link ratio') == output_tbl_reader.DEFAULT_PROJECTION
+    get_reference_data()
+    assert get_projection('link ratio') == {
+        'columns': ['LOB', 'Link Ratio'], 'header_row': 1, 'stop_at_blank_row': False}
+    assert 'reserves' not in output_tbl_reader.OUTPUT_TBL_PROJECTIONS
+
+
+def test_lookups():
+    assert get_stems('link ratio') == ('CA Link Ratios', 'GL Link Ratios')
+    assert get_stems('unknown') == ()
+    assert cig_lobs()['CA']['name'] == 'Commercial Auto'
+    assert get_lob('GL')['name'] == 'General Liability'
+    assert get_lob('WC') is None
+    with pytest.raises(TypeError):
+        cig_lobs()['CA']['name'] = 'changed'
+
+    frame = cig_filetypes()
+    assert frame['filename'].tolist() == [row['filename'] for row in REFERENCE['file_types']]
+    # a new frame every time
+    frame.loc[0, 'type'] = 'changed'
+    assert cig_filetypes().loc[0, 'type'] == 'link ratio'
+
+
+def test_link_ratio_filenames_from_the_reference():
+    df = pd.DataFrame({'file_name': ['CA Link Ratios 2021Q2.xlsb', 'ca link ratios 3Q2023.xlsb',
+                                     'GL LINK RATIOS 3Q2023.xlsb', 'CA Reserves 3Q2023.xlsb']})
+    found = get_cig_link_ratio_filenames(df)
+    assert found['file_name'].tolist() == df['file_name'].tolist()[:3]
+
+    # without any link ratio stem in the reference, nothing matches
+    reference = {'file_types': [{'filename': 'CA Reserves', 'type': 'reserves'}]}
+    write_reference(os.environ['RESERVING_DASHBOARD_REFERENCE_PATH'], reference, 1)
+    assert len(get_cig_link_ratio_filenames(df)) == 0
@@ -0,0 +1,107 @@
+"""
+# Description:
+Tests of the storage backends: the same operations on every backend, the
+mirror that copies only what changed, and the sharepoint threads.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.folder_to_parquet import get_dataframes_from_storage
+from src.instrumentation import enable_instrumentation, get_events
+from src.output_tbl_schema import UnknownColumnsWarning
+from src.storage import HttpBackend, LocalBackend, MirrorBackend, SharePointBackend, serve_folder
+
+pytestmark = pytest.mark.filterwarnings('ignore', category=UnknownColumnsWarning)
+
+
+@pytest.fixture(params=['local', 'http'])
+def backend(request, tmp_path):
+    root = tmp_path / 'root'
+    (root / 'folder').mkdir(parents=True)
+    (root / 'folder' / 'a.xlsx').write_bytes(b'a' * 10)
+    if request.param == 'local':
+        yield LocalBackend(str(root))
+        return
+    server = serve_folder(str(root))
+    yield HttpBackend(server.url)
+    server.shutdown()
+
+
+def test_every_backend_has_the_same_operations(backend):
+    assert [(file.path, file.size) for file in backend.list('folder')] == [('folder/a.xlsx', 10)]
+    with backend.open('folder/a.xlsx') as file:
+        assert file.read() == b'a' * 10
+
+    backend.upload('folder/sub', 'b.parquet', b'bb')
+    assert backend.stat('folder/sub/b.parquet').size == 2
+    backend.delete('folder/sub/b.parquet')
+
+    for operation, path in (('stat', 'folder/missing.xlsx'), ('list', 'missing'),
+                            ('open', 'folder/missing.xlsx')):
+        with pytest.raises(FileNotFoundError):
+            getattr(backend, operation)(path)
+
+
+def test_mirror_copies_only_the_changed_files(workbook_folder, tmp_path):
+    mirror = MirrorBackend(LocalBackend(str(workbook_folder)), str(tmp_path / 'mirror'))
+    assert mirror.sync('') == {'copied': 3, 'reused': 0, 'removed': 0}
+    assert not any(mirror.needs_download(file) for file in mirror.list(''))
+
+    # one changed, one removed: a new mirror on the same folder copies the changed one only
+    workbooks = sorted(workbook_folder.iterdir())
+    workbooks[0].write_bytes(workbooks[0].read_bytes() + b'\0')
+    workbooks[1].unlink()
+    mirror = MirrorBackend(LocalBackend(str(workbook_folder)), str(tmp_path / 'mirror'))
+    enable_instrumentation()
+    assert mirror.sync('') == {'copied': 1, 'reused': 1, 'removed': 1}
+    assert [event['file'] for event in get_events()
+            if event['stage'] == 'mirror.copy'] == [workbooks[0].name]
+    assert sorted(os.listdir(tmp_path / 'mirror')) == sorted(
+        ['.mirror_index.json', workbooks[0].name, workbooks[2].name])
+
+    # the refresh parses the copies
+    dataframes = get_dataframes_from_storage(mirror.list(''), work_dir=str(tmp_path / 'work'))
+    assert [len(df) for df in dataframes] == [20, 20]
+
+
+def test_sharepoint_threads_download_at_the_same_time(sharepoint_context):
+    storage = SharePointBackend(sharepoint_context)
+    files = storage.list('CIG Link Ratio Files')
+    barrier = threading.Barrier(len(files))
+
+    def read(file):
+        barrier.wait()
+        with file.open() as remote_file:
+            return remote_file.read()
+
+    with ThreadPoolExecutor(len(files)) as executor:
+        contents = list(executor.map(read, files))
+
+    # every thread on a clone of its own, and none waiting for the others
+    assert [len(content) for content in contents] == [file.size for file in files]
+    assert len(sharepoint_context.clones) == len(files)
+    assert sharepoint_context.site['max_active'] == len(files)
+
+
+def test_sharepoint_context_is_shared_without_clone(sharepoint_context, monkeypatch):
+    # an office365 version that cannot clone: the threads take turns
+    monkeypatch.delattr(type(sharepoint_context), 'clone')
+    storage = SharePointBackend(sharepoint_context)
+    files = storage.list('CIG Link Ratio Files')
+
+    with ThreadPoolExecutor(len(files)) as executor:
+        contents = list(executor.map(lambda file: file.open().read(), files))
+    assert [len(content) for content in contents] == [file.size for file in files]
+    assert sharepoint_context.site['max_active'] == 1
+
+
+def test_sharepoint_refresh_reads_with_several_workers(sharepoint_context, tmp_path):
+    storage = SharePointBackend(sharepoint_context)
+    dataframes = get_dataframes_from_storage(
+        storage.list('CIG Link Ratio Files'), work_dir=str(tmp_path / 'work'), max_workers=3)
+    assert [len(df) for df in dataframes] == [20, 20, 20]
+    assert len(sharepoint_context.clones) > 0
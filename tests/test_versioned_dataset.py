@@ -0,0 +1,157 @@
+"""
+# Description:
+Tests of the versioned dataset: the versions the refreshes write, their
+compaction, and the expiry of the versions that are not pinned.
+"""
+
+import fixtures
+import pytest
+
+from src.__main__ import main
+from src.output_tbl_schema import UnknownColumnsWarning
+from src.storage import LocalBackend
+from src.versioned_dataset import (compact_dataset, download_version, get_live_sources,
+                                   list_versions, open_version, pin_version, read_manifest,
+                                   read_pins, unpin_version)
+
+pytestmark = pytest.mark.filterwarnings('ignore', category=UnknownColumnsWarning)
+
+
+def refresh(workbook_folder):
+    assert main(['refresh', '--local-root', str(workbook_folder), '--sharepoint-folder', '',
+                 '--versioned']) == 0
+
+
+def change_workbook(workbook_folder, index=0):
+    workbook = sorted(workbook_folder.glob('*.xlsx'))[index]
+    workbook.write_bytes(workbook.read_bytes() + b'\0')
+    return workbook.name
+
+
+def count_rows(storage, local_dir, version=None):
+    version = download_version(storage, 'dataset', str(local_dir), version)
+    return open_version(str(local_dir), version).count_rows()
+
+
+@pytest.fixture
+def storage(workbook_folder):
+    return LocalBackend(str(workbook_folder))
+
+
+def test_refresh_appends_the_changed_workbooks(workbook_folder, storage, tmp_path):
+    refresh(workbook_folder)
+    changed = change_workbook(workbook_folder)
+    refresh(workbook_folder)
+
+    assert list_versions(storage, 'dataset') == [1, 2]
+    manifest = read_manifest(storage, 'dataset')
+    assert [sorted(fragment['sources']) for fragment in manifest['fragments']][-1] == [changed]
+    assert [(tombstone['file_name'], tombstone['version'], tombstone['reason'])
+            for tombstone in manifest['tombstones']] == [(changed, 1, 'replaced')]
+
+    # every version reads as it was written
+    assert count_rows(storage, tmp_path / 'copy', 1) == 3 * 20
+    assert count_rows(storage, tmp_path / 'copy', 2) == 3 * 20
+
+
+def test_unreadable_workbook_keeps_its_last_rows(workbook_folder, storage, tmp_path):
+    refresh(workbook_folder)
+    workbooks = sorted(workbook_folder.glob('*.xlsx'))
+    first_fingerprint = get_live_sources(read_manifest(storage, 'dataset'))[
+        workbooks[0].name][1]['fingerprint']
+
+    # one workbook is broken, another one is gone
+    workbooks[0].write_bytes(b'not a workbook')
+    workbooks[1].unlink()
+    refresh(workbook_folder)
+    manifest = read_manifest(storage, 'dataset')
+    assert [(tombstone['file_name'], tombstone['reason'])
+            for tombstone in manifest['tombstones']] == [(workbooks[1].name, 'removed')]
+    # the rows last read from the broken one are still live, under its old fingerprint
+    live = get_live_sources(manifest)
+    assert live[workbooks[0].name][1]['fingerprint'] == first_fingerprint
+    assert count_rows(storage, tmp_path / 'copy') == 2 * 20
+
+    # once it reads again, its new rows replace the old ones
+    fixtures.build_workbook(str(workbooks[0]), rows=5, decoy_sheets=0)
+    refresh(workbook_folder)
+    manifest = read_manifest(storage, 'dataset')
+    assert (workbooks[0].name, 'replaced') in [
+        (tombstone['file_name'], tombstone['reason']) for tombstone in manifest['tombstones']]
+    assert count_rows(storage, tmp_path / 'copy') == 20 + 5
+
+
+def test_empty_workbook_is_not_read_again(workbook_folder, storage, tmp_path):
+    empty = str(workbook_folder / 'empty 2023Q1.xlsx')
+    fixtures.build_workbook(empty, rows=0, decoy_sheets=0, trailing_blank_rows=0)
+    refresh(workbook_folder)
+    live = get_live_sources(read_manifest(storage, 'dataset'))
+    assert live['empty 2023Q1.xlsx'][1]['rows'] == 0
+
+    # nothing changed, so no new version
+    refresh(workbook_folder)
+    assert list_versions(storage, 'dataset') == [1]
+    assert count_rows(storage, tmp_path / 'copy') == 3 * 20
+
+
+def test_compaction_merges_and_expires(workbook_folder, storage, tmp_path):
+    refresh(workbook_folder)
+    for index in range(2):
+        change_workbook(workbook_folder, index)
+        refresh(workbook_folder)
+
+    summary = compact_dataset(storage, 'dataset', keep_versions=1, local_dir=str(tmp_path))
+    assert summary['version'] == 4
+    assert summary['expired_versions'] == [1, 2, 3]
+    manifest = read_manifest(storage, 'dataset')
+    assert len(manifest['fragments']) == 1
+    assert manifest['tombstones'] == []
+    assert count_rows(storage, tmp_path / 'copy') == 3 * 20
+
+    # only the fragment of the kept version is left
+    assert [file.name for file in storage.list('dataset/fragments')] == [
+        manifest['fragments'][0]['path'].split('/')[-1]]
+
+
+def test_pins_are_kept_in_the_dataset(workbook_folder, storage, tmp_path):
+    refresh(workbook_folder)
+    change_workbook(workbook_folder)
+    refresh(workbook_folder)
+
+    assert pin_version(storage, 'dataset', 1, 'quarter-end report')
+    assert not pin_version(storage, 'dataset', 1)
+    with pytest.raises(FileNotFoundError):
+        pin_version(storage, 'dataset', 7)
+    assert read_pins(storage, 'dataset')[1]['note'] == 'quarter-end report'
+
+    # a compaction without any pin on its command line keeps the pinned version
+    compact_dataset(storage, 'dataset', keep_versions=1, local_dir=str(tmp_path))
+    assert list_versions(storage, 'dataset') == [1, 3]
+    assert count_rows(storage, tmp_path / 'copy', 1) == 3 * 20
+
+    # unpinned, it expires with the next compaction
+    assert unpin_version(storage, 'dataset', 1)
+    assert not unpin_version(storage, 'dataset', 1)
+    compact_dataset(storage, 'dataset', keep_versions=1, local_dir=str(tmp_path))
+    assert list_versions(storage, 'dataset') == [3]
+
+
+def test_pin_commands(workbook_folder, storage, capsys):
+    refresh(workbook_folder)
+    options = ['--local-root', str(workbook_folder), '--sharepoint-folder', '']
+
+    assert main(['pin', '1', '--note', 'review', *options]) == 0
+    assert main(['pin', '2', *options]) == 1
+    assert main(['pin', *options]) == 0
+    assert '1 pinned version(s)' in capsys.readouterr().out
+
+    # compact --pin stores the pin too
+    change_workbook(workbook_folder)
+    refresh(workbook_folder)
+    assert main(['compact', '--pin', '2', '--keep-versions', '1', *options]) == 0
+    assert sorted(read_pins(storage, 'dataset')) == [1, 2]
+    assert list_versions(storage, 'dataset') == [1, 2, 3]
+
+    assert main(['unpin', '1', '2', *options]) == 0
+    assert main(['unpin', '1', *options]) == 1
+    assert read_pins(storage, 'dataset') == {}
@@ -0,0 +1,114 @@
+"""
+# Description:
+Tests of watch mode: the change feeds of a local folder tree and of a
+sharepoint change log, and the partitions re-published from the changes.
+"""
+
+import os
+
+import pytest
+
+from src.instrumentation import enable_instrumentation, get_events
+from src.output_tbl_schema import UnknownColumnsWarning
+from src.run_journal import get_quarantine, get_watch_state, open_journal
+from src.watch import LocalChangeSource, LocalPartitionPublisher, SharePointChangeSource, watch
+
+pytestmark = pytest.mark.filterwarnings('ignore', category=UnknownColumnsWarning)
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = open_journal(str(tmp_path / 'journal.sqlite'))
+    yield journal
+    journal.close()
+
+
+def get_counts(name):
+    return [event['stage'] for event in get_events()
+            if event['type'] == 'count' and event['stage'] == name]
+
+
+def test_local_source_watches_every_excel_extension(workbook_folder, journal):
+    (workbook_folder / 'notes.txt').write_text('not a workbook')
+    changed, deleted = LocalChangeSource(str(workbook_folder), journal).poll()
+    assert sorted(os.path.basename(path) for path in changed) == sorted(
+        path.name for path in workbook_folder.glob('*.xlsx'))
+    assert deleted == set()
+
+    # or the given extensions only
+    source = LocalChangeSource(str(workbook_folder), journal, ('.xlsb',))
+    assert source.poll() == (set(), set())
+
+
+def test_publisher_skips_the_quarantined_workbooks(workbook_folder, journal, tmp_path):
+    broken = workbook_folder / 'GL Link Ratios 2021Q1.xlsx'
+    broken.write_bytes(b'not a workbook')
+    publish_dir = tmp_path / 'published'
+    source = LocalChangeSource(str(workbook_folder), journal)
+    publisher = LocalPartitionPublisher(str(publish_dir), journal, source,
+                                        str(tmp_path / 'work'), max_failures=1)
+    watch(source, publisher, poll_interval=0, quiet_seconds=0, max_polls=1)
+    assert [os.path.basename(row['file_key']) for row in get_quarantine(journal)] == [broken.name]
+
+    # the partition of the broken workbook is re-published without reading it
+    enable_instrumentation()
+    partner = workbook_folder / 'CA Link Ratios 2021Q1.xlsx'
+    partner.write_bytes(partner.read_bytes())
+    watch(source, publisher, poll_interval=0, quiet_seconds=0, max_polls=1)
+    assert len(get_counts('file.quarantine_skipped')) == 1
+    assert get_counts('file.failed') == []
+
+    # fixed: released, and read again
+    broken.write_bytes(partner.read_bytes())
+    watch(source, publisher, poll_interval=0, quiet_seconds=0, max_polls=1)
+    assert len(get_counts('file.quarantine_released')) == 1
+    assert get_quarantine(journal) == []
+
+
+class FakeChange:
+    def __init__(self, url, token):
+        from office365.sharepoint.changes.token import ChangeToken
+        from office365.sharepoint.changes.type import ChangeType
+
+        self.properties = {'ServerRelativeUrl': url, 'ChangeType': ChangeType.Update,
+                           'ChangeToken': ChangeToken(StringValue=token)}
+
+
+class FakeChangeLog:
+    """
+    # Description:
+    A sharepoint folder whose change log holds the given changes, and which
+    keeps the queries it was asked.
+    """
+
+    def __init__(self, changes):
+        self.web = self
+        self.changes = changes
+        self.queries = []
+
+    def get_folder_by_server_relative_url(self, url):
+        return self
+
+    def get_changes(self, query):
+        self.queries.append(query)
+        return self.changes
+
+    def execute_query(self):
+        pass
+
+
+def test_sharepoint_change_token_round_trips(journal):
+    context = FakeChangeLog([FakeChange('/sites/test/Files/a.xlsx', '1;3;guid;1;100')])
+    source = SharePointChangeSource(context, 'Files', journal)
+    assert source.poll() == ({'a.xlsx'}, set())
+    source.commit()
+
+    # the journal keeps the string value of the token
+    assert get_watch_state(journal, 'sharepoint:Files') == '1;3;guid;1;100'
+
+    # a restarted watcher asks for the changes after it
+    context.changes = []
+    restarted = SharePointChangeSource(context, 'Files', journal)
+    assert restarted.poll() == (set(), set())
+    assert context.queries[-1].ChangeTokenStart.StringValue == '1;3;guid;1;100'
+    assert context.queries[-1].to_json()['ChangeTokenStart']['StringValue'] == '1;3;guid;1;100'
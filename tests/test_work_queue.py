@@ -0,0 +1,107 @@
+"""
+# Description:
+Tests of the work queue: the leases of the tasks, and a coordinator whose
+workers parse the files, or die.
+"""
+
+import os
+import time
+
+import pytest
+
+from src import work_queue
+from src.output_tbl_schema import UnknownColumnsWarning
+from src.run_journal import open_journal, start_run
+from src.storage import LocalBackend
+from src.work_queue import (claim_task, complete_task, enqueue_task, expire_leases,
+                            get_dataframes_from_work_queue, get_queue_counts, open_work_queue,
+                            renew_lease)
+
+pytestmark = pytest.mark.filterwarnings('ignore', category=UnknownColumnsWarning)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = open_work_queue(str(tmp_path / 'work'))
+    enqueue_task(queue, 'run', 'a.xlsx', '"1"', 'downloads/a.xlsx', 'parsed/a.parquet')
+    yield queue
+    queue.close()
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = open_journal(str(tmp_path / 'journal.sqlite'))
+    yield journal
+    journal.close()
+
+
+def test_expired_lease_goes_to_another_worker(queue):
+    task = claim_task(queue, 'host:1', lease_seconds=0.05)
+    assert task['attempts'] == 1
+    assert claim_task(queue, 'host:2') is None
+
+    # the first worker died: its lease runs out
+    time.sleep(0.1)
+    task = claim_task(queue, 'host:2')
+    assert (task['worker'], task['attempts']) == ('host:2', 2)
+
+    # the first worker cannot report the task any more
+    assert not renew_lease(queue, task['task_id'], 'host:1')
+    assert not complete_task(queue, task['task_id'], 'host:1', 1, 1, 1.0)
+    assert complete_task(queue, task['task_id'], 'host:2', 1, 1, 1.0)
+    assert get_queue_counts(queue, 'run')['done'] == 1
+
+
+def test_task_fails_after_max_attempts(queue):
+    for attempt in range(2):
+        assert claim_task(queue, f'host:{attempt}', lease_seconds=0.01,
+                          max_attempts=2) is not None
+        time.sleep(0.05)
+
+    assert claim_task(queue, 'host:3', max_attempts=2) is None
+    task = queue.execute("select * from tasks").fetchone()
+    assert task['status'] == 'failed'
+    assert task['error'] == 'the lease ran out 2 times'
+
+
+def test_dead_worker_releases_its_task(queue):
+    claim_task(queue, 'host:1')
+    assert expire_leases(queue) == 0
+    assert expire_leases(queue, worker_id='host:1') == 1
+    assert get_queue_counts(queue, 'run')['pending'] == 1
+
+
+def test_coordinator_collects_the_fragments(workbook_folder, journal, tmp_path):
+    run_id = start_run(journal)
+    dataframes = get_dataframes_from_work_queue(
+        LocalBackend(str(workbook_folder)).list(''), journal, run_id, str(tmp_path / 'work'),
+        local_workers=2, poll_interval=0.1)
+    assert [len(df) for df in dataframes] == [20, 20, 20]
+
+    # the same fragments by file, for the versioned dataset: reused, not parsed again
+    by_file = get_dataframes_from_work_queue(
+        LocalBackend(str(workbook_folder)).list(''), journal, run_id, str(tmp_path / 'work'),
+        resume=True, local_workers=0, poll_interval=0.1, by_file=True)
+    assert sorted(by_file) == sorted(os.listdir(workbook_folder))
+    assert all(df['file_name'].iat[0] == name for name, df in by_file.items())
+
+
+def test_coordinator_fails_when_its_workers_die(workbook_folder, journal, tmp_path,
+                                                monkeypatch):
+    # the workers are forked after the patch, and die on their first task
+    if work_queue.multiprocessing.get_start_method() != 'fork':
+        pytest.skip('the workers are not forked')
+    monkeypatch.setattr(work_queue, 'process_task', lambda *args, **kwargs: os._exit(3))
+
+    run_id = start_run(journal)
+    with pytest.raises(RuntimeError, match='every local worker'):
+        get_dataframes_from_work_queue(
+            LocalBackend(str(workbook_folder)).list(''), journal, run_id,
+            str(tmp_path / 'work'), local_workers=2, poll_interval=0.1)
+
+    # the claims of the dead workers went back to the queue
+    queue = open_work_queue(str(tmp_path / 'work'))
+    try:
+        assert get_queue_counts(queue, run_id)['claimed'] == 0
+    finally:
+        queue.close()